@@ -4,86 +4,234 @@ Powered by Chainlit and Claude AI
 """
 
 import chainlit as cl
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
+import asyncio
+import contextvars
+import functools
 import sqlite3
+import time
 import pandas as pd
 import os
+import re
 import shutil
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from dotenv import load_dotenv
+from ingest import quote_identifier
+from compact_storage import format_size_report
+from schema_profile import schema_cache, database_fingerprint
+from result_cache import ResultCache, frame_bytes
+from db_pool import get_pool
+from engines import QUERY_ENGINE, get_engine
+from query_budget import QueryBudget
+from query_planner import preflight
+from index_advisor import QueryLog, ADVISOR_EVERY_N_QUERIES, advise, index_on_ingest
+from rollups import ROLLUPS_ENABLED, build_rollups, drop_rollups, load_rollups, rewrite_query
+from sampling import APPROXIMATE_ANSWERS, approximate_query, build_sample, load_sample
+from translation_cache import TranslationCache, normalize_question
+from prompt_builder import TokenUsageLog, build_explain_prompt, build_sql_prompt
+from export import EXPORT_MAX_ROWS, EXPORT_TIMEOUT_SECONDS, PAGE_ROWS, export_formats, export_result, page_query
+import tracing
+from tracing import TIMING_FOOTER
+from pipeline import BackgroundJobs, Prefetch
+from incremental import INGEST_MODE, already_loaded, file_digest
+from sql_repair import LOCAL_SQL_REPAIR, REPAIR_ATTEMPTS, clean_sql, repair_sql
+from upload_formats import FORMAT_NAMES, MAX_FILE_SIZE_MB, accepted_upload, detect_format
+from llm_scheduler import PRIORITY_BACKGROUND, PRIORITY_EXPLAIN, PRIORITY_SQL, LLMScheduler, SharedMessage
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Anthropic client
-client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+# Initialize Anthropic client; llm_scheduler retries failed calls, so the SDK doesn't
+client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
 
-# Database configuration
-DB_PATH = "orders.db"
+# Model used for SQL generation and explanations
+MODEL = "claude-sonnet-4-20250514"
 
-# File upload configuration
-MAX_FILE_SIZE_MB = 50  # Maximum file size in MB
-ACCEPTED_MIME_TYPES = ["text/csv", "application/vnd.ms-excel", "application/csv"]
+# Concurrency configuration (per worker process, shared by all sessions)
+DB_WORKERS = int(os.getenv("DB_WORKERS", 8))  # Threads for database queries and pandas work
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))  # Threads for CSV uploads
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 16))  # Max in-flight Claude calls (see llm_scheduler.py)
 
-def convert_csv_to_db(csv_file_path: str, output_db_path: str = None):
+# Database configuration: QUERY_ENGINE picks SQLite, a DuckDB file or a Parquet file (see engines.py)
+engine = get_engine(pool_size=DB_WORKERS)
+DB_PATH = os.getenv("DB_PATH", engine.default_path)
+
+# Executed queries kept per session so results can be paged and exported
+SESSION_RESULTS = 20
+
+# Speculative work: answer the example questions in the background after an upload
+PREANSWER_EXAMPLES = os.getenv("PREANSWER_EXAMPLES", "true").lower() in ("1", "true", "yes")
+PREANSWER_CONCURRENCY = int(os.getenv("PREANSWER_CONCURRENCY", 2))  # Example questions answered at once
+
+# Example questions in the welcome message, by topic, and after an upload
+WELCOME_EXAMPLES = {
+    "Sales Performance": ["What are the top 5 products by revenue?", "Show me monthly revenue trends"],
+    "Regional Analysis": ["Which states generate the most sales?", "What's the revenue distribution by region?"],
+    "Customer Insights": ["What's the average order value?", "Which payment methods are most popular?"],
+    "Product Analysis": ["Which products have the highest profit margins?", "What are our best-selling SKUs?"],
+}
+UPLOAD_EXAMPLES = [
+    "What are the top 5 products by revenue?",
+    "Show me the sales trend by month",
+    "Which region has the highest sales?",
+]
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+# Claude calls: identical in-flight requests shared, admitted by priority under the rate limits
+llm_scheduler = LLMScheduler(LLM_CONCURRENCY)
+
+# Generated SQL keyed on (question, schema, model), shared by all sessions
+translation_cache = TranslationCache()
+
+# Query results keyed on (canonical SQL, database version), bounded by bytes
+result_cache = ResultCache()
+
+# Executed queries and their plans, read by the index advisor
+query_log = QueryLog()
+
+# Token counts of recent model calls (input, cache write/read, output)
+token_usage = TokenUsageLog()
+
+# Example questions being answered ahead of time, keyed by normalized question
+preanswers = BackgroundJobs(PREANSWER_CONCURRENCY)
+
+# Per-stage timings of questions and uploads, served on METRICS_PORT when set
+tracing.serve_metrics()
+
+async def run_blocking(executor, func, *args, **kwargs):
+    """
+    Run blocking database/pandas work on a bounded pool without blocking the event loop
+    The Chainlit context is carried over so the work can call cl.run_sync
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, ctx.run, functools.partial(func, *args, **kwargs))
+
+def convert_csv_to_db(csv_file_path, output_db_path: str = None, progress_callback=None, mode: str = None):
     """
-    Convert a CSV file to SQLite database
-    References the logic from setup_database.py
+    Convert a CSV file, or a list of CSV files with the same columns, to one table in the engine's database file
+    gzip/zstd compressed CSV, Parquet and Arrow IPC files are read directly (see upload_formats.py)
+    Streams the file in chunks (see ingest.py) so memory use stays bounded; large inputs are parsed
+    on all cores (see parallel_ingest.py)
+    mode 'replace' swaps the table for the files, 'append' adds their new rows (default INGEST_MODE);
+    files whose contents the table already holds are skipped (see incremental.py)
     """
     if output_db_path is None:
         output_db_path = DB_PATH
+    mode = mode or INGEST_MODE
     
     try:
-        # Read CSV file
-        df = pd.read_csv(csv_file_path)
+        paths = [csv_file_path] if isinstance(csv_file_path, str) else csv_file_path
+        input_bytes = sum(os.path.getsize(path) for path in paths)
+        
+        digest = None
+        if engine.supports_append:
+            with tracing.span("hash", input_bytes=input_bytes) as stage:
+                digest = file_digest(paths)
+                skipped = already_loaded(output_db_path, digest, mode)
+                stage.add(skipped=int(skipped))
+            if skipped:
+                # Same bytes as what's loaded: the table, its caches and its profile all stay
+                profile = engine.profile(output_db_path)
+                return True, {
+                    'records': profile.row_count,
+                    'columns': len(profile.columns),
+                    'column_names': profile.column_names,
+                    'storage': None,
+                    'skipped': True
+                }
+        elif mode == "append":
+            return False, f"Appending needs the SQLite engine (QUERY_ENGINE is {QUERY_ENGINE})"
+        
+        base = None
+        if mode == "append" and os.path.exists(output_db_path):
+            try:
+                base = engine.profile(output_db_path)
+            except sqlite3.OperationalError:
+                pass  # No table yet: the first upload loads it
+        if base is not None:
+            with tracing.span("append", input_bytes=input_bytes) as stage:
+                result = engine.append(csv_file_path, output_db_path, progress_callback=progress_callback,
+                                       digest=digest)
+                stage.add(rows_read=result['records'], rows_written=result['added'])
+            
+            # Only results are stale: the SQL cache, indexes and schema still hold, rollups were updated in place
+            result_cache.invalidate(output_db_path)
+            with tracing.span("schema_profile"):
+                profile = engine.schema_cache.extend(output_db_path, base, result['added'], result['stats'])
+            return True, {
+                'records': profile.row_count,
+                'columns': len(profile.columns),
+                'column_names': profile.column_names,
+                'storage': None,
+                'added': result['added'],
+                'duplicates': result['records'] - result['added']
+            }
+        
+        if engine.supports_rollups:
+            # Rollups of the old data must not answer for the new data
+            drop_rollups(output_db_path)
         
-        if len(df) == 0:
-            return False, "CSV file is empty"
+        with tracing.span("ingest", input_bytes=input_bytes) as stage:
+            if engine.supports_append:
+                result = engine.ingest(csv_file_path, output_db_path, progress_callback=progress_callback,
+                                       digest=digest)
+            else:
+                result = engine.ingest(csv_file_path, output_db_path, progress_callback=progress_callback)
+            stage.add(rows_written=result['records'], files=len(paths), shards=result.get('shards', 1))
         
-        # Create SQLite database
-        conn = sqlite3.connect(output_db_path)
+        # Results from the old table can never be served again; free them now
+        result_cache.invalidate(output_db_path)
         
-        # Write data to SQLite table (replace existing table)
-        df.to_sql('orders', conn, if_exists='replace', index=False)
+        # Rebuild the shared schema profile once, here, instead of on the next question
+        with tracing.span("schema_profile"):
+            profile = engine.schema_cache.refresh(output_db_path)
         
-        # Verify the data
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM orders")
-        count = cursor.fetchone()[0]
+        if engine.supports_query_plan:
+            # Index likely filter/group columns; the profile stays valid since the data is unchanged
+            with tracing.span("indexes"):
+                index_on_ingest(output_db_path, profile)
         
-        conn.close()
+        if engine.supports_rollups and ROLLUPS_ENABLED:
+            # Precompute the common aggregates (month x product, month x state, ...)
+            with tracing.span("rollups"):
+                build_rollups(output_db_path, profile)
+        
+        if engine.supports_samples and APPROXIMATE_ANSWERS:
+            # A weighted sample answers aggregates approximately while the exact query runs
+            with tracing.span("sample"):
+                build_sample(output_db_path, profile)
+        
+        if engine.supports_query_plan or engine.supports_rollups or engine.supports_samples:
+            schema_cache.restamp(output_db_path)
         
         return True, {
-            'records': count,
-            'columns': len(df.columns),
-            'column_names': list(df.columns)
+            'records': result['records'],
+            'columns': result['columns'],
+            'column_names': result['column_names'],
+            'storage': result['storage']
         }
         
     except Exception as e:
         return False, str(e)
 
+def upload_mode(text: str):
+    """'append' or 'replace' when the message sent with an upload asks for it, else None (INGEST_MODE)"""
+    words = set(re.findall(r"[a-z]+", (text or "").lower()))
+    for mode in ("append", "replace"):
+        if mode in words:
+            return mode
+    return None
+
+
 def get_table_schema():
-    """Get the database schema to provide context to the AI"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Get column information
-    cursor.execute("PRAGMA table_info(orders)")
-    columns = cursor.fetchall()
-    
-    # Get sample data for better context
-    cursor.execute("SELECT * FROM orders LIMIT 3")
-    sample_data = cursor.fetchall()
-    
-    schema = "Table: orders\n\nColumns:\n"
-    for col in columns:
-        schema += f"  - {col[1]} ({col[2]})\n"
-    
-    schema += "\nSample Data:\n"
-    schema += str(sample_data[:2])  # Show 2 sample rows
-    
-    conn.close()
-    return schema
+    """Get the database schema to provide context to the AI (cached per database version)"""
+    return engine.profile(DB_PATH).to_prompt()
 
 def validate_sql(query: str):
     """Validate SQL query for safety"""
@@ -101,96 +249,353 @@ def validate_sql(query: str):
     
     return True
 
-def execute_sql(query: str):
-    """Execute SQL query and return results as DataFrame"""
+def execute_sql(query: str, budget: QueryBudget = None):
+    """
+    Execute SQL query and return results as DataFrame (cached per database version)
+    Runs under a time/row/byte budget; df.attrs['total_rows'] is set when rows were left unfetched
+    """
     try:
         # Validate query first
         validate_sql(query)
         
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        # Serve repeated queries on unchanged data from the result cache
+        fingerprint = database_fingerprint(DB_PATH)
+        df = result_cache.get(query, DB_PATH, fingerprint)
+        if df is not None:
+            return df, None
+        
+        df = engine.execute(query, DB_PATH, budget)
+        result_cache.put(query, DB_PATH, fingerprint, df)
         return df, None
     except Exception as e:
         return None, str(e)
 
-def generate_sql_query(user_question: str, schema: str):
-    """Use Claude to generate SQL query from natural language"""
+def export_sql(query: str, fmt: str = "csv", budget: QueryBudget = None):
+    """
+    Stream all rows of a query to a CSV/Parquet file (see export.py)
+    Returns ((path, rows, truncated), None) or (None, error); the caller removes the file
+    """
+    try:
+        validate_sql(query)
+        return export_result(engine, query, DB_PATH, fmt, budget), None
+    except Exception as e:
+        return None, str(e)
+
+def remember_result(query: str, total_rows) -> str:
+    """Keep an executed query in the session; result actions carry only its key"""
+    results = cl.user_session.get("result_queries")
+    if results is None:
+        results = OrderedDict()
+        cl.user_session.set("result_queries", results)
+    key = uuid.uuid4().hex[:12]
+    results[key] = (query, total_rows)
+    while len(results) > SESSION_RESULTS:
+        results.popitem(last=False)
+    return key
+
+def result_actions(key: str, offset: int, total_rows, exports: bool = True):
+    """Paging buttons for a result page, plus download buttons"""
+    actions = []
+    if offset > 0:
+        actions.append(cl.Action(name="result_page", label="◀ Previous rows",
+                                 payload={"result": key, "offset": max(offset - PAGE_ROWS, 0)}))
+    if total_rows is None or offset + PAGE_ROWS < total_rows:
+        actions.append(cl.Action(name="result_page", label="Next rows ▶",
+                                 payload={"result": key, "offset": offset + PAGE_ROWS}))
+    if exports:
+        for fmt in export_formats():
+            actions.append(cl.Action(name="export_result", label=f"⬇ Download {fmt.upper()}",
+                                     payload={"result": key, "format": fmt}))
+    return actions
+
+def run_index_advisor():
+    """Adapt indexes to the logged workload (runs in the background)"""
+    try:
+        changes = advise(DB_PATH, schema_cache.get(DB_PATH), query_log)
+    except sqlite3.Error:
+        return None  # e.g. an ingest holds the write lock; try again next round
+    if changes['created'] or changes['dropped']:
+        schema_cache.restamp(DB_PATH)
+    return changes
+
+def route_to_rollup(query: str):
+    """
+    Rewrite an aggregate query to read a precomputed rollup table when one can answer it
+    Returns the rewritten SQL, or None to run the query as generated
+    """
+    if not engine.supports_rollups:
+        return None
     
-    prompt = f"""You are a SQL expert helping to analyze customer order data. 
-Given the database schema and a user question, generate a valid SQLite query.
+    try:
+        validate_sql(query)
+        profile = engine.profile(DB_PATH)
+        with get_pool(DB_PATH, size=DB_WORKERS).connection() as conn:
+            rollups = load_rollups(conn, profile.table)
+    except (sqlite3.Error, ValueError):
+        return None
+    
+    rewritten = rewrite_query(query, rollups, profile.column_names, profile.table)
+    return rewritten[0] if rewritten else None
 
-Database Schema:
-{schema}
+def route_to_sample(query: str):
+    """
+    Rewrite an aggregate query to estimate its result from the table's sample (see sampling.py)
+    Returns an Approximation, or None when the table has no sample or the query can't be estimated
+    """
+    if not (engine.supports_samples and APPROXIMATE_ANSWERS):
+        return None
+    
+    try:
+        validate_sql(query)
+        profile = engine.profile(DB_PATH)
+        with get_pool(DB_PATH, size=DB_WORKERS).connection() as conn:
+            sample = load_sample(conn, profile.table)
+    except (sqlite3.Error, ValueError):
+        return None
+    
+    return approximate_query(query, sample, profile.table) if sample else None
 
-User Question: {user_question}
+async def show_estimate(msg: cl.Message, approximation, exact: asyncio.Future):
+    """
+    Stream the sample's estimate unless the exact result is already in
+    Returns the length of msg's content before the estimate, to cut it back to, or None
+    """
+    estimate = asyncio.ensure_future(run_blocking(db_executor, execute_sql, approximation.sql))
+    await asyncio.wait([estimate, exact], return_when=asyncio.FIRST_COMPLETED)
+    if exact.done():
+        return None  # Fast enough without one; the estimate finishes unobserved
+    df, error = await estimate
+    if error or exact.done():
+        return None
+    
+    mark = len(msg.content)
+    sample = approximation.sample
+    preview = approximation.frame(df).round(2).head(PAGE_ROWS)
+    table_md = await run_blocking(db_executor, preview.to_markdown, index=False)
+    await msg.stream_token(
+        f"**Approximate Results** • estimated from a {sample.sampled:,}-row sample of {sample.rows:,} rows; "
+        f"± is a 95% margin. Exact results loading...\n\n{table_md}\n\n"
+    )
+    return mark
 
-Instructions:
-- Generate ONLY the SQL query, no explanations or markdown
-- Use proper SQLite syntax
-- The table name is 'orders'
-- Return only SELECT statements
-- Use appropriate aggregations (SUM, COUNT, AVG) as needed
-- Use GROUP BY for aggregations
-- Use ORDER BY to sort results meaningfully
-- Limit results to top 10-20 items for large datasets
-- Handle NULL values appropriately
+def check_query_plan(query: str):
+    """
+    Estimate the cost of a query from EXPLAIN QUERY PLAN before running it
+    Returns a PlanDecision, or None if the query can't be planned (execute_sql reports the error)
+    or the engine has no SQLite query plans
+    """
+    if not engine.supports_query_plan:
+        return None
+    
+    try:
+        validate_sql(query)
+        profile = schema_cache.get(DB_PATH)
+        counts = {}
+        
+        with get_pool(DB_PATH, size=DB_WORKERS).connection() as conn:
+            def table_rows(name):
+                if name == profile.table:
+                    return profile.row_count
+                if name not in counts:
+                    try:
+                        # O(log n) upper bound on the row count of a rowid table
+                        row = conn.execute(f"SELECT MAX(rowid) FROM {quote_identifier(name)}").fetchone()
+                        counts[name] = row[0] or 0
+                    except sqlite3.Error:
+                        counts[name] = profile.row_count
+                return counts[name]
+            
+            return preflight(conn, query, table_rows)
+    except (sqlite3.Error, ValueError):
+        return None
 
-SQL Query:"""
+async def generate_sql_query(user_question: str, schema, schema_fingerprint: str = None,
+                             feedback: str = None, priority: int = PRIORITY_SQL):
+    """
+    Use Claude to generate SQL query from natural language
+    schema is the table's SchemaProfile (compacted to SCHEMA_TOKEN_BUDGET) or a rendered schema string
+    Answers from the translation cache when schema_fingerprint is given and the question was seen before
+    feedback (e.g. why the previous query was rejected) forces a fresh generation
+    priority orders the call among others waiting for the model (see llm_scheduler.py)
+    """
+    if schema_fingerprint is not None and feedback is None:
+        cached_sql = await run_blocking(
+            db_executor, translation_cache.get, user_question, schema_fingerprint, MODEL
+        )
+        if cached_sql is not None:
+            tracing.annotate(cache_hit=1)
+            return cached_sql
+        tracing.annotate(cache_hit=0)
+    
+    prompt = build_sql_prompt(user_question, schema, engine.dialect, engine.dialect_hints, feedback)
 
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
+    message = await llm_scheduler.create(
+        client.messages, priority, prompt.estimated_tokens,
+        model=MODEL,
         max_tokens=1024,
-        messages=[{"role": "user", "content": prompt}]
+        **prompt.kwargs()
     )
+    if not isinstance(message, SharedMessage):
+        # A request shared with an identical one in flight cost nothing of its own
+        token_usage.record("sql", prompt, message.usage)
+    tracing.record_usage(message.usage)
     
-    sql_query = message.content[0].text.strip()
-    
-    # Clean up the query (remove markdown code blocks if present)
-    sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
+    # Keep only the statement: no markdown fences, surrounding prose or trailing semicolon
+    sql_query = clean_sql(message.content[0].text)
     
-    # Remove any trailing semicolon (SQLite doesn't require it)
-    sql_query = sql_query.rstrip(';')
+    if schema_fingerprint is not None:
+        await run_blocking(
+            db_executor, translation_cache.put, user_question, schema_fingerprint, MODEL, sql_query
+        )
     
     return sql_query
 
-def explain_results(user_question: str, sql_query: str, results_df: pd.DataFrame):
-    """Use Claude to explain the results in plain English"""
+def repair_locally(query: str, error: str, budget: QueryBudget = None):
+    """
+    Retry a failed query after deterministic fixes (see sql_repair.py), up to REPAIR_ATTEMPTS rounds
+    Returns (sql, results_df, error, fixes); error is None once a repaired query ran
+    """
+    profile = engine.profile(DB_PATH)
+    fixes = []
+    for _ in range(REPAIR_ATTEMPTS):
+        repaired, applied = repair_sql(query, error, profile.column_names, [profile.table], engine.dialect)
+        if not applied or repaired == query:
+            break
+        fixes.extend(applied)
+        query = repaired
+        results_df, error = execute_sql(query, budget)
+        if error is None:
+            return query, results_df, None, fixes
+    return query, None, error, fixes
+
+async def repair_query(user_question: str, schema, schema_fingerprint: str, sql_query: str, error: str,
+                       budget: QueryBudget = None):
+    """
+    Recover from a failed query: local fixes first, then one error-feedback call to the model
+    (whose answer gets the local fixes too if it fails). Returns (sql, results_df, error, fixes)
+    """
+    fixes = []
+    if LOCAL_SQL_REPAIR:
+        sql_query, results_df, error, fixes = await run_blocking(
+            db_executor, repair_locally, sql_query, error, budget
+        )
     
-    # Prepare results summary
-    if len(results_df) == 0:
-        results_str = "No results found"
-    else:
-        # Convert to string, limit to first 20 rows for context
-        results_str = results_df.head(20).to_string(index=False)
-        if len(results_df) > 20:
-            results_str += f"\n\n... and {len(results_df) - 20} more rows"
+    if error is not None:
+        feedback = f"This query failed:\n{sql_query}\nError: {error}\nWrite a corrected query."
+        sql_query = await generate_sql_query(user_question, schema, schema_fingerprint, feedback=feedback)
+        fixes.append("regenerated from the error")
+        decision = await run_blocking(db_executor, check_query_plan, sql_query)
+        if decision is not None and decision.action == "reject":
+            return sql_query, None, f"Query too expensive (~{decision.cost:,.0f} estimated row visits)", fixes
+        if decision is not None and decision.action == "rewrite":
+            sql_query = decision.sql
+        results_df, error = await run_blocking(db_executor, execute_sql, sql_query, budget)
+        if error is not None and LOCAL_SQL_REPAIR:
+            sql_query, results_df, error, more = await run_blocking(
+                db_executor, repair_locally, sql_query, error, budget
+            )
+            fixes.extend(more)
     
-    prompt = f"""You are a business analyst explaining data insights to stakeholders.
+    if error is None:
+        # Serve the working query next time
+        await run_blocking(db_executor, translation_cache.put, user_question, schema_fingerprint, MODEL, sql_query)
+    return sql_query, results_df, error, fixes
 
-User's Question: {user_question}
+async def explain_results(user_question: str, sql_query: str, results_df: pd.DataFrame):
+    """Use Claude to explain the results in plain English, yielding text as it streams"""
+    
+    with tracing.span("explain"):
+        # The result digest is pandas work: keep it off the event loop
+        prompt = await run_blocking(db_executor, build_explain_prompt, user_question, sql_query, results_df)
 
-SQL Query Used:
-{sql_query}
+        async with llm_scheduler.stream(
+            client.messages, PRIORITY_EXPLAIN, prompt.estimated_tokens,
+            model=MODEL,
+            max_tokens=2048,
+            **prompt.kwargs()
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            final = await stream.get_final_message()
+        if not isinstance(final, SharedMessage):
+            token_usage.record("explain", prompt, final.usage)
+        tracing.record_usage(final.usage)
 
-Query Results:
-{results_str}
+async def stream_insights(msg: cl.Message, user_question: str, sql_query: str, results_df: pd.DataFrame,
+                          tokens=None):
+    """
+    Stream the explanation of the results into an existing message
+    tokens is an explanation already requested (a Prefetch of explain_results); by default one is requested here
+    """
+    if tokens is None:
+        tokens = explain_results(user_question, sql_query, results_df)
+    try:
+        async for text in tokens:
+            await msg.stream_token(text)
+    finally:
+        await tokens.aclose()
 
-Provide a clear, business-friendly explanation that includes:
-1. Direct answer to the question
-2. Key insights and patterns in the data
-3. Notable trends or outliers
-4. Actionable recommendations if applicable
+def example_questions() -> list:
+    """Every example question the app suggests, upload suggestions first"""
+    questions = UPLOAD_EXAMPLES + [q for topic in WELCOME_EXAMPLES.values() for q in topic]
+    return list(dict.fromkeys(questions))
 
-Keep the tone professional but conversational. Use numbers and percentages where relevant."""
+def format_examples() -> str:
+    """The welcome message's example questions as markdown"""
+    return "\n\n".join(
+        f"**{topic}**\n" + "\n".join(f"• {question}" for question in questions)
+        for topic, questions in WELCOME_EXAMPLES.items()
+    ) + "\n"
 
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=2048,
-        messages=[{"role": "user", "content": prompt}]
-    )
+async def warm_up():
+    """Build the schema profile and open a database connection before the first question"""
+    try:
+        await run_blocking(db_executor, engine.warm, DB_PATH)
+    except Exception:
+        pass  # The question path reports database errors
+
+async def preanswer(question: str):
+    """
+    Take a question through SQL generation and execution ahead of time
+    The SQL lands in the translation cache and the rows in the result cache, so asking it
+    later only waits for the explanation. Expensive queries are left to the live path.
+    """
+    trace = tracing.start("preanswer")
+    try:
+        schema = await run_blocking(db_executor, engine.profile, DB_PATH)
+        with tracing.span("generate_sql"):
+            sql_query = await generate_sql_query(question, schema, schema.schema_hash, priority=PRIORITY_BACKGROUND)
+        rollup_query = await run_blocking(db_executor, route_to_rollup, sql_query)
+        decision = None
+        if rollup_query is None:
+            decision = await run_blocking(db_executor, check_query_plan, sql_query)
+        if decision is not None and decision.action in ("regenerate", "reject"):
+            return
+        if decision is not None and decision.action == "rewrite":
+            sql_query = decision.sql
+        with tracing.span("execute_sql"):
+            _, error = await run_blocking(db_executor, execute_sql, rollup_query or sql_query)
+            if error and rollup_query is not None:
+                _, error = await run_blocking(db_executor, execute_sql, sql_query)
+        if error:
+            await run_blocking(db_executor, translation_cache.discard, question, schema.schema_hash, MODEL)
+    finally:
+        tracing.finish(trace)
+
+def schedule_preanswers(questions: list):
+    """Answer questions in the background, PREANSWER_CONCURRENCY at a time"""
+    for question in questions:
+        preanswers.submit(normalize_question(question), functools.partial(preanswer, question))
+
+def cancel_active_work():
+    """Cancel this session's running query and in-flight insight stream, if any"""
+    budget = cl.user_session.get("query_budget")
+    if budget is not None:
+        budget.cancel()
     
-    return message.content[0].text
+    task = cl.user_session.get("insight_task")
+    if task is not None and not task.done():
+        task.cancel()
 
 @cl.on_chat_start
 async def start():
@@ -198,7 +603,7 @@ async def start():
     
     # Check if database exists
     if not os.path.exists(DB_PATH):
-        welcome_msg = """# TalkToYourData - Sales Insight Bot
+        welcome_msg = f"""# TalkToYourData - Sales Insight Bot
 
 ## Getting Started
 
@@ -206,8 +611,8 @@ async def start():
 Use the **file upload button** (📎 paperclip icon) in the chat input below or drag & drop a CSV file. The AI agent will automatically convert it to a database!
 
 **File Requirements:**
-- Format: CSV files (`.csv`)
-- Size: Maximum 50 MB
+- Format: CSV files (`.csv`, or compressed `.csv.gz` / `.csv.zst`), Parquet or Arrow IPC
+- Size: Maximum {MAX_FILE_SIZE_MB:,} MB of data once decompressed
 - Must include column headers
 
 ### Or Use the Setup Script
@@ -225,125 +630,162 @@ Ask questions about your customer orders in natural language. I'll analyze your
 
 ### Example Questions
 
-**Sales Performance**
-• What are the top 5 products by revenue?
-• Show me monthly revenue trends
-
-**Regional Analysis**
-• Which states generate the most sales?
-• What's the revenue distribution by region?
-
-**Customer Insights**
-• What's the average order value?
-• Which payment methods are most popular?
-
-**Product Analysis**
-• Which products have the highest profit margins?
-• What are our best-selling SKUs?
-"""
+{format_examples()}"""
     else:
-        welcome_msg = """# TalkToYourData - Sales Insight Bot
+        # Load the schema and open a connection while the user reads and types
+        cl.user_session.set("warm_task", asyncio.create_task(warm_up()))
+        
+        welcome_msg = f"""# TalkToYourData - Sales Insight Bot
 
 Ask questions about your customer orders in natural language. I'll analyze your data and provide insights. Your question is translated into SQL, run against your dataset, and the results are summarized in plain English.
 
-**Sales Performance**
-• What are the top 5 products by revenue?
-• Show me monthly revenue trends
-
-**Regional Analysis**
-• Which states generate the most sales?
-• What's the revenue distribution by region?
-
-**Customer Insights**
-• What's the average order value?
-• Which payment methods are most popular?
-
-**Product Analysis**
-• Which products have the highest profit margins?
-• What are our best-selling SKUs?
-
+{format_examples()}
 """
     
     await cl.Message(content=welcome_msg).send()
 
+@cl.on_stop
+async def stop():
+    """Stop the running query and insights when the user presses stop"""
+    cancel_active_work()
+
+@cl.on_chat_end
+async def end():
+    """Stop the session's work when the user disconnects"""
+    cancel_active_work()
+
 @cl.on_message
 async def main(message: cl.Message):
     """Handle user messages and process queries or file uploads"""
     
+    # A new message supersedes any query or insights still running for the previous one
+    cancel_active_work()
+    
     # Check if user uploaded a file
     if message.elements:
-        csv_files = [el for el in message.elements if el.mime in ACCEPTED_MIME_TYPES]
+        csv_files = [el for el in message.elements if accepted_upload(el.name, el.mime)]
         
         if csv_files:
-            for file_element in csv_files:
-                msg = cl.Message(content="")
-                await msg.send()
+            # Several files (e.g. monthly exports) are loaded together into one table
+            msg = cl.Message(content="")
+            await msg.send()
+            names = ", ".join(f"`{el.name}`" for el in csv_files)
+            
+            try:
+                # Get file size in MB
+                file_sizes_mb = [os.path.getsize(el.path) / (1024 * 1024) for el in csv_files]
+                file_size_mb = sum(file_sizes_mb)
+                formats = [detect_format(el.path) for el in csv_files]
+                kind = " + ".join(dict.fromkeys(FORMAT_NAMES[fmt] for fmt in formats))
                 
-                try:
-                    # Get file size in MB
-                    file_size_mb = os.path.getsize(file_element.path) / (1024 * 1024)
-                    
-                    await msg.stream_token(f"📁 **Processing CSV file:** `{file_element.name}`\n\n")
-                    await msg.stream_token(f"📏 **File size:** {file_size_mb:.2f} MB\n\n")
-                    
-                    # Validate file size
-                    if file_size_mb > MAX_FILE_SIZE_MB:
-                        await msg.stream_token(f"❌ **File too large!**\n\n")
-                        await msg.stream_token(f"The uploaded file ({file_size_mb:.2f} MB) exceeds the maximum allowed size of {MAX_FILE_SIZE_MB} MB.\n\n")
-                        await msg.stream_token(f"**Suggestions:**\n")
-                        await msg.stream_token(f"- Try filtering your data to include only recent records\n")
-                        await msg.stream_token(f"- Remove unnecessary columns\n")
-                        await msg.stream_token(f"- Split the file into smaller chunks\n")
-                        await msg.update()
-                        return
-                    
+                if len(csv_files) == 1:
+                    await msg.stream_token(f"📁 **Processing {kind} file:** {names}\n\n")
+                else:
+                    await msg.stream_token(f"📁 **Processing {len(csv_files)} {kind} files:** {names}\n\n")
+                await msg.stream_token(f"📏 **File size:** {file_size_mb:.2f} MB\n\n")
+                
+                # Validate file size: plain CSV is checked now, compressed and columnar files as they are decoded
+                too_large = [(el, size) for el, size, fmt in zip(csv_files, file_sizes_mb, formats)
+                             if fmt == "csv" and size > MAX_FILE_SIZE_MB]
+                if too_large:
+                    file_element, size = too_large[0]
+                    await msg.stream_token(f"❌ **File too large!**\n\n")
+                    await msg.stream_token(f"The uploaded file `{file_element.name}` ({size:.2f} MB) exceeds the maximum allowed size of {MAX_FILE_SIZE_MB} MB.\n\n")
+                    await msg.stream_token(f"**Suggestions:**\n")
+                    await msg.stream_token(f"- Try filtering your data to include only recent records\n")
+                    await msg.stream_token(f"- Remove unnecessary columns\n")
+                    await msg.stream_token(f"- Split the file into smaller chunks\n")
+                    await msg.update()
+                    return
+                
+                mode = upload_mode(message.content) or INGEST_MODE
+                if mode == "append":
+                    await msg.stream_token("⚙️ Appending new rows to the database...\n\n")
+                else:
                     await msg.stream_token("⚙️ Converting CSV to database...\n\n")
-                    
-                    # Convert CSV to database
-                    success, result = convert_csv_to_db(file_element.path)
-                    
-                    if success:
-                        await msg.stream_token(f"✅ **Successfully converted to database!**\n\n")
-                        await msg.stream_token(f"📊 **Database Statistics:**\n")
-                        await msg.stream_token(f"- **File Name**: {file_element.name}\n")
-                        await msg.stream_token(f"- **File Size**: {file_size_mb:.2f} MB\n")
-                        await msg.stream_token(f"- **Total Records**: {result['records']:,}\n")
-                        await msg.stream_token(f"- **Total Columns**: {result['columns']}\n")
-                        await msg.stream_token(f"- **Column Names**: `{', '.join(result['column_names'])}`\n\n")
-                        await msg.stream_token(f"💾 **Database Location**: `{DB_PATH}`\n\n")
-                        await msg.stream_token("---\n\n")
-                        await msg.stream_token("✨ **Ready to analyze!** You can now ask questions about your data.\n\n")
-                        await msg.stream_token("**Try these example questions:**\n")
-                        await msg.stream_token("- What are the top 5 products by revenue?\n")
-                        await msg.stream_token("- Show me the sales trend by month\n")
-                        await msg.stream_token("- Which region has the highest sales?\n")
-                    else:
-                        await msg.stream_token(f"❌ **Error converting CSV**\n\n")
-                        await msg.stream_token(f"**Error details:**\n```\n{result}\n```\n\n")
-                        await msg.stream_token(f"**Troubleshooting tips:**\n")
-                        await msg.stream_token(f"- Ensure the CSV file is properly formatted\n")
-                        await msg.stream_token(f"- Check that the file is not corrupted\n")
-                        await msg.stream_token(f"- Verify that the file contains data (not empty)\n")
-                        await msg.stream_token(f"- Make sure column headers are present\n")
-                        
-                except Exception as e:
-                    await msg.stream_token(f"❌ **Unexpected Error**\n\n")
-                    await msg.stream_token(f"```\n{str(e)}\n```\n\n")
-                    await msg.stream_token(f"Please try again or contact support if the issue persists.\n")
                 
-                await msg.update()
+                # Report ingest progress under the header without growing the message
+                header = msg.content
+                
+                def report_progress(rows, elapsed):
+                    rate = rows / elapsed if elapsed > 0 else 0
+                    msg.content = header + f"⏳ {rows:,} rows loaded • {rate:,.0f} rows/s\n\n"
+                    cl.run_sync(msg.update())
+                
+                # Answers being prepared for the old data are no longer wanted
+                preanswers.cancel_all()
+                
+                # Convert CSV to database (off the event loop so progress can be sent)
+                paths = [el.path for el in csv_files]
+                trace = tracing.start("upload", file=", ".join(el.name for el in csv_files),
+                                      file_mb=round(file_size_mb, 2), mode=mode, format=",".join(formats))
+                success, result = await run_blocking(
+                    ingest_executor, convert_csv_to_db,
+                    paths[0] if len(paths) == 1 else paths, progress_callback=report_progress, mode=mode
+                )
+                tracing.finish(trace)
+                msg.content = header
+                
+                if success:
+                    if result.get('skipped'):
+                        await msg.stream_token("♻️ **Already loaded:** the database holds this file's contents, so nothing was re-imported.\n\n")
+                    elif 'added' in result:
+                        await msg.stream_token(f"✅ **Appended {result['added']:,} new rows** ({result['duplicates']:,} already in the database)\n\n")
+                    else:
+                        await msg.stream_token(f"✅ **Successfully converted to database!**\n\n")
+                    await msg.stream_token(f"📊 **Database Statistics:**\n")
+                    await msg.stream_token(f"- **File Name**: {', '.join(el.name for el in csv_files)}\n")
+                    await msg.stream_token(f"- **File Size**: {file_size_mb:.2f} MB\n")
+                    await msg.stream_token(f"- **Total Records**: {result['records']:,}\n")
+                    await msg.stream_token(f"- **Total Columns**: {result['columns']}\n")
+                    await msg.stream_token(f"- **Column Names**: `{', '.join(result['column_names'])}`\n\n")
+                    await msg.stream_token(f"💾 **Database Location**: `{DB_PATH}`\n")
+                    if result['storage']:
+                        await msg.stream_token(f"🗜️ **Storage**: {format_size_report(result['storage'])}\n")
+                    await msg.stream_token("\n")
+                    await msg.stream_token("---\n\n")
+                    await msg.stream_token("✨ **Ready to analyze!** You can now ask questions about your data.\n\n")
+                    await msg.stream_token("**Try these example questions:**\n")
+                    for question in UPLOAD_EXAMPLES:
+                        await msg.stream_token(f"- {question}\n")
+                    msg.actions = [
+                        cl.Action(name="ask_example", payload={"question": q}, label=q) for q in UPLOAD_EXAMPLES
+                    ]
+                    if PREANSWER_EXAMPLES:
+                        # Have the answers ready by the time one is asked
+                        schedule_preanswers(example_questions())
+                    if TIMING_FOOTER:
+                        await msg.stream_token(f"\n{trace.footer()}\n")
+                else:
+                    await msg.stream_token(f"❌ **Error converting CSV**\n\n")
+                    await msg.stream_token(f"**Error details:**\n```\n{result}\n```\n\n")
+                    await msg.stream_token(f"**Troubleshooting tips:**\n")
+                    await msg.stream_token(f"- Ensure the CSV file is properly formatted\n")
+                    await msg.stream_token(f"- Check that the file is not corrupted\n")
+                    await msg.stream_token(f"- Verify that the file contains data (not empty)\n")
+                    await msg.stream_token(f"- Make sure column headers are present\n")
+                    if len(csv_files) > 1:
+                        await msg.stream_token(f"- Files uploaded together must have the same columns\n")
+                    
+            except Exception as e:
+                await msg.stream_token(f"❌ **Unexpected Error**\n\n")
+                await msg.stream_token(f"```\n{str(e)}\n```\n\n")
+                await msg.stream_token(f"Please try again or contact support if the issue persists.\n")
+            
+            await msg.update()
             return
         else:
-            # File uploaded but not CSV
+            # File uploaded but not a format we read
             if message.elements:
                 uploaded_file = message.elements[0]
                 await cl.Message(
                     content=f"⚠️ **Invalid file type**\n\n"
                             f"You uploaded: `{uploaded_file.name}` (type: `{uploaded_file.mime}`)\n\n"
                             f"**Accepted formats:**\n"
-                            f"- CSV files (`.csv`)\n"
-                            f"- Maximum size: {MAX_FILE_SIZE_MB} MB\n\n"
-                            f"Please upload a valid CSV file and try again.",
+                            f"- CSV files (`.csv`, `.csv.gz`, `.csv.zst`)\n"
+                            f"- Parquet (`.parquet`) and Arrow IPC (`.arrow`, `.feather`) files\n"
+                            f"- Maximum size: {MAX_FILE_SIZE_MB} MB once decompressed\n\n"
+                            f"Please upload a supported file and try again.",
                     author="System"
                 ).send()
                 return
@@ -360,6 +802,7 @@ async def main(message: cl.Message):
     # Create a message to stream updates
     msg = cl.Message(content="")
     await msg.send()
+    trace = tracing.start("question")
     
     try:
         # First check if database exists
@@ -371,42 +814,162 @@ async def main(message: cl.Message):
             
         # Step 1: Analyze question
         await msg.stream_token("Analyzing your question...\n\n")
-        schema = get_table_schema()
+        # An example question being pre-answered: wait for it rather than repeat the work
+        await preanswers.wait(normalize_question(user_question))
+        with tracing.span("schema"):
+            schema = await run_blocking(db_executor, engine.profile, DB_PATH)
+        schema_fingerprint = schema.schema_hash
         
         # Step 2: Generate SQL query
         await msg.stream_token("Generating SQL query...\n\n")
-        sql_query = generate_sql_query(user_question, schema)
+        with tracing.span("generate_sql"):
+            sql_query = await generate_sql_query(user_question, schema, schema_fingerprint)
         
         await msg.stream_token(f"**Generated Query**\n\n```sql\n{sql_query}\n```\n\n")
         
-        # Step 3: Execute query
+        # Step 3: Answer from a rollup when one covers the query (cost independent of table size)
+        with tracing.span("route_rollup"):
+            rollup_query = await run_blocking(db_executor, route_to_rollup, sql_query)
+        
+        # Estimate from the table's sample while the exact query runs (large tables only)
+        approximation = None
+        if rollup_query is None:
+            with tracing.span("route_sample"):
+                approximation = await run_blocking(db_executor, route_to_sample, sql_query)
+        
+        # Step 4: Pre-flight cost check against the query plan
+        decision = None
+        if rollup_query is None:
+            with tracing.span("preflight"):
+                decision = await run_blocking(db_executor, check_query_plan, sql_query)
+        
+        if decision is not None and decision.action == "regenerate":
+            await msg.stream_token("This query looks expensive. Asking for a cheaper version...\n\n")
+            with tracing.span("regenerate_sql"):
+                sql_query = await generate_sql_query(
+                    user_question, schema, schema_fingerprint, feedback=decision.feedback()
+                )
+            await msg.stream_token(f"**Revised Query**\n\n```sql\n{sql_query}\n```\n\n")
+            with tracing.span("preflight"):
+                decision = await run_blocking(db_executor, check_query_plan, sql_query)
+        
+        if decision is not None and decision.action == "reject":
+            await run_blocking(
+                db_executor, translation_cache.discard, user_question, schema_fingerprint, MODEL
+            )
+            await msg.stream_token(f"**Query too expensive** (~{decision.cost:,.0f} estimated row visits)\n\n")
+            await msg.stream_token("Please try a narrower question, e.g. with a date range or a specific product.")
+            await msg.update()
+            return
+        
+        if decision is not None and decision.action == "rewrite":
+            sql_query = decision.sql
+            await msg.stream_token(f"*Note: {decision.reasons[0]}*\n\n")
+        
+        # Step 5: Execute query
         await msg.stream_token("Executing query...\n\n")
-        results_df, error = execute_sql(sql_query)
+        budget = QueryBudget()
+        cl.user_session.set("query_budget", budget)
+        started = time.perf_counter()
+        if rollup_query is not None:
+            await msg.stream_token("*Answered from a precomputed rollup table*\n\n")
+        with tracing.span("execute_sql") as stage:
+            if rollup_query is not None:
+                results_df, error = await run_blocking(db_executor, execute_sql, rollup_query, budget)
+                if error:
+                    rollup_query = None  # Fall back to the query as generated
+            if rollup_query is None:
+                exact = asyncio.ensure_future(run_blocking(db_executor, execute_sql, sql_query, budget))
+                mark = None
+                if approximation is not None and sql_query == approximation.query:
+                    with tracing.span("estimate"):
+                        mark = await show_estimate(msg, approximation, exact)
+                results_df, error = await exact
+                if mark is not None:
+                    # The exact result replaces the estimate
+                    msg.content = msg.content[:mark]
+                    await msg.update()
+                stage.add(estimated=int(mark is not None))
+            if not error:
+                # Rows scanned is the planner's estimate (SQLite only); rollups scan the small rollup table
+                stage.add(rows_returned=len(results_df), result_bytes=frame_bytes(results_df),
+                          est_rows_scanned=decision.cost if decision else None, rollup=int(rollup_query is not None))
+        
+        if error and not budget.should_abort():
+            # Step 5b: Fix the query locally, or else with one error-feedback call to the model
+            await msg.stream_token("*The query failed; repairing it...*\n\n")
+            with tracing.span("repair_sql") as stage:
+                sql_query, results_df, error, fixes = await repair_query(
+                    user_question, schema, schema_fingerprint, sql_query, error, budget
+                )
+                stage.add(fixes=len(fixes), model_calls=int("regenerated from the error" in fixes))
+            if not error:
+                decision = None  # The plan was for the failed query
+                await msg.stream_token(
+                    f"**Repaired Query** ({'; '.join(fixes)})\n\n```sql\n{sql_query}\n```\n\n"
+                )
+        
+        if not error:
+            query_log.record(rollup_query or sql_query, decision.plan if decision else [], time.perf_counter() - started)
+            if engine.supports_query_plan and query_log.recorded % ADVISOR_EVERY_N_QUERIES == 0:
+                asyncio.get_running_loop().run_in_executor(ingest_executor, run_index_advisor)
         
         if error:
+            if not budget.should_abort():
+                # Don't keep serving SQL that fails (a stopped or timed-out query may be fine)
+                await run_blocking(
+                    db_executor, translation_cache.discard, user_question, schema_fingerprint, MODEL
+                )
             await msg.stream_token(f"**Error**\n\n```\n{error}\n```\n\n")
             await msg.stream_token("Please try rephrasing your question.")
             await msg.update()
             return
         
-        # Step 4: Display results
+        # Step 6: Display results
         row_count = len(results_df)
-        await msg.stream_token(f"**Results** • {row_count} row(s)\n\n")
+        total_rows = results_df.attrs.get('total_rows', row_count)
+        if total_rows is None:
+            await msg.stream_token(f"**Results** • more than {row_count:,} row(s)\n\n")
+        else:
+            await msg.stream_token(f"**Results** • {total_rows:,} row(s)\n\n")
         
         # Format and display results
         if row_count > 0:
-            # Show results as a formatted table
-            display_df = results_df.head(15)
-            table_md = display_df.to_markdown(index=False)
-            await msg.stream_token(f"{table_md}\n\n")
-            
-            if row_count > 15:
-                await msg.stream_token(f"*Showing 15 of {row_count} rows*\n\n")
+            # Request the explanation now; its tokens are buffered while the preview renders
+            insights = Prefetch(explain_results(user_question, sql_query, results_df))
+            try:
+                # Show results as a formatted table
+                display_df = results_df.head(PAGE_ROWS)
+                with tracing.span("render"):
+                    table_md = await run_blocking(db_executor, display_df.to_markdown, index=False)
+                await msg.stream_token(f"{table_md}\n\n")
+                
+                if row_count > PAGE_ROWS:
+                    await msg.stream_token(f"*Showing {PAGE_ROWS} of {total_rows or row_count:,} rows*\n\n")
+                    # Later pages and downloads re-run the query instead of keeping these rows
+                    key = remember_result(rollup_query or sql_query, total_rows)
+                    msg.actions = result_actions(key, 0, total_rows)
+                if results_df.attrs.get('truncated'):
+                    await msg.stream_token(f"*Insights cover the first {row_count:,} rows (query row limit)*\n\n")
+                
+                # Step 7: Generate insights
+                await msg.stream_token("---\n\n**Insights**\n\n")
+            except BaseException:
+                await insights.aclose()
+                raise
+            insight_task = asyncio.create_task(
+                stream_insights(msg, user_question, sql_query, results_df, tokens=insights)
+            )
+            cl.user_session.set("insight_task", insight_task)
+            try:
+                await asyncio.wait([insight_task])
+            finally:
+                insight_task.cancel()  # No-op unless this handler itself was cancelled
             
-            # Step 5: Generate insights
-            await msg.stream_token("---\n\n**Insights**\n\n")
-            explanation = explain_results(user_question, sql_query, results_df)
-            await msg.stream_token(explanation)
+            if insight_task.cancelled():
+                await msg.stream_token("\n\n*Insights stopped.*")
+            else:
+                insight_task.result()  # Surface any error from the stream
             
         else:
             await msg.stream_token("No results found. Try a different question.\n")
@@ -414,10 +977,79 @@ async def main(message: cl.Message):
     except Exception as e:
         await msg.stream_token(f"\n\n**Error**\n\n```\n{str(e)}\n```\n\n")
         await msg.stream_token("Please try asking your question differently.")
+    finally:
+        tracing.finish(trace)
+    
+    if TIMING_FOOTER:
+        await msg.stream_token(f"\n\n{trace.footer()}")
     
     # Update the message
     await msg.update()
 
+@cl.action_callback("ask_example")
+async def ask_example(action: cl.Action):
+    """Ask a suggested example question as if the user had typed it"""
+    question = action.payload["question"]
+    await cl.Message(content=question, type="user_message").send()
+    await main(cl.Message(content=question))
+
+@cl.action_callback("result_page")
+async def show_result_page(action: cl.Action):
+    """Show another page of a result by re-running its query with an offset"""
+    key = action.payload.get("result")
+    entry = (cl.user_session.get("result_queries") or {}).get(key)
+    if entry is None:
+        await cl.Message(content="This result is no longer available. Please ask the question again.").send()
+        return
+    query, total_rows = entry
+    offset = max(int(action.payload.get("offset", 0)), 0)
+    
+    page_df, error = await run_blocking(db_executor, execute_sql, page_query(query, offset))
+    if error:
+        await cl.Message(content=f"**Error**\n\n```\n{error}\n```").send()
+        return
+    if len(page_df) == 0:
+        await cl.Message(content="No more rows.").send()
+        return
+    
+    table_md = await run_blocking(db_executor, page_df.to_markdown, index=False)
+    of_total = f" of {total_rows:,}" if total_rows else ""
+    await cl.Message(
+        content=f"{table_md}\n\n*Rows {offset + 1:,}–{offset + len(page_df):,}{of_total}*",
+        actions=result_actions(key, offset, total_rows, exports=False)
+    ).send()
+
+@cl.action_callback("export_result")
+async def export_result_file(action: cl.Action):
+    """Stream a result's rows to a file and attach it to a message"""
+    entry = (cl.user_session.get("result_queries") or {}).get(action.payload.get("result"))
+    if entry is None:
+        await cl.Message(content="This result is no longer available. Please ask the question again.").send()
+        return
+    query, _ = entry
+    fmt = action.payload.get("format", "csv")
+    
+    msg = cl.Message(content=f"Exporting rows to {fmt.upper()}...")
+    await msg.send()
+    budget = QueryBudget(timeout=EXPORT_TIMEOUT_SECONDS, max_rows=EXPORT_MAX_ROWS)
+    cl.user_session.set("query_budget", budget)  # Stop cancels the export like a query
+    
+    exported, error = await run_blocking(db_executor, export_sql, query, fmt, budget)
+    if error:
+        msg.content = f"**Export failed**\n\n```\n{error}\n```"
+        await msg.update()
+        return
+    
+    path, rows, truncated = exported
+    try:
+        msg.content = f"⬇️ **{rows:,} rows** exported as {fmt.upper()}"
+        if truncated:
+            msg.content += f" (first {rows:,}; export row limit)"
+        msg.elements = [cl.File(name=f"query_results.{fmt}", path=path, display="inline")]
+        await msg.update()
+    finally:
+        os.remove(path)  # Chainlit keeps its own copy for the session
+
 if __name__ == "__main__":
     # This is only used for local testing
     pass
@@ -0,0 +1,505 @@
+"""
+Benchmark Suite
+Times each stage of the app on synthetic orders data (ingest, schema
+profile, validation, query execution, markdown rendering) and the whole
+message pipeline with a stub Claude client, then compares the timings to a
+saved JSON baseline so regressions fail the run
+
+    python benchmark.py --rows 10000 100000            # compare to benchmarks/baseline.json
+    python benchmark.py --rows 1000000 --update-baseline
+"""
+
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import chainlit as cl
+import pandas as pd
+
+import app
+import parallel_ingest
+from export import PAGE_ROWS
+from ingest import REGISTRY_TABLE
+from result_cache import ResultCache
+from synthetic_orders import generate_orders
+from translation_cache import TranslationCache
+
+# Benchmark configuration
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baseline.json")
+WORK_DIR = os.path.join(tempfile.gettempdir(), "sql-agent-bench")  # Generated CSVs are kept here and reused
+DEFAULT_ROWS = [10_000, 100_000]
+REPEAT = 3  # Runs per stage; the median is kept
+TOLERANCE = 0.25  # Slowdown over the baseline that counts as a regression
+MIN_REGRESSION_SECONDS = 0.005  # Smaller slowdowns are timer noise
+VALIDATE_ROUNDS = 1000  # validate_sql is timed over this many passes of the standard queries
+LLM_LATENCY = 0.05  # Seconds per stub Claude call
+STREAM_TOKENS = 20  # Tokens per stub explanation
+SESSIONS = 8  # Sessions asking the same question at once (e.g. an example question after a data refresh)
+
+# Standard analytic queries: (name, question, SQL)
+QUERIES = [
+    ("top_products", "What are the top 10 products by revenue?",
+     "SELECT product_name, SUM(revenue) AS revenue FROM orders GROUP BY product_name ORDER BY revenue DESC LIMIT 10"),
+    ("monthly_trend", "What's the monthly sales trend?",
+     "SELECT substr(order_date, 1, 7) AS month, SUM(revenue) AS revenue, COUNT(*) AS orders "
+     "FROM orders GROUP BY month ORDER BY month"),
+    ("revenue_by_state", "Which states are our strongest markets?",
+     "SELECT state, SUM(revenue) AS revenue FROM orders GROUP BY state ORDER BY revenue DESC"),
+    ("avg_order_by_payment", "What's the average order value by payment method?",
+     "SELECT payment_method, AVG(revenue) AS avg_order_value FROM orders GROUP BY payment_method"),
+    ("category_margin", "Which categories have the highest profit margins?",
+     "SELECT category, SUM(profit) / SUM(revenue) AS margin FROM orders GROUP BY category ORDER BY margin DESC"),
+    ("top_customers", "Who are our top 20 customers?",
+     "SELECT customer_id, SUM(revenue) AS revenue, COUNT(*) AS orders FROM orders "
+     "GROUP BY customer_id ORDER BY revenue DESC LIMIT 20"),
+    ("recent_california", "How did California do since July 2024?",
+     "SELECT COUNT(*) AS orders, SUM(revenue) AS revenue FROM orders "
+     "WHERE order_date >= '2024-07-01' AND state = 'CA'"),
+    ("order_lookup", "Show me order 4242",
+     "SELECT * FROM orders WHERE order_id = 4242"),
+    ("largest_discounted", "List the largest discounted orders",
+     "SELECT order_id, order_date, product_name, discount, revenue FROM orders "
+     "WHERE discount IS NOT NULL ORDER BY revenue DESC LIMIT 500"),
+]
+
+# Queries written for another dialect or with misspelled names, as a model
+# sometimes returns them: (name, question, broken SQL, the model's corrected SQL)
+BROKEN_QUERIES = [
+    ("trunc_month", "What was revenue per month in 2023?",
+     "SELECT DATE_TRUNC('month', order_date) AS month, SUM(revenue) AS revenue FROM orders "
+     "WHERE EXTRACT(YEAR FROM order_date) = 2023 GROUP BY 1 ORDER BY 1",
+     "SELECT strftime('%Y-%m-01', order_date) AS month, SUM(revenue) AS revenue FROM orders "
+     "WHERE strftime('%Y', order_date) = '2023' GROUP BY 1 ORDER BY 1"),
+    ("top_n", "Which 5 products sold the most units?",
+     "SELECT TOP 5 product_name, SUM(quantity) AS units FROM orders GROUP BY product_name ORDER BY units DESC",
+     "SELECT product_name, SUM(quantity) AS units FROM orders GROUP BY product_name ORDER BY units DESC LIMIT 5"),
+    ("misspelled_column", "What is total profit by category?",
+     "SELECT category, SUM(proft) AS profit FROM orders GROUP BY category",
+     "SELECT category, SUM(profit) AS profit FROM orders GROUP BY category"),
+    ("partial_column", "How many orders did each customer place?",
+     "SELECT customer, COUNT(*) AS orders FROM orders GROUP BY customer ORDER BY orders DESC LIMIT 20",
+     "SELECT customer_id, COUNT(*) AS orders FROM orders GROUP BY customer_id ORDER BY orders DESC LIMIT 20"),
+    ("table_name", "What is the average discount by state?",
+     "SELECT state, AVG(discount) AS avg_discount FROM order_table GROUP BY state",
+     "SELECT state, AVG(discount) AS avg_discount FROM orders GROUP BY state"),
+]
+
+
+def median_time(func, repeat: int = REPEAT, setup=None) -> float:
+    """Median wall-clock seconds of func() over repeat runs (setup() runs untimed before each)"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+class StubLLM:
+    """
+    Anthropic messages stand-in: canned SQL per question and streamed explanations, each after latency seconds.
+    A question may map to a list of answers, returned in turn on repeated requests (the last one repeats).
+    """
+
+    def __init__(self, sql_by_question: dict, latency: float = LLM_LATENCY):
+        self.sql_by_question = sql_by_question
+        self.latency = latency
+        self.calls = 0
+        self.asked = {}
+
+    @staticmethod
+    def usage(kwargs, output: str):
+        text = "".join(block["text"] for block in kwargs.get("system") or [])
+        text += "".join(m["content"] for m in kwargs["messages"])
+        return SimpleNamespace(input_tokens=len(text.split()), output_tokens=len(output.split()),
+                               cache_creation_input_tokens=0, cache_read_input_tokens=0)
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        prompt = kwargs["messages"][0]["content"]
+        question, sql = next((q, sql) for q, sql in self.sql_by_question.items() if q in prompt)
+        if isinstance(sql, list):
+            sql = sql[min(self.asked.get(question, 0), len(sql) - 1)]
+        self.asked[question] = self.asked.get(question, 0) + 1
+        return SimpleNamespace(content=[SimpleNamespace(text=f"```sql\n{sql}\n```")],
+                               usage=self.usage(kwargs, sql))
+
+    def stream(self, **kwargs):
+        self.calls += 1
+        return StubStream(self.latency, self.usage(kwargs, "word " * STREAM_TOKENS))
+
+
+class StubStream:
+    """Streams STREAM_TOKENS tokens spread over the call latency"""
+
+    def __init__(self, latency: float, usage):
+        self.latency = latency
+        self.final = SimpleNamespace(content=[], usage=usage)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        for _ in range(STREAM_TOKENS):
+            await asyncio.sleep(self.latency / STREAM_TOKENS)
+            yield "word "
+
+    async def get_final_message(self):
+        return self.final
+
+
+class StubMessage:
+    """cl.Message stand-in that accumulates streamed content"""
+
+    sent = []
+
+    def __init__(self, content: str = "", author: str = None, actions=None, elements=None):
+        self.content = content
+        self.actions = actions or []
+        self.elements = elements or []
+
+    async def send(self):
+        StubMessage.sent.append(self)
+        return self
+
+    async def stream_token(self, token: str):
+        self.content += token
+
+    async def update(self):
+        return True
+
+
+class StubSession(dict):
+    """cl.user_session stand-in"""
+
+    def set(self, key, value):
+        self[key] = value
+
+
+def stub_chainlit():
+    """The parts of chainlit app.main uses, without a running Chainlit server"""
+    return SimpleNamespace(Message=StubMessage, user_session=StubSession(), Action=cl.Action,
+                           File=cl.File, run_sync=lambda coroutine: coroutine.close())
+
+
+async def answer_questions(questions: list):
+    """Run each question through app.main in turn, failing on any error message"""
+    for question in questions:
+        StubMessage.sent.clear()
+        await app.main(SimpleNamespace(content=question, elements=[]))
+        reply = StubMessage.sent[-1].content
+        if "**Error**" in reply or "No database found" in reply:
+            raise RuntimeError(f"Pipeline failed for {question!r}:\n{reply}")
+
+
+def upload_copies(csv_path: str) -> dict:
+    """{format: path} of the CSV gzip-compressed and as Parquet, written once next to it"""
+    copies = {'gzip': csv_path + ".gz", 'parquet': os.path.splitext(csv_path)[0] + ".parquet"}
+    if not os.path.exists(copies['gzip']):
+        with open(csv_path, "rb") as src, gzip.open(copies['gzip'], "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+    if not os.path.exists(copies['parquet']):
+        pd.read_csv(csv_path).to_parquet(copies['parquet'], index=False)
+    return copies
+
+
+def benchmark_rows(rows: int, work_dir: str = WORK_DIR, seed: int = 0, repeat: int = REPEAT,
+                   llm_latency: float = LLM_LATENCY) -> dict:
+    """Time every stage on a rows-long synthetic orders table; returns {metric: seconds}"""
+    os.makedirs(work_dir, exist_ok=True)
+    csv_path = os.path.join(work_dir, f"orders_{rows}_{seed}.csv")
+    if not os.path.exists(csv_path):
+        generate_orders(csv_path, rows, seed)
+    db_path = os.path.join(work_dir, f"bench_{rows}{os.path.splitext(app.engine.default_path)[1] or '.db'}")
+
+    saved = {name: getattr(app, name) for name in
+             ('DB_PATH', 'cl', 'client', 'result_cache', 'translation_cache', 'LOCAL_SQL_REPAIR')}
+    timings = {}
+    try:
+        app.DB_PATH = db_path
+        app.result_cache = ResultCache()
+
+        def ingest(path=csv_path):
+            success, result = app.convert_csv_to_db(path, db_path)
+            if not success:
+                raise RuntimeError(f"Ingest failed: {result}")
+
+        def forget_loads():
+            """Make the next ingest a full load: the same file again would be skipped (see incremental.py)"""
+            if os.path.exists(db_path) and app.engine.supports_append:
+                conn = sqlite3.connect(db_path)
+                with conn:
+                    conn.execute(f"DROP TABLE IF EXISTS {REGISTRY_TABLE}")
+                conn.close()
+        timings['ingest'] = median_time(ingest, repeat, setup=forget_loads)
+
+        if app.engine.name == "sqlite":
+            # The same load sharded across INGEST_PROCESSES workers whatever its size; the pool is started first
+            min_bytes = parallel_ingest.PARALLEL_MIN_BYTES
+            parallel_ingest.PARALLEL_MIN_BYTES = 0
+            try:
+                forget_loads()
+                ingest()
+                timings['ingest_sharded'] = median_time(ingest, repeat, setup=forget_loads)
+            finally:
+                parallel_ingest.PARALLEL_MIN_BYTES = min_bytes
+            # Uploading the loaded file again: hashed and skipped
+            timings['ingest_unchanged'] = median_time(ingest, repeat)
+
+        # The same rows uploaded gzip-compressed and as Parquet, decoded as they stream in
+        for fmt, path in upload_copies(csv_path).items():
+            timings[f'ingest_{fmt}'] = median_time(lambda: ingest(path), repeat, setup=forget_loads)
+        forget_loads()
+        ingest()
+
+        timings['schema_cold'] = median_time(
+            app.get_table_schema, repeat, setup=lambda: app.engine.schema_cache.invalidate(db_path)
+        )
+        timings['schema_warm'] = median_time(app.get_table_schema, repeat)
+
+        def validate():
+            for _ in range(VALIDATE_ROUNDS):
+                for _, _, sql in QUERIES:
+                    app.validate_sql(sql)
+        timings['validate_sql'] = median_time(validate, repeat)
+
+        results = {}
+        for name, _, sql in QUERIES:
+            def execute():
+                results[name], error = app.execute_sql(sql)
+                if error:
+                    raise RuntimeError(f"{name} failed: {error}")
+            # Cold: nothing in the result cache
+            timings[f'execute_sql.{name}'] = median_time(
+                execute, repeat, setup=lambda: setattr(app, 'result_cache', ResultCache())
+            )
+        timings['execute_sql_cached'] = median_time(
+            lambda: [app.execute_sql(sql) for _, _, sql in QUERIES], repeat
+        )
+
+        # Approximate answers: the same queries estimated from the sample (tables of SAMPLE_MIN_ROWS or more)
+        estimates = [approximation.sql for approximation in map(app.route_to_sample, [sql for _, _, sql in QUERIES])
+                     if approximation is not None]
+        if estimates:
+            timings['estimate_sql'] = median_time(
+                lambda: [app.execute_sql(sql) for sql in estimates], repeat,
+                setup=lambda: setattr(app, 'result_cache', ResultCache())
+            )
+
+        timings['render_markdown'] = median_time(
+            lambda: [df.head(PAGE_ROWS).to_markdown(index=False) for df in results.values()], repeat
+        )
+
+        # Whole pipeline: fresh caches so every question goes to the (stub) model and the database
+        stub = StubLLM({question: sql for _, question, sql in QUERIES}, llm_latency)
+        app.cl = stub_chainlit()
+        app.client = SimpleNamespace(messages=stub)
+        questions = [question for _, question, _ in QUERIES]
+
+        def reset_caches():
+            app.result_cache = ResultCache()
+            app.translation_cache = TranslationCache(path=os.path.join(work_dir, "translations.db"))
+            app.translation_cache.clear()
+            stub.calls = 0
+        runs = []
+        for _ in range(repeat):
+            reset_caches()
+            started = time.perf_counter()
+            asyncio.run(answer_questions(questions))
+            elapsed = time.perf_counter() - started
+            runs.append((elapsed, elapsed - stub.calls * llm_latency))
+        timings['pipeline'] = statistics.median(r[0] for r in runs) / len(questions)
+        # Time spent outside the model calls: the part this codebase controls
+        timings['pipeline_overhead'] = statistics.median(r[1] for r in runs) / len(questions)
+
+        async def first_question(warm: bool):
+            # A new chat on data nothing has read yet; warm-up runs while the user types
+            app.engine.schema_cache.invalidate(db_path)
+            if warm:
+                await app.warm_up()
+            started = time.perf_counter()
+            await answer_questions(questions[:1])
+            return time.perf_counter() - started
+
+        for warm in (False, True):
+            times = []
+            for _ in range(repeat):
+                reset_caches()
+                times.append(asyncio.run(first_question(warm)))
+            timings['pipeline_first_question' + ('_warmed' if warm else '')] = statistics.median(times)
+
+        async def preanswered():
+            # Pre-answering runs while the user reads the upload message
+            app.schedule_preanswers(questions)
+            await app.preanswers.join()
+            started = time.perf_counter()
+            await answer_questions(questions)
+            return time.perf_counter() - started
+
+        times = []
+        for _ in range(repeat):
+            reset_caches()
+            times.append(asyncio.run(preanswered()))
+        timings['pipeline_preanswered'] = statistics.median(times) / len(questions)
+
+        async def same_question_at_once():
+            # Each session generates SQL, runs it and streams the explanation; identical calls in flight are shared
+            _, question, _ = QUERIES[0]
+            schema = app.engine.profile(db_path)
+
+            async def session():
+                sql_query = await app.generate_sql_query(question, schema, schema.schema_hash)
+                results_df, _ = await app.run_blocking(app.db_executor, app.execute_sql, sql_query)
+                async for _ in app.explain_results(question, sql_query, results_df):
+                    pass
+            await asyncio.gather(*[session() for _ in range(SESSIONS)])
+
+        calls = []
+        for _ in range(repeat):
+            reset_caches()
+            asyncio.run(same_question_at_once())
+            calls.append(stub.calls)
+        timings['llm_calls_same_question'] = statistics.median(calls) / SESSIONS
+
+        # Failed SQL: fixed locally, or (with local repair off) by an error-feedback call
+        broken = [question for _, question, _, _ in BROKEN_QUERIES]
+        for local in (True, False):
+            app.LOCAL_SQL_REPAIR = local
+            times, calls = [], []
+            for _ in range(repeat):
+                reset_caches()
+                stub = StubLLM({question: [bad, fixed] for _, question, bad, fixed in BROKEN_QUERIES}, llm_latency)
+                app.client = SimpleNamespace(messages=stub)
+                started = time.perf_counter()
+                asyncio.run(answer_questions(broken))
+                times.append(time.perf_counter() - started)
+                calls.append(stub.calls)
+            suffix = '' if local else '_no_local_repair'
+            timings['pipeline_repaired' + suffix] = statistics.median(times) / len(broken)
+            timings['llm_calls_per_answer' + suffix] = statistics.median(calls) / len(broken)
+    finally:
+        for name, value in saved.items():
+            setattr(app, name, value)
+    return timings
+
+
+def run_benchmarks(row_counts: list, work_dir: str = WORK_DIR, seed: int = 0, repeat: int = REPEAT,
+                   llm_latency: float = LLM_LATENCY) -> dict:
+    """Benchmark each table size; returns the results document saved as JSON"""
+    return {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'engine': app.engine.dialect,
+            'cpus': os.cpu_count(),
+            'ingest_processes': parallel_ingest.INGEST_PROCESSES,
+            'seed': seed,
+            'repeat': repeat,
+            'llm_latency': llm_latency,
+        },
+        'runs': {str(rows): benchmark_rows(rows, work_dir, seed, repeat, llm_latency) for rows in row_counts},
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = TOLERANCE,
+            min_seconds: float = MIN_REGRESSION_SECONDS) -> list:
+    """
+    Regressions of current against baseline, as (rows, metric, baseline seconds, current seconds).
+    A metric regresses when it is more than tolerance slower and at least min_seconds slower;
+    sizes or metrics only one side has are skipped.
+    """
+    regressions = []
+    for rows, timings in current['runs'].items():
+        base = baseline['runs'].get(rows, {})
+        for metric, seconds in timings.items():
+            before = base.get(metric)
+            if before is not None and seconds > before * (1 + tolerance) and seconds - before >= min_seconds:
+                regressions.append((rows, metric, before, seconds))
+    return regressions
+
+
+def format_report(current: dict, baseline: dict = None) -> str:
+    """A table of timings per size, with the change against the baseline when there is one"""
+    lines = []
+    for rows, timings in current['runs'].items():
+        lines.append(f"\n{int(rows):,} rows")
+        base = (baseline or {}).get('runs', {}).get(rows, {})
+        for metric, seconds in timings.items():
+            if metric.startswith("llm_calls"):
+                line = f"  {metric:<36} {seconds:>10.2f}"  # A count, not a time
+            else:
+                line = f"  {metric:<36} {seconds * 1000:>10.2f} ms"
+            if base.get(metric):
+                line += f"  ({seconds / base[metric] - 1:+.0%} vs baseline)"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ingest, schema, queries, rendering and the message pipeline")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="Table sizes to benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic data seed")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Runs per stage (median is kept)")
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY, help="Seconds per stub Claude call")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare against")
+    parser.add_argument("--output", help="Also write this run's results to this JSON file")
+    parser.add_argument("--update-baseline", action="store_true", help="Save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed slowdown, e.g. 0.25 = 25%%")
+    parser.add_argument("--work-dir", default=WORK_DIR, help="Where synthetic CSVs and databases are kept")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.rows, args.work_dir, args.seed, args.repeat, args.llm_latency)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_report(current, baseline))
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    if baseline['meta'].get('platform') != current['meta']['platform']:
+        print(f"\nNote: baseline was recorded on {baseline['meta'].get('platform')}")
+
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) over {args.tolerance:.0%}:")
+        for rows, metric, before, seconds in regressions:
+            print(f"  {int(rows):,} rows {metric}: {before * 1000:.2f} ms → {seconds * 1000:.2f} ms")
+        return 1
+    print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
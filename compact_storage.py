@@ -0,0 +1,228 @@
+"""
+Compact Typed Storage
+Ingest-time type optimizer: normalizes dates to sortable ISO text and
+dictionary-encodes repeated long strings into lookup tables behind a view
+that keeps the original columns
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from ingest import DICTIONARY_INFIX, STORAGE_SUFFIX, quote_identifier
+
+# Compaction configuration
+COMPACT_STORAGE = os.getenv("COMPACT_STORAGE", "true").lower() in ("1", "true", "yes")
+DICTIONARY_MAX_DISTINCT = int(os.getenv("DICTIONARY_MAX_DISTINCT", 65_536))  # Values per lookup table
+# Lookups cost a join per row on scans; they pay off once the table no longer fits the page cache/mmap
+DICTIONARY_MIN_TABLE_BYTES = int(os.getenv("DICTIONARY_MIN_TABLE_BYTES", 1024 * 1024 * 1024))
+DICTIONARY_MIN_LENGTH = 8  # Average characters a value needs for its code to save space
+DICTIONARY_MAX_RATIO = 0.1  # Distinct values per row above which a column isn't low-cardinality
+DATE_SAMPLE_ROWS = 1000  # Values checked when detecting a date format
+
+ISO_DATE = "%Y-%m-%d"
+DATE_FORMATS = [
+    ISO_DATE, "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M",
+    "%m/%d/%Y", "%d/%m/%Y", "%m/%d/%Y %H:%M", "%d/%m/%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S",
+    "%Y/%m/%d", "%m-%d-%Y", "%d-%m-%Y", "%d.%m.%Y", "%d %b %Y", "%b %d %Y", "%B %d, %Y",
+]
+
+
+def parses(value, fmt: str) -> bool:
+    try:
+        datetime.strptime(value.strip(), fmt)
+    except (AttributeError, ValueError):  # Not text, or not in this format
+        return False
+    return True
+
+
+def day_month_swapped(fmt: str) -> str:
+    return fmt.replace("%d", "\0").replace("%m", "%d").replace("\0", "%m")
+
+
+def pick_date_format(candidates: list):
+    """The first candidate, unless its day-first/month-first twin fits too (e.g. 03/04/2024)"""
+    if not candidates or day_month_swapped(candidates[0]) in candidates[1:]:
+        return None
+    return candidates[0]
+
+
+def detect_date_format(values: list):
+    """Return the first format that parses every value, or None (no format, or day and month ambiguous)"""
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return pick_date_format([fmt for fmt in DATE_FORMATS if all(parses(value, fmt) for value in values)])
+
+
+def column_date_format(conn: sqlite3.Connection, table: str, col: str):
+    """
+    The date format every value of a column parses with, or None. Formats are
+    narrowed on a sample, then checked against each distinct value of the column.
+    """
+    name, q = quote_identifier(table), quote_identifier(col)
+    sample = [row[0] for row in conn.execute(
+        f"SELECT {q} FROM {name} WHERE {q} IS NOT NULL LIMIT {DATE_SAMPLE_ROWS}"
+    )]
+    candidates = [fmt for fmt in DATE_FORMATS if sample and all(parses(value, fmt) for value in sample)]
+    if not candidates:
+        return None
+    for (value,) in conn.execute(f"SELECT DISTINCT {q} FROM {name} WHERE {q} IS NOT NULL"):
+        candidates = [fmt for fmt in candidates if parses(value, fmt)]
+        if not candidates:
+            return None
+    return pick_date_format(candidates)
+
+
+def normalize_date(value, fmt: str):
+    """
+    Rewrite a date as ISO text (date only at midnight); values that don't parse
+    are kept, so only rewrite columns column_date_format() found fully in fmt
+    """
+    if value is None:
+        return None
+    try:
+        parsed = datetime.strptime(str(value).strip(), fmt)
+    except ValueError:
+        return value
+    if parsed.hour == parsed.minute == parsed.second == 0:
+        return parsed.strftime("%Y-%m-%d")
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def used_bytes(conn: sqlite3.Connection) -> int:
+    """Bytes of the database in use (excluding free pages)"""
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (pages - free) * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def storage_table(conn: sqlite3.Connection, table: str) -> str:
+    """The table holding a relation's rows: its storage table if it was dictionary-encoded"""
+    storage = f"{table}{STORAGE_SUFFIX}"
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    if row and row[0] == "view" and conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (storage,)
+    ).fetchone():
+        return storage
+    return table
+
+
+def dictionary_columns(conn: sqlite3.Connection, table: str) -> set:
+    """Columns of a table stored as codes into lookup tables"""
+    prefix = f"{table}{DICTIONARY_INFIX}"
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ?",
+        (len(prefix), prefix)
+    ).fetchall()
+    return {name[len(prefix):] for (name,) in rows}
+
+
+def compact_table(conn: sqlite3.Connection, table: str = "orders",
+                  min_table_bytes: int = DICTIONARY_MIN_TABLE_BYTES,
+                  max_distinct: int = DICTIONARY_MAX_DISTINCT) -> dict:
+    """
+    Rewrite a freshly loaded table in compact form (call inside the load transaction).
+
+    Text dates are normalized to ISO-8601 when every value of the column
+    parses in one unambiguous format, and when the table is at least
+    min_table_bytes, long low-cardinality strings move to lookup tables. In
+    that case the rows live in {table}__data and {table} becomes a view with
+    the original column names, so generated SQL keeps working. REAL columns
+    stay REAL even when they only hold whole numbers: SQLite already stores
+    those as integers on disk, and INTEGER affinity would turn x / 2 and
+    SUM(a) / SUM(b) into integer division.
+
+    Returns a size report: 'bytes_before', 'bytes_after', and the columns
+    converted under 'dates' and 'dictionary'.
+    """
+    name = quote_identifier(table)
+    columns = [(row[1], (row[2] or "").upper()) for row in conn.execute(f"PRAGMA table_info({name})")]
+    before = used_bytes(conn)
+    row_count = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+    dates = {}
+    text_columns = []
+    for col, col_type in columns:
+        if col_type == "TEXT":
+            fmt = column_date_format(conn, table, col)
+            if fmt is None:
+                text_columns.append(col)
+            elif fmt != ISO_DATE:
+                dates[col] = fmt
+
+    dictionary = []
+    if text_columns and before >= min_table_bytes:
+        # One scan for the cardinality and average length of every text column
+        aggregates = ", ".join(
+            f"COUNT(DISTINCT {quote_identifier(col)}), AVG(LENGTH({quote_identifier(col)}))" for col in text_columns
+        )
+        stats = conn.execute(f"SELECT {aggregates} FROM {name}").fetchone()
+        for i, col in enumerate(text_columns):
+            distinct, avg_length = stats[2 * i], stats[2 * i + 1] or 0
+            if distinct <= min(max_distinct, row_count * DICTIONARY_MAX_RATIO) and avg_length >= DICTIONARY_MIN_LENGTH:
+                dictionary.append(col)
+
+    report = {'bytes_before': before, 'bytes_after': before,
+              'dates': list(dates), 'dictionary': dictionary}
+    if not (dates or dictionary):
+        return report
+
+    conn.create_function("normalize_date", 2, normalize_date, deterministic=True)
+    storage = f"{table}{STORAGE_SUFFIX}" if dictionary else f"{table}__compact"
+    lookups = {col: f"{table}{DICTIONARY_INFIX}{col}" for col in dictionary}
+
+    for col, lookup in lookups.items():
+        q = quote_identifier(col)
+        # Codes follow value order, so ORDER BY on codes and values agree
+        conn.execute(f"CREATE TABLE {quote_identifier(lookup)} (id INTEGER PRIMARY KEY, value TEXT UNIQUE)")
+        conn.execute(
+            f"INSERT INTO {quote_identifier(lookup)} (value) "
+            f"SELECT DISTINCT {q} FROM {name} WHERE {q} IS NOT NULL ORDER BY {q}"
+        )
+
+    definitions = []
+    expressions = []
+    for col, col_type in columns:
+        q = quote_identifier(col)
+        if col in lookups:
+            definitions.append(f"{q} INTEGER")
+            expressions.append(f"(SELECT id FROM {quote_identifier(lookups[col])} WHERE value = {q})")
+        elif col in dates:
+            definitions.append(f"{q} TEXT")
+            expressions.append(f"normalize_date({q}, '{dates[col]}')")
+        else:
+            definitions.append(f"{q} {col_type}".rstrip())
+            expressions.append(q)
+
+    conn.execute(f"CREATE TABLE {quote_identifier(storage)} ({', '.join(definitions)})")
+    conn.execute(
+        f"INSERT INTO {quote_identifier(storage)} SELECT {', '.join(expressions)} FROM {name} ORDER BY rowid"
+    )
+    conn.execute(f"DROP TABLE {name}")
+
+    if lookups:
+        select = []
+        joins = []
+        for col, _ in columns:
+            q = quote_identifier(col)
+            if col in lookups:
+                lookup = quote_identifier(lookups[col])
+                select.append(f"{lookup}.value AS {q}")
+                joins.append(f"LEFT JOIN {lookup} ON {lookup}.id = {quote_identifier(storage)}.{q}")
+            else:
+                select.append(f"{quote_identifier(storage)}.{q}")
+        conn.execute(
+            f"CREATE VIEW {name} AS SELECT {', '.join(select)} FROM {quote_identifier(storage)} {' '.join(joins)}"
+        )
+    else:
+        conn.execute(f"ALTER TABLE {quote_identifier(storage)} RENAME TO {name}")
+
+    report['bytes_after'] = used_bytes(conn)
+    return report
+
+
+def format_size_report(report: dict) -> str:
+    """One-line summary of a compaction report"""
+    before, after = report['bytes_before'], report['bytes_after']
+    saved = 1 - after / before if before else 0
+    return f"{before / 1024 / 1024:,.1f} MB → {after / 1024 / 1024:,.1f} MB ({saved:.0%} smaller)"
@@ -0,0 +1,172 @@
+"""
+SQLite Connection Pool
+Reuses tuned, read-only connections for the query path so the page cache
+survives between questions
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# Pool configuration
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # Seconds to wait for a free connection
+
+# PRAGMAs applied to every pooled (read-only) connection
+READ_PRAGMAS = [
+    "PRAGMA query_only = ON",
+    f"PRAGMA mmap_size = {int(os.getenv('SQLITE_MMAP_BYTES', 1024 * 1024 * 1024))}",
+    f"PRAGMA cache_size = -{int(os.getenv('SQLITE_CACHE_KB', 64 * 1024))}",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+def file_identity(db_path: str):
+    """Device and inode of the database file, or None if it doesn't exist"""
+    try:
+        st = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+def connect_read_only(db_path: str) -> sqlite3.Connection:
+    """Open a read-only connection tuned for analytic queries"""
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    for pragma in READ_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of read-only connections to one database file.
+    Connections are opened lazily and handed out most-recently-used first.
+    If the file is replaced (new inode), stale connections are reopened.
+    """
+
+    def __init__(self, db_path: str, size: int, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open_count = 0
+        self._identity = file_identity(db_path)
+        self.stats = {'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0, 'opened': 0, 'reopened': 0}
+
+    def _check_identity(self):
+        """Retire all idle connections if the database file was replaced"""
+        identity = file_identity(self.db_path)
+        if identity == self._identity:
+            return
+        with self._lock:
+            self._identity = identity
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open_count -= 1
+                self.stats['reopened'] += 1
+
+    def _checkout(self):
+        self._check_identity()
+        with self._lock:
+            self.stats['checkouts'] += 1
+
+        try:
+            conn, identity = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._open_count < self.size
+                if can_open:
+                    self._open_count += 1
+            if can_open:
+                try:
+                    conn = connect_read_only(self.db_path)
+                except Exception:
+                    with self._lock:
+                        self._open_count -= 1
+                    raise
+                with self._lock:
+                    self.stats['opened'] += 1
+                return conn, self._identity
+
+            started = time.perf_counter()
+            try:
+                conn, identity = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No database connection free after {self.timeout}s")
+            with self._lock:
+                self.stats['waits'] += 1
+                self.stats['wait_seconds'] += time.perf_counter() - started
+
+        if identity != self._identity:
+            # Checked in before the file was replaced
+            conn.close()
+            conn = connect_read_only(self.db_path)
+            with self._lock:
+                self.stats['reopened'] += 1
+        return conn, self._identity
+
+    def _checkin(self, conn, identity, broken=False):
+        if broken:
+            conn.close()
+            with self._lock:
+                self._open_count -= 1
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put((conn, identity))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn, identity = self._checkout()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # Keep connections that only ran a bad query; drop ones that may be unusable
+            broken = not isinstance(e, sqlite3.OperationalError)
+            raise
+        finally:
+            self._checkin(conn, identity, broken)
+
+    def snapshot(self):
+        """Pool statistics for monitoring"""
+        with self._lock:
+            return dict(self.stats, size=self.size, open=self._open_count, idle=self._idle.qsize())
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open_count -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str, size: int) -> ConnectionPool:
+    """Return the shared pool for a database file, creating it on first use"""
+    key = os.path.realpath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_path, size)
+            _pools[key] = pool
+        return pool
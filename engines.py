@@ -0,0 +1,357 @@
+"""
+Query Engines
+Storage and execution back-ends behind the app: the row-store SQLite file,
+or a columnar DuckDB file / Parquet file queried by DuckDB's vectorized,
+multi-threaded engine
+"""
+
+import os
+import threading
+import time
+import warnings
+import pandas as pd
+from compact_storage import COMPACT_STORAGE, compact_table
+from db_pool import file_identity, get_pool
+from ingest import quote_identifier
+from incremental import append_files, register
+from parallel_ingest import ingest_files, read_headers
+from query_budget import (FETCH_BATCH_ROWS, QueryBudget, QueryTimeout, count_rows, fetch_bounded, fetch_chunks,
+                          run_bounded, run_streamed)
+from upload_formats import CSV_FORMATS, detect_format, open_arrow
+from schema_profile import ColumnProfile, SchemaCache, database_fingerprint, profile_connection, schema_cache
+
+try:
+    import duckdb
+except ImportError:  # Optional: only needed for QUERY_ENGINE=duckdb/parquet
+    duckdb = None
+
+# Engine configuration
+QUERY_ENGINE = os.getenv("QUERY_ENGINE", "sqlite").lower()  # sqlite, duckdb or parquet
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", 0))  # 0 = one per core
+INTERRUPT_POLL_SECONDS = 0.05  # How often a running DuckDB query checks its budget
+
+
+def quote_literal(value: str) -> str:
+    """Quote a string as a SQL literal (for statements that can't take parameters)"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class SQLiteEngine:
+    """Row-store SQLite file: pooled read-only connections, plan pre-flight and auto-indexing"""
+
+    name = "sqlite"
+    dialect = "SQLite"
+    dialect_hints = [
+        "Dates are stored as ISO text: use strftime('%Y-%m', column) or date(column) for date parts",
+        "Use CAST(x AS REAL) before dividing integers",
+    ]
+    default_path = "orders.db"
+    supports_query_plan = True  # EXPLAIN QUERY PLAN pre-flight and the index advisor apply
+    supports_rollups = True  # Rollup tables are built at ingest (see rollups.py)
+    supports_append = True  # Uploads can be appended and re-uploads skipped (see incremental.py)
+    supports_samples = True  # Large tables get a weighted sample for approximate answers (see sampling.py)
+
+    def __init__(self, pool_size: int = 8):
+        self.pool_size = pool_size
+        self.schema_cache = schema_cache
+
+    def ingest(self, csv_file_path, db_path: str, table: str = "orders", progress_callback=None,
+               digest: str = None):
+        """
+        Load a CSV, or a list of CSVs with the same columns, into one table (sharded across processes)
+        digest, the files' content hash, is registered with the load so a re-upload can be skipped
+        """
+        def finalize(conn, table):
+            storage = compact_table(conn, table) if COMPACT_STORAGE else None
+            if digest is not None:
+                register(conn, table, digest, "replace")
+            return storage
+
+        return ingest_files(csv_file_path, db_path, table=table, progress_callback=progress_callback,
+                            finalize=finalize)
+
+    def append(self, csv_file_path, db_path: str, table: str = "orders", progress_callback=None,
+               digest: str = None):
+        """Add the rows of CSVs that the table doesn't hold yet (see incremental.append_files)"""
+        return append_files(csv_file_path, db_path, table=table, digest=digest, progress_callback=progress_callback)
+
+    def profile(self, db_path: str, table: str = "orders"):
+        return self.schema_cache.get(db_path, table)
+
+    def warm(self, db_path: str, table: str = "orders"):
+        """Open a pooled connection and build the schema profile ahead of the first query"""
+        with get_pool(db_path, size=self.pool_size).connection():
+            pass
+        self.profile(db_path, table)
+
+    def execute(self, query: str, db_path: str, budget: QueryBudget = None):
+        """Run a query under its budget; df.attrs['total_rows'] is set when rows were left unfetched"""
+        if budget is None:
+            budget = QueryBudget()
+
+        # Pooled read-only connection, sized to the query thread pool
+        with get_pool(db_path, size=self.pool_size).connection() as conn:
+            df = run_bounded(conn, query, budget)
+            if df.attrs['truncated']:
+                try:
+                    df.attrs['total_rows'] = count_rows(conn, query, budget)
+                except QueryTimeout:
+                    df.attrs['total_rows'] = None  # Known only to exceed len(df)
+        return df
+
+    def export(self, query: str, db_path: str, write, budget: QueryBudget = None,
+               chunk_rows: int = FETCH_BATCH_ROWS):
+        """Stream every row of a query to write(columns, rows) in chunks; returns (rows, truncated)"""
+        with get_pool(db_path, size=self.pool_size).connection() as conn:
+            return run_streamed(conn, query, write, budget, chunk_rows)
+
+
+class DuckDBEngine:
+    """
+    Columnar storage queried by DuckDB.
+
+    storage='duckdb' keeps the data in a DuckDB database file; storage='parquet'
+    keeps it in a Parquet file read through a view. Ingest writes a new file
+    next to the old one and renames it into place, so queries in flight keep
+    reading the previous version. Query connections are in-memory instances
+    that can only see the data file: external file access is switched off
+    and the configuration locked once the data is attached.
+    """
+
+    dialect = "DuckDB"
+    dialect_hints = [
+        "Date columns are native DATE/TIMESTAMP values: use date_trunc('month', column) "
+        "or strftime(column, '%Y-%m') for date parts",
+        "/ always returns a decimal result; use // for integer division",
+    ]
+    supports_query_plan = False
+    supports_rollups = False
+    supports_append = False  # Every ingest rewrites the data file
+    supports_samples = False
+
+    def __init__(self, storage: str = "duckdb", threads: int = DUCKDB_THREADS):
+        if duckdb is None:
+            raise ImportError("duckdb is not installed")
+        if storage not in ("duckdb", "parquet"):
+            raise ValueError(f"Unknown DuckDB storage: {storage}")
+        self.name = storage
+        self.storage = storage
+        self.threads = threads
+        self.default_path = "orders.parquet" if storage == "parquet" else "orders.duckdb"
+        self.schema_cache = SchemaCache(builder=self.build_profile)
+        self._connections = {}  # realpath -> (file identity, connection)
+        self._lock = threading.Lock()
+
+    def ingest(self, csv_file_path, db_path: str, table: str = "orders", progress_callback=None):
+        """
+        Load a CSV, or a list of CSVs with the same columns, with DuckDB's parallel reader,
+        replacing the data file. Types are inferred from all the data. Returns the same dict as ingest_csv.
+        Compressed CSV, Parquet and Arrow IPC files are read by DuckDB as they are.
+        """
+        started = time.perf_counter()
+        staging = f"{db_path}.ingest"
+        if os.path.exists(staging):
+            os.remove(staging)
+
+        paths = [csv_file_path] if isinstance(csv_file_path, str) else list(csv_file_path)
+        if len(paths) > 1:
+            read_headers(paths)  # Same check as the SQLite engine: one table needs the same columns
+        conn = duckdb.connect(staging if self.storage == "duckdb" else ":memory:")
+        try:
+            if self.threads:
+                conn.execute(f"SET threads = {self.threads}")
+            source = self._source(conn, paths)
+            if self.storage == "duckdb":
+                conn.execute(f"CREATE TABLE {quote_identifier(table)} AS SELECT * FROM {source}")
+                loaded = quote_identifier(table)
+            else:
+                conn.execute(f"COPY (SELECT * FROM {source}) TO {quote_literal(staging)} (FORMAT PARQUET)")
+                loaded = f"read_parquet({quote_literal(staging)})"
+
+            described = conn.execute(f"DESCRIBE SELECT * FROM {loaded}").fetchall()
+            columns = [row[0] for row in described]
+            counts = ", ".join(f"COUNT({quote_identifier(col)})" for col in columns)
+            stats = conn.execute(f"SELECT COUNT(*), {counts} FROM {loaded}").fetchone()
+            records = stats[0]
+            if records == 0:
+                raise ValueError("CSV file is empty")
+
+            if self.storage == "duckdb":
+                conn.execute("CHECKPOINT")
+        except Exception:
+            conn.close()
+            if os.path.exists(staging):
+                os.remove(staging)
+            raise
+        conn.close()
+
+        os.replace(staging, db_path)
+
+        elapsed = time.perf_counter() - started
+        if progress_callback:
+            progress_callback(records, elapsed)
+
+        return {
+            'records': records,
+            'columns': len(columns),
+            'column_names': columns,
+            'column_types': {row[0]: row[1] for row in described},
+            'non_null': dict(zip(columns, stats[1:])),
+            'elapsed': elapsed,
+            'storage': None,  # Already columnar and compressed
+        }
+
+    def _source(self, conn, paths: list) -> str:
+        """A FROM clause reading every file, each in its own format"""
+        formats = [detect_format(path) for path in paths]
+        if all(fmt in CSV_FORMATS for fmt in formats) and len(set(formats)) == 1:
+            files = "[" + ", ".join(quote_literal(path) for path in paths) + "]"
+            # Uploads are stored without their extension, so compression is named, not guessed
+            compression = "none" if formats[0] == "csv" else formats[0]
+            # union_by_name lines up files whose columns come in a different order
+            return (f"read_csv_auto({files}, header = true, sample_size = -1, union_by_name = true, "
+                    f"compression = {quote_literal(compression)})")
+
+        selects = []
+        for i, (path, fmt) in enumerate(zip(paths, formats)):
+            if fmt in CSV_FORMATS:
+                compression = "none" if fmt == "csv" else fmt
+                selects.append(f"SELECT * FROM read_csv_auto({quote_literal(path)}, header = true, "
+                               f"sample_size = -1, compression = {quote_literal(compression)})")
+            elif fmt == "parquet":
+                selects.append(f"SELECT * FROM read_parquet({quote_literal(path)})")
+            else:
+                conn.register(f"upload_{i}", open_arrow(path, fmt))
+                selects.append(f"SELECT * FROM upload_{i}")
+        return "(" + " UNION ALL BY NAME ".join(selects) + ")"
+
+    def _open(self, db_path: str):
+        """Open an in-memory DuckDB instance that exposes the data file's tables as views"""
+        conn = duckdb.connect(":memory:")
+        if self.threads:
+            conn.execute(f"SET threads = {self.threads}")
+
+        path = os.path.abspath(db_path)
+        if self.storage == "duckdb":
+            conn.execute(f"ATTACH {quote_literal(path)} AS data (READ_ONLY)")
+            tables = conn.execute(
+                "SELECT table_name FROM duckdb_tables() WHERE database_name = 'data'"
+            ).fetchall()
+            for (table,) in tables:
+                name = quote_identifier(table)
+                conn.execute(f"CREATE VIEW {name} AS SELECT * FROM data.{name}")
+        else:
+            conn.execute(f"SET allowed_paths = [{quote_literal(path)}]")
+            conn.execute(f"CREATE VIEW orders AS SELECT * FROM read_parquet({quote_literal(path)})")
+
+        # Generated SQL must not reach any other file (read_csv, COPY, ATTACH, ...)
+        conn.execute("SET enable_external_access = false")
+        conn.execute("SET lock_configuration = true")
+        return conn
+
+    def connection(self, db_path: str):
+        """Shared query connection for the current version of the data file"""
+        key = os.path.realpath(db_path)
+        identity = file_identity(db_path)
+        if identity is None:
+            raise FileNotFoundError(f"No database at {db_path}")
+
+        with self._lock:
+            entry = self._connections.get(key)
+            if entry is None or entry[0] != identity:
+                # Replaced by an ingest: old cursors finish on the old instance
+                entry = (identity, self._open(db_path))
+                self._connections[key] = entry
+            return entry[1]
+
+    def build_profile(self, db_path: str, table: str = "orders"):
+        fingerprint = database_fingerprint(db_path)
+        cursor = self.connection(db_path).cursor()
+        try:
+            described = cursor.execute(f"DESCRIBE {quote_identifier(table)}").fetchall()
+            columns = [ColumnProfile(name=row[0], type=row[1]) for row in described]
+            return profile_connection(cursor, table, columns, fingerprint)
+        finally:
+            cursor.close()
+
+    def profile(self, db_path: str, table: str = "orders"):
+        return self.schema_cache.get(db_path, table)
+
+    def warm(self, db_path: str, table: str = "orders"):
+        """Open the query connection and build the schema profile ahead of the first query"""
+        self.profile(db_path, table)
+
+    def _run(self, cursor, budget: QueryBudget, func):
+        """Call func() while a watcher interrupts the cursor once the budget says stop"""
+        budget.start()
+        done = threading.Event()
+
+        def watch():
+            while not done.wait(INTERRUPT_POLL_SECONDS):
+                if budget.should_abort():
+                    cursor.interrupt()
+                    return
+
+        watcher = threading.Thread(target=watch, name="duckdb-budget", daemon=True)
+        watcher.start()
+        try:
+            return func()
+        except duckdb.InterruptException:
+            budget.check()
+            raise
+        finally:
+            done.set()
+
+    def execute(self, query: str, db_path: str, budget: QueryBudget = None):
+        """Run a query under its budget; df.attrs['total_rows'] is set when rows were left unfetched"""
+        if budget is None:
+            budget = QueryBudget()
+
+        cursor = self.connection(db_path).cursor()
+        try:
+            def fetch():
+                cursor.execute(query)
+                return fetch_bounded(cursor, budget)
+
+            columns, rows, truncated = self._run(cursor, budget, fetch)
+            df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            df.attrs['truncated'] = truncated
+            if truncated:
+                try:
+                    df.attrs['total_rows'] = self._run(
+                        cursor, budget,
+                        lambda: cursor.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+                    )
+                except QueryTimeout:
+                    df.attrs['total_rows'] = None
+        finally:
+            cursor.close()
+        return df
+
+    def export(self, query: str, db_path: str, write, budget: QueryBudget = None,
+               chunk_rows: int = FETCH_BATCH_ROWS):
+        """Stream every row of a query to write(columns, rows) in chunks; returns (rows, truncated)"""
+        if budget is None:
+            budget = QueryBudget(max_rows=None)
+
+        cursor = self.connection(db_path).cursor()
+        try:
+            def stream():
+                cursor.execute(query)
+                return fetch_chunks(cursor, write, chunk_rows, budget.max_rows)
+
+            return self._run(cursor, budget, stream)
+        finally:
+            cursor.close()
+
+
+def get_engine(name: str = QUERY_ENGINE, pool_size: int = 8):
+    """Engine for a QUERY_ENGINE name, falling back to SQLite when DuckDB isn't installed"""
+    name = name.lower()
+    if name in ("duckdb", "parquet"):
+        if duckdb is not None:
+            return DuckDBEngine(storage=name)
+        warnings.warn(f"QUERY_ENGINE={name} needs the duckdb package; falling back to SQLite")
+    elif name != "sqlite":
+        raise ValueError(f"Unknown QUERY_ENGINE: {name}")
+    return SQLiteEngine(pool_size=pool_size)
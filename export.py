@@ -0,0 +1,150 @@
+"""
+Result Export
+Streams a query's rows from the cursor into a CSV or Parquet file chunk by
+chunk, and pages through results with LIMIT/OFFSET, so neither ever holds
+a whole result in memory
+"""
+
+import csv
+import os
+import tempfile
+import uuid
+from query_budget import QueryBudget
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: only needed for Parquet exports
+    pa = pq = None
+
+# Export configuration
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 10_000))  # Rows fetched and written at a time
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", 5_000_000))  # Rows written to one file
+EXPORT_TIMEOUT_SECONDS = float(os.getenv("EXPORT_TIMEOUT_SECONDS", 300))  # Wall-clock limit for one export
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "sql-agent-exports"))
+PAGE_ROWS = 15  # Rows per preview page
+
+
+def export_formats() -> list:
+    """File formats available for export (Parquet needs pyarrow)"""
+    return ["csv", "parquet"] if pq is not None else ["csv"]
+
+
+class CsvWriter:
+    """Appends chunks of rows to a CSV file, header first"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.started = False
+
+    def write(self, columns: list, rows: list):
+        if not self.started:
+            self.writer.writerow(columns)
+            self.started = True
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+def column_array(values):
+    """An Arrow array of one column of a chunk; mixed types become text"""
+    try:
+        return pa.array(list(values))
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in values], type=pa.string())
+
+
+def widen(current, new):
+    """The narrowest type holding both: NULL gives way to anything, integers to floats, the rest to text"""
+    if current == new or pa.types.is_null(new):
+        return current
+    if pa.types.is_null(current):
+        return new
+    numeric = (pa.types.is_integer, pa.types.is_floating)
+    if any(is_type(current) for is_type in numeric) and any(is_type(new) for is_type in numeric):
+        return pa.float64()
+    return pa.string()
+
+
+class ParquetWriter:
+    """
+    Writes each chunk of rows as a Parquet row group. Column types widen as
+    chunks arrive (see widen()); when one does, the row groups written so far
+    are rewritten with the wider types, a row group at a time. Each column
+    can only widen a few times, so few exports pay for a rewrite at all.
+    """
+
+    def __init__(self, path: str):
+        if pq is None:
+            raise ImportError("pyarrow is not installed")
+        self.path = path
+        self.schema = None
+        self.writer = None
+
+    def write(self, columns: list, rows: list):
+        arrays = [column_array(column) for column in zip(*rows)]
+        if self.schema is None:
+            self.schema = pa.schema([pa.field(name, array.type) for name, array in zip(columns, arrays)])
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        else:
+            wider = pa.schema([pa.field(field.name, widen(field.type, array.type))
+                               for field, array in zip(self.schema, arrays)])
+            if not wider.equals(self.schema):
+                self._rewrite(wider)
+        arrays = [array if array.type == field.type else array.cast(field.type)
+                  for array, field in zip(arrays, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def _rewrite(self, schema):
+        """Start the file over with schema, copying the row groups written so far"""
+        self.writer.close()
+        previous = f"{self.path}.narrow"
+        os.replace(self.path, previous)
+        try:
+            self.writer = pq.ParquetWriter(self.path, schema)
+            with pq.ParquetFile(previous) as source:
+                for i in range(source.num_row_groups):
+                    self.writer.write_table(source.read_row_group(i).cast(schema))
+        finally:
+            os.remove(previous)
+        self.schema = schema
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def export_result(engine, query: str, db_path: str, fmt: str = "csv", budget: QueryBudget = None):
+    """
+    Run a query and stream all its rows to a new file in EXPORT_DIR.
+
+    Rows go from the cursor to the file EXPORT_CHUNK_ROWS at a time, so
+    memory use doesn't depend on the result size. budget defaults to
+    EXPORT_TIMEOUT_SECONDS and EXPORT_MAX_ROWS. Returns (path, rows, truncated);
+    the caller owns the file.
+    """
+    if fmt not in export_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if budget is None:
+        budget = QueryBudget(timeout=EXPORT_TIMEOUT_SECONDS, max_rows=EXPORT_MAX_ROWS)
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{uuid.uuid4().hex}.{fmt}")
+    writer = ParquetWriter(path) if fmt == "parquet" else CsvWriter(path)
+    try:
+        try:
+            rows, truncated = engine.export(query, db_path, writer.write, budget, EXPORT_CHUNK_ROWS)
+        finally:
+            writer.close()
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return path, rows, truncated
+
+
+def page_query(query: str, offset: int, limit: int = PAGE_ROWS) -> str:
+    """The query restricted to one page of its rows"""
+    return f"SELECT * FROM ({query}) AS page LIMIT {int(limit)} OFFSET {int(offset)}"
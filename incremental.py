@@ -0,0 +1,282 @@
+"""
+Incremental Ingest
+Remembers which files (by content hash) a table was loaded from, so an
+upload of the same bytes is skipped, and appends new files by inserting
+only the rows whose key, or whole-row hash, the table doesn't hold yet
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from compact_storage import ISO_DATE, DATE_SAMPLE_ROWS, column_date_format, detect_date_format, dictionary_columns, \
+    normalize_date, storage_table
+from ingest import BULK_LOAD_PRAGMAS, DICTIONARY_INFIX, REGISTRY_TABLE, ROW_HASH_SUFFIX, drop_relation, \
+    quote_identifier
+from parallel_ingest import ingest_files
+from rollups import update_rollups
+from sampling import update_sample
+
+# Incremental ingest configuration
+INGEST_MODE = os.getenv("INGEST_MODE", "replace").lower()  # replace or append (per upload: say "append"/"replace")
+# Columns identifying a row for append dedup (e.g. order_id); empty = hash of the whole row
+APPEND_KEY = [col.strip() for col in os.getenv("APPEND_KEY", "").split(",") if col.strip()]
+HASH_BLOCK_BYTES = 1024 * 1024  # Bytes read at a time when hashing an upload
+
+
+def file_digest(paths) -> str:
+    """Content hash of one file or an ordered list of files"""
+    if isinstance(paths, str):
+        paths = [paths]
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                file_hash.update(block)
+        digest.update(file_hash.digest())
+    return digest.hexdigest()
+
+
+def table_mark(conn: sqlite3.Connection, table: str):
+    """The last rowid of a table's rows: a cheap check that nothing else rewrote it since it was registered"""
+    try:
+        return conn.execute(f"SELECT MAX(rowid) FROM {quote_identifier(storage_table(conn, table))}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone() is not None
+
+
+def register(conn: sqlite3.Connection, table: str, digest: str, mode: str, records: int = None, added: int = None):
+    """Record a load of table from the files with this digest (call inside the load transaction)"""
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {REGISTRY_TABLE} "
+        "(source TEXT, digest TEXT, mode TEXT, records INTEGER, added INTEGER, mark INTEGER, loaded_at TEXT)"
+    )
+    if mode == "replace":
+        conn.execute(f"DELETE FROM {REGISTRY_TABLE} WHERE source = ?", (table,))
+    conn.execute(
+        f"INSERT INTO {REGISTRY_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (table, digest, mode, records, added, table_mark(conn, table),
+         datetime.now(timezone.utc).isoformat(timespec="seconds"))
+    )
+
+
+def already_loaded(db_path: str, digest: str, mode: str, table: str = "orders") -> bool:
+    """
+    Whether loading these files would leave the table as it is: a replace by
+    the only file it was loaded from, or an append of a file already in it
+    """
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        if not table_exists(conn, REGISTRY_TABLE):
+            return False
+        rows = conn.execute(
+            f"SELECT digest, mark FROM {REGISTRY_TABLE} WHERE source = ? ORDER BY rowid", (table,)
+        ).fetchall()
+        if not rows or rows[-1][1] != table_mark(conn, table):
+            return False
+    finally:
+        conn.close()
+    if mode == "replace":
+        return len(rows) == 1 and rows[0][0] == digest
+    return any(row[0] == digest for row in rows)
+
+
+def row_hash(*values) -> int:
+    """64-bit hash of a row; whole-number floats hash like integers (a column may load as either)"""
+    normalized = tuple(int(v) if isinstance(v, float) and v.is_integer() else v for v in values)
+    return int.from_bytes(hashlib.blake2b(repr(normalized).encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def sampled_date_format(conn: sqlite3.Connection, table: str, col: str):
+    """The date format of a text column, from a sample of its values (None if not all text dates)"""
+    q = quote_identifier(col)
+    return detect_date_format([row[0] for row in conn.execute(
+        f"SELECT {q} FROM {quote_identifier(table)} WHERE {q} IS NOT NULL LIMIT {DATE_SAMPLE_ROWS}"
+    )])
+
+
+def normalize_dates(conn: sqlite3.Connection, table: str, staging: str, columns: list) -> list:
+    """
+    Rewrite non-ISO text dates in a staging table to ISO where the table's
+    dates are ISO (as compaction leaves them); a table loaded without
+    compaction keeps its own format. New dates that aren't all in one
+    unambiguous format would leave the column mixed, so they raise
+    ValueError. Returns the columns rewritten.
+    """
+    conn.create_function("normalize_date", 2, normalize_date, deterministic=True)
+    normalized = []
+    for col in columns:
+        # The table's dates were checked in full when it was compacted; the new ones are checked now
+        q = quote_identifier(col)
+        if sampled_date_format(conn, table, col) != ISO_DATE or conn.execute(
+            f"SELECT 1 FROM {quote_identifier(staging)} WHERE {q} IS NOT NULL LIMIT 1"
+        ).fetchone() is None:
+            continue
+        fmt = column_date_format(conn, staging, col)
+        if fmt is None:
+            raise ValueError(f"The file's {col} values aren't all dates in one format, or could be read "
+                             f"day-first or month-first; the {table} table holds them as YYYY-MM-DD")
+        if fmt == ISO_DATE:
+            continue
+        conn.execute(f"UPDATE {quote_identifier(staging)} SET {q} = normalize_date({q}, '{fmt}')")
+        normalized.append(col)
+    return normalized
+
+
+def typed_copy(conn: sqlite3.Connection, table: str, staging: str, columns: list) -> str:
+    """
+    Copy the staging rows into a temp table with the table's column types, so
+    values compare and hash as they will be stored ('5' read as text becomes
+    5 in an INTEGER column, 5 becomes '5' in a TEXT one). Returns its name.
+    """
+    types = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})")}
+    typed = quote_identifier(f"{table}__typed")
+    column_list = ", ".join(quote_identifier(col) for col in columns)
+    conn.execute(f"DROP TABLE IF EXISTS temp.{typed}")
+    conn.execute(f"CREATE TEMP TABLE {typed} "
+                 f"({', '.join(f'{quote_identifier(col)} {types[col]}'.rstrip() for col in columns)})")
+    conn.execute(f"INSERT INTO {typed} SELECT {column_list} FROM {quote_identifier(staging)} ORDER BY rowid")
+    return f"{table}__typed"
+
+
+def new_rows_by_key(conn: sqlite3.Connection, table: str, staging: str, key: list) -> str:
+    """SQL selecting staging rowids whose key the table doesn't hold (first of any repeats)"""
+    storage = storage_table(conn, table)
+    encoded = dictionary_columns(conn, table)
+    if not encoded & set(key):
+        # Lets each new row's lookup cost a B-tree probe; built once, then maintained by SQLite
+        columns = ", ".join(quote_identifier(col) for col in key)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'{table}__append_key')} "
+                     f"ON {quote_identifier(storage)} ({columns})")
+    match = " AND ".join(f"t.{quote_identifier(col)} IS s.{quote_identifier(col)}" for col in key)
+    group = ", ".join(quote_identifier(col) for col in key)
+    return (f"SELECT s.rowid FROM {quote_identifier(staging)} AS s "
+            f"WHERE s.rowid IN (SELECT MIN(rowid) FROM {quote_identifier(staging)} GROUP BY {group}) "
+            f"AND NOT EXISTS (SELECT 1 FROM {quote_identifier(table)} AS t WHERE {match})")
+
+
+def new_rows_by_hash(conn: sqlite3.Connection, table: str, staging: str, columns: list) -> str:
+    """SQL selecting staging rowids whose whole-row hash the table doesn't hold (first of any repeats)"""
+    conn.create_function("row_hash", -1, row_hash, deterministic=True)
+    hashes = quote_identifier(f"{table}{ROW_HASH_SUFFIX}")
+    column_list = ", ".join(quote_identifier(col) for col in columns)
+    if not table_exists(conn, f"{table}{ROW_HASH_SUFFIX}"):
+        # First append since the table was loaded: hash what it holds, once
+        conn.execute(f"CREATE TABLE {hashes} (hash INTEGER PRIMARY KEY)")
+        conn.execute(f"INSERT OR IGNORE INTO {hashes} SELECT row_hash({column_list}) FROM {quote_identifier(table)}")
+    conn.execute("DROP TABLE IF EXISTS temp.append_hashes")
+    conn.execute(f"CREATE TEMP TABLE append_hashes AS "
+                 f"SELECT rowid AS id, row_hash({column_list}) AS hash FROM {quote_identifier(staging)}")
+    return (f"SELECT MIN(id) FROM append_hashes WHERE hash NOT IN (SELECT hash FROM {hashes}) GROUP BY hash")
+
+
+def append_files(paths, db_path: str, table: str = "orders", key: list = None, digest: str = None,
+                 progress_callback=None) -> dict:
+    """
+    Append CSV files to a table, skipping rows it already holds.
+
+    The files are loaded into a staging table (in parallel when large, see
+    parallel_ingest.py), their dates normalized where compaction did and
+    their values given the table's column types. Rows
+    whose key columns (APPEND_KEY), or whole-row hash when there is no key,
+    match a row in the table or an earlier row of the files are dropped.
+    The rest are inserted into the table's storage (through its lookup
+    tables when dictionary-encoded), its rollups and sample are updated from
+    them, and the files are registered under digest, all in one transaction.
+
+    Returns 'records' (rows in the files), 'added', 'columns', 'column_names',
+    'stats' ({column: (non-null, min, max)} of the added rows), 'elapsed' and 'storage'.
+    """
+    if key is None:
+        key = APPEND_KEY
+    started = time.perf_counter()
+    staging = f"{table}__append"
+    loaded = ingest_files(paths, db_path, table=staging, progress_callback=progress_callback)
+
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        for pragma in BULK_LOAD_PRAGMAS:
+            conn.execute(pragma)
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})")]
+        if set(columns) != set(loaded['column_names']):
+            raise ValueError(f"The file's columns don't match the {table} table: "
+                             f"{', '.join(loaded['column_names'])}")
+        missing = [col for col in key if col not in columns]
+        if missing:
+            raise ValueError(f"Append key column not in the table: {', '.join(missing)}")
+
+        conn.execute("BEGIN")
+        try:
+            normalize_dates(conn, table, staging, [col for col, col_type in loaded['column_types'].items()
+                                                   if col_type == "TEXT"])
+            rows = typed_copy(conn, table, staging, columns)
+            if key:
+                new_rows = new_rows_by_key(conn, table, rows, key)
+            else:
+                new_rows = new_rows_by_hash(conn, table, rows, columns)
+
+            # The rows to add, in file order, for the insert, the rollups and the stats
+            delta = f"{table}__delta"
+            column_list = ", ".join(quote_identifier(col) for col in columns)
+            conn.execute(f"DROP TABLE IF EXISTS temp.{quote_identifier(delta)}")
+            conn.execute(f"CREATE TEMP TABLE {quote_identifier(delta)} AS SELECT {column_list} "
+                         f"FROM {quote_identifier(rows)} WHERE rowid IN ({new_rows}) ORDER BY rowid")
+            added = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(delta)}").fetchone()[0]
+
+            storage = storage_table(conn, table)
+            encoded = dictionary_columns(conn, table)
+            expressions = []
+            for col in columns:
+                q = quote_identifier(col)
+                if col in encoded:
+                    # New values get the next codes
+                    lookup = quote_identifier(f"{table}{DICTIONARY_INFIX}{col}")
+                    conn.execute(f"INSERT OR IGNORE INTO {lookup} (value) SELECT DISTINCT {q} "
+                                 f"FROM {quote_identifier(delta)} WHERE {q} IS NOT NULL ORDER BY {q}")
+                    expressions.append(f"(SELECT id FROM {lookup} WHERE value = {q})")
+                else:
+                    expressions.append(q)
+            conn.execute(f"INSERT INTO {quote_identifier(storage)} ({column_list}) "
+                         f"SELECT {', '.join(expressions)} FROM {quote_identifier(delta)} ORDER BY rowid")
+            if not key:
+                conn.execute(f"INSERT OR IGNORE INTO {quote_identifier(f'{table}{ROW_HASH_SUFFIX}')} "
+                             f"SELECT row_hash({column_list}) FROM {quote_identifier(delta)}")
+
+            update_rollups(conn, table, delta)
+            update_sample(conn, table, delta)
+
+            aggregates = ", ".join(f"COUNT({quote_identifier(col)}), MIN({quote_identifier(col)}), "
+                                   f"MAX({quote_identifier(col)})" for col in columns)
+            row = conn.execute(f"SELECT {aggregates} FROM {quote_identifier(delta)}").fetchone()
+            stats = {col: tuple(row[3 * i: 3 * i + 3]) for i, col in enumerate(columns)}
+
+            drop_relation(conn, staging)
+            if digest is not None:
+                register(conn, table, digest, "append", loaded['records'], added)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        if table_exists(conn, staging):
+            drop_relation(conn, staging)
+        conn.close()
+
+    return {
+        'records': loaded['records'],
+        'added': added,
+        'columns': len(columns),
+        'column_names': columns,
+        'stats': stats,
+        'elapsed': time.perf_counter() - started,
+        'storage': None,
+    }
@@ -0,0 +1,263 @@
+"""
+Index Advisor
+Builds indexes on likely filter/group columns at ingest, then adapts them
+to the queries people actually run
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, replace
+from compact_storage import dictionary_columns, storage_table
+from ingest import quote_identifier
+from query_planner import table_aliases
+
+# Advisor configuration
+INDEX_BUILD_BUDGET_SECONDS = float(os.getenv("INDEX_BUILD_BUDGET_SECONDS", 30))  # Per advisor run
+INDEX_MAX_AUTO = int(os.getenv("INDEX_MAX_AUTO", 8))  # Advisor-owned indexes per table
+ADVISOR_MIN_HITS = int(os.getenv("ADVISOR_MIN_HITS", 3))  # Slow queries needing an index before it is built
+ADVISOR_EVERY_N_QUERIES = int(os.getenv("ADVISOR_EVERY_N_QUERIES", 20))
+QUERY_LOG_SIZE = 1000  # Executed queries remembered for the advisor
+MAX_GROUP_DISTINCT_RATIO = 0.2  # Columns more unique than this aren't useful grouping keys
+
+AUTO_PREFIX = "idx_auto_"  # Built by the advisor from the workload; dropped again when unused
+INGEST_PREFIX = "idx_ingest_"  # Built from the profile at ingest; kept until the table is reloaded
+PROGRESS_STEPS = 10_000  # SQLite VM steps between budget checks during an index build
+
+# Date-part expressions worth an expression index: strftime('%Y-%m', col), date(col), substr(col, 1, 7)
+DATE_PART_RE = re.compile(
+    r"(strftime\s*\(\s*'[^']*'\s*,\s*\"?(\w+)\"?\s*\)|date\s*\(\s*\"?(\w+)\"?\s*\)"
+    r"|substr\s*\(\s*\"?(\w+)\"?\s*,\s*\d+\s*,\s*\d+\s*\))",
+    re.IGNORECASE
+)
+CLAUSE_RE = re.compile(r"\b(where|group\s+by|order\s+by|having|limit)\b", re.IGNORECASE)
+SUM_RE = re.compile(r"\b(?:sum|avg|min|max|count)\s*\(\s*\"?(\w+)\"?\s*\)", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class IndexCandidate:
+    """An index the advisor may build: plain columns or one expression"""
+    table: str
+    columns: tuple = ()
+    expression: str = None
+    prefix: str = AUTO_PREFIX
+
+    @property
+    def name(self):
+        label = "_".join(self.columns) if self.columns else re.sub(r"\W+", "_", self.expression).strip("_")
+        digest = hashlib.sha1(self.definition.encode()).hexdigest()[:6]
+        return f"{self.prefix}{self.table}_{label[:40]}_{digest}"
+
+    @property
+    def definition(self):
+        if self.expression:
+            return self.expression
+        return ", ".join(quote_identifier(col) for col in self.columns)
+
+    def create_sql(self):
+        return (f"CREATE INDEX IF NOT EXISTS {quote_identifier(self.name)} "
+                f"ON {quote_identifier(self.table)} ({self.definition})")
+
+
+class QueryLog:
+    """Recent executed queries with their plans and timings, shared by all sessions"""
+
+    def __init__(self, size: int = QUERY_LOG_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def record(self, sql: str, plan: list, elapsed: float):
+        with self._lock:
+            self._entries.append((sql, list(plan or []), elapsed, time.time()))
+            self.recorded += 1
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+
+def ingest_candidates(profile) -> list:
+    """Pick filter/group columns from profile statistics: low-cardinality text and dates"""
+    candidates = []
+    rows = max(profile.sampled_rows, 1)
+    for col in profile.columns:
+        if col.distinct <= 1:
+            continue
+        candidate = IndexCandidate(profile.table, (col.name,), prefix=INGEST_PREFIX)
+        if col.is_date:
+            candidates.append((0, candidate))
+        elif col.type.upper() == "TEXT" and col.distinct <= rows * MAX_GROUP_DISTINCT_RATIO:
+            candidates.append((1 + col.distinct / rows, candidate))
+    return [candidate for _, candidate in sorted(candidates, key=lambda item: item[0])]
+
+
+def query_candidates(sql: str, table: str, column_names: list) -> list:
+    """Indexes that would help one query: filter columns, grouping keys, date-part expressions"""
+    known = {name.lower(): name for name in column_names}
+    candidates = []
+
+    # Split the statement into clauses by keyword
+    parts = CLAUSE_RE.split(sql)
+    clauses = {}
+    for keyword, body in zip(parts[1::2], parts[2::2]):
+        clauses.setdefault(re.sub(r"\s+", " ", keyword.lower()), []).append(body)
+
+    def columns_in(text):
+        found = []
+        for word in re.findall(r"\"?([A-Za-z_]\w*)\"?", text):
+            name = known.get(word.lower())
+            if name and name not in found:
+                found.append(name)
+        return found
+
+    for body in clauses.get("where", []):
+        for col in columns_in(DATE_PART_RE.sub(" ", body)):
+            candidates.append(IndexCandidate(table, (col,)))
+
+    for body in clauses.get("group by", []):
+        expressions = DATE_PART_RE.findall(body)
+        for match in expressions:
+            col = next(c for c in match[1:] if c)
+            if col.lower() in known:
+                candidates.append(IndexCandidate(table, expression=match[0]))
+        group_cols = columns_in(DATE_PART_RE.sub(" ", body))
+        if group_cols:
+            # Covering index: grouping keys followed by the aggregated measure
+            measures = [known[m.lower()] for m in SUM_RE.findall(sql) if m.lower() in known]
+            measures = [m for m in measures if m not in group_cols]
+            candidates.append(IndexCandidate(table, tuple(group_cols + measures[:1])))
+
+    return candidates
+
+
+def on_storage(conn: sqlite3.Connection, candidates: list) -> list:
+    """
+    Point candidates for a compacted table's view at its storage table.
+    Dictionary-encoded columns hold codes there, so plain indexes on them still
+    serve equality filters, but expressions over them are dropped.
+    """
+    mapped = []
+    for candidate in candidates:
+        storage = storage_table(conn, candidate.table)
+        if storage == candidate.table:
+            mapped.append(candidate)
+            continue
+        encoded = dictionary_columns(conn, candidate.table)
+        if candidate.expression and any(
+            re.search(rf"\b{re.escape(col)}\b", candidate.expression) for col in encoded
+        ):
+            continue
+        mapped.append(replace(candidate, table=storage))
+    return mapped
+
+
+def existing_indexes(conn: sqlite3.Connection, table: str) -> dict:
+    """Map index name to its CREATE statement for a table"""
+    rows = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table,)
+    ).fetchall()
+    return {name: sql or "" for name, sql in rows}
+
+
+def build_indexes(conn: sqlite3.Connection, candidates: list, budget_seconds: float = INDEX_BUILD_BUDGET_SECONDS,
+                  max_auto: int = INDEX_MAX_AUTO) -> list:
+    """
+    Create candidate indexes in order until the time or count budget is used, then ANALYZE.
+    A build still running when the budget runs out is interrupted and rolled back.
+    """
+    created = []
+    deadline = time.perf_counter() + budget_seconds
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, PROGRESS_STEPS)
+    try:
+        for candidate in candidates:
+            existing = existing_indexes(conn, candidate.table)
+            auto_count = sum(1 for name in existing if name.startswith(candidate.prefix))
+            target = f"ON {quote_identifier(candidate.table)} ({candidate.definition})"
+            if candidate.name in existing or any(sql.endswith(target) for sql in existing.values()):
+                continue  # Built already, maybe by the other of ingest and advisor
+            if auto_count >= max_auto or time.perf_counter() > deadline:
+                break
+            try:
+                conn.execute(candidate.create_sql())
+            except sqlite3.OperationalError:
+                if time.perf_counter() <= deadline:
+                    raise
+                conn.rollback()  # Interrupted by the budget: nothing of it is kept
+                break
+            created.append(candidate.name)
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    if created:
+        conn.execute("ANALYZE")
+        conn.commit()
+    return created
+
+
+def index_on_ingest(db_path: str, profile) -> list:
+    """Build indexes suggested by the fresh profile of an ingested table"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return build_indexes(conn, on_storage(conn, ingest_candidates(profile)))
+    finally:
+        conn.close()
+
+
+def advise(db_path: str, profile, query_log: QueryLog, min_hits: int = ADVISOR_MIN_HITS) -> dict:
+    """
+    Adjust advisor-owned indexes to the logged workload.
+
+    Candidates from queries whose plan still scanned the table are weighted
+    by elapsed time; ones seen in at least min_hits slow queries are built.
+    Advisor indexes no logged plan has used are dropped to make room;
+    queries logged without a plan (answered from a rollup or the sample, or
+    repaired) don't count towards that, and ingest-built indexes are kept.
+    """
+    entries = query_log.entries()
+    hits = Counter()
+    weight = Counter()
+    used = set()
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        storage = storage_table(conn, profile.table)
+
+        for sql, plan, elapsed, _ in entries:
+            # Plans name tables by their alias in the query
+            aliases = table_aliases(sql)
+            scanned = False
+            for detail in plan:
+                match = re.search(r"USING (?:COVERING )?INDEX (\S+)", detail)
+                if match:
+                    used.add(match.group(1))
+                scan = re.match(r"SCAN (\S+)", detail)
+                if scan and "INDEX" not in detail:
+                    scanned |= aliases.get(scan.group(1), scan.group(1)) in (storage, profile.table)
+            if not scanned:
+                continue
+            for candidate in set(query_candidates(sql, profile.table, profile.column_names)):
+                hits[candidate] += 1
+                weight[candidate] += elapsed
+
+        wanted = [c for c in sorted(hits, key=lambda c: -weight[c]) if hits[c] >= min_hits]
+
+        dropped = []
+        existing = existing_indexes(conn, storage)
+        planned = sum(1 for _, plan, _, _ in entries if plan)
+        if planned >= QUERY_LOG_SIZE // 2:
+            # Only judge usefulness once the log holds a meaningful window of plans
+            for name in existing:
+                if name.startswith(AUTO_PREFIX) and name not in used:
+                    conn.execute(f"DROP INDEX IF EXISTS {quote_identifier(name)}")
+                    dropped.append(name)
+            conn.commit()
+        created = build_indexes(conn, on_storage(conn, wanted))
+    finally:
+        conn.close()
+
+    return {'created': created, 'dropped': dropped}
@@ -0,0 +1,232 @@
+"""
+Streaming CSV Ingest
+Loads CSV files into SQLite in fixed-size chunks so memory stays bounded
+(compressed CSV, Parquet and Arrow uploads are streamed the same way, see upload_formats.py)
+"""
+
+import os
+import sqlite3
+import time
+import pandas as pd
+from upload_formats import read_chunks
+
+# Ingest configuration
+CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 50_000))  # Rows per chunk read from the CSV
+PROGRESS_INTERVAL = 1.0  # Minimum seconds between progress callbacks
+VACUUM_FREE_RATIO = 0.25  # Rewrite the file after a load that leaves this share of pages free
+
+# Compacted tables (see compact_storage.py) are a view over these tables
+STORAGE_SUFFIX = "__data"
+DICTIONARY_INFIX = "__dict__"
+
+# Append bookkeeping (see incremental.py): the files a table was loaded from, and its rows' hashes
+REGISTRY_TABLE = "ingest_registry"
+ROW_HASH_SUFFIX = "__row_hashes"
+
+# Approximate answers (see sampling.py): a weighted sample of a table and its strata
+SAMPLE_SUFFIX = "__sample"
+STRATA_SUFFIX = "__sample_strata"
+
+# SQLite type lattice, narrowest first. A column only ever moves right.
+TYPE_ORDER = ["INTEGER", "REAL", "TEXT"]
+
+# PRAGMAs applied to the writer connection for the duration of a bulk load
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",  # 64 MB page cache
+]
+
+
+def quote_identifier(name: str) -> str:
+    """Quote a column or table name for use in SQLite statements"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sqlite_type(series: pd.Series):
+    """Map a pandas column to a SQLite type, or None if it holds no values"""
+    if series.isna().all():
+        return None
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(series):
+        return "REAL"
+    return "TEXT"
+
+
+def widen_type(current: str, new: str) -> str:
+    """Return the wider of two SQLite types"""
+    if current is None:
+        return new
+    if new is None:
+        return current
+    return TYPE_ORDER[max(TYPE_ORDER.index(current), TYPE_ORDER.index(new))]
+
+
+def chunk_rows(chunk: pd.DataFrame):
+    """Convert a chunk to plain Python tuples with NULLs for missing values"""
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+def drop_relation(conn: sqlite3.Connection, table: str):
+    """
+    Drop a table, or a compacted table's view together with its storage and lookup tables,
+    and its sample, and forget which files it was loaded from
+    """
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    if row and row[0] == "view":
+        conn.execute(f"DROP VIEW {quote_identifier(table)}")
+    else:
+        conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table)}")
+
+    prefix = f"{table}{DICTIONARY_INFIX}"
+    lookups = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND substr(name, 1, ?) = ?",
+        (len(prefix), prefix)
+    ).fetchall()
+    derived = [STORAGE_SUFFIX, ROW_HASH_SUFFIX, SAMPLE_SUFFIX, STRATA_SUFFIX]
+    for (name,) in lookups + [(f"{table}{suffix}",) for suffix in derived]:
+        conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(name)}")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (REGISTRY_TABLE,)).fetchone():
+        conn.execute(f"DELETE FROM {REGISTRY_TABLE} WHERE source = ?", (table,))
+
+
+def reclaim_space(conn: sqlite3.Connection) -> bool:
+    """VACUUM when much of the file is free pages (e.g. a replaced table); skipped if readers are busy"""
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not pages or free < pages * VACUUM_FREE_RATIO:
+        return False
+    try:
+        conn.execute("VACUUM")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def create_table_sql(table: str, columns: list, types: dict) -> str:
+    """Build a CREATE TABLE statement from column names and SQLite types"""
+    column_defs = ", ".join(
+        f"{quote_identifier(col)} {types[col] or 'TEXT'}" for col in columns
+    )
+    return f"CREATE TABLE {quote_identifier(table)} ({column_defs})"
+
+
+def ingest_csv(csv_file_path: str, db_path: str, table: str = "orders",
+               chunk_size: int = None, progress_callback=None, finalize=None):
+    """
+    Stream a CSV file into a SQLite table, replacing any existing table.
+    gzip or zstd compressed CSV is decoded as it is read, and Parquet or
+    Arrow IPC files are read a record batch at a time.
+
+    Column types are fixed from the first chunk and widened
+    (INTEGER -> REAL -> TEXT) when later chunks need it. All chunks are
+    written inside one transaction, and the new table only replaces the
+    old one on commit, so readers never see a half-loaded table.
+
+    progress_callback, if given, is called as progress_callback(rows, elapsed)
+    at most once per PROGRESS_INTERVAL seconds.
+
+    finalize, if given, is called as finalize(conn, table) inside the load
+    transaction once the table is in place (e.g. compact_storage.compact_table);
+    its return value is included as 'storage'.
+
+    Returns a dict with 'records', 'columns', 'column_names', 'column_types',
+    'non_null', 'elapsed' and 'storage'.
+    """
+    if chunk_size is None:
+        chunk_size = CHUNK_ROWS
+
+    staging = f"{table}__ingest"
+    reader = read_chunks(csv_file_path, chunk_size)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # WAL lets pooled readers keep querying the old table while we load
+        conn.execute("PRAGMA journal_mode = WAL")
+        for pragma in BULK_LOAD_PRAGMAS:
+            conn.execute(pragma)
+
+        columns = None
+        declared = {}
+        types = {}
+        non_null = {}
+        records = 0
+        started = time.perf_counter()
+        last_report = started
+
+        conn.execute("BEGIN")
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(staging)}")
+
+            for chunk in reader:
+                if columns is None:
+                    columns = [str(col) for col in chunk.columns]
+                    types = {col: sqlite_type(chunk[col]) for col in columns}
+                    declared = dict(types)
+                    non_null = {col: 0 for col in columns}
+                    conn.execute(create_table_sql(staging, columns, declared))
+                    placeholders = ", ".join("?" for _ in columns)
+                    insert_sql = f"INSERT INTO {quote_identifier(staging)} VALUES ({placeholders})"
+                else:
+                    for col in columns:
+                        types[col] = widen_type(types[col], sqlite_type(chunk[col]))
+
+                counts = chunk.notna().sum()
+                for col, count in zip(columns, counts):
+                    non_null[col] += int(count)
+
+                conn.executemany(insert_sql, chunk_rows(chunk))
+                records += len(chunk)
+
+                now = time.perf_counter()
+                if progress_callback and now - last_report >= PROGRESS_INTERVAL:
+                    progress_callback(records, now - started)
+                    last_report = now
+
+            if columns is None or records == 0:
+                conn.execute("ROLLBACK")
+                raise ValueError("CSV file is empty")
+
+            drop_relation(conn, table)
+
+            if types == declared:
+                conn.execute(
+                    f"ALTER TABLE {quote_identifier(staging)} RENAME TO {quote_identifier(table)}"
+                )
+            else:
+                # A later chunk widened a column: rebuild once with the final
+                # types so SQLite's column affinity matches the data.
+                conn.execute(create_table_sql(table, columns, types))
+                conn.execute(
+                    f"INSERT INTO {quote_identifier(table)} SELECT * FROM {quote_identifier(staging)}"
+                )
+                conn.execute(f"DROP TABLE {quote_identifier(staging)}")
+
+            storage = finalize(conn, table) if finalize else None
+
+            conn.execute("COMMIT")
+            reclaim_space(conn)
+            # Fold the loaded pages into the main file so the WAL doesn't stay GBs large
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        elapsed = time.perf_counter() - started
+        if progress_callback:
+            progress_callback(records, elapsed)
+
+        return {
+            'records': records,
+            'columns': len(columns),
+            'column_names': columns,
+            'column_types': {col: types[col] or 'TEXT' for col in columns},
+            'non_null': non_null,
+            'elapsed': elapsed,
+            'storage': storage,
+        }
+    finally:
+        conn.close()
@@ -0,0 +1,344 @@
+"""
+LLM Call Scheduling
+Every Claude call goes through one scheduler per worker process. Identical
+requests in flight at the same time share one call. Calls are admitted by
+priority (SQL generation before explanations, live questions before
+background pre-answers) within the concurrency limit and token buckets for
+the account's request, input token and output token rate limits. Rate
+limited, overloaded and dropped calls are retried a bounded number of times
+with jittered exponential backoff.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from types import SimpleNamespace
+
+import anthropic
+import tracing
+
+# Rate limits of the API key, per minute (0 = unlimited)
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 1000))
+LLM_INPUT_TOKENS_PER_MINUTE = int(os.getenv("LLM_INPUT_TOKENS_PER_MINUTE", 450_000))
+LLM_OUTPUT_TOKENS_PER_MINUTE = int(os.getenv("LLM_OUTPUT_TOKENS_PER_MINUTE", 90_000))
+
+# Retries of calls that were rate limited, overloaded or dropped
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+RETRY_BASE_SECONDS = 0.5  # First backoff; doubles per attempt, with jitter
+RETRY_MAX_SECONDS = 30
+RETRYABLE_STATUS = {408, 409, 429}  # And every 5xx, including 529 overloaded
+
+# Priorities: lower runs first
+PRIORITY_SQL = 0
+PRIORITY_EXPLAIN = 1
+PRIORITY_BACKGROUND = 2  # Speculative work, e.g. pre-answering example questions
+
+# Usage of a call shared with an earlier identical one: it spent no tokens of its own
+NO_USAGE = SimpleNamespace(input_tokens=0, output_tokens=0, cache_creation_input_tokens=0, cache_read_input_tokens=0)
+
+
+class TokenBucket:
+    """A rate limit of per_minute units, refilled continuously up to a minute's worth"""
+
+    def __init__(self, per_minute: int, clock=time.monotonic):
+        self.capacity = per_minute
+        self.clock = clock
+        self.level = float(per_minute)
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until amount can be taken (amounts over capacity wait for a full bucket)"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float):
+        """Take amount (negative gives back); the level may go below zero, delaying later takers"""
+        if self.capacity > 0:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+def retryable(error: Exception) -> bool:
+    if isinstance(error, anthropic.APIConnectionError):
+        return True  # Includes timeouts
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after(error: Exception):
+    """Seconds the API asked to wait before retrying, if it said"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def request_key(kind: str, kwargs: dict) -> str:
+    """Identical requests (model, prompt, limits...) have the same key"""
+    payload = json.dumps({"kind": kind, **kwargs}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SharedMessage:
+    """The message of a call made for an identical request: same content, none of its token usage"""
+
+    usage = NO_USAGE
+
+    def __init__(self, message):
+        self.message = message
+
+    def __getattr__(self, name):
+        return getattr(self.message, name)
+
+
+class _Flight:
+    """
+    One call in flight, the text it has streamed so far, how many callers
+    share it and the most urgent priority among them
+    """
+
+    def __init__(self, priority: int):
+        self.task = None
+        self.chunks = []
+        self.changed = asyncio.Event()
+        self.callers = 0
+        self.priority = priority
+        self.waiting = None  # Its entry in the admission queue while it waits
+
+    def push(self, text: str = None):
+        """Add streamed text (or, with none, wake followers to see the call finished)"""
+        if text is not None:
+            self.chunks.append(text)
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def follow(self):
+        """Every chunk streamed, from the first, as they arrive"""
+        i = 0
+        while True:
+            changed = self.changed
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.task.done():
+                self.task.result()  # Raises the call's error
+                return
+            await changed.wait()
+
+
+class _SharedStream:
+    """messages.stream() as a caller sees it: text_stream and get_final_message() of a shared call"""
+
+    def __init__(self, scheduler, key, flight, first: bool):
+        self.scheduler = scheduler
+        self.key = key
+        self.flight = flight
+        self.first = first
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.scheduler._leave(self.key, self.flight)
+
+    @property
+    def text_stream(self):
+        return self.flight.follow()
+
+    async def get_final_message(self):
+        message = await asyncio.shield(self.flight.task)
+        return message if self.first else SharedMessage(message)
+
+
+class LLMScheduler:
+    """
+    Admits Claude calls by priority within a concurrency limit and rate limits,
+    shares identical in-flight calls and retries transient failures.
+    Bound to the event loop of its first call, like BackgroundJobs.
+    """
+
+    def __init__(self, concurrency: int = 16, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 input_tokens_per_minute: int = LLM_INPUT_TOKENS_PER_MINUTE,
+                 output_tokens_per_minute: int = LLM_OUTPUT_TOKENS_PER_MINUTE,
+                 max_retries: int = LLM_MAX_RETRIES, retry_base: float = RETRY_BASE_SECONDS):
+        self.concurrency = concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.input_tokens = TokenBucket(input_tokens_per_minute)
+        self.output_tokens = TokenBucket(output_tokens_per_minute)
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.stats = {"calls": 0, "shared": 0, "retries": 0}
+        self._loop = None
+        self._order = itertools.count()
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Waiters, flights and timers belong to one event loop
+            self._loop = loop
+            self._waiting = []
+            self._active = 0
+            self._flights = {}
+            self._timer = None
+            self._paused_until = 0.0
+
+    def _dispatch(self):
+        """Admit waiting calls in priority order while a slot and the rate limits allow"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiting and self._active < self.concurrency:
+            _, _, cost, admitted = self._waiting[0]
+            if admitted.done():  # The caller was cancelled while waiting
+                heapq.heappop(self._waiting)
+                continue
+            requests, input_tokens, output_tokens = cost
+            wait = max(self._paused_until - time.monotonic(), self.requests.delay(requests),
+                       self.input_tokens.delay(input_tokens), self.output_tokens.delay(output_tokens))
+            if wait > 0:
+                # Lower priorities wait too: the head of the queue gets the next capacity
+                self._timer = self._loop.call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiting)
+            self.requests.take(requests)
+            self.input_tokens.take(input_tokens)
+            self.output_tokens.take(output_tokens)
+            self._active += 1
+            admitted.set_result(None)
+
+    async def _admit(self, flight, cost: tuple):
+        admitted = self._loop.create_future()
+        flight.waiting = (flight.priority, next(self._order), cost, admitted)
+        heapq.heappush(self._waiting, flight.waiting)
+        self._dispatch()
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            if admitted.done() and not admitted.cancelled():
+                self._release()  # Admitted as it was cancelled
+            raise
+        finally:
+            flight.waiting = None
+
+    def _promote(self, flight, priority: int):
+        """A more urgent caller joined: the flight waits (and retries) at its priority from now on"""
+        flight.priority = priority
+        if flight.waiting is not None:
+            # Queue it again; the old entry is skipped once the shared future is done
+            _, _, cost, admitted = flight.waiting
+            flight.waiting = (priority, next(self._order), cost, admitted)
+            heapq.heappush(self._waiting, flight.waiting)
+            self._dispatch()
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _settle(self, estimated: int, reserved: int, usage):
+        """Correct the buckets from the estimate and max_tokens to what the call used"""
+        used_input = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+        self.input_tokens.take(used_input - estimated)
+        self.output_tokens.take((getattr(usage, "output_tokens", 0) or 0) - reserved)
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Jittered exponential backoff, or longer if the API asked for it"""
+        delay = min(RETRY_MAX_SECONDS, self.retry_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        return max(delay, retry_after(error) or 0.0)
+
+    async def _call(self, api, stream: bool, estimated_tokens: int, kwargs: dict, flight):
+        cost = (1, estimated_tokens, kwargs.get("max_tokens", 0))
+        for attempt in range(self.max_retries + 1):
+            await self._admit(flight, cost)
+            self.stats["calls"] += 1
+            try:
+                if stream:
+                    async with api.stream(**kwargs) as response:
+                        async for text in response.text_stream:
+                            flight.push(text)
+                        message = await response.get_final_message()
+                else:
+                    message = await api.create(**kwargs)
+            except BaseException as error:
+                # The slot is free during the backoff; nothing was output that counts
+                self._release()
+                self._settle(estimated_tokens, cost[2], None)
+                # A stream that already sent text can't be taken back
+                if (not isinstance(error, Exception) or attempt == self.max_retries or flight.chunks
+                        or not retryable(error)):
+                    raise
+                delay = self.backoff(attempt, error)
+                if isinstance(error, anthropic.RateLimitError):
+                    # The limit is the account's: hold every call, not just this one
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self.stats["retries"] += 1
+                tracing.annotate(llm_retries=1)
+                await asyncio.sleep(delay)
+                continue
+            self._release()
+            self._settle(estimated_tokens, cost[2], message.usage)
+            return message
+
+    def _join(self, kind: str, api, priority: int, estimated_tokens: int, kwargs: dict):
+        """The flight for this request, started if none is in the air; (key, flight, first caller)"""
+        self._bind()
+        key = request_key(kind, kwargs)
+        flight = self._flights.get(key)
+        first = flight is None
+        if first:
+            flight = _Flight(priority)
+            flight.task = asyncio.ensure_future(
+                self._call(api, kind == "stream", estimated_tokens, kwargs, flight)
+            )
+            flight.task.add_done_callback(lambda task: flight.push())
+            flight.task.add_done_callback(lambda task: self._flights.get(key) is flight and self._flights.pop(key))
+            self._flights[key] = flight
+        else:
+            self.stats["shared"] += 1
+            tracing.annotate(llm_shared=1)
+            if priority < flight.priority:
+                self._promote(flight, priority)
+        flight.callers += 1
+        return key, flight, first
+
+    def _leave(self, key: str, flight):
+        """A caller is done with a flight; the call is cancelled once nobody waits for it"""
+        flight.callers -= 1
+        if flight.callers == 0 and not flight.task.done():
+            flight.task.cancel()
+            if self._flights.get(key) is flight:
+                self._flights.pop(key)
+
+    async def create(self, api, priority: int = PRIORITY_SQL, estimated_tokens: int = 0, **kwargs):
+        """
+        api.create(**kwargs), scheduled (api is client.messages). A caller whose
+        request matches one in flight gets its message as a SharedMessage.
+        """
+        key, flight, first = self._join("create", api, priority, estimated_tokens, kwargs)
+        try:
+            message = await asyncio.shield(flight.task)
+        finally:
+            self._leave(key, flight)
+        return message if first else SharedMessage(message)
+
+    def stream(self, api, priority: int = PRIORITY_EXPLAIN, estimated_tokens: int = 0, **kwargs):
+        """
+        api.stream(**kwargs), scheduled: use as `async with`, then read
+        text_stream and get_final_message(). A caller whose request matches one
+        in flight reads the same text from the start.
+        """
+        return _SharedStream(self, *self._join("stream", api, priority, estimated_tokens, kwargs))
@@ -0,0 +1,317 @@
+"""
+Parallel CSV Ingest
+Loads one large CSV or several CSVs with the same columns into one SQLite
+table using every core: files are split at line boundaries into byte-range
+shards, worker processes parse each shard into its own scratch database,
+and a single writer copies the shards into the table in file order.
+Compressed and columnar files (see upload_formats.py) are one shard each.
+"""
+
+import io
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from ingest import (BULK_LOAD_PRAGMAS, CHUNK_ROWS, PROGRESS_INTERVAL, chunk_rows, create_table_sql, drop_relation,
+                    ingest_csv, quote_identifier, reclaim_space, sqlite_type, widen_type)
+from upload_formats import detect_format, read_chunks, source_columns
+
+# Parallel ingest configuration
+PARALLEL_INGEST = os.getenv("PARALLEL_INGEST", "true").lower() in ("1", "true", "yes")
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", os.cpu_count() or 1))  # Worker processes parsing shards
+SHARD_BYTES = int(os.getenv("INGEST_SHARD_BYTES", 64 * 1024 * 1024))  # Largest byte range one worker parses
+MIN_SHARD_BYTES = 4 * 1024 * 1024  # Smaller shards cost more in process overhead than they save
+# Inputs smaller than this are parsed in the calling thread: starting workers would take longer
+PARALLEL_MIN_BYTES = int(os.getenv("PARALLEL_INGEST_MIN_BYTES", 32 * 1024 * 1024))
+
+SHARD_TABLE = "shard"
+
+_pool = None
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """The shared worker pool, started on first use"""
+    global _pool
+    if _pool is None:
+        # Forking a process that runs threads (the event loop, query pools) can deadlock the child
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=INGEST_PROCESSES, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def discard_pool():
+    """Drop a broken pool (a worker died, e.g. out of memory) so the next ingest starts a fresh one"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+def read_header(path: str):
+    """The raw header line and the column names pandas reads from it (no line for non-CSV files)"""
+    if detect_format(path) != "csv":
+        return b"", source_columns(path)
+    with open(path, "rb") as f:
+        header = f.readline()
+    columns = [str(col) for col in pd.read_csv(io.BytesIO(header), nrows=0).columns] if header.strip() else []
+    return header, columns
+
+
+def read_headers(paths: list) -> dict:
+    """{path: (header line, columns)}, checking that every file has the first file's columns"""
+    headers = {}
+    for path in paths:
+        header, columns = read_header(path)
+        if not columns:
+            raise ValueError(f"{os.path.basename(path)} is empty")
+        if headers and set(columns) != set(headers[paths[0]][1]):
+            raise ValueError(f"{os.path.basename(path)} has different columns from {os.path.basename(paths[0])}")
+        headers[path] = (header, columns)
+    return headers
+
+
+def shard_size(total_bytes: int, processes: int) -> int:
+    """Bytes per shard: about two shards per worker so a slow shard doesn't hold up the rest"""
+    return max(MIN_SHARD_BYTES, min(SHARD_BYTES, -(-total_bytes // (processes * 2))))
+
+
+def plan_shards(path: str, size: int) -> list:
+    """Split a file into (start, end) byte ranges that begin and end at line boundaries"""
+    total = os.path.getsize(path)
+    shards = []
+    start = 0
+    with open(path, "rb") as f:
+        while start < total:
+            f.seek(min(start + size, total))
+            f.readline()  # Finish the line the cut fell in
+            end = min(f.tell(), total)
+            shards.append((start, end))
+            start = end
+    return shards
+
+
+def parse_shard(path: str, start: int, end: int, header: bytes, out_path: str, chunk_size: int = None) -> dict:
+    """
+    Parse bytes [start, end) of a CSV into the SHARD_TABLE of a new SQLite file (runs in a worker).
+
+    Shards after the first are parsed with the header line prepended.
+    Returns 'path', 'records', 'columns', 'types', 'non_null', 'error' (a
+    parser error, or None) and 'quotes', the number of double quotes in the
+    range: a shard boundary is only a row boundary when the quotes before it
+    are balanced, and a shard cut inside a quoted field may not parse.
+    """
+    if start == 0 and end == os.path.getsize(path):
+        # A whole file is streamed, not read into memory (and decoded, if compressed or columnar)
+        quotes = 0
+        reader = read_chunks(path, chunk_size or CHUNK_ROWS)
+    else:
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        quotes = data.count(b'"')
+        reader = pd.read_csv(io.BytesIO(data if start == 0 else header + data), chunksize=chunk_size or CHUNK_ROWS)
+
+    conn = sqlite3.connect(out_path, isolation_level=None)
+    try:
+        for pragma in BULK_LOAD_PRAGMAS + ["PRAGMA journal_mode = OFF"]:
+            conn.execute(pragma)
+        columns = None
+        types = {}
+        non_null = {}
+        records = 0
+        conn.execute("BEGIN")
+        try:
+            for chunk in reader:
+                if columns is None:
+                    columns = [str(col) for col in chunk.columns]
+                    types = {col: sqlite_type(chunk[col]) for col in columns}
+                    non_null = {col: 0 for col in columns}
+                    conn.execute(create_table_sql(SHARD_TABLE, columns, types))
+                    placeholders = ", ".join("?" for _ in columns)
+                    insert_sql = f"INSERT INTO {SHARD_TABLE} VALUES ({placeholders})"
+                else:
+                    for col in columns:
+                        types[col] = widen_type(types[col], sqlite_type(chunk[col]))
+                for col, count in zip(columns, chunk.notna().sum()):
+                    non_null[col] += int(count)
+                conn.executemany(insert_sql, chunk_rows(chunk))
+                records += len(chunk)
+            error = None
+        except pd.errors.ParserError as e:
+            error = str(e)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    return {'path': out_path, 'records': records, 'columns': columns, 'types': types,
+            'non_null': non_null, 'quotes': quotes, 'error': error}
+
+
+def balanced(results: list) -> bool:
+    """Whether every shard of a file starts outside a quoted field (no quoted newline was cut)"""
+    quotes = 0
+    for result in results[:-1]:
+        quotes += result['quotes']
+        if quotes % 2:
+            return False
+    return True
+
+
+def ingest_files(paths: list, db_path: str, table: str = "orders", progress_callback=None, finalize=None,
+                 processes: int = None, size: int = None) -> dict:
+    """
+    Load CSV files with the same columns (in any order) into one SQLite table, replacing it.
+
+    A single file below PARALLEL_MIN_BYTES, or not plain CSV, goes through
+    ingest_csv. Otherwise every CSV is sharded (a compressed or columnar file
+    is one shard), the shards are parsed on the process pool (in this
+    thread for small inputs or when PARALLEL_INGEST is off), and this thread
+    alone writes: it copies the shards into a staging table in file order,
+    then swaps it in and runs finalize inside one transaction as ingest_csv
+    does. A file whose shards cut through a quoted field is parsed again as
+    one shard. Column types are widened across shards like ingest_csv widens
+    them across chunks.
+
+    Returns the ingest_csv dict plus 'files' and 'shards'.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if processes is None:
+        processes = INGEST_PROCESSES if PARALLEL_INGEST else 1
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    formats = [detect_format(path) for path in paths]
+    if len(paths) == 1 and (processes == 1 or total_bytes < PARALLEL_MIN_BYTES or formats[0] != "csv"):
+        result = ingest_csv(paths[0], db_path, table=table, progress_callback=progress_callback, finalize=finalize)
+        return dict(result, files=1, shards=1)
+
+    headers = read_headers(paths)
+    columns = headers[paths[0]][1]
+
+    started = time.perf_counter()
+    scratch = tempfile.mkdtemp(prefix=".ingest-", dir=os.path.dirname(os.path.abspath(db_path)))
+    try:
+        parallel = processes > 1 and total_bytes >= PARALLEL_MIN_BYTES
+        size = size or shard_size(total_bytes, processes)
+        # Only plain text can be cut at byte offsets
+        jobs = [(path, start, end) for path, fmt in zip(paths, formats)
+                for start, end in (plan_shards(path, size) if fmt == "csv" else [(0, os.path.getsize(path))])]
+
+        def parse(job_list):
+            """Parse shards, reporting rows as they finish; returns results keyed by job"""
+            arguments = {(path, start, end): (path, start, end, headers[path][0],
+                                              os.path.join(scratch, f"{paths.index(path)}-{start}.db"))
+                         for path, start, end in job_list}
+            if parallel:
+                pool = process_pool()
+                futures = {pool.submit(parse_shard, *args): job for job, args in arguments.items()}
+                done = ((futures[future], future.result()) for future in as_completed(futures))
+            else:
+                done = ((job, parse_shard(*args)) for job, args in arguments.items())
+            results = {}
+            records = 0
+            last_report = time.perf_counter()
+            for job, result in done:
+                results[job] = result
+                records += result['records']
+                now = time.perf_counter()
+                if progress_callback and now - last_report >= PROGRESS_INTERVAL:
+                    progress_callback(records, now - started)
+                    last_report = now
+            return results
+
+        try:
+            results = parse(jobs)
+        except BrokenProcessPool:
+            discard_pool()
+            raise
+
+        # Files whose shard boundaries fell inside a quoted field are parsed whole
+        for path in paths:
+            shards = [results[job] for job in jobs if job[0] == path]
+            if not balanced(shards):
+                for job in [job for job in jobs if job[0] == path]:
+                    scratch_db = results.pop(job)['path']
+                    if os.path.exists(scratch_db):
+                        os.remove(scratch_db)
+                jobs = [job for job in jobs if job[0] != path] + [(path, 0, os.path.getsize(path))]
+                results.update(parse([jobs[-1]]))
+        jobs.sort(key=lambda job: (paths.index(job[0]), job[1]))
+        for job in jobs:
+            if results[job]['error']:
+                raise ValueError(f"{os.path.basename(job[0])}: {results[job]['error']}")
+        shards = [results[job] for job in jobs if results[job]['records']]
+        if not shards:
+            raise ValueError("CSV file is empty")
+
+        types = {col: None for col in columns}
+        non_null = {col: 0 for col in columns}
+        for shard in shards:
+            for col in columns:
+                types[col] = widen_type(types[col], shard['types'][col])
+                non_null[col] += shard['non_null'][col]
+        records = sum(shard['records'] for shard in shards)
+
+        # The single writer: copy each shard into staging, then swap it in
+        staging = f"{table}__ingest"
+        column_list = ", ".join(quote_identifier(col) for col in columns)
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            for pragma in BULK_LOAD_PRAGMAS:
+                conn.execute(pragma)
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(staging)}")
+            conn.execute(create_table_sql(staging, columns, types))
+            copied = 0
+            for shard in shards:
+                # ATTACH can't run inside a transaction; staging is invisible to readers until the swap
+                conn.execute("ATTACH DATABASE ? AS shard", (shard['path'],))
+                try:
+                    conn.execute(f"INSERT INTO {quote_identifier(staging)} ({column_list}) "
+                                 f"SELECT {column_list} FROM shard.{SHARD_TABLE}")
+                finally:
+                    conn.execute("DETACH DATABASE shard")
+                copied += shard['records']
+                if progress_callback:
+                    progress_callback(copied, time.perf_counter() - started)
+
+            conn.execute("BEGIN")
+            try:
+                drop_relation(conn, table)
+                conn.execute(f"ALTER TABLE {quote_identifier(staging)} RENAME TO {quote_identifier(table)}")
+                storage = finalize(conn, table) if finalize else None
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            reclaim_space(conn)
+            # Fold the loaded pages into the main file so the WAL doesn't stay GBs large
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(staging)}")
+            raise
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    if progress_callback:
+        progress_callback(records, elapsed)
+
+    return {
+        'records': records,
+        'columns': len(columns),
+        'column_names': columns,
+        'column_types': {col: types[col] or 'TEXT' for col in columns},
+        'non_null': non_null,
+        'elapsed': elapsed,
+        'storage': storage,
+        'files': len(paths),
+        'shards': len(shards),
+    }
@@ -0,0 +1,100 @@
+"""
+Pipelined Execution
+Helpers for overlapping the stages of a question: start a streamed model
+call early and buffer its output, and run speculative work (pre-answering
+example questions) in the background, keyed so a live request can wait for
+the matching job instead of repeating it
+"""
+
+import asyncio
+
+
+class Prefetch:
+    """
+    Consume an async iterator in a background task starting now, buffering
+    its items until they are read. Lets a slow request (e.g. the explanation
+    stream) get going while other work renders.
+    """
+
+    _DONE = object()
+
+    def __init__(self, source):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source):
+        try:
+            async for item in source:
+                await self._queue.put(item)
+        except Exception as e:
+            await self._queue.put(e)
+        finally:
+            await self._queue.put(self._DONE)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is self._DONE:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def aclose(self):
+        """Stop the source (closing its stream) if it is still running"""
+        if not self._task.done():
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+class BackgroundJobs:
+    """Keyed background tasks, at most `concurrency` running at once"""
+
+    def __init__(self, concurrency: int = 2):
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._loop = None
+        self._tasks = {}
+
+    def submit(self, key, factory):
+        """Run factory() in the background under key, unless that key is already pending"""
+        task = self._tasks.get(key)
+        if task is not None and not task.done():
+            return task
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A semaphore belongs to one event loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+
+        semaphore = self._semaphore
+
+        async def run():
+            async with semaphore:
+                return await factory()
+
+        task = asyncio.create_task(run())
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._tasks.get(key) is t and self._tasks.pop(key))
+        return task
+
+    async def wait(self, key):
+        """Wait for the pending job under key, if any; a failed or cancelled job is ignored"""
+        task = self._tasks.get(key)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def join(self):
+        """Wait for every pending job"""
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def pending(self) -> int:
+        return sum(not task.done() for task in self._tasks.values())
+
+    def cancel_all(self):
+        """Cancel every pending job, e.g. when the data they were computed on is replaced"""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
@@ -0,0 +1,308 @@
+"""
+Prompt Builder
+Token-budgeted prompts for the model: a compact schema encoding sent as a
+cacheable system prefix, columns ranked by relevance to the question when
+the whole schema doesn't fit, results trimmed or digested to a budget, and a log
+of the token counts each call actually used
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import pandas as pd
+from result_digest import digest_results
+
+# Prompt configuration
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", 2000))  # Schema context per SQL prompt
+RESULT_TOKEN_BUDGET = int(os.getenv("RESULT_TOKEN_BUDGET", 1500))  # Result rows per explanation prompt
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "true").lower() in ("1", "true", "yes")
+CHARS_PER_TOKEN = 3.5  # Conservative for identifiers, numbers and punctuation
+MAX_VALUE_CHARS = 40  # Longer sample/top values are clipped
+RESULT_MAX_ROWS = 20  # Larger results are sent as a digest instead of rows
+DIGEST_SAMPLE_ROWS = 5  # Rows sent alongside a digest
+USAGE_LOG_SIZE = 500  # Calls kept in the token usage log
+
+# Question words that make a kind of column relevant even when it isn't named
+TIME_WORDS = {"date", "day", "daily", "week", "weekly", "month", "monthly", "quarter",
+              "year", "yearly", "trend", "time", "when", "recent", "latest"}
+MEASURE_WORDS = {"revenue", "sales", "total", "sum", "average", "avg", "mean", "amount",
+                 "profit", "spend", "value", "much", "many", "count", "number"}
+NUMERIC_TYPES = {"INTEGER", "REAL", "BIGINT", "DOUBLE", "FLOAT", "DECIMAL", "HUGEINT", "SMALLINT", "TINYINT"}
+
+SQL_INSTRUCTIONS = """You are a SQL expert helping to analyze customer order data.
+Given the database schema and a user question, generate a valid {dialect} query.
+
+Instructions:
+- Generate ONLY the SQL query, no explanations or markdown
+- Use proper {dialect} syntax
+{dialect_hints}- The table name is '{table}'
+- Return only SELECT statements
+- Use appropriate aggregations (SUM, COUNT, AVG) as needed
+- Use GROUP BY for aggregations
+- Use ORDER BY to sort results meaningfully
+- Limit results to top 10-20 items for large datasets
+- Handle NULL values appropriately"""
+
+EXPLAIN_INSTRUCTIONS = """You are a business analyst explaining data insights to stakeholders.
+
+Provide a clear, business-friendly explanation that includes:
+1. Direct answer to the question
+2. Key insights and patterns in the data
+3. Notable trends or outliers
+4. Actionable recommendations if applicable
+
+Keep the tone professional but conversational. Use numbers and percentages where relevant."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of a text, erring high"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def clip(value, limit: int = MAX_VALUE_CHARS) -> str:
+    """Render a value on one line, shortened to limit characters"""
+    text = " ".join(str(value).split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def words(text: str) -> set:
+    """Lowercase word tokens, with snake_case and camelCase split apart"""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def column_line(col, approx: str = "") -> str:
+    """One compact line of type and statistics for a column"""
+    details = [col.type or "TEXT"]
+    if col.is_date:
+        details.append("date")
+    details.append(f"{approx}{col.distinct:,} distinct")
+    if col.non_null is not None and col.distinct is not None and col.non_null == 0:
+        details.append("all NULL")
+    if col.top_values:
+        details.append("top " + ", ".join(repr(clip(value)) for value, _ in col.top_values))
+    elif col.min is not None:
+        details.append(f"{clip(col.min)}..{clip(col.max)}")
+    return f"{col.name}: {'; '.join(details)}"
+
+
+def sample_lines(profile, rows: int = 2) -> list:
+    """Header and sample rows as pipe-separated values"""
+    lines = [" | ".join(col.name for col in profile.columns)]
+    for row in profile.sample_rows[:rows]:
+        lines.append(" | ".join(clip(value, 20) for value in row))
+    return lines
+
+
+def rank_columns(profile, question: str) -> list:
+    """Columns ordered by relevance to the question, table order among equals"""
+    asked = words(question)
+    question_lower = question.lower()
+
+    def score(col):
+        points = 0
+        for part in words(col.name):
+            if part in asked or any(len(part) >= 4 and word.startswith(part) for word in asked):
+                points += 3
+        if any(str(value).lower() in question_lower for value, _ in col.top_values or []):
+            points += 2
+        if col.is_date and asked & TIME_WORDS:
+            points += 2
+        if (col.type or "").upper() in NUMERIC_TYPES and asked & MEASURE_WORDS:
+            points += 1
+        return points
+
+    return sorted(profile.columns, key=lambda col: -score(col))
+
+
+def compact_schema(profile, question: str, budget: int = SCHEMA_TOKEN_BUDGET):
+    """
+    Encode a schema profile in at most about budget tokens.
+
+    Returns (stable, relevant). stable depends only on the data, so it can be
+    cached across questions: the full column statistics and two sample rows
+    when they fit, otherwise just column names grouped by type. relevant is empty
+    in the first case; in the second it holds statistics for the columns most
+    relevant to the question, as many as the rest of the budget allows.
+    """
+    approx = "~" if profile.sampled_rows < profile.row_count else ""
+    header = f"Table: {profile.table} ({profile.row_count:,} rows)"
+
+    full = "\n".join(
+        [header, "Columns:"] + [f"  {column_line(col, approx)}" for col in profile.columns]
+        + ["Sample rows:"] + [f"  {line}" for line in sample_lines(profile)]
+    )
+    if estimate_tokens(full) <= budget:
+        return full, ""
+
+    by_type = {}
+    for col in profile.columns:
+        by_type.setdefault(col.type or "TEXT", []).append(col.name)
+    stable = "\n".join([header, "Columns by type:"] + [f"  {t}: {', '.join(names)}" for t, names in by_type.items()])
+    remaining = budget - estimate_tokens(stable)
+    relevant = []
+    for col in rank_columns(profile, question):
+        line = f"  {column_line(col, approx)}"
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            break
+        relevant.append(line)
+        remaining -= cost
+    if not relevant:
+        return stable, ""
+    return stable, "Columns most relevant to this question:\n" + "\n".join(relevant)
+
+
+def cacheable(text: str) -> list:
+    """A system prompt as one text block, marked for prompt caching when enabled"""
+    block = {"type": "text", "text": text}
+    if PROMPT_CACHING:
+        block["cache_control"] = {"type": "ephemeral"}
+    return [block]
+
+
+@dataclass
+class Prompt:
+    """Arguments for messages.create/stream plus the estimated input size"""
+    system: list
+    messages: list
+    estimated_tokens: int
+
+    def kwargs(self):
+        return {"system": self.system, "messages": self.messages}
+
+
+def build_sql_prompt(question: str, schema, dialect: str, dialect_hints: list = (),
+                     feedback: str = None, budget: int = SCHEMA_TOKEN_BUDGET) -> Prompt:
+    """
+    Build the SQL generation prompt.
+
+    schema is a SchemaProfile (compacted to budget) or an already rendered
+    string. Instructions and the stable schema go in the system prompt, which
+    is identical across questions on the same data and marked for caching;
+    the question, question-specific columns and any feedback follow it.
+    """
+    if isinstance(schema, str):
+        stable, relevant, table = schema, "", "orders"
+    else:
+        stable, relevant = compact_schema(schema, question, budget)
+        table = schema.table
+
+    instructions = SQL_INSTRUCTIONS.format(
+        dialect=dialect, table=table,
+        dialect_hints="".join(f"- {hint}\n" for hint in dialect_hints)
+    )
+    system = f"{instructions}\n\nDatabase Schema:\n{stable}"
+
+    parts = [relevant] if relevant else []
+    parts.append(f"User Question: {question}")
+    if feedback:
+        parts.append(f"Feedback on your previous attempt:\n{feedback}")
+    parts.append("SQL Query:")
+    user = "\n\n".join(parts)
+
+    return Prompt(
+        system=cacheable(system),
+        messages=[{"role": "user", "content": user}],
+        estimated_tokens=estimate_tokens(system) + estimate_tokens(user),
+    )
+
+
+def format_rows(results_df: pd.DataFrame, budget: int = RESULT_TOKEN_BUDGET) -> str:
+    """Result rows as compact CSV, as many as fit the budget"""
+    clipped = results_df.apply(lambda column: column.map(
+        lambda value: value if isinstance(value, (int, float)) or value is None else clip(value)
+    ))
+    lines = clipped.to_csv(index=False, float_format="%.10g").splitlines()
+
+    shown = [lines[0]]
+    remaining = budget - estimate_tokens(lines[0])
+    for line in lines[1:]:
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            break
+        shown.append(line)
+        remaining -= cost
+    return "\n".join(shown)
+
+
+def format_results(results_df: pd.DataFrame, budget: int = RESULT_TOKEN_BUDGET) -> str:
+    """
+    Results for the explanation prompt. Up to RESULT_MAX_ROWS rows are sent
+    as they are; larger results as a digest of every row (see result_digest.py)
+    plus the first few rows, so the prompt size doesn't grow with the result.
+    """
+    if len(results_df) == 0:
+        return "No results found"
+    if len(results_df) <= RESULT_MAX_ROWS:
+        text = format_rows(results_df, budget)
+        rows = text.count("\n")
+        if rows < len(results_df):
+            text += f"\n... and {len(results_df) - rows:,} more rows"
+        return text
+
+    digest = digest_results(results_df)
+    sample = format_rows(results_df.head(DIGEST_SAMPLE_ROWS), budget - estimate_tokens(digest))
+    return f"Summary of all rows:\n{digest}\n\nFirst rows:\n{sample}"
+
+
+def build_explain_prompt(question: str, sql_query: str, results_df: pd.DataFrame,
+                         budget: int = RESULT_TOKEN_BUDGET) -> Prompt:
+    """Build the explanation prompt: fixed analyst instructions, then the question, SQL and results"""
+    user = (
+        f"User's Question: {question}\n\n"
+        f"SQL Query Used:\n{sql_query}\n\n"
+        f"Query Results:\n{format_results(results_df, budget)}"
+    )
+    return Prompt(
+        system=[{"type": "text", "text": EXPLAIN_INSTRUCTIONS}],
+        messages=[{"role": "user", "content": user}],
+        estimated_tokens=estimate_tokens(EXPLAIN_INSTRUCTIONS) + estimate_tokens(user),
+    )
+
+
+class TokenUsageLog:
+    """Token counts of recent model calls, as reported by the API, shared by all sessions"""
+
+    def __init__(self, size: int = USAGE_LOG_SIZE):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, prompt: Prompt, usage) -> dict:
+        """Log one call's usage (input, cache write/read, output) next to the estimate"""
+        entry = {
+            'kind': kind,
+            'estimated': prompt.estimated_tokens,
+            'input': getattr(usage, 'input_tokens', 0) or 0,
+            'cache_write': getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+            'cache_read': getattr(usage, 'cache_read_input_tokens', 0) or 0,
+            'output': getattr(usage, 'output_tokens', 0) or 0,
+            'time': time.time(),
+        }
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def summary(self) -> dict:
+        """Totals per kind of call, with the share of input tokens read from the cache"""
+        totals = {}
+        for entry in self.entries():
+            kind = totals.setdefault(entry['kind'], {
+                'calls': 0, 'input': 0, 'cache_write': 0, 'cache_read': 0, 'output': 0
+            })
+            kind['calls'] += 1
+            for key in ('input', 'cache_write', 'cache_read', 'output'):
+                kind[key] += entry[key]
+        for kind in totals.values():
+            prompt_tokens = kind['input'] + kind['cache_write'] + kind['cache_read']
+            kind['cache_hit_ratio'] = kind['cache_read'] / prompt_tokens if prompt_tokens else 0.0
+        return totals
@@ -0,0 +1,194 @@
+"""
+Bounded Query Execution
+Runs generated SQL under a wall-clock, row and byte budget, and lets a
+session cancel its running query
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+# Budget configuration
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", 30))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", 10_000))  # Rows fetched into the result
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", 64 * 1024 * 1024))  # Approximate result size
+FETCH_BATCH_ROWS = 1000  # Rows per fetchmany call
+PROGRESS_HANDLER_OPS = 10_000  # SQLite VM instructions between budget checks
+
+
+class QueryCancelled(Exception):
+    """Raised when a query is stopped by its session"""
+
+
+class QueryTimeout(QueryCancelled):
+    """Raised when a query runs past its time limit"""
+
+
+class QueryBudget:
+    """Limits for one query, plus a flag the owning session can set to cancel it"""
+
+    def __init__(self, timeout: float = QUERY_TIMEOUT_SECONDS, max_rows: int = QUERY_MAX_ROWS,
+                 max_bytes: int = QUERY_MAX_BYTES):
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self._cancelled = threading.Event()
+        self._deadline = None
+
+    def cancel(self):
+        """Stop the running query at its next progress check"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def start(self):
+        """Start the clock; later calls keep the original deadline"""
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.timeout
+
+    def expired(self):
+        return self._deadline is not None and time.monotonic() > self._deadline
+
+    def should_abort(self):
+        """Progress handler: a non-zero return makes SQLite interrupt the statement"""
+        return 1 if self.cancelled or self.expired() else 0
+
+    def check(self):
+        """Raise if the budget says the query must stop"""
+        if self.cancelled:
+            raise QueryCancelled("Query cancelled")
+        if self.expired():
+            raise QueryTimeout(f"Query exceeded the {self.timeout:g}s time limit")
+
+
+def row_bytes(row) -> int:
+    """Rough in-memory size of a fetched row"""
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value) + 49
+        else:
+            size += 24
+    return size
+
+
+def fetch_bounded(cursor, budget: QueryBudget):
+    """
+    Fetch rows from an executed DB-API cursor until the row or byte budget is used.
+    Returns (columns, rows, truncated).
+    """
+    columns = [desc[0] for desc in cursor.description or []]
+    rows = []
+    size = 0
+    while True:
+        remaining = budget.max_rows - len(rows)
+        batch = cursor.fetchmany(min(FETCH_BATCH_ROWS, remaining + 1))
+        if not batch:
+            return columns, rows, False
+        for row in batch:
+            if len(rows) >= budget.max_rows or size >= budget.max_bytes:
+                return columns, rows, True
+            rows.append(tuple(row))
+            size += row_bytes(row)
+
+
+def fetch_chunks(cursor, write, chunk_rows: int = FETCH_BATCH_ROWS, max_rows: int = None):
+    """
+    Pass the rows of an executed DB-API cursor to write(columns, rows), one
+    fetchmany chunk at a time, so only a chunk is ever held in memory.
+    Returns (rows written, truncated); at most max_rows rows when given.
+    """
+    columns = [desc[0] for desc in cursor.description or []]
+    written = 0
+    while True:
+        size = chunk_rows if max_rows is None else min(chunk_rows, max_rows - written + 1)
+        batch = cursor.fetchmany(size)
+        if not batch:
+            return written, False
+        truncated = max_rows is not None and written + len(batch) > max_rows
+        if truncated:
+            batch = batch[:max_rows - written]
+        if batch:
+            write(columns, batch)
+            written += len(batch)
+        if truncated:
+            return written, True
+
+
+def run_bounded(conn: sqlite3.Connection, query: str, budget: QueryBudget = None):
+    """
+    Execute a query and fetch at most the budgeted rows/bytes incrementally.
+
+    The returned DataFrame carries attrs['truncated'] (True if rows were left
+    unfetched). Use count_rows() for the full row count when it is needed.
+    """
+    if budget is None:
+        budget = QueryBudget()
+
+    budget.start()
+    conn.set_progress_handler(budget.should_abort, PROGRESS_HANDLER_OPS)
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query)
+            columns, rows, truncated = fetch_bounded(cursor, budget)
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                budget.check()
+            raise
+        finally:
+            cursor.close()
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    df.attrs['truncated'] = truncated
+    return df
+
+
+def count_rows(conn: sqlite3.Connection, query: str, budget: QueryBudget = None) -> int:
+    """Count the rows a query would return, within what is left of the time budget"""
+    if budget is None:
+        budget = QueryBudget()
+
+    budget.start()
+    conn.set_progress_handler(budget.should_abort, PROGRESS_HANDLER_OPS)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            budget.check()
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def run_streamed(conn: sqlite3.Connection, query: str, write, budget: QueryBudget = None,
+                 chunk_rows: int = FETCH_BATCH_ROWS):
+    """
+    Execute a query and stream its rows to write(columns, rows) in chunks
+    (see fetch_chunks) under the budget's time limit and max_rows.
+    Without a budget every row is written. Returns (rows written, truncated).
+    """
+    if budget is None:
+        budget = QueryBudget(max_rows=None)
+
+    budget.start()
+    conn.set_progress_handler(budget.should_abort, PROGRESS_HANDLER_OPS)
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query)
+            return fetch_chunks(cursor, write, chunk_rows, budget.max_rows)
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                budget.check()
+            raise
+        finally:
+            cursor.close()
+    finally:
+        conn.set_progress_handler(None, 0)
@@ -0,0 +1,188 @@
+"""
+Query Plan Pre-flight
+Estimates the cost of generated SQL from EXPLAIN QUERY PLAN before it runs,
+and decides whether to run it, cap it with a LIMIT, or ask for a cheaper query
+"""
+
+import math
+import os
+import re
+import sqlite3
+from dataclasses import dataclass, field
+
+# Pre-flight configuration
+PLAN_COST_LIMIT = float(os.getenv("PLAN_COST_LIMIT", 20_000_000))  # Estimated row visits allowed as-is
+PLAN_REJECT_COST = float(os.getenv("PLAN_REJECT_COST", 2_000_000_000))  # Never run above this
+SEARCH_FRACTION = 0.05  # Share of a table an index SEARCH is assumed to touch
+GROUP_FRACTION = 0.01  # Share of rows assumed to be left as groups after GROUP BY or DISTINCT
+REWRITE_LIMIT = int(os.getenv("QUERY_MAX_ROWS", 10_000))  # LIMIT injected into expensive row dumps
+
+SCAN_RE = re.compile(r"^(SCAN|SEARCH)\s+(\S+)")
+NAMED_SUBQUERY_RE = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE)\s+(\S+)")
+TABLE_REF_RE = re.compile(
+    r"\b(?:from|join)\s+(\"[^\"]+\"|\w+)(?:\s+(?:as\s+)?(\"[^\"]+\"|\w+))?", re.IGNORECASE
+)
+GROUP_BY_RE = re.compile(r"\bgroup\s+by\b", re.IGNORECASE)
+OUTER_LIMIT_RE = re.compile(r"\blimit\s+\d+(\s*(,|offset)\s*\d+)?\s*$", re.IGNORECASE)
+NOT_ALIASES = {
+    "where", "on", "join", "inner", "left", "right", "cross", "natural", "group", "order",
+    "limit", "having", "union", "except", "intersect", "using", "outer", "full", "window",
+}
+
+
+@dataclass
+class PlanDecision:
+    """Outcome of the pre-flight check"""
+    action: str  # 'allow', 'rewrite', 'regenerate' or 'reject'
+    sql: str
+    cost: float
+    plan: list = field(default_factory=list)
+    reasons: list = field(default_factory=list)
+
+    def feedback(self) -> str:
+        """Explain the problem to the model so it can write a cheaper query"""
+        plan = "\n".join(f"  {line}" for line in self.plan)
+        reasons = "\n".join(f"- {reason}" for reason in self.reasons)
+        return (
+            f"This query was rejected as too expensive (~{self.cost:,.0f} estimated row visits):\n"
+            f"{self.sql}\n\nQuery plan:\n{plan}\n\nProblems:\n{reasons}\n\n"
+            "Write a cheaper query that answers the same question: avoid self-joins, "
+            "cross joins and correlated subqueries; aggregate in a single pass instead."
+        )
+
+
+def explain_plan(conn: sqlite3.Connection, query: str):
+    """Return EXPLAIN QUERY PLAN rows as (id, parent, detail)"""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+
+
+def table_aliases(query: str) -> dict:
+    """Map aliases used in FROM/JOIN clauses to table names"""
+    aliases = {}
+    for table, alias in TABLE_REF_RE.findall(query):
+        table = table.strip('"')
+        aliases[table] = table
+        if alias and alias.lower() not in NOT_ALIASES:
+            aliases[alias.strip('"')] = table
+    return aliases
+
+
+def has_outer_limit(query: str) -> bool:
+    return bool(OUTER_LIMIT_RE.search(query.strip().rstrip(';')))
+
+
+def has_outer_group_by(query: str) -> bool:
+    """Whether the outermost SELECT groups (GROUP BY in subqueries doesn't count)"""
+    depth, outer = 0, []
+    for char in query:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(0, depth - 1)
+        elif depth == 0:
+            outer.append(char)
+    return bool(GROUP_BY_RE.search("".join(outer)))
+
+
+def estimate_cost(plan: list, table_rows, aliases: dict = None, grouped: bool = False):
+    """
+    Estimate row visits for a plan.
+
+    Consecutive SCAN/SEARCH steps under one parent are nested loops, so their
+    row counts multiply. Temp B-trees add n*log2(n); a sort after GROUP BY or
+    DISTINCT only sorts the groups. Correlated subqueries run once per outer
+    row. table_rows(name) returns the row count of a table. grouped says the
+    outermost query has a GROUP BY, which the plan doesn't show when an index
+    does the grouping.
+
+    Returns (cost, reasons) where reasons lists the expensive plan shapes found.
+    """
+    aliases = aliases or {}
+    children = {}
+    for node_id, parent, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+    derived_rows = {}
+    reasons = []
+
+    def rows_for(name):
+        if name in derived_rows:
+            return derived_rows[name]
+        return table_rows(aliases.get(name, name))
+
+    def walk(parent):
+        cost = 0.0
+        loop_rows = 1.0
+        full_scans = 0
+        grouping = grouped and parent == 0
+        for node_id, detail in children.get(parent, []):
+            if detail.startswith("SCAN CONSTANT ROW"):
+                continue  # SELECT without FROM, e.g. around scalar subqueries
+            scan = SCAN_RE.match(detail)
+            named = NAMED_SUBQUERY_RE.match(detail)
+            if scan:
+                kind, name = scan.groups()
+                base = float(rows_for(name))
+                if kind == "SCAN":
+                    rows = base
+                    full_scans += 1
+                    if full_scans > 1:
+                        reasons.append(f"nested full scan of {name} inside another full scan")
+                elif "AUTOMATIC" in detail:
+                    cost += base * math.log2(base + 1)  # Index built on the fly
+                    rows = max(1.0, base * SEARCH_FRACTION)
+                    reasons.append(f"automatic index built on {name} at query time")
+                elif "rowid=" in detail or "PRIMARY KEY" in detail:
+                    rows = 1.0
+                else:
+                    rows = max(1.0, base * SEARCH_FRACTION)
+                loop_rows *= rows
+                cost += loop_rows
+            elif detail.startswith("USE TEMP B-TREE"):
+                sorted_rows = loop_rows
+                if "ORDER BY" in detail and grouping:
+                    sorted_rows = max(1.0, loop_rows * GROUP_FRACTION)
+                cost += sorted_rows * math.log2(sorted_rows + 1)
+                if "GROUP BY" in detail or "DISTINCT" in detail:
+                    grouping = True
+            elif named:
+                sub_cost, sub_rows = walk(node_id)
+                cost += sub_cost
+                derived_rows[named.group(1)] = sub_rows
+            elif "CORRELATED" in detail:
+                sub_cost, _ = walk(node_id)
+                cost += sub_cost * loop_rows
+                if sub_cost > 1:
+                    reasons.append("correlated subquery re-runs for every outer row")
+            else:
+                sub_cost, _ = walk(node_id)
+                cost += sub_cost
+        return cost, loop_rows
+
+    cost, _ = walk(0)
+    return cost, reasons
+
+
+def preflight(conn: sqlite3.Connection, query: str, table_rows,
+              cost_limit: float = PLAN_COST_LIMIT, reject_cost: float = PLAN_REJECT_COST) -> PlanDecision:
+    """Decide how to handle a query based on its estimated cost"""
+    plan = explain_plan(conn, query)
+    details = [detail for _, _, detail in plan]
+    grouped = has_outer_group_by(query)
+    cost, reasons = estimate_cost(plan, table_rows, table_aliases(query), grouped)
+
+    if cost <= cost_limit:
+        return PlanDecision("allow", query, cost, details, reasons)
+
+    if reasons:
+        # Nested scans or correlated subqueries: a rewrite by the model can fix the shape
+        action = "reject" if cost > reject_cost else "regenerate"
+        return PlanDecision(action, query, cost, details, reasons)
+
+    if not grouped and not has_outer_limit(query) and any("ORDER BY" in d for d in details):
+        # A big sort for rows nobody will see: let SQLite keep only the top rows
+        limited = f"{query}\nLIMIT {REWRITE_LIMIT}"
+        reasons = [f"sorting ~{cost:,.0f} rows without a LIMIT; capped at {REWRITE_LIMIT:,} rows"]
+        return PlanDecision("rewrite", limited, cost, details, reasons)
+
+    # A single pass over a large table is expected for analytics; the query budget bounds it
+    return PlanDecision("allow", query, cost, details, reasons)
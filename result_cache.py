@@ -0,0 +1,119 @@
+"""
+Query Result Cache
+Keeps recent query results in memory, keyed on canonical SQL and database version
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+# Cache configuration
+RESULT_CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", 256 * 1024 * 1024))  # Memory budget
+RESULT_CACHE_MAX_ENTRY_FRACTION = 0.25  # Larger results are not cached
+
+# Quoted strings and identifiers are kept verbatim when canonicalizing
+QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\])")
+
+
+def canonicalize_sql(query: str) -> str:
+    """
+    Lowercase and collapse whitespace outside quoted text so equivalent spellings share an entry.
+    Spaces are only dropped around parentheses and commas: next to operators they
+    separate tokens (a - -1 is not a --1, which starts a comment).
+    """
+    parts = QUOTED.split(query.strip().rstrip(';').strip())
+    for i in range(0, len(parts), 2):
+        text = re.sub(r"\s+", " ", parts[i].lower())
+        text = re.sub(r" ?([(),]) ?", r"\1", text)
+        parts[i] = text
+    return "".join(parts).strip()
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    """Memory held by a DataFrame, including Python string objects"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Store repeated text as categoricals; numeric columns are already NumPy arrays"""
+    compact = df.copy()
+    for col in compact.columns:
+        series = compact[col]
+        if series.dtype == object and len(series) > 1 and series.nunique(dropna=False) <= len(series) // 2:
+            compact[col] = series.astype("category")
+    return compact
+
+
+def expand_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Return a caller-owned copy with categoricals turned back into plain columns"""
+    expanded = df.copy()
+    for col in expanded.columns:
+        if isinstance(expanded[col].dtype, pd.CategoricalDtype):
+            expanded[col] = expanded[col].astype(object)
+    return expanded
+
+
+class ResultCache:
+    """
+    LRU cache of query results bounded by bytes, not entries.
+    Keys include the database path and fingerprint, so results computed
+    before an ingest are never served after it.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'too_large': 0}
+
+    @staticmethod
+    def make_key(query: str, db_path: str, fingerprint):
+        return (os.path.realpath(db_path), fingerprint, canonicalize_sql(query))
+
+    def get(self, query: str, db_path: str, fingerprint):
+        """Return a copy of the cached result, or None"""
+        key = self.make_key(query, db_path, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            df = entry[0]
+        return expand_frame(df)
+
+    def put(self, query: str, db_path: str, fingerprint, df: pd.DataFrame):
+        """Cache a result if it fits in the budget"""
+        compact = compact_frame(df)
+        size = frame_bytes(compact)
+        key = self.make_key(query, db_path, fingerprint)
+
+        with self._lock:
+            if size > self.max_bytes * RESULT_CACHE_MAX_ENTRY_FRACTION:
+                self.stats['too_large'] += 1
+                return False
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (compact, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.stats['evictions'] += 1
+            return True
+
+    def invalidate(self, db_path: str):
+        """Drop every result computed against a database"""
+        path = os.path.realpath(db_path)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
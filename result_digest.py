@@ -0,0 +1,256 @@
+"""
+Result Digest
+Vectorized summary of a whole query result for the model: totals, shares,
+top/bottom rows, period-over-period growth and outliers, in text of a fixed
+size however many rows the result has
+"""
+
+import re
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_integer_dtype, is_numeric_dtype
+
+# Digest configuration
+TOP_K = 5  # Rows listed at each end of a ranking
+MAX_MEASURES = 4  # Numeric columns summarized
+MAX_DIMENSIONS = 3  # Text columns summarized
+MAX_OUTLIERS = 3  # Outliers listed per measure
+OUTLIER_Z = 3.5  # Robust z-score (median/MAD) beyond which a value is an outlier
+DATE_SAMPLE = 50  # Values checked when deciding whether a text column holds dates
+LABEL_CHARS = 40  # Longer labels are clipped
+
+TIME_NAME = re.compile(r"(^|_)(year|quarter|month|week|day|date|period)s?($|_)", re.IGNORECASE)
+ID_NAME = re.compile(r"(^|_)id$", re.IGNORECASE)
+
+
+def fmt(value) -> str:
+    """Format a number compactly: thousands separators, two decimals unless whole"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "NULL"
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e15:
+        return f"{value:,.0f}"
+    if abs(value) >= 1000:
+        return f"{value:,.0f}"
+    return f"{value:,.4g}" if abs(value) < 1 else f"{value:,.2f}"
+
+
+def pct(value) -> str:
+    return "n/a" if value is None or not np.isfinite(value) else f"{value:+.1%}"
+
+
+def label(value) -> str:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "NULL"
+    text = " ".join(str(value).split())
+    return text if len(text) <= LABEL_CHARS else text[:LABEL_CHARS - 1] + "…"
+
+
+def time_periods(series: pd.Series, name: str):
+    """
+    Periods of a date/period column (e.g. '2024-03', or an integer year) as
+    (codes, labels, keys): each row's period, each period's label and its
+    sort key. None if the column doesn't hold dates or periods.
+    """
+    if is_integer_dtype(series):
+        if not TIME_NAME.search(name):
+            return None
+    elif series.dtype == object:
+        sample = series.dropna().head(DATE_SAMPLE)
+        if sample.empty or not all(isinstance(v, str) and not v.strip().lstrip("-").isdigit() for v in sample):
+            return None
+        if pd.to_datetime(sample, errors="coerce", format="ISO8601").isna().any():
+            return None
+    elif not is_datetime64_any_dtype(series):
+        return None
+    # Parse each distinct value once; results hold far fewer periods than rows
+    codes, labels = pd.factorize(series)
+    if is_datetime64_any_dtype(series):
+        keys = np.asarray(labels)
+        stamps = pd.DatetimeIndex(labels)
+        labels = stamps.strftime("%Y-%m-%d" if (stamps == stamps.normalize()).all() else "%Y-%m-%d %H:%M")
+    elif series.dtype == object:
+        keys = np.asarray(pd.to_datetime(pd.Series(labels), errors="coerce", format="ISO8601"))
+    else:
+        keys = np.asarray(labels)
+    return codes, np.asarray(labels), keys
+
+
+def classify(df: pd.DataFrame):
+    """Split columns into (time column, its periods, measures, dimensions)"""
+    time_col, periods = None, None
+    measures, dimensions = [], []
+    for col in df.columns:
+        series = df[col]
+        if time_col is None:
+            periods = time_periods(series, str(col))
+            if periods is not None:
+                time_col = col
+                continue
+        if is_numeric_dtype(series) and not is_bool_dtype(series):
+            if not (is_integer_dtype(series) and ID_NAME.search(str(col))):
+                measures.append(col)
+        else:
+            dimensions.append(col)
+    return time_col, periods, measures[:MAX_MEASURES], dimensions[:MAX_DIMENSIONS]
+
+
+def group_sum(codes: np.ndarray, groups: int, values: np.ndarray) -> np.ndarray:
+    """Sum values per group code in one pass (NULLs count as 0; rows without a code are skipped)"""
+    keep = codes >= 0
+    return np.bincount(codes[keep], weights=np.nan_to_num(values[keep]), minlength=groups)
+
+
+def share(value: float, total: float) -> str:
+    fraction = value / total
+    return "<0.1%" if 0 < fraction < 0.001 else f"{fraction:.1%}"
+
+
+def ranking(values: np.ndarray, labels: np.ndarray, total: float, largest: bool) -> str:
+    """The TOP_K largest (or smallest) values with their labels and share of the total"""
+    valid = np.flatnonzero(~np.isnan(values))
+    k = min(TOP_K, len(valid))
+    keys = -values[valid] if largest else values[valid]
+    # argpartition keeps this O(n) however many rows there are
+    chosen = valid[np.argpartition(keys, k - 1)[:k]] if k < len(valid) else valid
+    chosen = chosen[np.argsort(-values[chosen] if largest else values[chosen], kind="stable")]
+    shares = total > 0 and np.nanmin(values) >= 0
+    parts = []
+    for i in chosen:
+        text = f"{label(labels[i])} {fmt(values[i])}"
+        if shares:
+            text += f" ({share(values[i], total)})"
+        parts.append(text)
+    summary = ", ".join(parts)
+    if shares and largest:
+        summary += f"; together {share(values[chosen].sum(), total)} of the total"
+    return summary
+
+
+def outliers(values: np.ndarray, labels) -> str:
+    """Values far from the median by robust z-score, or '' when there are none"""
+    valid = ~np.isnan(values)
+    if valid.sum() < 10:
+        return ""
+    median = np.median(values[valid])
+    mad = np.median(np.abs(values[valid] - median))
+    if mad == 0:
+        return ""
+    z = 0.6745 * (values - median) / mad
+    flagged = np.flatnonzero(np.abs(np.nan_to_num(z)) > OUTLIER_Z)
+    if len(flagged) == 0:
+        return ""
+    worst = flagged[np.argsort(-np.abs(z[flagged]))[:MAX_OUTLIERS]]
+    names = ", ".join(
+        f"{label(labels[i])} {fmt(values[i])}" if labels is not None else fmt(values[i]) for i in worst
+    )
+    return f"{len(flagged):,} outlier(s) vs median {fmt(median)}: {names}"
+
+
+def growth(measure: str, time_col: str, values: np.ndarray, names: list) -> list:
+    """Period-over-period lines for a measure's per-period totals (in period order)"""
+    if len(values) < 2:
+        return []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        changes = np.where(values[:-1] != 0, values[1:] / values[:-1] - 1, np.nan)
+    lines = [
+        f"{measure} by {time_col} ({len(values)} periods, {names[0]} to {names[-1]}): "
+        f"{fmt(values[0])} → {fmt(values[-1])} "
+        f"({pct(values[-1] / values[0] - 1 if values[0] else np.nan)} overall, "
+        f"{pct(np.nanmean(changes) if np.isfinite(changes).any() else np.nan)} average per period)"
+    ]
+    peak, trough = int(np.argmax(values)), int(np.argmin(values))
+    detail = f"peak {names[peak]} {fmt(values[peak])}, low {names[trough]} {fmt(values[trough])}"
+    if np.isfinite(changes).sum() >= 2:
+        rise, fall = int(np.nanargmax(changes)), int(np.nanargmin(changes))
+        up = "biggest rise" if changes[rise] > 0 else "smallest drop"
+        down = "biggest drop" if changes[fall] < 0 else "smallest rise"
+        detail += (f"; {up} {names[rise + 1]} {pct(changes[rise])}, "
+                   f"{down} {names[fall + 1]} {pct(changes[fall])}")
+    return lines + [f"  {detail}"]
+
+
+def digest_results(results_df: pd.DataFrame) -> str:
+    """
+    Summarize a result set in a fixed number of lines.
+
+    Numeric columns get totals and averages, a top/bottom ranking by the
+    first text column (summed per label when labels repeat) with shares of
+    the total, and robust outliers. When a column holds dates or periods
+    each measure also gets its trend. Text columns get their most common
+    values. Everything is computed over all rows with pandas/NumPy.
+    """
+    df = results_df
+    rows = len(df)
+    total_rows = df.attrs.get('total_rows')
+    header = f"{rows:,} rows"
+    if df.attrs.get('truncated'):
+        header += f" (first {rows:,} of {f'{total_rows:,}' if total_rows else 'more'}; statistics cover these rows)"
+    lines = [header]
+
+    time_col, periods, measures, dimensions = classify(df)
+    if time_col is not None:
+        codes, labels, keys = periods
+        order = np.argsort(keys, kind="stable")
+        order = order[~pd.isna(keys[order])]
+        period_codes = np.full(len(labels), -1)
+        period_codes[order] = np.arange(len(order))
+        period_codes = np.where(codes >= 0, period_codes[np.maximum(codes, 0)], -1)
+        period_names = [label(value) for value in labels[order]]
+        if period_names:
+            lines.append(f"Time column {time_col}: {period_names[0]} to {period_names[-1]}")
+
+    label_col = dimensions[0] if dimensions else time_col
+    if label_col == time_col and time_col is not None:
+        label_codes, label_values = codes, labels
+    elif label_col is not None:
+        label_codes, label_values = pd.factorize(df[label_col], use_na_sentinel=False)
+        label_values = np.asarray(label_values)
+    if label_col is not None:
+        repeated = len(label_values) < rows
+        row_labels = np.where(label_codes >= 0, label_values.astype(object)[np.maximum(label_codes, 0)], None)
+
+    for measure in measures:
+        values = df[measure].to_numpy(dtype=float, na_value=np.nan)
+        valid = values[~np.isnan(values)]
+        if len(valid) == 0:
+            lines.append(f"{measure}: all NULL")
+            continue
+        total = valid.sum()
+        nulls = rows - len(valid)
+        lines.append(
+            f"{measure}: total {fmt(total)}, mean {fmt(valid.mean())}, median {fmt(np.median(valid))}, "
+            f"min {fmt(valid.min())}, max {fmt(valid.max())}" + (f", {nulls:,} NULL" if nulls else "")
+        )
+        if label_col is not None:
+            if repeated:
+                ranked_values = group_sum(label_codes, len(label_values), values)
+                ranked_labels = label_values
+                by = f"{label_col} (summed, {len(label_values):,} distinct)"
+            else:
+                ranked_values, ranked_labels, by = values, row_labels, label_col
+            lines.append(f"  top by {by}: {ranking(ranked_values, ranked_labels, total, largest=True)}")
+            if len(ranked_values) > 2 * TOP_K:
+                lines.append(f"  bottom: {ranking(ranked_values, ranked_labels, total, largest=False)}")
+            unusual = outliers(ranked_values, ranked_labels)
+        else:
+            unusual = outliers(values, None)
+        if unusual:
+            lines.append(f"  {unusual}")
+        if time_col is not None:
+            per_period = group_sum(period_codes, len(period_names), values)
+            lines.extend(f"  {line}" for line in growth(measure, time_col, per_period, period_names))
+
+    for dimension in dimensions:
+        if dimension == label_col:
+            counts = pd.Series(np.bincount(label_codes, minlength=len(label_values)), index=label_values)
+            counts = counts.sort_values(ascending=False, kind="stable")
+        else:
+            counts = df[dimension].value_counts(dropna=False)
+        if counts.iloc[0] == 1:
+            lines.append(f"{dimension}: {len(counts):,} distinct (one row each)")
+            continue
+        common = ", ".join(f"{label(value)} ({count:,})" for value, count in counts.head(TOP_K).items())
+        lines.append(f"{dimension}: {len(counts):,} distinct; most common {common}")
+
+    return "\n".join(lines)
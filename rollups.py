@@ -0,0 +1,510 @@
+"""
+Rollup Tables
+Precomputes small aggregate tables at ingest (e.g. month x product) and
+rewrites aggregate queries that one of them can answer to read it instead
+of scanning the orders table
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from dataclasses import dataclass
+from ingest import quote_identifier
+
+# Rollup configuration
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() in ("1", "true", "yes")
+ROLLUP_MAX_TABLES = int(os.getenv("ROLLUP_MAX_TABLES", 6))  # Rollups built per ingest
+ROLLUP_MAX_DISTINCT = int(os.getenv("ROLLUP_MAX_DISTINCT", 1000))  # Text columns with more values aren't dimensions
+ROLLUP_MAX_ROWS_RATIO = 0.1  # A rollup larger than this share of the table is dropped again
+
+CATALOG = "rollup_catalog"
+ROLLUP_PREFIX = "rollup_"
+
+TEXT_TYPES = {"TEXT", "VARCHAR"}
+NUMERIC_TYPES = {"INTEGER", "REAL", "BIGINT", "DOUBLE", "FLOAT"}
+QUANTITY_RE = re.compile(r"qty|quantity|units", re.IGNORECASE)
+PRICE_RE = re.compile(r"price|cost|amount", re.IGNORECASE)
+
+TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\d+(?:\.\d*)?|\w+|\|\||<=|>=|<>|!=|\S")
+AGGREGATES = {"sum", "total", "count", "avg", "min", "max"}
+KEYWORDS = {"end", "null", "true", "false", "and", "or", "not", "is", "nocase"}
+CLAUSES = ["select", "from", "where", "group", "having", "order", "limit"]
+# Query shapes a rollup can't answer faithfully
+UNSUPPORTED = {"join", "union", "except", "intersect", "distinct", "over", "with", "window", "offset"}
+
+
+class NoMatch(Exception):
+    """The query can't be answered from a given rollup"""
+
+
+@dataclass
+class Rollup:
+    """An aggregate table over a source table, grouped by its dimensions"""
+    table: str
+    dimensions: list  # [(kind, column)] with kind 'plain' or 'month'
+    measures: list  # Column tuples: ('price',) or ('quantity', 'price') for a product
+    rows: int = 0
+
+    @property
+    def name(self):
+        key = json.dumps([self.table, self.dimensions, self.measures])
+        label = re.sub(r"\W+", "_", "_".join(column for _, column in self.dimensions))[:40]
+        digest = hashlib.sha1(key.encode()).hexdigest()[:6]
+        return f"{ROLLUP_PREFIX}{self.table}_{label}_{digest}"
+
+    @staticmethod
+    def dimension_column(kind, column):
+        return f"{column}__month" if kind == "month" else column
+
+    def dimension_map(self) -> dict:
+        """Canonical source expression -> SQL over the rollup"""
+        mapping = {}
+        for kind, column in self.dimensions:
+            target = quote_identifier(self.dimension_column(kind, column))
+            if kind == "month":
+                source = quote_identifier(column)
+                mapping[canonical(tokenize(f"strftime('%Y-%m', {source})"))] = target
+                mapping[canonical(tokenize(f"strftime('%Y', {source})"))] = f"substr({target}, 1, 4)"
+            else:
+                mapping[column.lower()] = target
+        return mapping
+
+    def measure_map(self) -> dict:
+        """Canonical measure expression -> prefix of its rollup columns"""
+        return {measure_key(measure): f"__m{i}" for i, measure in enumerate(self.measures)}
+
+    def create_sql(self) -> str:
+        return f"CREATE TABLE {quote_identifier(self.name)} AS {self.select_sql()}"
+
+    def select_sql(self, source: str = None) -> str:
+        """The rollup's aggregate query over source (default: its table), e.g. over appended rows"""
+        select = []
+        for kind, column in self.dimensions:
+            expr = quote_identifier(column)
+            if kind == "month":
+                expr = f"strftime('%Y-%m', {expr})"
+            select.append(f"{expr} AS {quote_identifier(self.dimension_column(kind, column))}")
+        select.append("COUNT(*) AS __n")
+        for i, measure in enumerate(self.measures):
+            expr = " * ".join(quote_identifier(column) for column in measure)
+            for agg in ("sum", "count", "min", "max"):
+                select.append(f"{agg.upper()}({expr}) AS __m{i}_{agg}")
+        groups = ", ".join(str(i + 1) for i in range(len(self.dimensions)))
+        group_by = f" GROUP BY {groups}" if groups else ""
+        return f"SELECT {', '.join(select)} FROM {quote_identifier(source or self.table)}{group_by}"
+
+    def merge_sql(self, delta: str) -> list:
+        """
+        Statements folding the rollup of a delta table (e.g. from select_sql) into this rollup:
+        matching groups add counts and sums and widen min/max, new groups are inserted
+        """
+        name = quote_identifier(self.name)
+        match = " AND ".join(
+            f"{name}.{quote_identifier(self.dimension_column(kind, column))} IS "
+            f"d.{quote_identifier(self.dimension_column(kind, column))}"
+            for kind, column in self.dimensions
+        ) or "1"
+        updates = [f"__n = {name}.__n + d.__n"]
+        for i in range(len(self.measures)):
+            m = f"{name}.__m{i}"
+            updates += [
+                f"__m{i}_sum = COALESCE({m}_sum + d.__m{i}_sum, {m}_sum, d.__m{i}_sum)",
+                f"__m{i}_count = {m}_count + d.__m{i}_count",
+                f"__m{i}_min = COALESCE(MIN({m}_min, d.__m{i}_min), {m}_min, d.__m{i}_min)",
+                f"__m{i}_max = COALESCE(MAX({m}_max, d.__m{i}_max), {m}_max, d.__m{i}_max)",
+            ]
+        return [
+            f"UPDATE {name} SET {', '.join(updates)} FROM {quote_identifier(delta)} AS d WHERE {match}",
+            f"INSERT INTO {name} SELECT * FROM {quote_identifier(delta)} AS d "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {name} WHERE {match})",
+        ]
+
+
+def tokenize(sql: str) -> list:
+    return TOKEN_RE.findall(sql)
+
+
+def is_identifier(token: str) -> bool:
+    return token.startswith('"') or bool(re.match(r"[A-Za-z_]\w*$", token))
+
+
+def identifier_name(token: str) -> str:
+    if token.startswith('"'):
+        return token[1:-1].replace('""', '"')
+    return token
+
+
+def canonical(tokens: list) -> str:
+    """Case- and quoting-insensitive form of an expression, for matching"""
+    out = []
+    for token in tokens:
+        out.append(token if token.startswith("'") else identifier_name(token).lower())
+    return " ".join(out)
+
+
+def measure_key(columns) -> str:
+    # Multiplication commutes, so price * quantity and quantity * price match
+    return " * ".join(sorted(column.lower() for column in columns))
+
+
+def match_paren(tokens: list, open_index: int) -> int:
+    """Index of the ')' closing the '(' at open_index"""
+    depth = 0
+    for i in range(open_index, len(tokens)):
+        if tokens[i] == "(":
+            depth += 1
+        elif tokens[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise NoMatch("unbalanced parentheses")
+
+
+def split_top_level(indexes: list, tokens: list) -> list:
+    """Split token indexes on commas outside parentheses"""
+    parts, current, depth = [], [], 0
+    for i in indexes:
+        if tokens[i] == "(":
+            depth += 1
+        elif tokens[i] == ")":
+            depth -= 1
+        if tokens[i] == "," and depth == 0:
+            parts.append(current)
+            current = []
+        else:
+            current.append(i)
+    parts.append(current)
+    return parts
+
+
+def strip_qualifiers(tokens: list, qualifiers: set) -> list:
+    """Drop table qualifiers (orders.revenue -> revenue)"""
+    out, i = [], 0
+    while i < len(tokens):
+        if identifier_name(tokens[i]).lower() in qualifiers and i + 1 < len(tokens) and tokens[i + 1] == ".":
+            i += 2
+            continue
+        out.append(tokens[i])
+        i += 1
+    return out
+
+
+def plan_rollups(profile, max_tables: int = ROLLUP_MAX_TABLES) -> list:
+    """Choose rollups from the profile: month of the first date column crossed with each low-cardinality text column"""
+    dates = [col.name for col in profile.columns if col.is_date]
+    texts = sorted(
+        (col for col in profile.columns
+         if not col.is_date and col.type.upper() in TEXT_TYPES and 1 < col.distinct <= ROLLUP_MAX_DISTINCT),
+        key=lambda col: col.distinct
+    )
+    numerics = [col.name for col in profile.columns if col.type.upper() in NUMERIC_TYPES and not col.is_date]
+
+    measures = [(name,) for name in numerics]
+    measures += [(q, p) for q in numerics if QUANTITY_RE.search(q)
+                 for p in numerics if p != q and PRICE_RE.search(p)]
+
+    month = [("month", dates[0])] if dates else []
+    dimension_sets = [month] if month else []
+    dimension_sets += [month + [("plain", col.name)] for col in texts]
+
+    return [Rollup(profile.table, dims, measures) for dims in dimension_sets[:max_tables]]
+
+
+def load_rollups(conn, table: str = "orders") -> list:
+    """Rollups recorded in the catalog for a table, smallest first"""
+    try:
+        rows = conn.execute(
+            f"SELECT dimensions, measures, rows FROM {CATALOG} WHERE source = ? ORDER BY rows", (table,)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return []  # No catalog: rollups were never built
+    return [
+        Rollup(table, [tuple(d) for d in json.loads(dims)], [tuple(m) for m in json.loads(measures)], count)
+        for dims, measures, count in rows
+    ]
+
+
+def _drop_catalogued(conn, table: str):
+    for rollup in load_rollups(conn, table):
+        conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(rollup.name)}")
+    try:
+        conn.execute(f"DELETE FROM {CATALOG} WHERE source = ?", (table,))
+    except sqlite3.OperationalError:
+        pass
+
+
+def drop_rollups(db_path: str, table: str = "orders"):
+    """Remove a table's rollups, e.g. before its data is replaced"""
+    if not os.path.exists(db_path):
+        return
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        _drop_catalogued(conn, table)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def build_rollups(db_path: str, profile, max_tables: int = ROLLUP_MAX_TABLES) -> list:
+    """Replace the table's rollups with the ones planned from its profile, in one transaction"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    built = []
+    try:
+        conn.execute("BEGIN")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {CATALOG} "
+            "(name TEXT PRIMARY KEY, source TEXT, dimensions TEXT, measures TEXT, rows INTEGER)"
+        )
+        _drop_catalogued(conn, profile.table)
+
+        for rollup in plan_rollups(profile, max_tables):
+            conn.execute(rollup.create_sql())
+            rollup.rows = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(rollup.name)}").fetchone()[0]
+            if rollup.rows > max(profile.row_count * ROLLUP_MAX_ROWS_RATIO, 1):
+                # Not much smaller than the table itself: scanning it saves little
+                conn.execute(f"DROP TABLE {quote_identifier(rollup.name)}")
+                continue
+            conn.execute(
+                f"INSERT INTO {CATALOG} VALUES (?, ?, ?, ?, ?)",
+                (rollup.name, rollup.table, json.dumps(rollup.dimensions), json.dumps(rollup.measures), rollup.rows)
+            )
+            built.append(rollup)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return built
+
+
+def update_rollups(conn, table: str, delta: str) -> list:
+    """
+    Fold rows appended to table, also held in the delta table, into its rollups
+    (call inside the append transaction); costs the delta, not the table
+    """
+    updated = []
+    for rollup in load_rollups(conn, table):
+        staged = f"{rollup.name}__delta"
+        conn.execute(f"DROP TABLE IF EXISTS temp.{quote_identifier(staged)}")
+        conn.execute(f"CREATE TEMP TABLE {quote_identifier(staged)} AS {rollup.select_sql(delta)}")
+        for statement in rollup.merge_sql(staged):
+            conn.execute(statement)
+        conn.execute(f"DROP TABLE temp.{quote_identifier(staged)}")
+        rollup.rows = conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(rollup.name)}").fetchone()[0]
+        conn.execute(f"UPDATE {CATALOG} SET rows = ? WHERE name = ?", (rollup.rows, rollup.name))
+        updated.append(rollup)
+    return updated
+
+
+class _Rewriter:
+    """Maps expressions over the source table onto one rollup"""
+
+    def __init__(self, rollup: Rollup, column_names: list, qualifiers: set):
+        self.rollup = rollup
+        self.columns = {name.lower() for name in column_names}
+        self.qualifiers = qualifiers
+        self.dimensions = rollup.dimension_map()
+        self.measures = rollup.measure_map()
+        self.has_aggregate = False
+        self.bare_dimension = False  # A dimension referenced outside an aggregate
+
+    def strip_qualifiers(self, tokens):
+        return strip_qualifiers(tokens, self.qualifiers)
+
+    def aggregate(self, func, arg):
+        self.has_aggregate = True
+        key = canonical(arg)
+        if func == "count" and key == "*":
+            return "COALESCE(SUM(__n), 0)"
+
+        arg_columns = [identifier_name(t).lower() for t in arg if is_identifier(t)]
+        if len(arg) == 3 and arg[1] == "*" and all(is_identifier(t) for t in (arg[0], arg[2])):
+            key = measure_key(arg_columns)
+        prefix = self.measures.get(key)
+
+        if prefix is None:
+            dim = self.dimensions.get(key)
+            if dim is not None and func in ("min", "max"):
+                return f"{func.upper()}({dim})"
+            if dim is not None and func == "count":
+                return f"COALESCE(SUM(CASE WHEN {dim} IS NOT NULL THEN __n END), 0)"
+            raise NoMatch(f"no rollup measure for {key}")
+
+        return {
+            "sum": f"SUM({prefix}_sum)",
+            "total": f"TOTAL({prefix}_sum)",
+            "count": f"COALESCE(SUM({prefix}_count), 0)",
+            "avg": f"(TOTAL({prefix}_sum) / SUM({prefix}_count))",
+            "min": f"MIN({prefix}_min)",
+            "max": f"MAX({prefix}_max)",
+        }[func]
+
+    def expression(self, tokens) -> str:
+        tokens = self.strip_qualifiers(tokens)
+        out, i = [], 0
+        while i < len(tokens):
+            token = tokens[i]
+            lower = token.lower()
+            call = i + 1 < len(tokens) and tokens[i + 1] == "("
+
+            if call and lower in AGGREGATES:
+                end = match_paren(tokens, i + 1)
+                out.append(self.aggregate(lower, tokens[i + 2:end]))
+                i = end + 1
+                continue
+
+            if call:
+                end = match_paren(tokens, i + 1)
+                dim = self.dimensions.get(canonical(tokens[i:end + 1]))
+                if dim is not None:
+                    self.bare_dimension = True
+                    out.append(dim)
+                    i = end + 1
+                    continue
+
+            if lower == "as" and i + 1 < len(tokens):
+                out += [token, tokens[i + 1]]  # An alias, even if it reuses a column name
+                i += 2
+                continue
+
+            if is_identifier(token) and not call and identifier_name(token).lower() in self.columns:
+                dim = self.dimensions.get(identifier_name(token).lower())
+                if dim is None:
+                    raise NoMatch(f"column {token} is not a rollup dimension")
+                self.bare_dimension = True
+                out.append(dim)
+            else:
+                out.append(token)
+            i += 1
+        return " ".join(out)
+
+
+def parse_select(query: str, table: str):
+    """Split a single-table SELECT into its clauses, or None if the shape isn't supported"""
+    query = query.strip().rstrip(";")
+    matches = list(TOKEN_RE.finditer(query))
+    tokens = [m.group() for m in matches]
+    lowered = [t.lower() for t in tokens]
+    if not tokens or lowered[0] != "select" or lowered.count("select") != 1:
+        return None
+    if any(t in UNSUPPORTED for t in lowered):
+        return None
+
+    clauses = {}
+    current, depth, i = None, 0, 0
+    order = []
+    while i < len(tokens):
+        token = lowered[i]
+        if tokens[i] == "(":
+            depth += 1
+        elif tokens[i] == ")":
+            depth -= 1
+        if depth == 0 and token in CLAUSES:
+            if token in ("group", "order"):
+                if i + 1 >= len(tokens) or lowered[i + 1] != "by":
+                    return None
+                i += 1
+            if token in clauses:
+                return None
+            current = token
+            clauses[current] = []
+            order.append(current)
+            i += 1
+            continue
+        clauses[current].append(i)
+        i += 1
+
+    # Select items keep their original text: it names unaliased result columns
+    select = []
+    for item in split_top_level(clauses.get("select", []), tokens):
+        text = query[matches[item[0]].start():matches[item[-1]].end()] if item else ""
+        select.append(([tokens[j] for j in item], text))
+    clauses = {name: [tokens[j] for j in indexes] for name, indexes in clauses.items()}
+    clauses["select"] = select
+
+    if order != sorted(order, key=CLAUSES.index) or "from" not in clauses:
+        return None
+
+    source = clauses["from"]
+    if not source or identifier_name(source[0]).lower() != table.lower() or "," in source:
+        return None
+    qualifiers = {identifier_name(source[0]).lower()}
+    if len(source) == 2 and is_identifier(source[1]):
+        qualifiers.add(identifier_name(source[1]).lower())
+    elif len(source) == 3 and source[1].lower() == "as" and is_identifier(source[2]):
+        qualifiers.add(identifier_name(source[2]).lower())
+    elif len(source) != 1:
+        return None
+
+    return clauses, qualifiers
+
+
+def split_alias(item: list):
+    """A select item's expression tokens and its alias token (None when it has none)"""
+    if len(item) >= 3 and item[-2].lower() == "as" and is_identifier(item[-1]):
+        return item[:-2], item[-1]
+    if (len(item) >= 2 and is_identifier(item[-1]) and item[-1].lower() not in KEYWORDS
+            and (item[-2] == ")" or is_identifier(item[-2]) or item[-2][0] in "'0123456789")):
+        return item[:-1], item[-1]  # Alias without AS
+    return item, None
+
+
+def result_name(item: list, alias, text: str, qualifiers: set) -> str:
+    """The result column name the original query gives a select item, as an SQL alias"""
+    if alias is not None:
+        return alias
+    # SQLite names an unaliased column reference by the column, anything else by its text
+    stripped = strip_qualifiers(item, qualifiers)
+    if len(stripped) == 1 and is_identifier(stripped[0]):
+        return quote_identifier(identifier_name(stripped[0]))
+    return quote_identifier(text)
+
+
+def _select_item(rewriter: _Rewriter, item: list, text: str) -> str:
+    """Rewrite one select item, keeping the result column name the original query would have"""
+    if not item or item[-1] == "*":
+        raise NoMatch("row-level select")
+
+    item, alias = split_alias(item)
+    expr = rewriter.expression(item)
+    return f"{expr} AS {result_name(item, alias, text, rewriter.qualifiers)}"
+
+
+def rewrite_query(query: str, rollups: list, column_names: list, table: str = "orders"):
+    """
+    Rewrite an aggregate query over table to read the smallest rollup that can answer it.
+
+    Only single-table SELECTs whose filters and groupings use rollup dimensions,
+    and whose aggregates are SUM/COUNT/AVG/MIN/MAX over rollup measures, qualify.
+    Returns (sql, rollup) or None when no rollup applies.
+    """
+    parsed = parse_select(query, table)
+    if parsed is None:
+        return None
+    clauses, qualifiers = parsed
+
+    for rollup in sorted(rollups, key=lambda r: r.rows):
+        rewriter = _Rewriter(rollup, column_names, qualifiers)
+        try:
+            items = [_select_item(rewriter, item, text) for item, text in clauses["select"]]
+            select_bare, rewriter.bare_dimension = rewriter.bare_dimension, False
+            if not rewriter.has_aggregate and "group" not in clauses:
+                raise NoMatch("not an aggregate query")
+            if "group" not in clauses and select_bare:
+                raise NoMatch("bare column in an ungrouped aggregate")
+
+            parts = [f"SELECT {', '.join(items)}", f"FROM {quote_identifier(rollup.name)}"]
+            for clause, keyword in (("where", "WHERE"), ("group", "GROUP BY"),
+                                    ("having", "HAVING"), ("order", "ORDER BY")):
+                if clause in clauses:
+                    parts.append(f"{keyword} {rewriter.expression(clauses[clause])}")
+            if "limit" in clauses:
+                parts.append(f"LIMIT {' '.join(clauses['limit'])}")
+        except NoMatch:
+            continue
+        return "\n".join(parts), rollup
+    return None
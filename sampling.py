@@ -0,0 +1,283 @@
+"""
+Approximate Answers
+Keeps a stratified random sample of large tables, built at ingest, and
+rewrites aggregate queries to run on it: sums and counts are scaled up by
+each row's weight and come with a 95% confidence margin, so an estimate can
+be shown in milliseconds while the exact query runs
+"""
+
+import math
+import os
+import sqlite3
+from dataclasses import dataclass
+import pandas as pd
+from ingest import SAMPLE_SUFFIX, STRATA_SUFFIX, quote_identifier
+from rollups import (AGGREGATES, TEXT_TYPES, NoMatch, identifier_name, match_paren, parse_select, result_name,
+                     split_alias)
+
+# Sampling configuration
+APPROXIMATE_ANSWERS = os.getenv("APPROXIMATE_ANSWERS", "true").lower() in ("1", "true", "yes")
+SAMPLE_ROWS = int(os.getenv("SAMPLE_ROWS", 100_000))  # Rows kept in a table's sample
+SAMPLE_MIN_ROWS = int(os.getenv("SAMPLE_MIN_ROWS", 1_000_000))  # Smaller tables are fast enough to answer exactly
+SAMPLE_MAX_STRATA = 100  # Text columns with more values aren't used to stratify
+SAMPLE_MIN_STRATUM = 200  # Rows sampled from each stratum at least, so small groups still show up
+CONFIDENCE_Z = 1.96  # Margins are 95% confidence intervals
+RATE_RESOLUTION = 1_000_000  # Sampling rates are drawn as random() % RATE_RESOLUTION
+
+WEIGHT = "__w"  # Sample column: how many table rows each sampled row stands for
+# Aggregates whose value over a sample says nothing about the table's
+UNSCALABLE = {"group_concat", "string_agg", "json_group_array", "json_group_object"}
+
+
+@dataclass
+class Sample:
+    """A table's sample: rows drawn at a rate per stratum (value of one column), each weighted rows / sampled"""
+    table: str
+    stratum: str  # Column the table was stratified by, or None
+    rows: int  # Table rows when the sample was last drawn or extended
+    sampled: int
+
+    @property
+    def name(self):
+        return f"{self.table}{SAMPLE_SUFFIX}"
+
+
+@dataclass
+class Approximation:
+    """An aggregate query rewritten to run on a sample, and the columns its margins come from"""
+    query: str  # The query estimated
+    sql: str
+    sample: Sample
+    margins: dict  # Result column -> variance column
+
+    def frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """The estimate as the exact query's columns, each scaled aggregate followed by its ± margin"""
+        out = df.drop(columns=list(self.margins.values()))
+        for column, variance in self.margins.items():
+            if column not in out.columns:
+                continue
+            margin = CONFIDENCE_Z * df[variance].clip(lower=0).astype(float).map(math.sqrt)
+            out.insert(out.columns.get_loc(column) + 1, f"{column} ±", margin)
+        return out
+
+
+def choose_stratum(profile):
+    """The text column with the most values up to SAMPLE_MAX_STRATA: the groups users most likely compare"""
+    candidates = [col for col in profile.columns
+                  if not col.is_date and col.type.upper() in TEXT_TYPES and 1 < col.distinct <= SAMPLE_MAX_STRATA]
+    return max(candidates, key=lambda col: col.distinct).name if candidates else None
+
+
+def load_sample(conn, table: str = "orders"):
+    """The table's Sample, or None when it has none"""
+    try:
+        rows = conn.execute(
+            f"SELECT stratum_column, SUM(rows), SUM(sampled) FROM {quote_identifier(table + STRATA_SUFFIX)}"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if rows is None or rows[1] is None:
+        return None
+    return Sample(table, rows[0], rows[1], rows[2])
+
+
+def drop_sample(conn, table: str):
+    for suffix in (SAMPLE_SUFFIX, STRATA_SUFFIX):
+        conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table + suffix)}")
+
+
+def _key(alias: str, stratum) -> str:
+    return f"{alias}.{quote_identifier(stratum)}" if stratum else "NULL"
+
+
+def _draw(conn, sample: Sample, source: str):
+    """Insert rows of source into the sample, each with its stratum's rate, and refresh the weights"""
+    strata = quote_identifier(sample.table + STRATA_SUFFIX)
+    conn.execute(
+        f"INSERT INTO {quote_identifier(sample.name)} SELECT t.*, 1.0 FROM {source} AS t "
+        f"JOIN {strata} AS s ON s.stratum IS {_key('t', sample.stratum)} "
+        f"WHERE abs(random() % {RATE_RESOLUTION}) < s.rate * {RATE_RESOLUTION}"
+    )
+    # Post-stratified weights: each sampled row stands for rows / sampled of its stratum
+    conn.execute("DROP TABLE IF EXISTS temp.sample_counts")
+    conn.execute(f"CREATE TEMP TABLE sample_counts AS SELECT {_key('t', sample.stratum)} AS stratum, "
+                 f"COUNT(*) AS n FROM {quote_identifier(sample.name)} AS t GROUP BY 1")
+    conn.execute(f"UPDATE {strata} SET sampled = "
+                 f"COALESCE((SELECT n FROM sample_counts WHERE sample_counts.stratum IS {strata}.stratum), 0)")
+    conn.execute("DROP TABLE temp.sample_counts")
+    conn.execute(f"UPDATE {quote_identifier(sample.name)} AS t SET {WEIGHT} = (SELECT CAST(rows AS REAL) / sampled "
+                 f"FROM {strata} AS s WHERE s.stratum IS {_key('t', sample.stratum)})")
+    sample.rows, sample.sampled = conn.execute(f"SELECT SUM(rows), SUM(sampled) FROM {strata}").fetchone()
+
+
+def build_sample(db_path: str, profile) -> Sample:
+    """
+    Replace the table's sample, in one transaction. Tables under SAMPLE_MIN_ROWS get none.
+
+    Rows are drawn independently, at SAMPLE_ROWS / table rows, except that
+    each value of the stratum column gets at least SAMPLE_MIN_STRATUM rows.
+    Two scans of the table (counts per stratum, then the draw), no sort.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        drop_sample(conn, profile.table)
+        if profile.row_count < SAMPLE_MIN_ROWS:
+            conn.execute("COMMIT")
+            return None
+
+        sample = Sample(profile.table, choose_stratum(profile), 0, 0)
+        strata = quote_identifier(profile.table + STRATA_SUFFIX)
+        conn.execute(f"CREATE TABLE {strata} (stratum_column TEXT, stratum, rows INTEGER, rate REAL, sampled INTEGER)")
+        conn.execute(f"CREATE UNIQUE INDEX {quote_identifier(profile.table + STRATA_SUFFIX + '_key')} "
+                     f"ON {strata} (stratum)")
+        counts = conn.execute(f"SELECT {_key('t', sample.stratum)}, COUNT(*) FROM {quote_identifier(profile.table)} "
+                              f"AS t GROUP BY 1").fetchall()
+        total = sum(count for _, count in counts)
+        for value, count in counts:
+            rate = min(1.0, max(SAMPLE_ROWS / total, SAMPLE_MIN_STRATUM / count))
+            conn.execute(f"INSERT INTO {strata} VALUES (?, ?, ?, ?, 0)", (sample.stratum, value, count, rate))
+
+        conn.execute(f"CREATE TABLE {quote_identifier(sample.name)} AS "
+                     f"SELECT *, 1.0 AS {WEIGHT} FROM {quote_identifier(profile.table)} LIMIT 0")
+        _draw(conn, sample, quote_identifier(profile.table))
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return sample
+
+
+def update_sample(conn, table: str, delta: str):
+    """
+    Draw the sample's share of rows appended to table, also held in the delta
+    table (call inside the append transaction); costs the delta and the sample
+    """
+    sample = load_sample(conn, table)
+    if sample is None:
+        return None
+    strata = quote_identifier(table + STRATA_SUFFIX)
+    key = _key("d", sample.stratum)
+    # New strata are drawn at the table-wide rate
+    conn.execute(f"INSERT OR IGNORE INTO {strata} SELECT ?, {key}, 0, ?, 0 FROM {quote_identifier(delta)} AS d "
+                 f"GROUP BY 2", (sample.stratum, min(1.0, SAMPLE_ROWS / sample.rows)))
+    conn.execute("DROP TABLE IF EXISTS temp.delta_counts")
+    conn.execute(f"CREATE TEMP TABLE delta_counts AS SELECT {key} AS stratum, COUNT(*) AS n "
+                 f"FROM {quote_identifier(delta)} AS d GROUP BY 1")
+    conn.execute(f"UPDATE {strata} SET rows = rows + "
+                 f"COALESCE((SELECT n FROM delta_counts WHERE delta_counts.stratum IS {strata}.stratum), 0)")
+    conn.execute("DROP TABLE temp.delta_counts")
+    _draw(conn, sample, quote_identifier(delta))
+    return sample
+
+
+class _Scaler:
+    """Rewrites the aggregates of a query over a table into estimates over its weighted sample"""
+
+    def __init__(self):
+        self.has_aggregate = False
+
+    @staticmethod
+    def counted(arg: str, value: str) -> str:
+        return f"CASE WHEN ({arg}) IS NOT NULL THEN {value} END"
+
+    def scaled(self, func: str, arg: str) -> str:
+        if func == "count":
+            weights = WEIGHT if arg == "*" else self.counted(arg, WEIGHT)
+            return f"CAST(ROUND(TOTAL({weights})) AS INTEGER)"
+        if func in ("sum", "total"):
+            return f"{func.upper()}(({arg}) * {WEIGHT})"
+        if func == "avg":
+            return f"(TOTAL(({arg}) * {WEIGHT}) / TOTAL({self.counted(arg, WEIGHT)}))"
+        return f"{func.upper()}({arg})"  # MIN/MAX: the sample's, unscaled
+
+    def variance(self, func: str, arg: str):
+        """
+        Variance of an estimate under independent draws: each row of weight w
+        adds w(w - 1) times its value squared (a ratio's linearized for AVG)
+        """
+        spread = f"{WEIGHT} * ({WEIGHT} - 1)"
+        if func == "count":
+            return f"TOTAL({spread if arg == '*' else self.counted(arg, spread)})"
+        if func in ("sum", "total"):
+            return f"TOTAL({spread} * ({arg}) * ({arg}))"
+        if func == "avg":
+            mean = self.scaled("avg", arg)
+            return (f"((TOTAL({spread} * ({arg}) * ({arg})) - 2 * {mean} * TOTAL({spread} * ({arg})) "
+                    f"+ {mean} * {mean} * TOTAL({self.counted(arg, spread)})) "
+                    f"/ (TOTAL({self.counted(arg, WEIGHT)}) * TOTAL({self.counted(arg, WEIGHT)})))")
+        return None
+
+    def expression(self, tokens: list) -> str:
+        out, i = [], 0
+        while i < len(tokens):
+            lower = tokens[i].lower()
+            call = i + 1 < len(tokens) and tokens[i + 1] == "("
+            if call and lower in UNSCALABLE:
+                raise NoMatch(f"{lower} can't be estimated from a sample")
+            if call and lower in AGGREGATES:
+                end = match_paren(tokens, i + 1)
+                self.has_aggregate = True
+                out.append(self.scaled(lower, " ".join(tokens[i + 2:end])))
+                i = end + 1
+                continue
+            out.append(tokens[i])
+            i += 1
+        return " ".join(out)
+
+    def single_aggregate(self, item: list):
+        """(function, argument SQL) when a select item is one aggregate call, else None"""
+        if len(item) >= 3 and item[0].lower() in AGGREGATES and item[1] == "(" and match_paren(item, 1) == len(item) - 1:
+            return item[0].lower(), " ".join(item[2:-1])
+        return None
+
+
+def approximate_query(query: str, sample: Sample, table: str = "orders"):
+    """
+    Rewrite an aggregate query over table to estimate its result from the sample.
+
+    COUNT, SUM, TOTAL and AVG are weighted; MIN and MAX are the sample's.
+    Every select item that is a single COUNT/SUM/TOTAL/AVG also gets a
+    variance column, which Approximation.frame turns into a ± margin.
+    Only single-table SELECTs qualify (see rollups.parse_select), and only
+    aggregate ones: row-level results can't be estimated. Returns an
+    Approximation, or None.
+    """
+    parsed = parse_select(query, table)
+    if parsed is None:
+        return None
+    clauses, qualifiers = parsed
+
+    scaler = _Scaler()
+    try:
+        items, variances, margins = [], [], {}
+        for i, (item, text) in enumerate(clauses["select"]):
+            if not item or item[-1] == "*":
+                raise NoMatch("row-level select")
+            item, alias = split_alias(item)
+            name = result_name(item, alias, text, qualifiers)
+            items.append(f"{scaler.expression(item)} AS {name}")
+            aggregate = scaler.single_aggregate(item)
+            if aggregate is not None and scaler.variance(*aggregate) is not None:
+                # Margins are keyed by the result column's name as pandas will see it
+                margins[identifier_name(name)] = f"__variance_{i}"
+                variances.append(f"{scaler.variance(*aggregate)} AS {quote_identifier(f'__variance_{i}')}")
+        if not scaler.has_aggregate:
+            raise NoMatch("not an aggregate query")
+
+        # The sample takes the table's name (or alias) so qualified columns still resolve
+        source = clauses["from"]
+        # Variance columns go last so ORDER BY positions still point at the query's own columns
+        parts = [f"SELECT {', '.join(items + variances)}", f"FROM {quote_identifier(sample.name)} AS {source[-1]}"]
+        for clause, keyword in (("where", "WHERE"), ("group", "GROUP BY"), ("having", "HAVING"), ("order", "ORDER BY")):
+            if clause in clauses:
+                parts.append(f"{keyword} {scaler.expression(clauses[clause])}")
+        if "limit" in clauses:
+            parts.append(f"LIMIT {' '.join(clauses['limit'])}")
+    except NoMatch:
+        return None
+
+    return Approximation(query, "\n".join(parts), sample, margins)
@@ -0,0 +1,267 @@
+"""
+Schema Profile Cache
+Introspects the orders table once per database version and shares the
+result (columns, sample rows and cheap column statistics) across sessions
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import warnings
+from dataclasses import dataclass, field, replace
+import pandas as pd
+from ingest import quote_identifier
+
+# Profiling configuration
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", 100_000))  # Rows scanned for column stats
+TOP_VALUES_MAX_DISTINCT = 50  # Only list top values for columns with at most this many distinct values
+TOP_VALUES = 5  # Number of top values kept per column
+TEXT_TYPES = {"TEXT", "VARCHAR"}  # Column types whose values may hold dates
+DATE_TYPES = {"DATE", "TIMESTAMP", "TIMESTAMP WITH TIME ZONE"}  # Native date types (DuckDB)
+
+
+def database_fingerprint(db_path: str):
+    """
+    Identify the current version of a database file without opening it.
+    Combines file identity (device, inode) with size and mtime of the
+    database and its WAL file, so any committed write changes it. An empty
+    WAL (created when the first connection opens) counts as no WAL.
+    """
+    parts = [os.path.realpath(db_path)]
+    for path in (db_path, db_path + "-wal"):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            parts.append(None)
+            continue
+        if path != db_path and st.st_size == 0:
+            parts.append(None)
+            continue
+        parts.append((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns))
+    return tuple(parts)
+
+
+@dataclass
+class ColumnProfile:
+    """Statistics for one column, computed over a bounded sample"""
+    name: str
+    type: str
+    non_null: int = 0
+    distinct: int = 0
+    min: object = None
+    max: object = None
+    top_values: list = field(default_factory=list)
+    is_date: bool = False
+
+
+@dataclass
+class SchemaProfile:
+    """Everything the prompts need to know about a table"""
+    table: str
+    fingerprint: tuple
+    row_count: int
+    sampled_rows: int
+    columns: list
+    sample_rows: list
+
+    @property
+    def column_names(self):
+        return [col.name for col in self.columns]
+
+    @property
+    def schema_hash(self):
+        """Hash of table and column definitions; stable across data-only changes"""
+        definition = self.table + "|" + "|".join(f"{c.name}:{c.type}" for c in self.columns)
+        return hashlib.sha256(definition.encode()).hexdigest()[:16]
+
+    def column(self, name: str):
+        for col in self.columns:
+            if col.name == name:
+                return col
+        return None
+
+    def to_prompt(self):
+        """Render the profile as schema context for the model"""
+        approx = "~" if self.sampled_rows < self.row_count else ""
+        schema = f"Table: {self.table} ({self.row_count:,} rows)\n\nColumns:\n"
+        for col in self.columns:
+            details = [col.type]
+            if col.is_date:
+                details.append("date")
+            details.append(f"{approx}{col.distinct:,} distinct")
+            if col.non_null < self.sampled_rows:
+                details.append("has NULLs")
+            if col.min is not None and not col.top_values:
+                details.append(f"range {col.min!r} to {col.max!r}")
+            schema += f"  - {col.name} ({', '.join(details)})\n"
+            if col.top_values:
+                values = ", ".join(repr(value) for value, _ in col.top_values)
+                schema += f"      top values: {values}\n"
+
+        schema += "\nSample Data:\n"
+        schema += str(self.sample_rows[:2])  # Show 2 sample rows
+        return schema
+
+
+def widen_range(current, new, pick):
+    """min/max of two column bounds, either of which may be missing; values that don't compare keep current"""
+    if current is None or new is None:
+        return new if current is None else current
+    try:
+        return pick(current, new)
+    except TypeError:
+        return current
+
+
+def looks_like_date(values: list) -> bool:
+    """Check whether sampled text values all parse as dates"""
+    values = [v for v in values if isinstance(v, str)]
+    if not values:
+        return False
+    if all(v.strip().lstrip("-").replace(".", "", 1).isdigit() for v in values):
+        return False  # Plain numbers, not dates
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        parsed = pd.to_datetime(pd.Series(values), errors="coerce")
+    return bool(parsed.notna().all())
+
+
+def profile_connection(conn, table: str, columns: list, fingerprint=None) -> SchemaProfile:
+    """
+    Compute column statistics for a table over an open connection.
+    Only portable SQL is used, so any engine whose connection has
+    execute(...).fetchall() works (SQLite, DuckDB).
+    """
+    name = quote_identifier(table)
+
+    # Get sample data for better context
+    sample_rows = conn.execute(f"SELECT * FROM {name} LIMIT 3").fetchall()
+
+    row_count = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+    # One pass over a bounded sample for counts, distincts and ranges
+    sample = f"(SELECT * FROM {name} LIMIT {PROFILE_SAMPLE_ROWS}) AS profile_sample"
+    aggregates = ["COUNT(*)"]
+    for col in columns:
+        q = quote_identifier(col.name)
+        aggregates += [f"COUNT({q})", f"COUNT(DISTINCT {q})", f"MIN({q})", f"MAX({q})"]
+    stats = conn.execute(f"SELECT {', '.join(aggregates)} FROM {sample}").fetchone()
+    sampled_rows = stats[0]
+
+    for i, col in enumerate(columns):
+        col.non_null, col.distinct, col.min, col.max = stats[1 + 4 * i: 5 + 4 * i]
+
+        q = quote_identifier(col.name)
+        if 0 < col.distinct <= TOP_VALUES_MAX_DISTINCT:
+            col.top_values = [tuple(row) for row in conn.execute(
+                f"SELECT {q}, COUNT(*) AS n FROM {sample} WHERE {q} IS NOT NULL "
+                f"GROUP BY {q} ORDER BY n DESC, {q} LIMIT {TOP_VALUES}"
+            ).fetchall()]
+
+        if col.type.upper() in DATE_TYPES:
+            col.is_date = True
+        elif col.type.upper() in TEXT_TYPES and col.non_null:
+            values = [row[0] for row in conn.execute(
+                f"SELECT {q} FROM {sample} WHERE {q} IS NOT NULL LIMIT 20"
+            ).fetchall()]
+            col.is_date = looks_like_date(values + [col.min, col.max])
+
+    return SchemaProfile(
+        table=table,
+        fingerprint=fingerprint,
+        row_count=row_count,
+        sampled_rows=sampled_rows,
+        columns=columns,
+        sample_rows=sample_rows,
+    )
+
+
+def build_profile(db_path: str, table: str = "orders") -> SchemaProfile:
+    """Introspect a SQLite table and compute cheap column statistics"""
+    fingerprint = database_fingerprint(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        # Get column information
+        rows = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+        columns = [ColumnProfile(name=row[1], type=row[2]) for row in rows]
+        if not columns:
+            raise sqlite3.OperationalError(f"no such table: {table}")
+
+        return profile_connection(conn, table, columns, fingerprint)
+    finally:
+        conn.close()
+
+
+class SchemaCache:
+    """
+    Process-wide cache of schema profiles, one per (database, table).
+    A profile is served as long as the database fingerprint is unchanged.
+    """
+
+    def __init__(self, builder=None):
+        self._builder = builder or build_profile  # (db_path, table) -> SchemaProfile
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, db_path: str, table: str = "orders") -> SchemaProfile:
+        """Return the profile for the current database version, building it if needed"""
+        key = (os.path.realpath(db_path), table)
+        fingerprint = database_fingerprint(db_path)
+
+        profile = self._profiles.get(key)
+        if profile is not None and profile.fingerprint == fingerprint:
+            return profile
+
+        with self._lock:
+            # Another session may have rebuilt it while we waited
+            profile = self._profiles.get(key)
+            if profile is not None and profile.fingerprint == database_fingerprint(db_path):
+                return profile
+            profile = self._builder(db_path, table)
+            self._profiles[key] = profile
+            self.builds += 1
+            return profile
+
+    def refresh(self, db_path: str, table: str = "orders") -> SchemaProfile:
+        """Rebuild the profile now, e.g. right after an ingest"""
+        self.invalidate(db_path, table)
+        return self.get(db_path, table)
+
+    def restamp(self, db_path: str, table: str = "orders"):
+        """Keep the cached profile across a change that doesn't alter the data (new indexes, ANALYZE)"""
+        key = (os.path.realpath(db_path), table)
+        with self._lock:
+            profile = self._profiles.get(key)
+            if profile is not None:
+                profile.fingerprint = database_fingerprint(db_path)
+
+    def extend(self, db_path: str, base: SchemaProfile, added: int, stats: dict) -> SchemaProfile:
+        """
+        Update the profile taken before rows were appended instead of rebuilding it.
+        stats is {column: (non-null, min, max)} of the added rows: the row count
+        and ranges take them in, while the sample-based statistics stay as they
+        were (the sample is the first rows). A table still smaller than the
+        sample is profiled again, which costs at most the sample.
+        """
+        if base.row_count < PROFILE_SAMPLE_ROWS:
+            return self.refresh(db_path, base.table)
+        columns = []
+        for col in base.columns:
+            _, low, high = stats.get(col.name, (0, None, None))
+            columns.append(replace(col, min=widen_range(col.min, low, min), max=widen_range(col.max, high, max)))
+        profile = replace(base, fingerprint=database_fingerprint(db_path), row_count=base.row_count + added,
+                          columns=columns)
+        with self._lock:
+            self._profiles[(os.path.realpath(db_path), base.table)] = profile
+        return profile
+
+    def invalidate(self, db_path: str, table: str = "orders"):
+        """Drop the cached profile for a table"""
+        with self._lock:
+            self._profiles.pop((os.path.realpath(db_path), table), None)
+
+
+# Shared by every session in this worker
+schema_cache = SchemaCache()
@@ -6,6 +6,10 @@ Converts customer orders CSV file to SQLite database
 import pandas as pd
 import sqlite3
 import os
+from compact_storage import COMPACT_STORAGE, compact_table, format_size_report
+from ingest import ingest_csv
+from rollups import ROLLUPS_ENABLED, build_rollups, drop_rollups
+from schema_profile import build_profile
 
 def setup_database():
     """Convert CSV to SQLite database"""
@@ -19,38 +23,41 @@ def setup_database():
         print("Please place your CSV file in the project directory and name it 'customer_orders.csv'")
         return
     
-    print("📁 Reading CSV file...")
+    print("📁 Loading CSV file in chunks...")
+    
+    def report_progress(rows, elapsed):
+        rate = rows / elapsed if elapsed > 0 else 0
+        print(f"   {rows:,} rows loaded ({rate:,.0f} rows/s)")
+    
     try:
-        df = pd.read_csv(csv_file)
+        drop_rollups(db_file)  # Rollups of the old data must not outlive it
+        result = ingest_csv(csv_file, db_file, progress_callback=report_progress,
+                            finalize=compact_table if COMPACT_STORAGE else None)
     except Exception as e:
-        print(f"❌ Error reading CSV: {e}")
+        print(f"❌ Error loading CSV: {e}")
         return
     
-    print(f"✅ CSV loaded successfully! Found {len(df)} records")
+    count = result['records']
+    print(f"✅ CSV loaded successfully! Found {count} records in {result['elapsed']:.1f}s")
     
     # Display column information
     print("\n📊 Column Information:")
     print("-" * 50)
-    for i, col in enumerate(df.columns, 1):
-        dtype = df[col].dtype
-        non_null = df[col].notna().sum()
+    for i, col in enumerate(result['column_names'], 1):
+        dtype = result['column_types'][col]
+        non_null = result['non_null'][col]
         print(f"{i}. {col}")
-        print(f"   Type: {dtype}, Non-null: {non_null}/{len(df)}")
+        print(f"   Type: {dtype}, Non-null: {non_null}/{count}")
     
-    # Create SQLite database
-    print(f"\n💾 Creating SQLite database: {db_file}")
-    conn = sqlite3.connect(db_file)
+    print(f"\n💾 SQLite database written: {db_file}")
+    if result['storage']:
+        print(f"🗜️ Compacted storage: {format_size_report(result['storage'])}")
     
-    # Write data to SQLite table
-    df.to_sql('orders', conn, if_exists='replace', index=False)
+    if ROLLUPS_ENABLED:
+        rollups = build_rollups(db_file, build_profile(db_file))
+        print(f"📦 Built {len(rollups)} rollup table(s) for common aggregate questions")
     
-    # Verify the data
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM orders")
-    count = cursor.fetchone()[0]
-    
-    print(f"✅ Database created successfully!")
-    print(f"   Records in database: {count}")
+    conn = sqlite3.connect(db_file)
     
     # Show sample data
     print("\n📋 Sample Data (first 3 rows):")
@@ -0,0 +1,316 @@
+"""
+SQL Repair
+Deterministic fixes for common failures of generated SQL, tried before
+asking the model again: markdown fences and prose around the query, smart
+quotes and backticks, misspelled or mis-cased column and table names
+(fuzzy-matched against the cached schema), and functions from other
+dialects translated to SQLite equivalents
+"""
+
+import difflib
+import os
+import re
+
+# Repair configuration
+LOCAL_SQL_REPAIR = os.getenv("LOCAL_SQL_REPAIR", "true").lower() in ("1", "true", "yes")  # Off: errors go straight to the model
+REPAIR_ATTEMPTS = int(os.getenv("REPAIR_ATTEMPTS", 3))  # Local fix-and-retry rounds per query
+IDENTIFIER_CUTOFF = 0.75  # difflib similarity needed to accept a fuzzy identifier match
+
+FENCE = re.compile(r"```[a-zA-Z]*\s*(.*?)\s*(?:```|$)", re.DOTALL)
+STATEMENT_START = re.compile(r"\b(SELECT|WITH)\b", re.IGNORECASE)
+SIMPLE_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+# Error messages naming the identifier that failed (SQLite, then DuckDB)
+MISSING_COLUMN = [re.compile(r"no such column: ([\w.\"]+)"),
+                  re.compile(r'Referenced column "([^"]+)" not found')]
+MISSING_TABLE = [re.compile(r"no such table: ([\w.\"]+)"),
+                 re.compile(r"Table with name (\w+) does not exist")]
+
+DATE_PARTS = {'year': '%Y', 'month': '%m', 'day': '%d', 'hour': '%H', 'minute': '%M', 'second': '%S',
+              'dow': '%w', 'doy': '%j', 'week': '%W'}
+TO_CHAR_FORMATS = [("YYYY", "%Y"), ("HH24", "%H"), ("MM", "%m"), ("DD", "%d"), ("MI", "%M"), ("SS", "%S")]
+# Postgres-style ::type casts; SQLite's CAST(x AS DATE) would give the year as a number
+CAST_TYPES = {'date': "date({})", 'timestamp': "datetime({})", 'datetime': "datetime({})",
+              'int': "CAST({} AS INTEGER)", 'integer': "CAST({} AS INTEGER)", 'bigint': "CAST({} AS INTEGER)",
+              'float': "CAST({} AS REAL)", 'real': "CAST({} AS REAL)", 'numeric': "CAST({} AS REAL)",
+              'decimal': "CAST({} AS REAL)", 'double': "CAST({} AS REAL)",
+              'text': "CAST({} AS TEXT)", 'varchar': "CAST({} AS TEXT)"}
+
+
+def clean_sql(text: str) -> str:
+    """The SQL statement in a model reply: no fences, prose, smart quotes, backticks or trailing ';'"""
+    fenced = FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = STATEMENT_START.search(text)
+    if start:
+        text = text[start.start():]
+    # Only outside literals: a curly apostrophe inside 'Men’s Shirt' is data, not a quote
+    text = map_code(text, lambda code: code.translate(SMART_QUOTES).replace("`", '"')).strip()
+    end = statement_end(text)
+    return text[:end].strip().rstrip(";").strip()
+
+
+def statement_end(sql: str) -> int:
+    """Index of the first ';' outside quotes (so prose after the statement is dropped)"""
+    quote = None
+    for i, ch in enumerate(sql):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == ";":
+            return i
+    return len(sql)
+
+
+def code_spans(sql: str):
+    """(start, end) of the parts of sql outside string literals and quoted identifiers"""
+    spans, start, quote = [], 0, None
+    for i, ch in enumerate(sql):
+        if quote:
+            if ch == quote:
+                quote = None
+                start = i + 1
+        elif ch in ("'", '"'):
+            spans.append((start, i))
+            quote = ch
+    if quote is None:
+        spans.append((start, len(sql)))
+    return spans
+
+
+def map_code(sql: str, func) -> str:
+    """sql with func applied to each part outside string literals and quoted identifiers"""
+    parts, last = [], 0
+    for start, end in code_spans(sql):
+        parts.append(sql[last:start])
+        parts.append(func(sql[start:end]))
+        last = end
+    parts.append(sql[last:])
+    return "".join(parts)
+
+
+def in_code(sql: str, position: int) -> bool:
+    return any(start <= position < end for start, end in code_spans(sql))
+
+
+def split_args(sql: str, open_paren: int):
+    """Arguments of the call whose '(' is at open_paren, and the index just past its ')'"""
+    depth, quote, args, start = 0, None, [], open_paren + 1
+    for i in range(open_paren, len(sql)):
+        ch = sql[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                args.append(sql[start:i].strip())
+                return ([] if args == [""] else args), i + 1
+        elif ch == "," and depth == 1:
+            args.append(sql[start:i].strip())
+            start = i + 1
+    return None, None
+
+
+def rewrite_calls(sql: str, name: str, rewrite) -> str:
+    """Replace each call name(...) outside literals with rewrite(args), unless it returns None"""
+    pattern = re.compile(rf"\b{name}\s*\(", re.IGNORECASE)
+    position = 0
+    while True:
+        match = pattern.search(sql, position)
+        if match is None:
+            return sql
+        position = match.end()
+        if not in_code(sql, match.start()) or (match.start() > 0 and sql[match.start() - 1] == "."):
+            continue
+        args, end = split_args(sql, match.end() - 1)
+        if args is None:
+            return sql
+        replacement = rewrite(args)
+        if replacement is not None:
+            sql = sql[:match.start()] + replacement + sql[end:]
+            position = match.start() + len(replacement)
+
+
+def unquote(literal: str) -> str:
+    return literal.strip().strip("'\"")
+
+
+def date_trunc(args):
+    if len(args) != 2:
+        return None
+    unit, expr = unquote(args[0]).lower(), args[1]
+    if unit == 'year':
+        return f"strftime('%Y-01-01', {expr})"
+    if unit == 'quarter':
+        return (f"printf('%s-%02d-01', strftime('%Y', {expr}), "
+                f"((CAST(strftime('%m', {expr}) AS INTEGER) - 1) / 3) * 3 + 1)")
+    if unit == 'month':
+        return f"strftime('%Y-%m-01', {expr})"
+    if unit == 'week':
+        return f"date({expr}, 'weekday 0', '-6 days')"
+    if unit == 'day':
+        return f"date({expr})"
+    return None
+
+
+def extract(args):
+    if len(args) != 1:
+        return None
+    match = re.fullmatch(r"(\w+)\s+FROM\s+(.+)", args[0], re.IGNORECASE | re.DOTALL)
+    if match is None:
+        return None
+    unit, expr = match.group(1).lower(), match.group(2)
+    if unit == 'quarter':
+        return f"((CAST(strftime('%m', {expr}) AS INTEGER) + 2) / 3)"
+    if unit not in DATE_PARTS:
+        return None
+    return f"CAST(strftime('{DATE_PARTS[unit]}', {expr}) AS INTEGER)"
+
+
+def date_part(unit):
+    return lambda args: f"CAST(strftime('{DATE_PARTS[unit]}', {args[0]}) AS INTEGER)" if len(args) == 1 else None
+
+
+def to_char(args):
+    if len(args) != 2:
+        return None
+    fmt = unquote(args[1])
+    for pattern, replacement in TO_CHAR_FORMATS:
+        fmt = fmt.replace(pattern, replacement)
+    return f"strftime('{fmt}', {args[0]})"
+
+
+# (function name, rewrite(args) → SQLite SQL, or None to leave the call as it is)
+SQLITE_FUNCTIONS = [
+    ("DATE_TRUNC", date_trunc),
+    ("EXTRACT", extract),
+    ("YEAR", date_part('year')),
+    ("MONTH", date_part('month')),
+    ("DAY", date_part('day')),
+    ("TO_CHAR", to_char),
+    ("DATE_FORMAT", lambda args: f"strftime({args[1]}, {args[0]})" if len(args) == 2 else None),
+    ("CONCAT", lambda args: "(" + " || ".join(args) + ")" if args else None),
+    ("ISNULL", lambda args: f"IFNULL({args[0]}, {args[1]})" if len(args) == 2 else None),
+    ("NVL", lambda args: f"IFNULL({args[0]}, {args[1]})" if len(args) == 2 else None),
+    ("LEN", lambda args: f"LENGTH({args[0]})" if len(args) == 1 else None),
+    ("CHAR_LENGTH", lambda args: f"LENGTH({args[0]})" if len(args) == 1 else None),
+    ("NOW", lambda args: "datetime('now')" if not args else None),
+    ("GETDATE", lambda args: "datetime('now')" if not args else None),
+    ("CURDATE", lambda args: "date('now')" if not args else None),
+    ("CURRENT_DATE", lambda args: "date('now')" if not args else None),
+]
+
+
+def translate_to_sqlite(sql: str, fixes: list) -> str:
+    """Rewrite other dialects' functions and syntax (TOP n, ILIKE, ::casts) as SQLite"""
+    for name, rewrite in SQLITE_FUNCTIONS:
+        rewritten = rewrite_calls(sql, name, rewrite)
+        if rewritten != sql:
+            fixes.append(f"{name}() → SQLite equivalent")
+            sql = rewritten
+
+    top = re.match(r"(\s*SELECT\s+(?:DISTINCT\s+)?)TOP\s*\(?\s*(\d+)\s*\)?\s+", sql, re.IGNORECASE)
+    if top:
+        sql = top.group(1) + sql[top.end():]
+        if not re.search(r"\bLIMIT\s+\d+\s*$", sql, re.IGNORECASE):
+            sql = f"{sql.rstrip()} LIMIT {top.group(2)}"
+        fixes.append(f"TOP {top.group(2)} → LIMIT {top.group(2)}")
+
+    def in_code_sub(pattern, replacement, text, description):
+        def swap(match):
+            return replacement(match) if in_code(text, match.start()) else match.group(0)
+        new = re.sub(pattern, swap, text, flags=re.IGNORECASE)
+        if new != text:
+            fixes.append(description)
+        return new
+
+    sql = in_code_sub(r"\bILIKE\b", lambda m: "LIKE", sql, "ILIKE → LIKE")
+    sql = in_code_sub(r"([\w.]+|'[^']*')::(\w+)",
+                      lambda m: CAST_TYPES.get(m.group(2).lower(), "CAST({} AS " + m.group(2) + ")").format(m.group(1)),
+                      sql, "::type → CAST")
+    return sql
+
+
+def match_identifier(name: str, candidates: list, cutoff: float = IDENTIFIER_CUTOFF):
+    """The candidate a misspelled/mis-cased identifier most likely means, or None if unclear"""
+    lowered = {c.lower(): c for c in candidates}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+    squashed = {re.sub(r"[^a-z0-9]", "", c.lower()): c for c in candidates}
+    key = re.sub(r"[^a-z0-9]", "", name.lower())
+    if key in squashed:
+        return squashed[key]
+    close = difflib.get_close_matches(name.lower(), list(lowered), n=2, cutoff=cutoff)
+    if len(close) == 1 or (len(close) == 2 and difflib.SequenceMatcher(None, name.lower(), close[0]).ratio()
+                           > difflib.SequenceMatcher(None, name.lower(), close[1]).ratio()):
+        return lowered[close[0]]
+    # 'price' → 'unit_price' when exactly one name has it as a word
+    containing = [c for c in candidates if name.lower() in c.lower().split("_")]
+    return containing[0] if len(containing) == 1 else None
+
+
+def replace_identifier(sql: str, old: str, new: str) -> str:
+    """Replace a bare or double-quoted identifier outside string literals"""
+    replacement = new if SIMPLE_IDENTIFIER.fullmatch(new) else '"' + new.replace('"', '""') + '"'
+    quoted = '"' + old + '"'
+    sql = sql.replace(quoted, replacement) if quoted in sql else sql
+    pattern = re.compile(rf"(?<![\w\"]){re.escape(old)}(?![\w\"])")
+    return map_code(sql, lambda code: pattern.sub(replacement, code))
+
+
+def replace_table(sql: str, old: str, new: str) -> str:
+    """Replace a table name where it follows FROM/JOIN (it may also be a keyword, e.g. 'order')"""
+    replacement = new if SIMPLE_IDENTIFIER.fullmatch(new) else '"' + new.replace('"', '""') + '"'
+    pattern = re.compile(rf'(\b(?:FROM|JOIN)\s+)"?{re.escape(old)}"?(?![\w"])', re.IGNORECASE)
+    return pattern.sub(lambda m: m.group(1) + replacement, sql)
+
+
+def missing_identifier(error: str, patterns: list):
+    for pattern in patterns:
+        match = pattern.search(error)
+        if match:
+            return match.group(1).strip('"').split(".")[-1]
+    return None
+
+
+def repair_sql(query: str, error: str, columns: list, tables: list, dialect: str = "SQLite"):
+    """
+    Fix what can be fixed locally in a query that failed with error.
+    columns/tables are the known names to match against. Returns
+    (sql, fixes): the repaired query and a description of each fix (empty
+    when nothing could be changed).
+    """
+    fixes = []
+    sql = clean_sql(query)
+    if sql != query.strip().rstrip(";").strip():
+        fixes.append("removed markdown/prose, normalized quotes")
+
+    if dialect == "SQLite":
+        sql = translate_to_sqlite(sql, fixes)
+
+    column = missing_identifier(error, MISSING_COLUMN)
+    if column:
+        match = match_identifier(column, columns)
+        if match and match != column:
+            sql = replace_identifier(sql, column, match)
+            fixes.append(f"column {column} → {match}")
+
+    table = missing_identifier(error, MISSING_TABLE)
+    if table:
+        match = match_identifier(table, tables, cutoff=0.6)
+        if match is None and len(tables) == 1:
+            match = tables[0]  # With one table there is nothing else the query can mean
+        if match and match != table:
+            sql = replace_table(sql, table, match)
+            fixes.append(f"table {table} → {match}")
+
+    return sql, fixes
@@ -0,0 +1,101 @@
+"""
+Synthetic Orders
+Deterministic generator of realistic orders CSVs (10k to 10M+ rows) for
+benchmarks: three years of dates with growth and seasonality, Zipf-skewed
+customers and products, weighted states and NULL discounts
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+# Generator configuration
+CHUNK_ROWS = 250_000  # Rows generated and written at a time (part of the seed: changing it changes the data)
+START_DATE = "2022-01-01"
+DAYS = 3 * 365
+PRODUCTS = 500
+CUSTOMERS_PER_ORDER = 0.12  # Distinct customers per order (min 100)
+
+CATEGORIES = ["Electronics", "Home", "Office", "Outdoors", "Toys", "Beauty",
+              "Grocery", "Clothing", "Sports", "Books", "Garden", "Automotive"]
+STATES = ["CA", "TX", "FL", "NY", "PA", "IL", "OH", "GA", "NC", "MI", "NJ", "VA", "WA", "AZ", "MA",
+          "TN", "IN", "MD", "MO", "WI", "CO", "MN", "SC", "AL", "LA", "KY", "OR", "OK", "CT", "UT",
+          "IA", "NV", "AR", "MS", "KS", "NM", "NE", "ID", "WV", "HI", "NH", "ME", "RI", "MT", "DE",
+          "SD", "ND", "AK", "VT", "WY"]
+PAYMENT_METHODS = ["Credit Card", "Debit Card", "PayPal", "Apple Pay", "Gift Card"]
+PAYMENT_WEIGHTS = [0.45, 0.25, 0.18, 0.09, 0.03]
+DISCOUNTS = [0.05, 0.10, 0.15, 0.20]
+
+
+def zipf_weights(n: int, s: float = 1.1) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def day_cdf() -> np.ndarray:
+    """Cumulative share of orders by day: ~30%/year growth, a Q4 peak and quieter weekends"""
+    days = np.arange(DAYS)
+    dates = pd.Timestamp(START_DATE) + pd.to_timedelta(days, unit="D")
+    weight = 1.3 ** (days / 365)
+    weight *= 1 + 0.35 * np.exp(-((dates.dayofyear.to_numpy() - 340) / 25.0) ** 2)
+    weight *= np.where(dates.dayofweek.to_numpy() >= 5, 0.8, 1.0)
+    return np.cumsum(weight) / weight.sum()
+
+
+def catalog(seed: int) -> pd.DataFrame:
+    """The product catalog: name, category, list price and margin, fixed by the seed"""
+    rng = np.random.default_rng([seed, 0])
+    return pd.DataFrame({
+        'product_name': [f"Product {i:03d}" for i in range(PRODUCTS)],
+        'category': rng.choice(CATEGORIES, PRODUCTS),
+        'list_price': np.round(rng.lognormal(3.5, 0.9, PRODUCTS) + 1, 2),
+        'margin': rng.uniform(0.05, 0.45, PRODUCTS),
+    })
+
+
+def generate_chunk(start: int, rows: int, total_rows: int, seed: int, products: pd.DataFrame,
+                   cdf: np.ndarray) -> pd.DataFrame:
+    """Orders start..start+rows of a total_rows dataset; the same arguments give the same rows"""
+    rng = np.random.default_rng([seed, 1, start])
+    ids = np.arange(start, start + rows)
+    # Order dates rise with order_id, following the daily volume curve
+    days = np.searchsorted(cdf, (ids + 0.5) / total_rows)
+    dates = (np.datetime64(START_DATE) + days.astype("timedelta64[D]")).astype(str)
+
+    customers = max(100, int(total_rows * CUSTOMERS_PER_ORDER))
+    product = rng.choice(PRODUCTS, rows, p=zipf_weights(PRODUCTS))
+    quantity = np.minimum(rng.geometric(0.45, rows), 20)
+    unit_price = np.round(products['list_price'].to_numpy()[product] * rng.uniform(0.9, 1.1, rows), 2)
+    discount = np.where(rng.random(rows) < 0.3, rng.choice(DISCOUNTS, rows), np.nan)
+    revenue = np.round(quantity * unit_price * (1 - np.nan_to_num(discount)), 2)
+    margin = products['margin'].to_numpy()[product] - np.nan_to_num(discount)
+
+    return pd.DataFrame({
+        'order_id': ids + 1,
+        'order_date': dates,
+        'customer_id': rng.zipf(1.3, rows) % customers + 1,
+        'product_name': products['product_name'].to_numpy()[product],
+        'category': products['category'].to_numpy()[product],
+        'state': rng.choice(STATES, rows, p=zipf_weights(len(STATES), 0.9)),
+        'payment_method': rng.choice(PAYMENT_METHODS, rows, p=PAYMENT_WEIGHTS),
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'discount': discount,
+        'revenue': revenue,
+        'profit': np.round(revenue * margin, 2),
+    })
+
+
+def generate_orders(path: str, rows: int, seed: int = 0) -> str:
+    """
+    Write a rows-long orders CSV to path, CHUNK_ROWS at a time.
+    Output depends only on (rows, seed), so runs are comparable across machines.
+    """
+    products = catalog(seed)
+    cdf = day_cdf()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for start in range(0, rows, CHUNK_ROWS):
+            chunk = generate_chunk(start, min(CHUNK_ROWS, rows - start), rows, seed, products, cdf)
+            chunk.to_csv(f, header=start == 0, index=False)
+    return path
@@ -0,0 +1,97 @@
+"""
+Stub Anthropic clients shared by the test suite
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+
+def stub_usage(kwargs, output, cached_prefixes):
+    """
+    Usage as the API would report it, with whitespace-split words as tokens.
+    A system prompt marked with cache_control is a cache write the first
+    time it is seen and a cache read afterwards.
+    """
+    system = kwargs.get("system") or []
+    prefix = "".join(block["text"] for block in system)
+    messages = "".join(m["content"] for m in kwargs.get("messages", []))
+    usage = SimpleNamespace(
+        input_tokens=len(messages.split()), output_tokens=len(output.split()),
+        cache_creation_input_tokens=0, cache_read_input_tokens=0
+    )
+    if any("cache_control" in block for block in system):
+        if prefix in cached_prefixes:
+            usage.cache_read_input_tokens = len(prefix.split())
+        else:
+            usage.cache_creation_input_tokens = len(prefix.split())
+            cached_prefixes.add(prefix)
+    else:
+        usage.input_tokens += len(prefix.split())
+    return usage
+
+
+class StubMessages:
+    """Records calls and returns a canned completion after a delay"""
+
+    def __init__(self, text, delay=0.0):
+        self.text = text
+        self.delay = delay
+        self.calls = []
+        self.cached_prefixes = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return SimpleNamespace(
+            content=[SimpleNamespace(text=self.text)],
+            usage=stub_usage(kwargs, self.text, self.cached_prefixes)
+        )
+
+
+class StubStream:
+    """Async context manager mimicking the Anthropic message stream"""
+
+    def __init__(self, tokens, delay, log, usage=None):
+        self.tokens = tokens
+        self.delay = delay
+        self.log = log
+        self.usage = usage
+
+    async def __aenter__(self):
+        self.log.append("open")
+        return self
+
+    async def __aexit__(self, *exc):
+        self.log.append("close")
+
+    @property
+    async def text_stream(self):
+        for token in self.tokens:
+            await asyncio.sleep(self.delay)
+            yield token
+
+    async def get_final_message(self):
+        return SimpleNamespace(content=[SimpleNamespace(text="".join(self.tokens))], usage=self.usage)
+
+
+class StubStreamingMessages:
+    """Streams canned tokens and records stream lifecycle events"""
+
+    def __init__(self, tokens, delay=0.0):
+        self.tokens = tokens
+        self.delay = delay
+        self.log = []
+        self.calls = []
+        self.cached_prefixes = set()
+
+    def stream(self, **kwargs):
+        self.calls.append(kwargs)
+        usage = stub_usage(kwargs, "".join(self.tokens), self.cached_prefixes)
+        return StubStream(self.tokens, self.delay, self.log, usage)
@@ -0,0 +1,93 @@
+"""
+Test suite for the async message pipeline
+"""
+
+import pytest
+import asyncio
+import os
+import pandas as pd
+import threading
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from llm_scheduler import LLMScheduler
+from stubs import StubMessages, StubStreamingMessages
+
+
+class TestAsyncPipeline:
+    """Test cases for async LLM calls and off-thread database work"""
+
+    @pytest.mark.asyncio
+    async def test_run_blocking_uses_worker_thread(self):
+        """Test that blocking work runs off the event loop thread"""
+        thread_name = await app.run_blocking(app.db_executor, lambda: threading.current_thread().name)
+        assert thread_name.startswith("db")
+
+    @pytest.mark.asyncio
+    async def test_generate_sql_query_is_async(self, monkeypatch):
+        """Test SQL generation through a stub async client"""
+        stub = StubMessages("```sql\nSELECT COUNT(*) FROM orders;\n```")
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+
+        sql = await app.generate_sql_query("How many orders?", "Table: orders")
+
+        assert sql == "SELECT COUNT(*) FROM orders"
+        assert len(stub.calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_llm_concurrency_limit(self, monkeypatch):
+        """Test that concurrent LLM calls respect the configured limit"""
+        stub = StubMessages("SELECT 1", delay=0.02)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+        monkeypatch.setattr(app, 'llm_scheduler', LLMScheduler(concurrency=2))
+
+        await asyncio.gather(*[app.generate_sql_query(f"q{i}", "schema") for i in range(6)])
+
+        assert len(stub.calls) == 6
+        assert stub.max_in_flight == 2
+
+
+class TestStreamedInsights:
+    """Test cases for token-streamed explanations"""
+
+    @pytest.fixture
+    def results_df(self):
+        """Small result set to explain"""
+        return pd.DataFrame({'product': ['A', 'B'], 'revenue': [100.0, 50.0]})
+
+    @pytest.mark.asyncio
+    async def test_explain_results_streams_tokens(self, monkeypatch, results_df):
+        """Test that insight text arrives token by token"""
+        stub = StubStreamingMessages(["Product ", "A ", "leads."])
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+
+        tokens = [t async for t in app.explain_results("Top products?", "SELECT 1", results_df)]
+
+        assert tokens == ["Product ", "A ", "leads."]
+        assert stub.log == ["open", "close"]
+
+    @pytest.mark.asyncio
+    async def test_stream_insights_cancellation_closes_stream(self, monkeypatch, results_df):
+        """Test that cancelling the insight task stops streaming and closes the stream"""
+        stub = StubStreamingMessages(["tok "] * 100, delay=0.01)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+
+        received = []
+        msg = SimpleNamespace(stream_token=lambda t: asyncio.sleep(0, received.append(t)))
+
+        task = asyncio.create_task(app.stream_insights(msg, "q", "SELECT 1", results_df))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.wait([task])
+
+        assert task.cancelled()
+        assert 0 < len(received) < 100
+        assert stub.log == ["open", "close"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,78 @@
+"""
+Test suite for the benchmark suite and synthetic data generator
+"""
+
+import pytest
+import json
+import os
+import pandas as pd
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import benchmark
+from synthetic_orders import generate_orders
+
+
+class TestSyntheticOrders:
+    """Test cases for the deterministic orders generator"""
+
+    def test_same_seed_same_file(self, tmp_path):
+        """Test that the data depends only on the row count and seed"""
+        first = generate_orders(str(tmp_path / "a.csv"), 3000, seed=1)
+        second = generate_orders(str(tmp_path / "b.csv"), 3000, seed=1)
+        other = generate_orders(str(tmp_path / "c.csv"), 3000, seed=2)
+
+        assert open(first, "rb").read() == open(second, "rb").read()
+        assert open(first, "rb").read() != open(other, "rb").read()
+
+    def test_realistic_shape(self, tmp_path):
+        """Test cardinalities, date range and NULL discounts"""
+        df = pd.read_csv(generate_orders(str(tmp_path / "orders.csv"), 20000))
+
+        assert df['order_id'].is_unique and df['order_date'].is_monotonic_increasing
+        assert df['order_date'].iloc[0] == "2022-01-01" and df['order_date'].iloc[-1] < "2025-01-01"
+        assert df['state'].nunique() == 50 and df['category'].nunique() == 12
+        assert df['state'].value_counts().iloc[0] > 5 * df['state'].value_counts().iloc[-1]
+        assert 0.6 < df['discount'].isna().mean() < 0.8
+        revenue_by_year = df.groupby(df['order_date'].str[:4])['revenue'].sum()
+        assert revenue_by_year.is_monotonic_increasing
+
+
+class TestBenchmark:
+    """Test cases for timing runs and baseline comparison"""
+
+    def test_compare_flags_regressions_over_noise(self):
+        """Test that only slowdowns over both the tolerance and the noise floor regress"""
+        baseline = {'runs': {'1000': {'ingest': 1.0, 'schema_warm': 0.0001, 'render_markdown': 0.01}}}
+        current = {'runs': {'1000': {'ingest': 1.5, 'schema_warm': 0.0003, 'render_markdown': 0.011,
+                                     'new_metric': 9.0},
+                            '5000': {'ingest': 99.0}}}
+
+        assert benchmark.compare(current, baseline, tolerance=0.25) == [('1000', 'ingest', 1.0, 1.5)]
+
+    def test_run_saves_baseline_and_fails_on_regression(self, tmp_path):
+        """Test a full small run: every stage is timed, app state is restored, regressions exit 1"""
+        baseline_path = str(tmp_path / "baseline.json")
+        args = ["--rows", "2000", "--repeat", "1", "--llm-latency", "0",
+                "--baseline", baseline_path, "--work-dir", str(tmp_path / "work")]
+        db_path = app.DB_PATH
+
+        assert benchmark.main(args + ["--update-baseline"]) == 0
+        saved = json.load(open(baseline_path))
+        timings = saved['runs']['2000']
+        assert {'ingest', 'schema_cold', 'validate_sql', 'execute_sql.top_products', 'render_markdown',
+                'pipeline', 'pipeline_overhead'} <= set(timings)
+        assert all(seconds >= 0 for seconds in timings.values())
+        assert app.DB_PATH == db_path
+
+        # A baseline far faster than this machine makes the run fail
+        saved['runs']['2000'] = {metric: 1e-6 for metric in timings}
+        json.dump(saved, open(baseline_path, "w"))
+        assert benchmark.main(args) == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,165 @@
+"""
+Test suite for compact typed storage
+"""
+
+import pytest
+import os
+import pandas as pd
+import sqlite3
+import sys
+from functools import partial
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compact_storage
+from compact_storage import compact_table, detect_date_format, format_size_report, normalize_date, storage_table
+from index_advisor import index_on_ingest
+from ingest import ingest_csv
+from schema_profile import build_profile
+
+
+def write_orders(path, n):
+    data = {
+        'order_id': range(n),
+        'product': [f"Deluxe Product Number {i % 17}" for i in range(n)],
+        'state': [['California', 'Texas', 'New York', 'Washington'][i % 4] for i in range(n)],
+        'order_date': [f"{i % 12 + 1:02d}/{i % 28 + 1:02d}/2024" for i in range(n)],
+        'customer': [f"Customer {i}" for i in range(n)],
+        'quantity': [float(i % 5 + 1) if i % 7 else None for i in range(n)],
+        'price': [round(i * 0.37 % 100, 2) for i in range(n)],
+    }
+    pd.DataFrame(data).to_csv(path, index=False)
+
+
+class TestCompactStorage:
+    """Test cases for the ingest-time type optimizer"""
+
+    @pytest.fixture
+    def csv_file(self, tmp_path):
+        csv_file = tmp_path / "orders.csv"
+        write_orders(csv_file, 5000)
+        return str(csv_file)
+
+    def test_date_formats(self):
+        """Test that US dates are detected and rewritten as ISO"""
+        fmt = detect_date_format(["03/15/2024", "12/01/2023"])
+
+        assert fmt == "%m/%d/%Y"
+        assert normalize_date("03/15/2024", fmt) == "2024-03-15"
+        assert normalize_date("03/15/2024 00:00", "%m/%d/%Y %H:%M") == "2024-03-15"
+        assert normalize_date("03/15/2024 09:30", "%m/%d/%Y %H:%M") == "2024-03-15 09:30:00"
+        assert normalize_date("n/a", fmt) == "n/a"
+        assert detect_date_format(["Product 1", "03/15/2024"]) is None
+
+    def test_date_format_checked_on_every_value(self, monkeypatch):
+        """Test that a format fitting the sample is only used if every value parses, and day/month is never guessed"""
+        monkeypatch.setattr(compact_storage, 'DATE_SAMPLE_ROWS', 10)
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE orders (day_first TEXT, ambiguous TEXT, mixed TEXT)")
+        rows = [(f"{i % 12 + 1:02d}/03/2024", f"{i % 12 + 1:02d}/03/2024", "03/15/2024") for i in range(50)]
+        rows.append(("25/03/2024", "01/02/2024", "n/a"))  # Past the sample
+        conn.executemany("INSERT INTO orders VALUES (?, ?, ?)", rows)
+
+        report = compact_table(conn, "orders")
+        last = conn.execute("SELECT * FROM orders ORDER BY rowid DESC LIMIT 1").fetchone()
+        first = conn.execute("SELECT * FROM orders ORDER BY rowid LIMIT 1").fetchone()
+        conn.close()
+
+        assert report['dates'] == ['day_first']
+        assert first == ("2024-03-01", "01/03/2024", "03/15/2024")
+        assert last == ("2024-03-25", "01/02/2024", "n/a")
+        assert detect_date_format(["01/02/2024", "03/04/2024"]) is None
+
+    def test_types_tightened(self, csv_file, tmp_path):
+        """Test that dates become ISO below the dictionary threshold and whole-number floats stay REAL"""
+        path = str(tmp_path / "test.db")
+        result = ingest_csv(csv_file, path, finalize=compact_table)
+
+        conn = sqlite3.connect(path)
+        types = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(orders)")}
+        first = conn.execute("SELECT order_date, quantity FROM orders ORDER BY rowid LIMIT 1").fetchone()
+        conn.close()
+
+        assert result['storage']['dates'] == ['order_date']
+        assert result['storage']['dictionary'] == []
+        assert types['quantity'] == 'REAL' and types['price'] == 'REAL'
+        assert first == ('2024-01-01', None)
+        assert build_profile(path).column('order_date').is_date
+
+    def test_ratios_unchanged(self, csv_file, tmp_path):
+        """Test that averages and ratios of whole-number columns are the same before and after compaction"""
+        plain, compact = str(tmp_path / "plain.db"), str(tmp_path / "compact.db")
+        ingest_csv(csv_file, plain)
+        ingest_csv(csv_file, compact, finalize=compact_table)
+        query = ("SELECT AVG(quantity), SUM(quantity) / COUNT(quantity), SUM(quantity) / SUM(order_id), "
+                 "MAX(CASE WHEN quantity = 1 THEN quantity / 2 END) FROM orders")
+
+        results = []
+        for path in (plain, compact):
+            conn = sqlite3.connect(path)
+            results.append(conn.execute(query).fetchone())
+            conn.close()
+        assert results[0] == results[1]
+        assert results[1][1] == pytest.approx(3.0) and results[1][3] == 0.5
+
+    def test_dictionary_view_matches_plain_table(self, csv_file, tmp_path):
+        """Test that a dictionary-encoded table reads back exactly like a plain load, in less space"""
+        plain = str(tmp_path / "plain.db")
+        compact = str(tmp_path / "compact.db")
+        ingest_csv(csv_file, plain)
+        result = ingest_csv(csv_file, compact, finalize=partial(compact_table, min_table_bytes=0))
+        report = result['storage']
+
+        conn = sqlite3.connect(compact)
+        expected = pd.read_sql_query("SELECT * FROM orders", sqlite3.connect(plain))
+        actual = pd.read_sql_query("SELECT * FROM orders", conn)
+        by_state = pd.read_sql_query("SELECT state, COUNT(*) AS n FROM orders WHERE state = 'Texas' GROUP BY state", conn)
+        storage = storage_table(conn, "orders")
+        conn.close()
+
+        assert sorted(report['dictionary']) == ['product', 'state']
+        assert storage == "orders__data"
+        assert report['bytes_after'] < report['bytes_before']
+        assert "smaller" in format_size_report(report)
+        assert list(actual.columns) == list(expected.columns)
+        pd.testing.assert_frame_equal(actual.drop(columns=['order_date', 'quantity']),
+                                      expected.drop(columns=['order_date', 'quantity']))
+        assert by_state['n'][0] == 1250
+        assert build_profile(compact).column('state').type == 'TEXT'
+
+    def test_indexes_on_storage_table(self, csv_file, tmp_path):
+        """Test that ingest-time indexes land on the storage table behind the view"""
+        path = str(tmp_path / "test.db")
+        ingest_csv(csv_file, path, finalize=partial(compact_table, min_table_bytes=0))
+        created = index_on_ingest(path, build_profile(path))
+
+        conn = sqlite3.connect(path)
+        tables = {row[0] for row in conn.execute("SELECT tbl_name FROM sqlite_master WHERE type = 'index'")}
+        plan = [row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM orders WHERE order_date >= '2024-06-01'"
+        )]
+        conn.close()
+
+        assert created
+        assert "orders__data" in tables
+        assert any("USING" in detail and "INDEX" in detail for detail in plan)
+
+    def test_reingest_replaces_compacted_layout(self, csv_file, tmp_path):
+        """Test that a plain load over a compacted one removes the view and lookup tables"""
+        path = str(tmp_path / "test.db")
+        ingest_csv(csv_file, path, finalize=partial(compact_table, min_table_bytes=0))
+        ingest_csv(csv_file, path)
+
+        conn = sqlite3.connect(path)
+        objects = {row[0]: row[1] for row in conn.execute("SELECT name, type FROM sqlite_master")}
+        count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        conn.close()
+
+        assert objects['orders'] == 'table'
+        assert not any("__dict__" in name or name.endswith("__data") for name in objects)
+        assert count == 5000
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,122 @@
+"""
+Test suite for the read-only SQLite connection pool
+"""
+
+import pytest
+import os
+import sqlite3
+import threading
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_pool import ConnectionPool
+
+
+class TestConnectionPool:
+    """Test cases for pooled read-only connections"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        """Create a small WAL-mode orders database"""
+        path = tmp_path / "test.db"
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("CREATE TABLE orders (order_id INTEGER, price REAL)")
+        conn.executemany("INSERT INTO orders VALUES (?, ?)", [(i, i * 1.5) for i in range(10)])
+        conn.commit()
+        conn.close()
+        return str(path)
+
+    def test_connections_are_reused(self, db_path):
+        """Test that sequential checkouts share one connection"""
+        pool = ConnectionPool(db_path, size=4)
+        for _ in range(5):
+            with pool.connection() as conn:
+                assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 10
+
+        stats = pool.snapshot()
+        assert stats['checkouts'] == 5
+        assert stats['opened'] == 1
+
+    def test_connections_are_read_only(self, db_path):
+        """Test that pooled connections reject writes"""
+        pool = ConnectionPool(db_path, size=1)
+        with pytest.raises(sqlite3.OperationalError):
+            with pool.connection() as conn:
+                conn.execute("DELETE FROM orders")
+
+        # The connection survives a rejected statement
+        with pool.connection() as conn:
+            assert conn.execute("PRAGMA query_only").fetchone()[0] == 1
+        assert pool.snapshot()['opened'] == 1
+
+    def test_waits_when_exhausted(self, db_path):
+        """Test that checkouts beyond the pool size wait and are counted"""
+        pool = ConnectionPool(db_path, size=1)
+        release = threading.Event()
+        held = threading.Event()
+
+        def hold():
+            with pool.connection():
+                held.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        threading.Timer(0.05, release.set).start()
+        with pool.connection() as conn:
+            conn.execute("SELECT 1")
+        holder.join()
+
+        assert pool.snapshot()['waits'] == 1
+
+    def test_timeout_when_exhausted(self, db_path):
+        """Test that a checkout gives up after the timeout"""
+        pool = ConnectionPool(db_path, size=1, timeout=0.01)
+        with pool.connection():
+            with pytest.raises(TimeoutError):
+                with pool.connection():
+                    pass
+
+    def test_reads_during_uncommitted_write(self, db_path):
+        """Test that WAL readers see the last committed data while a load is in progress"""
+        pool = ConnectionPool(db_path, size=2)
+        writer = sqlite3.connect(db_path, isolation_level=None)
+        writer.execute("BEGIN")
+        writer.execute("DELETE FROM orders")
+
+        with pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 10
+
+        writer.execute("COMMIT")
+        writer.close()
+        with pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 0
+
+    def test_reopens_after_file_replaced(self, db_path):
+        """Test that connections to a replaced database file are retired"""
+        pool = ConnectionPool(db_path, size=2)
+        with pool.connection() as conn:
+            conn.execute("SELECT 1")
+
+        replacement = db_path + ".new"
+        conn = sqlite3.connect(replacement)
+        conn.execute("CREATE TABLE orders (order_id INTEGER)")
+        conn.execute("INSERT INTO orders VALUES (1)")
+        conn.commit()
+        conn.close()
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        os.replace(replacement, db_path)
+
+        with pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 1
+        assert pool.snapshot()['reopened'] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
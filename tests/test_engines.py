@@ -0,0 +1,167 @@
+"""
+Test suite for the query engines
+"""
+
+import pytest
+import os
+import pandas as pd
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("duckdb")
+
+import app
+import engines
+from engines import DuckDBEngine, SQLiteEngine, get_engine
+from query_budget import QueryBudget, QueryTimeout
+from result_cache import ResultCache
+
+# The same questions in each dialect; only date handling differs
+QUERIES = [
+    ("SELECT product, SUM(price * quantity) AS revenue FROM orders GROUP BY product ORDER BY revenue DESC, product",) * 2,
+    ("SELECT state, COUNT(*) AS orders, AVG(price) AS avg_price FROM orders GROUP BY state ORDER BY state",) * 2,
+    ("SELECT COUNT(DISTINCT customer) AS customers FROM orders WHERE discount IS NULL",) * 2,
+    ("SELECT state, SUM(discount) AS discounts FROM orders WHERE price > 50 GROUP BY state ORDER BY state",) * 2,
+    (
+        "SELECT strftime('%Y-%m', order_date) AS month, SUM(price) AS revenue FROM orders GROUP BY month ORDER BY month",
+        "SELECT strftime(order_date, '%Y-%m') AS month, SUM(price) AS revenue FROM orders GROUP BY month ORDER BY month",
+    ),
+]
+
+
+class TestEngines:
+    """Cross-check DuckDB and Parquet storage against SQLite on the same CSV"""
+
+    @pytest.fixture
+    def csv_file(self, tmp_path):
+        """Create an orders CSV with text, dates, numbers and nulls"""
+        csv_file = tmp_path / "orders.csv"
+        n = 3000
+        data = {
+            'order_id': range(n),
+            'product': [f"Product {i % 17}" for i in range(n)],
+            'state': [['CA', 'TX', 'NY', 'WA'][i % 4] for i in range(n)],
+            'order_date': [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(n)],
+            'customer': [f"Customer {i % 250}" for i in range(n)],
+            'quantity': [i % 5 + 1 for i in range(n)],
+            'price': [round(i * 0.37 % 100, 2) for i in range(n)],
+            'discount': [None if i % 3 else i % 10 for i in range(n)],
+        }
+        pd.DataFrame(data).to_csv(csv_file, index=False)
+        return str(csv_file)
+
+    @pytest.fixture
+    def loaded(self, csv_file, tmp_path):
+        """Ingest the CSV with every engine"""
+        loaded = {}
+        for engine, filename in [(SQLiteEngine(), "test.db"),
+                                 (DuckDBEngine("duckdb"), "test.duckdb"),
+                                 (DuckDBEngine("parquet"), "test.parquet")]:
+            path = str(tmp_path / filename)
+            result = engine.ingest(csv_file, path)
+            loaded[engine.name] = (engine, path, result)
+        return loaded
+
+    def test_ingest_results_agree(self, loaded):
+        """Test that every engine loads the same rows and columns"""
+        results = [result for _, _, result in loaded.values()]
+
+        for result in results:
+            assert result['records'] == 3000
+            assert result['column_names'] == results[0]['column_names']
+            assert result['non_null']['discount'] == 1000
+
+    def test_query_results_agree(self, loaded):
+        """Test that analytic queries give the same answers on every engine"""
+        sqlite_engine, sqlite_path, _ = loaded['sqlite']
+
+        for sqlite_query, duckdb_query in QUERIES:
+            expected = sqlite_engine.execute(sqlite_query, sqlite_path)
+            for name in ('duckdb', 'parquet'):
+                engine, path, _ = loaded[name]
+                actual = engine.execute(duckdb_query, path)
+                pd.testing.assert_frame_equal(actual, expected, check_dtype=False, rtol=1e-9)
+
+    def test_profile_detects_types(self, loaded):
+        """Test that DuckDB profiles report native dates and statistics"""
+        engine, path, _ = loaded['parquet']
+        profile = engine.profile(path)
+
+        assert profile.row_count == 3000
+        assert profile.column('order_date').is_date
+        assert profile.column('state').distinct == 4
+        assert "Table: orders (3,000 rows)" in profile.to_prompt()
+        assert engine.profile(path) is profile
+
+    def test_budget_truncates_and_counts(self, loaded):
+        """Test that DuckDB results are fetched within the row budget"""
+        engine, path, _ = loaded['duckdb']
+        df = engine.execute("SELECT * FROM orders", path, QueryBudget(max_rows=100))
+
+        assert len(df) == 100
+        assert df.attrs['truncated'] is True
+        assert df.attrs['total_rows'] == 3000
+
+    def test_timeout_interrupts_query(self, loaded):
+        """Test that a runaway DuckDB query is interrupted at the deadline"""
+        engine, path, _ = loaded['duckdb']
+
+        with pytest.raises(QueryTimeout):
+            engine.execute(
+                "SELECT COUNT(*) FROM range(1000000000) r, orders o WHERE r.range + o.price > 0",
+                path, QueryBudget(timeout=0.2)
+            )
+        assert len(engine.execute("SELECT * FROM orders LIMIT 5", path)) == 5
+
+    def test_generated_sql_cannot_read_files(self, loaded, csv_file):
+        """Test that query connections only see the data file"""
+        for name in ('duckdb', 'parquet'):
+            engine, path, _ = loaded[name]
+            with pytest.raises(Exception, match="disabled"):
+                engine.execute(f"SELECT * FROM read_csv_auto('{csv_file}')", path)
+
+    def test_reingest_replaces_data(self, loaded, tmp_path):
+        """Test that queries see a new upload without a restart"""
+        engine, path, _ = loaded['duckdb']
+        engine.execute("SELECT COUNT(*) FROM orders", path)
+
+        smaller = tmp_path / "smaller.csv"
+        pd.DataFrame({'product': ['A', 'B'], 'price': [1.0, 2.0]}).to_csv(smaller, index=False)
+        engine.ingest(str(smaller), path)
+
+        assert engine.execute("SELECT COUNT(*) AS n FROM orders", path)['n'][0] == 2
+        assert engine.schema_cache.refresh(path).column_names == ['product', 'price']
+
+    def test_app_runs_on_duckdb(self, csv_file, tmp_path, monkeypatch):
+        """Test the app pipeline end to end with the DuckDB engine"""
+        engine = DuckDBEngine("duckdb")
+        path = str(tmp_path / "app.duckdb")
+        monkeypatch.setattr(app, 'engine', engine)
+        monkeypatch.setattr(app, 'DB_PATH', path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+
+        success, result = app.convert_csv_to_db(csv_file, path)
+        df, error = app.execute_sql("SELECT state, COUNT(*) AS n FROM orders GROUP BY state ORDER BY state")
+
+        assert success and result['records'] == 3000
+        assert error is None
+        assert list(df['n']) == [750] * 4
+        assert "VARCHAR" in app.get_table_schema()
+        assert app.check_query_plan("SELECT * FROM orders") is None
+
+    def test_fallback_without_duckdb(self, monkeypatch):
+        """Test that SQLite is used when DuckDB isn't installed"""
+        monkeypatch.setattr(engines, 'duckdb', None)
+
+        with pytest.warns(UserWarning, match="falling back"):
+            engine = get_engine("duckdb")
+
+        assert engine.name == "sqlite"
+        with pytest.raises(ValueError):
+            get_engine("oracle")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
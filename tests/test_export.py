@@ -0,0 +1,155 @@
+"""
+Test suite for streamed result export and paging
+"""
+
+import pytest
+import os
+import pandas as pd
+import sqlite3
+import sys
+import tracemalloc
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import export
+from engines import SQLiteEngine
+from export import PAGE_ROWS, export_result, page_query
+from ingest import ingest_csv
+from query_budget import QueryBudget, QueryTimeout
+
+
+def write_orders(path, n):
+    pd.DataFrame({
+        'order_id': range(n),
+        'product': [f"Product {i % 17}" for i in range(n)],
+        'price': [round(i * 0.37 % 100, 2) for i in range(n)],
+        'discount': [None if i < 3000 or i % 3 else float(i % 10) for i in range(n)],
+    }).to_csv(path, index=False)
+
+
+class TestExport:
+    """Test cases for streaming query results to files"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path, monkeypatch):
+        """Orders database, with exports written under tmp_path"""
+        monkeypatch.setattr(export, 'EXPORT_DIR', str(tmp_path / "exports"))
+        csv_file = tmp_path / "orders.csv"
+        write_orders(csv_file, 20000)
+        path = str(tmp_path / "test.db")
+        ingest_csv(str(csv_file), path)
+        return path
+
+    def test_csv_export_streams_all_rows(self, db_path):
+        """Test that a CSV export has every row, fetched in chunks beyond the query row limit"""
+        chunks = []
+        engine = SQLiteEngine()
+        rows, truncated = engine.export(
+            "SELECT * FROM orders ORDER BY order_id", db_path,
+            lambda columns, batch: chunks.append(len(batch)), chunk_rows=1000
+        )
+        path, exported, _ = export_result(engine, "SELECT * FROM orders ORDER BY order_id", db_path)
+
+        expected = pd.read_sql_query("SELECT * FROM orders ORDER BY order_id", sqlite3.connect(db_path))
+        pd.testing.assert_frame_equal(pd.read_csv(path), expected)
+        assert rows == exported == 20000 and not truncated
+        assert max(chunks) == 1000 and len(chunks) == 20
+
+    def test_parquet_export_keeps_types(self, db_path):
+        """Test that Parquet exports keep column types, including a column NULL in the first chunk"""
+        pytest.importorskip("pyarrow")
+        query = "SELECT order_id, product, price, discount FROM orders ORDER BY order_id"
+        path, rows, _ = export_result(SQLiteEngine(), query, db_path, "parquet")
+
+        actual = pd.read_parquet(path)
+        expected = pd.read_sql_query(query, sqlite3.connect(db_path))
+        assert rows == 20000
+        assert str(actual['order_id'].dtype) == 'int64' and str(actual['price'].dtype) == 'float64'
+        assert actual['discount'].notna().sum() == expected['discount'].notna().sum()
+
+    def test_parquet_types_widen_across_chunks(self, db_path, monkeypatch):
+        """Test that a column whose type changes in a later chunk is widened, not a failed export"""
+        pytest.importorskip("pyarrow")
+        monkeypatch.setattr(export, 'EXPORT_CHUNK_ROWS', 1000)
+        query = ("SELECT order_id, CASE WHEN order_id < 5000 THEN order_id ELSE order_id / 2.0 END AS half, "
+                 "CASE WHEN order_id < 3000 THEN NULL ELSE product END AS late_text, "
+                 "CASE WHEN order_id < 8000 THEN order_id ELSE 'n/a' END AS mixed "
+                 "FROM orders ORDER BY order_id")
+        path, rows, _ = export_result(SQLiteEngine(), query, db_path, "parquet")
+
+        actual = pd.read_parquet(path)
+        assert rows == len(actual) == 20000
+        assert str(actual['half'].dtype) == 'float64' and actual['half'][10000] == 5000.0
+        assert actual['late_text'][:3000].isna().all() and actual['late_text'][3000] == "Product 8"
+        assert list(actual['mixed'][[0, 7999, 8000]]) == ["0", "7999", "n/a"]
+        assert os.listdir(export.EXPORT_DIR) == [os.path.basename(path)]
+
+    def test_memory_flat_in_result_size(self, db_path, monkeypatch):
+        """Test that exporting 5x the rows doesn't raise peak memory beyond one chunk"""
+        monkeypatch.setattr(export, 'EXPORT_CHUNK_ROWS', 1000)
+        peaks = []
+        for limit in (4000, 20000):
+            tracemalloc.start()
+            path, _, _ = export_result(SQLiteEngine(), f"SELECT * FROM orders LIMIT {limit}", db_path)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            os.remove(path)
+
+        assert peaks[1] < peaks[0] * 1.5
+
+    def test_row_limit_and_timeout(self, db_path):
+        """Test that exports stop at their row limit and time limit"""
+        path, rows, truncated = export_result(
+            SQLiteEngine(), "SELECT * FROM orders", db_path, budget=QueryBudget(max_rows=150)
+        )
+        assert rows == 150 and truncated
+        assert len(pd.read_csv(path)) == 150
+
+        with pytest.raises(QueryTimeout):
+            export_result(SQLiteEngine(), "SELECT a.order_id FROM orders a, orders b", db_path,
+                          budget=QueryBudget(timeout=0.2, max_rows=10**9))
+        assert len(os.listdir(export.EXPORT_DIR)) == 1
+
+    def test_duckdb_export(self, tmp_path, monkeypatch):
+        """Test that DuckDB-stored results stream to CSV the same way"""
+        pytest.importorskip("duckdb")
+        from engines import DuckDBEngine
+        monkeypatch.setattr(export, 'EXPORT_DIR', str(tmp_path / "exports"))
+        csv_file = tmp_path / "orders.csv"
+        write_orders(csv_file, 5000)
+        engine = DuckDBEngine("duckdb")
+        path = str(tmp_path / "test.duckdb")
+        engine.ingest(str(csv_file), path)
+
+        out, rows, _ = export_result(engine, "SELECT * FROM orders ORDER BY order_id", path)
+
+        assert rows == 5000
+        assert list(pd.read_csv(out)['order_id']) == list(range(5000))
+
+    def test_pages_reassemble_result(self, db_path):
+        """Test that offset pages of an ordered query concatenate to the full result"""
+        query = "SELECT product, SUM(price) AS revenue FROM orders GROUP BY product ORDER BY revenue DESC"
+        conn = sqlite3.connect(db_path)
+        pages = [pd.read_sql_query(page_query(query, offset), conn) for offset in range(0, 17, PAGE_ROWS)]
+        expected = pd.read_sql_query(query, conn)
+        conn.close()
+
+        pd.testing.assert_frame_equal(pd.concat(pages, ignore_index=True), expected)
+
+    def test_app_export_validates_and_offers_actions(self, db_path, monkeypatch):
+        """Test that app exports reject non-SELECT SQL and results get paging/download actions"""
+        monkeypatch.setattr(app, 'DB_PATH', db_path)
+        _, error = app.export_sql("DELETE FROM orders")
+        assert error is not None
+
+        actions = app.result_actions("abc", 0, 40)
+        assert [a.name for a in actions][:2] == ["result_page", "export_result"]
+        assert actions[0].payload == {"result": "abc", "offset": PAGE_ROWS}
+        last_page = app.result_actions("abc", 30, 40, exports=False)
+        assert [a.payload["offset"] for a in last_page] == [15]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
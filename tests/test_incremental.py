@@ -0,0 +1,213 @@
+"""
+Test suite for incremental (append) ingest and skip-if-unchanged uploads
+"""
+
+import pytest
+import os
+import pandas as pd
+import sqlite3
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import engines
+import incremental
+import schema_profile
+from benchmark import StubMessage, stub_chainlit
+from compact_storage import storage_table
+from incremental import already_loaded, append_files, file_digest
+from pipeline import BackgroundJobs
+from result_cache import ResultCache
+from rollups import load_rollups
+
+
+def write_orders(path, ids, day_offset=0):
+    """Orders with one row per id; dates in a non-ISO format so appends must normalize them"""
+    pd.DataFrame({
+        'order_id': ids,
+        'order_date': [f"{(i + day_offset) % 12 + 1:02d}/{i % 28 + 1:02d}/2024" for i in ids],
+        'category': [f"Category {i % 4}" for i in ids],
+        'quantity': [i % 9 + 1 for i in ids],
+        'revenue': [float(i % 50) * 2 for i in ids],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def read_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT * FROM orders ORDER BY order_id").fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture
+def loaded(tmp_path, monkeypatch):
+    """A database loaded the way the app loads an upload (compacted, with rollups)"""
+    monkeypatch.setattr(app, 'result_cache', ResultCache())
+    db_path = str(tmp_path / "orders.db")
+    success, result = app.convert_csv_to_db(write_orders(tmp_path / "jan.csv", range(1000)), db_path)
+    assert success and not result.get('skipped')
+    return db_path
+
+
+class TestSkipUnchanged:
+    """Test cases for recognizing files a table was already loaded from"""
+
+    def test_same_file_skipped(self, loaded, tmp_path):
+        """Test that uploading the same bytes again doesn't reload"""
+        success, result = app.convert_csv_to_db(str(tmp_path / "jan.csv"), loaded)
+        assert success and result['skipped']
+        assert result['records'] == 1000
+
+        # Different bytes load normally
+        other = write_orders(tmp_path / "feb.csv", range(500))
+        success, result = app.convert_csv_to_db(other, loaded)
+        assert success and not result.get('skipped') and result['records'] == 500
+
+    def test_changed_table_not_skipped(self, loaded, tmp_path):
+        """Test that a table changed outside the registry is loaded again"""
+        conn = sqlite3.connect(loaded)
+        conn.execute(f"INSERT INTO {storage_table(conn, 'orders')} (order_id) VALUES (99999)")
+        conn.commit()
+        conn.close()
+        assert not already_loaded(loaded, file_digest(str(tmp_path / "jan.csv")), "replace")
+
+
+class TestAppend:
+    """Test cases for appending only new rows"""
+
+    def test_append_by_key(self, loaded, tmp_path):
+        """Test that rows whose key the table holds, or repeated in the file, are dropped"""
+        delta = write_orders(tmp_path / "delta.csv", list(range(900, 1100)) + [1050])
+        result = append_files([delta], loaded, key=["order_id"])
+
+        assert result['records'] == 201 and result['added'] == 100
+        rows = read_rows(loaded)
+        assert [row[0] for row in rows] == list(range(1100))
+
+    def test_append_by_row_hash(self, loaded, tmp_path):
+        """Test whole-row dedup, including whole-number revenue read back as REAL"""
+        delta = write_orders(tmp_path / "delta.csv", range(990, 1010))
+        changed = write_orders(tmp_path / "changed.csv", [5], day_offset=1)
+        result = append_files([delta, changed], loaded, key=[])
+
+        assert result['added'] == 11  # 10 new ids and a changed row 5
+        assert len(read_rows(loaded)) == 1011
+
+    def test_row_hash_after_type_change(self, tmp_path, monkeypatch):
+        """Test whole-row dedup when a column is read as another type than on the original load"""
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        db_path = str(tmp_path / "codes.db")
+        # code is TEXT in the first file (one value isn't a number), INTEGER in the second;
+        # quantity the other way round
+        first = tmp_path / "first.csv"
+        first.write_text("order_id,code,quantity\n1,5,2\n2,A7,3\n")
+        second = tmp_path / "second.csv"
+        second.write_text("order_id,code,quantity\n1,5,2\n2,7,n/a\n3,8,n/a\n")
+        success, _ = app.convert_csv_to_db(str(first), db_path)
+        assert success
+
+        result = append_files([str(second)], db_path, key=[])
+
+        assert result['added'] == 2  # Row 1 is already there
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT typeof(code), typeof(quantity) FROM orders WHERE order_id = 1").fetchone() \
+            == ('text', 'integer')
+        conn.close()
+
+    def test_matches_full_load(self, loaded, tmp_path):
+        """Test that load + append holds the same rows, dates and rollups as loading both files at once"""
+        delta = write_orders(tmp_path / "delta.csv", range(500, 1500))
+        append_files([delta], loaded, key=["order_id"])
+
+        reference = str(tmp_path / "reference.db")
+        app.convert_csv_to_db([str(tmp_path / "jan.csv"), write_orders(tmp_path / "new.csv", range(1000, 1500))],
+                              reference)
+        assert read_rows(loaded) == read_rows(reference)
+
+        ours, theirs = sqlite3.connect(loaded), sqlite3.connect(reference)
+        rollups = load_rollups(ours)
+        assert rollups and [r.name for r in rollups] == [r.name for r in load_rollups(theirs)]
+        for rollup in rollups:
+            query = f'SELECT * FROM "{rollup.name}" ORDER BY 1, 2'
+            assert ours.execute(query).fetchall() == theirs.execute(query).fetchall(), rollup.name
+        ours.close()
+        theirs.close()
+
+    def test_uncompacted_dates_kept(self, tmp_path, monkeypatch):
+        """Test that a table loaded without compaction keeps its date format for appended rows"""
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(engines, 'COMPACT_STORAGE', False)
+        db_path = str(tmp_path / "plain.db")
+        success, _ = app.convert_csv_to_db(write_orders(tmp_path / "jan.csv", range(100)), db_path)
+        assert success
+        append_files([write_orders(tmp_path / "delta.csv", range(100, 200))], db_path, key=["order_id"])
+
+        dates = [row[1] for row in read_rows(db_path)]
+        assert dates[0] == "01/01/2024" and dates[150] == "07/11/2024"
+
+    def test_ambiguous_dates_rejected(self, loaded, tmp_path):
+        """Test that new dates that could be day-first or month-first aren't mixed into ISO dates"""
+        delta = write_orders(tmp_path / "delta.csv", range(1008, 1018))  # Every day is 12 or less
+        with pytest.raises(ValueError, match="day-first or month-first"):
+            append_files([delta], loaded, key=["order_id"])
+        assert len(read_rows(loaded)) == 1000
+
+    def test_mismatched_columns_rejected(self, loaded, tmp_path):
+        """Test that a file with other columns is refused and the table kept"""
+        other = tmp_path / "customers.csv"
+        other.write_text("customer_id,name\n1,Ann\n")
+        with pytest.raises(ValueError, match="don't match"):
+            append_files([str(other)], loaded)
+        assert len(read_rows(loaded)) == 1000
+
+    def test_profile_extended(self, loaded, tmp_path, monkeypatch):
+        """Test that a large table's profile takes in the appended rows without a rebuild"""
+        monkeypatch.setattr(schema_profile, 'PROFILE_SAMPLE_ROWS', 100)
+        base = app.engine.schema_cache.refresh(loaded)
+        delta = write_orders(tmp_path / "delta.csv", range(1000, 1200))
+        result = append_files([delta], loaded, key=["order_id"])
+
+        profile = app.engine.schema_cache.extend(loaded, base, result['added'], result['stats'])
+        order_id = next(col for col in profile.columns if col.name == "order_id")
+        assert profile.row_count == 1200 and order_id.max == 1199
+        assert profile.fingerprint == schema_profile.database_fingerprint(loaded)
+        assert app.engine.schema_cache.get(loaded) is profile
+
+
+class TestAppUpload:
+    """Test the upload flow when the message asks to append"""
+
+    @pytest.mark.asyncio
+    async def test_append_upload(self, tmp_path, monkeypatch):
+        """Test that 'append' in the upload message adds new rows and a re-upload is skipped"""
+        monkeypatch.setattr(app, 'DB_PATH', str(tmp_path / "app.db"))
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(app, 'preanswers', BackgroundJobs(2))
+        monkeypatch.setattr(app, 'PREANSWER_EXAMPLES', False)
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        monkeypatch.setattr(incremental, 'APPEND_KEY', ["order_id"])
+        first = write_orders(tmp_path / "jan.csv", range(300))
+        delta = write_orders(tmp_path / "feb.csv", range(200, 400))
+
+        def upload(path, content=""):
+            element = SimpleNamespace(name=os.path.basename(path), path=path, mime="text/csv")
+            return app.main(SimpleNamespace(content=content, elements=[element]))
+
+        StubMessage.sent.clear()
+        await upload(first)
+        await upload(delta, "append February")
+        await upload(delta, "append")
+
+        replies = [message.content for message in StubMessage.sent]
+        assert "Appended 100 new rows** (100 already in the database)" in replies[1]
+        assert "**Total Records**: 400" in replies[1]
+        assert "Already loaded" in replies[2]
+        assert len(read_rows(tmp_path / "app.db")) == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
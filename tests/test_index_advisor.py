@@ -0,0 +1,168 @@
+"""
+Test suite for the index advisor
+"""
+
+import pytest
+import os
+import pandas as pd
+import sqlite3
+import sys
+import time
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import index_advisor
+from ingest import ingest_csv
+from index_advisor import (
+    INGEST_PREFIX, IndexCandidate, QueryLog, advise, build_indexes, existing_indexes,
+    index_on_ingest, ingest_candidates, query_candidates,
+)
+from query_planner import explain_plan
+from schema_profile import build_profile
+
+
+class TestIndexAdvisor:
+    """Test cases for ingest-time and workload-driven indexing"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        """Create an orders database with typical analytic columns"""
+        csv_file = tmp_path / "orders.csv"
+        n = 2000
+        data = {
+            'order_id': range(n),
+            'product': [f"Product {i % 20}" for i in range(n)],
+            'state': [['CA', 'TX', 'NY', 'WA'][i % 4] for i in range(n)],
+            'order_date': [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(n)],
+            'customer': [f"Customer {i}" for i in range(n)],
+            'price': [float(i % 100) for i in range(n)],
+        }
+        pd.DataFrame(data).to_csv(csv_file, index=False)
+        path = tmp_path / "test.db"
+        ingest_csv(str(csv_file), str(path))
+        return str(path)
+
+    def test_ingest_candidates(self, db_path):
+        """Test that dates and low-cardinality text are chosen, unique text is not"""
+        names = [c.columns[0] for c in ingest_candidates(build_profile(db_path))]
+
+        assert names[0] == 'order_date'
+        assert 'state' in names and 'product' in names
+        assert 'customer' not in names and 'order_id' not in names
+
+    def test_index_on_ingest_runs_analyze(self, db_path):
+        """Test that ingest-time indexes are built and statistics gathered"""
+        created = index_on_ingest(db_path, build_profile(db_path))
+
+        conn = sqlite3.connect(db_path)
+        stats = conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+        plan = explain_plan(conn, "SELECT * FROM orders WHERE state = 'CA'")
+        conn.close()
+
+        assert len(created) == 3
+        assert stats > 0
+        assert any("USING INDEX" in detail for _, _, detail in plan)
+
+    def test_build_respects_count_budget(self, db_path):
+        """Test that no more than max_auto advisor indexes exist"""
+        conn = sqlite3.connect(db_path)
+        candidates = [IndexCandidate('orders', (col,)) for col in ('product', 'state', 'price')]
+        created = build_indexes(conn, candidates, max_auto=2)
+        conn.close()
+
+        assert len(created) == 2
+
+    def test_build_interrupted_at_time_budget(self, tmp_path):
+        """Test that an index build running past the budget is stopped and rolled back"""
+        conn = sqlite3.connect(str(tmp_path / "big.db"))
+        conn.execute("CREATE TABLE orders (customer TEXT)")
+        conn.executemany("INSERT INTO orders VALUES (?)", ((f"Customer {i * 7919 % 500_000}",) for i in range(500_000)))
+        conn.commit()
+
+        started = time.perf_counter()
+        created = build_indexes(conn, [IndexCandidate('orders', ('customer',))], budget_seconds=0.02)
+        elapsed = time.perf_counter() - started
+
+        assert created == []
+        assert existing_indexes(conn, 'orders') == {}
+        assert elapsed < 0.2
+        conn.close()
+
+    def test_query_candidates(self):
+        """Test extraction of filter, covering and date-part expression candidates"""
+        columns = ['order_date', 'state', 'product', 'price']
+        sql = ("SELECT strftime('%Y-%m', order_date) AS month, product, SUM(price) FROM orders "
+               "WHERE state = 'CA' GROUP BY strftime('%Y-%m', order_date), product")
+        candidates = query_candidates(sql, 'orders', columns)
+
+        assert IndexCandidate('orders', ('state',)) in candidates
+        assert IndexCandidate('orders', expression="strftime('%Y-%m', order_date)") in candidates
+        assert IndexCandidate('orders', ('product', 'price')) in candidates
+
+    def test_advise_builds_expression_index(self, db_path):
+        """Test that repeated slow month rollups get an expression index"""
+        profile = build_profile(db_path)
+        sql = "SELECT strftime('%Y-%m', order_date) AS month, COUNT(*) FROM orders GROUP BY strftime('%Y-%m', order_date)"
+        conn = sqlite3.connect(db_path)
+        plan = [detail for _, _, detail in explain_plan(conn, sql)]
+        conn.close()
+
+        log = QueryLog()
+        for _ in range(3):
+            log.record(sql, plan, 0.5)
+        changes = advise(db_path, profile, log)
+
+        conn = sqlite3.connect(db_path)
+        new_plan = [detail for _, _, detail in explain_plan(conn, sql)]
+        conn.close()
+
+        assert len(changes['created']) >= 1
+        assert any("INDEX" in detail for detail in new_plan)
+
+    def test_advise_drops_unused_indexes(self, db_path, monkeypatch):
+        """Test that advisor indexes unused by a full log window are dropped, and ingest indexes kept"""
+        monkeypatch.setattr(index_advisor, 'QUERY_LOG_SIZE', 4)
+        profile = build_profile(db_path)
+        ingest_built = index_on_ingest(db_path, profile)
+        conn = sqlite3.connect(db_path)
+        advisor_built = build_indexes(conn, [IndexCandidate('orders', ('product', 'price'))])
+        assert build_indexes(conn, [IndexCandidate('orders', ('state',))]) == []  # Same as an ingest index
+        conn.close()
+
+        log = QueryLog()
+        for _ in range(2):
+            log.record("SELECT COUNT(*) FROM orders", [], 0.01)  # e.g. answered from a rollup
+        assert advise(db_path, profile, log)['dropped'] == []
+
+        for _ in range(2):
+            log.record("SELECT COUNT(*) FROM orders", ["SCAN orders"], 0.01)
+        changes = advise(db_path, profile, log)
+
+        conn = sqlite3.connect(db_path)
+        remaining = set(existing_indexes(conn, 'orders'))
+        conn.close()
+
+        assert all(name.startswith(INGEST_PREFIX) for name in ingest_built)
+        assert changes['dropped'] == advisor_built
+        assert remaining == set(ingest_built)
+
+    def test_advise_sees_aliased_scans(self, db_path):
+        """Test that scans reported under a table alias count as scans of the table"""
+        profile = build_profile(db_path)
+        sql = "SELECT o.product, SUM(o.price) FROM orders AS o WHERE o.state = 'CA' GROUP BY o.product"
+        conn = sqlite3.connect(db_path)
+        plan = [detail for _, _, detail in explain_plan(conn, sql)]
+        conn.close()
+        assert "SCAN o" in plan
+
+        log = QueryLog()
+        for _ in range(3):
+            log.record(sql, plan, 0.5)
+        changes = advise(db_path, profile, log)
+
+        assert any("_state_" in name for name in changes['created'])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,116 @@
+"""
+Test suite for streaming CSV ingest
+"""
+
+import pytest
+import os
+import pandas as pd
+import sqlite3
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import ingest_csv
+
+
+class TestChunkedIngest:
+    """Test cases for chunked CSV ingestion"""
+
+    @pytest.fixture
+    def orders_csv_path(self, tmp_path):
+        """Create a CSV file spanning several chunks"""
+        csv_file = tmp_path / "orders.csv"
+        data = {
+            'order_id': range(1000),
+            'product': ['Product ' + str(i % 7) for i in range(1000)],
+            'quantity': [i % 50 for i in range(1000)],
+            'price': [float(i % 100) + 0.5 for i in range(1000)],
+        }
+        pd.DataFrame(data).to_csv(csv_file, index=False)
+        return str(csv_file)
+
+    @pytest.fixture
+    def widening_csv_path(self, tmp_path):
+        """Create a CSV whose column types only widen after the first chunk"""
+        csv_file = tmp_path / "widening.csv"
+        lines = ["id,amount,code"]
+        lines += [f"{i},{i},{i}" for i in range(10)]
+        lines += ["10,10.5,11", "11,,ABC"]
+        csv_file.write_text("\n".join(lines) + "\n")
+        return str(csv_file)
+
+    def test_chunked_ingest_matches_csv(self, orders_csv_path, tmp_path):
+        """Test that chunked ingest loads every row unchanged"""
+        db_path = tmp_path / "test.db"
+        result = ingest_csv(orders_csv_path, str(db_path), chunk_size=128)
+
+        assert result['records'] == 1000
+        assert result['column_types'] == {
+            'order_id': 'INTEGER', 'product': 'TEXT', 'quantity': 'INTEGER', 'price': 'REAL'
+        }
+
+        conn = sqlite3.connect(db_path)
+        df = pd.read_sql_query("SELECT * FROM orders ORDER BY order_id", conn)
+        conn.close()
+
+        pd.testing.assert_frame_equal(df, pd.read_csv(orders_csv_path))
+
+    def test_types_widen_across_chunks(self, widening_csv_path, tmp_path):
+        """Test that later chunks widen the declared column types"""
+        db_path = tmp_path / "test.db"
+        result = ingest_csv(widening_csv_path, str(db_path), chunk_size=5)
+
+        assert result['column_types'] == {'id': 'INTEGER', 'amount': 'REAL', 'code': 'TEXT'}
+        assert result['non_null']['amount'] == 11
+
+        conn = sqlite3.connect(db_path)
+        declared = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(orders)")}
+        codes = [row[0] for row in conn.execute("SELECT code FROM orders ORDER BY id")]
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        conn.close()
+
+        assert declared == {'id': 'INTEGER', 'amount': 'REAL', 'code': 'TEXT'}
+        assert codes[-1] == 'ABC'
+        assert tables == ['orders']
+
+    def test_replaces_existing_table(self, orders_csv_path, widening_csv_path, tmp_path):
+        """Test that a new ingest replaces the previous table"""
+        db_path = tmp_path / "test.db"
+        ingest_csv(orders_csv_path, str(db_path))
+        ingest_csv(widening_csv_path, str(db_path))
+
+        conn = sqlite3.connect(db_path)
+        count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        conn.close()
+
+        assert count == 12
+
+    def test_failed_ingest_keeps_previous_table(self, orders_csv_path, tmp_path):
+        """Test that an ingest error leaves the existing table untouched"""
+        db_path = tmp_path / "test.db"
+        ingest_csv(orders_csv_path, str(db_path))
+
+        header_only = tmp_path / "header_only.csv"
+        header_only.write_text("a,b\n")
+        with pytest.raises(ValueError, match="empty"):
+            ingest_csv(str(header_only), str(db_path))
+
+        conn = sqlite3.connect(db_path)
+        count = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        conn.close()
+
+        assert count == 1000
+
+    def test_progress_callback(self, orders_csv_path, tmp_path):
+        """Test that progress is reported with the final row count"""
+        db_path = tmp_path / "test.db"
+        reports = []
+        ingest_csv(orders_csv_path, str(db_path), chunk_size=100,
+                   progress_callback=lambda rows, elapsed: reports.append(rows))
+
+        assert reports[-1] == 1000
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,277 @@
+"""
+Test suite for scheduling Claude calls: shared in-flight requests, priority, rate limits and retries
+"""
+
+import pytest
+import asyncio
+import httpx
+import os
+import pandas as pd
+import sys
+import time
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import anthropic
+import app
+from llm_scheduler import PRIORITY_BACKGROUND, PRIORITY_EXPLAIN, PRIORITY_SQL, LLMScheduler, SharedMessage, TokenBucket
+from prompt_builder import TokenUsageLog
+from stubs import StubMessages, StubStreamingMessages
+
+
+def api_error(status, retry_after=None):
+    """An error as the SDK raises it for an HTTP status"""
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(status, headers=headers,
+                              request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+    error_type = {429: anthropic.RateLimitError, 400: anthropic.BadRequestError}.get(status,
+                                                                                     anthropic.InternalServerError)
+    return error_type(f"HTTP {status}", response=response, body=None)
+
+
+class FlakyMessages(StubMessages):
+    """Fails with the given errors, one per call, then answers"""
+
+    def __init__(self, errors, text="SELECT 1"):
+        super().__init__(text)
+        self.errors = list(errors)
+
+    async def create(self, **kwargs):
+        if self.errors:
+            self.calls.append(kwargs)
+            raise self.errors.pop(0)
+        return await super().create(**kwargs)
+
+
+class OrderedMessages:
+    """Records the order calls start in; each takes delay seconds"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.started = []
+
+    async def create(self, **kwargs):
+        self.started.append(kwargs["messages"][0]["content"])
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(content=[SimpleNamespace(text="ok")], usage=None)
+
+    def stream(self, **kwargs):
+        self.started.append(kwargs["messages"][0]["content"])
+        return StubStreamingMessages(["ok"], self.delay).stream(**kwargs)
+
+
+def request(text):
+    return {"model": "m", "max_tokens": 10, "messages": [{"role": "user", "content": text}]}
+
+
+class TestTokenBucket:
+    """Test cases for the rate limit bucket"""
+
+    def test_refill_and_delay(self):
+        """Test that a drained bucket refills at per_minute / 60 per second"""
+        now = [0.0]
+        bucket = TokenBucket(600, clock=lambda: now[0])
+        assert bucket.delay(600) == 0
+        bucket.take(600)
+        assert bucket.delay(10) == pytest.approx(1.0)
+        now[0] = 0.5
+        assert bucket.delay(10) == pytest.approx(0.5)
+        bucket.take(-5)  # Given back: the call used less than reserved
+        assert bucket.delay(10) == 0
+        assert bucket.delay(10_000) == pytest.approx(59.0)  # Capped at a full bucket
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0)
+        bucket.take(1_000_000)
+        assert bucket.delay(1_000_000) == 0
+
+
+class TestSingleFlight:
+    """Test cases for sharing identical in-flight calls"""
+
+    @pytest.mark.asyncio
+    async def test_identical_sql_requests_share_a_call(self, monkeypatch):
+        """Test that sessions asking the same question at once make one call, and only it counts tokens"""
+        stub = StubMessages("```sql\nSELECT COUNT(*) FROM orders\n```", delay=0.05)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+        monkeypatch.setattr(app, 'llm_scheduler', LLMScheduler())
+        monkeypatch.setattr(app, 'token_usage', TokenUsageLog())
+
+        results = await asyncio.gather(*[app.generate_sql_query("How many orders?", "Table: orders")
+                                         for _ in range(5)])
+        results.append(await app.generate_sql_query("How many customers?", "Table: orders"))
+
+        assert results[:5] == ["SELECT COUNT(*) FROM orders"] * 5
+        assert len(stub.calls) == 2
+        assert app.llm_scheduler.stats['shared'] == 4
+        assert app.token_usage.summary()['sql']['calls'] == 2
+
+    @pytest.mark.asyncio
+    async def test_identical_explanations_share_a_stream(self, monkeypatch):
+        """Test that followers get every token, and one leaving doesn't stop the others"""
+        stub = StubStreamingMessages(["Product ", "A ", "leads."], delay=0.05)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+        monkeypatch.setattr(app, 'llm_scheduler', LLMScheduler())
+        df = pd.DataFrame({'product': ['A', 'B'], 'revenue': [100.0, 50.0]})
+
+        async def read(stop_after=None, wait=0):
+            await asyncio.sleep(wait)
+            tokens = []
+            stream = app.explain_results("Top products?", "SELECT 1", df)
+            try:
+                async for text in stream:
+                    tokens.append(text)
+                    if len(tokens) == stop_after:
+                        break
+            finally:
+                await stream.aclose()
+            return tokens
+
+        # The others join after the first token arrived; the first caller stops after two
+        results = await asyncio.gather(read(stop_after=2), read(wait=0.07), read(wait=0.07))
+
+        assert results == [["Product ", "A "]] + [["Product ", "A ", "leads."]] * 2
+        assert len(stub.calls) == 1 and stub.log == ["open", "close"]
+
+    @pytest.mark.asyncio
+    async def test_abandoned_call_cancelled(self):
+        """Test that a call is cancelled once every caller waiting for it is gone"""
+        stub = StubMessages("SELECT 1", delay=1)
+        scheduler = LLMScheduler()
+        task = asyncio.create_task(scheduler.create(stub, **request("q")))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.wait([task])
+        await asyncio.sleep(0)
+        assert stub.in_flight == 0 and not scheduler._flights
+
+
+class TestAdmission:
+    """Test cases for priority and rate limits"""
+
+    @pytest.mark.asyncio
+    async def test_sql_before_explanations(self):
+        """Test that waiting SQL generation is admitted ahead of explanations queued earlier"""
+        stub = OrderedMessages()
+        scheduler = LLMScheduler(concurrency=1)
+
+        async def explain(text):
+            async with scheduler.stream(stub, PRIORITY_EXPLAIN, **request(text)) as stream:
+                return [t async for t in stream.text_stream]
+
+        busy = asyncio.create_task(scheduler.create(stub, PRIORITY_SQL, **request("busy")))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(explain("explain 1"), explain("explain 2"),
+                             scheduler.create(stub, PRIORITY_SQL, **request("sql")), busy)
+
+        assert stub.started == ["busy", "sql", "explain 1", "explain 2"]
+
+    @pytest.mark.asyncio
+    async def test_joining_raises_priority(self):
+        """Test that a live question joining a waiting background call moves it ahead of explanations"""
+        stub = OrderedMessages()
+        scheduler = LLMScheduler(concurrency=1)
+
+        busy = asyncio.create_task(scheduler.create(stub, PRIORITY_SQL, **request("busy")))
+        await asyncio.sleep(0.01)
+        background = asyncio.create_task(scheduler.create(stub, PRIORITY_BACKGROUND, **request("pre-answer")))
+        explain = asyncio.create_task(scheduler.create(stub, PRIORITY_EXPLAIN, **request("explain")))
+        await asyncio.sleep(0.01)
+        live = await scheduler.create(stub, PRIORITY_SQL, **request("pre-answer"))
+        await asyncio.gather(busy, background, explain)
+
+        assert stub.started == ["busy", "pre-answer", "explain"]
+        assert isinstance(live, SharedMessage)
+
+    @pytest.mark.asyncio
+    async def test_request_rate_limit(self):
+        """Test that calls wait for the request bucket to refill"""
+        stub = StubMessages("SELECT 1")
+        scheduler = LLMScheduler(requests_per_minute=1200)  # 20 a second
+        scheduler.requests.level = 0
+
+        started = time.perf_counter()
+        await asyncio.gather(*[scheduler.create(stub, **request(f"q{i}")) for i in range(4)])
+        assert time.perf_counter() - started >= 0.18
+        assert len(stub.calls) == 4
+
+    @pytest.mark.asyncio
+    async def test_output_tokens_reserved_then_settled(self):
+        """Test that max_tokens is reserved while a call runs and the unused part given back"""
+        stub = StubMessages("one two three", delay=0.05)
+        scheduler = LLMScheduler(output_tokens_per_minute=60_000)
+        task = asyncio.create_task(scheduler.create(stub, max_tokens=1000, model="m",
+                                                    messages=[{"role": "user", "content": "q"}]))
+        await asyncio.sleep(0.01)
+        assert scheduler.output_tokens.level == pytest.approx(59_000, abs=50)
+        await task
+        assert scheduler.output_tokens.level == pytest.approx(59_997, abs=50)
+
+
+class TestRetries:
+    """Test cases for bounded retries with backoff"""
+
+    @pytest.mark.asyncio
+    async def test_transient_errors_retried(self):
+        """Test that rate limited and overloaded calls are retried until they succeed"""
+        stub = FlakyMessages([api_error(429, retry_after=0), api_error(529)])
+        scheduler = LLMScheduler(retry_base=0.01)
+
+        message = await scheduler.create(stub, **request("q"))
+
+        assert message.content[0].text == "SELECT 1"
+        assert len(stub.calls) == 3 and scheduler.stats['retries'] == 2
+
+    @pytest.mark.asyncio
+    async def test_retries_bounded(self):
+        """Test that a call failing more than max_retries times raises"""
+        stub = FlakyMessages([api_error(503)] * 5)
+        scheduler = LLMScheduler(max_retries=2, retry_base=0.01)
+        with pytest.raises(anthropic.InternalServerError):
+            await scheduler.create(stub, **request("q"))
+        assert len(stub.calls) == 3
+
+    @pytest.mark.asyncio
+    async def test_bad_request_not_retried(self):
+        stub = FlakyMessages([api_error(400)])
+        scheduler = LLMScheduler(retry_base=0.01)
+        with pytest.raises(anthropic.BadRequestError):
+            await scheduler.create(stub, **request("q"))
+        assert len(stub.calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_retry_after_holds_every_call(self):
+        """Test that a 429's retry-after delays the other calls too: the limit is the account's"""
+        stub = FlakyMessages([api_error(429, retry_after=0.2)])
+        scheduler = LLMScheduler(concurrency=2, retry_base=0.01)
+
+        first = asyncio.create_task(scheduler.create(stub, **request("q1")))
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        await scheduler.create(stub, **request("q2"))
+        assert time.perf_counter() - started >= 0.15
+        await first
+
+    @pytest.mark.asyncio
+    async def test_backoff_frees_the_slot(self):
+        """Test that other calls run while a failed one waits to retry"""
+        stub = FlakyMessages([api_error(503)])
+        scheduler = LLMScheduler(concurrency=1, retry_base=0.4)
+
+        retried = asyncio.create_task(scheduler.create(stub, **request("q1")))
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        await scheduler.create(stub, **request("q2"))
+        assert time.perf_counter() - started < 0.15 and not retried.done()
+        await retried
+
+    def test_shared_message_has_no_usage(self):
+        message = SimpleNamespace(content=["x"], usage=SimpleNamespace(input_tokens=10, output_tokens=5))
+        shared = SharedMessage(message)
+        assert shared.content == ["x"] and shared.usage.input_tokens == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
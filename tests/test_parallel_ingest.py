@@ -0,0 +1,150 @@
+"""
+Test suite for sharded, multi-file CSV ingest
+"""
+
+import pytest
+import os
+import pandas as pd
+import sqlite3
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import parallel_ingest
+from benchmark import StubMessage, stub_chainlit
+from ingest import ingest_csv
+from parallel_ingest import discard_pool, ingest_files, plan_shards
+from pipeline import BackgroundJobs
+from result_cache import ResultCache
+
+
+def read_table(db_path, order_by="order_id"):
+    conn = sqlite3.connect(db_path)
+    df = pd.read_sql_query(f"SELECT * FROM orders ORDER BY {order_by}", conn)
+    conn.close()
+    return df
+
+
+class TestShardedIngest:
+    """Test cases for shard planning, merging and the process pool"""
+
+    @pytest.fixture
+    def orders_csv_path(self, tmp_path):
+        """Create a CSV file several shards long whose types only widen near the end"""
+        csv_file = tmp_path / "orders.csv"
+        lines = ["order_id,product,quantity,price,code"]
+        lines += [f"{i},Product {i % 7},{i % 50},{i % 100}.5,{i}" for i in range(2000)]
+        lines += ["2000,Product 0,,1.5,ABC"]
+        csv_file.write_text("\n".join(lines) + "\n")
+        return str(csv_file)
+
+    @pytest.fixture
+    def workers(self, monkeypatch):
+        """Shard even small files across two worker processes"""
+        monkeypatch.setattr(parallel_ingest, 'PARALLEL_MIN_BYTES', 0)
+        monkeypatch.setattr(parallel_ingest, 'INGEST_PROCESSES', 2)
+        yield
+        discard_pool()
+
+    def test_shards_end_at_lines(self, orders_csv_path):
+        """Test that shards cover the file and every cut is at a line boundary"""
+        shards = plan_shards(orders_csv_path, 5000)
+        data = open(orders_csv_path, "rb").read()
+
+        assert len(shards) > 5
+        assert shards[0][0] == 0 and shards[-1][1] == len(data)
+        assert all(end == next_start for (_, end), (next_start, _) in zip(shards, shards[1:]))
+        assert all(data[end - 1:end] == b"\n" for _, end in shards)
+
+    def test_sharded_matches_serial(self, orders_csv_path, tmp_path, workers):
+        """Test that shards parsed by worker processes give the same table, types and counts as ingest_csv"""
+        serial = ingest_csv(orders_csv_path, str(tmp_path / "serial.db"))
+        sharded = ingest_files([orders_csv_path], str(tmp_path / "sharded.db"), processes=2, size=5000)
+
+        assert sharded['shards'] > 5
+        for key in ('records', 'column_names', 'column_types', 'non_null'):
+            assert sharded[key] == serial[key]
+        assert sharded['column_types']['code'] == 'TEXT'
+        pd.testing.assert_frame_equal(read_table(tmp_path / "sharded.db"), read_table(tmp_path / "serial.db"))
+        # Scratch shard databases are removed
+        assert [name for name in os.listdir(tmp_path) if name.startswith(".ingest-")] == []
+
+    def test_quoted_newlines(self, tmp_path, workers):
+        """Test that a file whose shards cut a quoted field is reparsed whole"""
+        csv_file = tmp_path / "notes.csv"
+        rows = [f'{i},"line one\nline two {i}",{i}' for i in range(300)]
+        csv_file.write_text("order_id,note,quantity\n" + "\n".join(rows) + "\n")
+
+        result = ingest_files([str(csv_file)], str(tmp_path / "notes.db"), processes=2, size=1000)
+
+        assert result['records'] == 300 and result['shards'] == 1
+        df = read_table(tmp_path / "notes.db")
+        assert df['note'].iloc[299] == "line one\nline two 299"
+
+
+class TestMultiFileIngest:
+    """Test cases for loading several files into one table"""
+
+    @pytest.fixture
+    def monthly_csv_paths(self, tmp_path):
+        """Three monthly exports; the last has its columns in another order"""
+        paths = []
+        for month in range(3):
+            df = pd.DataFrame({
+                'order_id': range(month * 100, month * 100 + 100),
+                'order_date': [f"2024-0{month + 1}-{day % 28 + 1:02d}" for day in range(100)],
+                'revenue': [float(i) for i in range(100)],
+            })
+            if month == 2:
+                df = df[['revenue', 'order_id', 'order_date']]
+            path = tmp_path / f"orders_2024_0{month + 1}.csv"
+            df.to_csv(path, index=False)
+            paths.append(str(path))
+        return paths
+
+    def test_files_merge_in_order(self, monthly_csv_paths, tmp_path):
+        """Test that every file's rows land in one table, in file order (small inputs parse in-thread)"""
+        result = ingest_files(monthly_csv_paths, str(tmp_path / "orders.db"), size=1000)
+
+        assert result['records'] == 300 and result['files'] == 3 and result['shards'] > 3
+        assert result['column_names'] == ['order_id', 'order_date', 'revenue']
+        conn = sqlite3.connect(tmp_path / "orders.db")
+        ids = [row[0] for row in conn.execute("SELECT order_id FROM orders")]
+        conn.close()
+        assert ids == list(range(300))
+
+    def test_different_columns_rejected(self, monthly_csv_paths, tmp_path):
+        """Test that files with other columns are refused and the old table is kept"""
+        ingest_files(monthly_csv_paths[:1], str(tmp_path / "orders.db"))
+        other = tmp_path / "customers.csv"
+        other.write_text("customer_id,name\n1,Ann\n")
+
+        with pytest.raises(ValueError, match="different columns"):
+            ingest_files([monthly_csv_paths[0], str(other)], str(tmp_path / "orders.db"))
+        assert len(read_table(tmp_path / "orders.db")) == 100
+
+    @pytest.mark.asyncio
+    async def test_upload_several_files(self, monthly_csv_paths, tmp_path, monkeypatch):
+        """Test that files uploaded in one message are converted together"""
+        monkeypatch.setattr(app, 'DB_PATH', str(tmp_path / "app.db"))
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(app, 'preanswers', BackgroundJobs(2))
+        monkeypatch.setattr(app, 'PREANSWER_EXAMPLES', False)
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        elements = [SimpleNamespace(name=os.path.basename(path), path=path, mime="text/csv")
+                    for path in monthly_csv_paths]
+        StubMessage.sent.clear()
+
+        await app.main(SimpleNamespace(content="", elements=elements))
+
+        assert len(StubMessage.sent) == 1
+        reply = StubMessage.sent[0].content
+        assert "Processing 3 CSV files" in reply and "**Total Records**: 300" in reply
+        assert len(read_table(tmp_path / "app.db")) == 300
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,167 @@
+"""
+Test suite for pipelined and speculative execution
+"""
+
+import pytest
+import asyncio
+import os
+import pandas as pd
+import sys
+import time
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from benchmark import QUERIES, StubLLM, StubMessage, stub_chainlit
+from pipeline import BackgroundJobs, Prefetch
+from result_cache import ResultCache
+from synthetic_orders import generate_orders
+from translation_cache import TranslationCache
+
+
+class TestPipelineHelpers:
+    """Test cases for Prefetch and BackgroundJobs"""
+
+    @pytest.mark.asyncio
+    async def test_prefetch_starts_immediately(self):
+        """Test that the source runs before anyone reads, and items arrive in order"""
+        events = []
+
+        async def source():
+            events.append("started")
+            for i in range(3):
+                yield i
+
+        prefetched = Prefetch(source())
+        await asyncio.sleep(0.01)
+        assert events == ["started"]
+        assert [item async for item in prefetched] == [0, 1, 2]
+
+    @pytest.mark.asyncio
+    async def test_prefetch_errors_and_close(self):
+        """Test that source errors surface to the reader and aclose stops the source"""
+        async def failing():
+            yield 1
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            _ = [item async for item in Prefetch(failing())]
+
+        closed = []
+
+        async def endless():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield "tok"
+            finally:
+                closed.append(True)
+
+        prefetched = Prefetch(endless())
+        await anext(prefetched)
+        await prefetched.aclose()
+        assert closed == [True]
+
+    @pytest.mark.asyncio
+    async def test_background_jobs_dedupe_and_limit(self):
+        """Test that a pending key isn't run twice and concurrency is bounded"""
+        jobs = BackgroundJobs(concurrency=2)
+        running, peak, runs = [0], [0], []
+
+        async def job(name):
+            runs.append(name)
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.02)
+            running[0] -= 1
+
+        for name in ["a", "b", "c", "d", "a"]:
+            jobs.submit(name, lambda name=name: job(name))
+        assert jobs.pending() == 4
+        await jobs.wait("d")
+        await jobs.join()
+
+        assert sorted(runs) == ["a", "b", "c", "d"] and peak[0] == 2
+        assert jobs.pending() == 0
+
+
+class TestAppPipelining:
+    """Test warm-up, overlapped explanation and pre-answered questions in the app"""
+
+    @pytest.fixture
+    def stub(self, tmp_path, monkeypatch):
+        """Synthetic orders database with a stub client and Chainlit"""
+        path = str(tmp_path / "orders.db")
+        monkeypatch.setattr(app, 'DB_PATH', path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(app, 'translation_cache', TranslationCache(path=str(tmp_path / "t.db")))
+        monkeypatch.setattr(app, 'preanswers', BackgroundJobs(2))
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        success, _ = app.convert_csv_to_db(generate_orders(str(tmp_path / "orders.csv"), 2000), path)
+        assert success
+        llm = StubLLM({question: sql for _, question, sql in QUERIES}, latency=0.01)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=llm))
+        return llm
+
+    @pytest.mark.asyncio
+    async def test_warm_up_builds_profile(self, stub):
+        """Test that warm-up leaves the schema profile cached for the first question"""
+        app.engine.schema_cache.invalidate(app.DB_PATH)
+        builds = app.engine.schema_cache.builds
+
+        await app.warm_up()
+        app.engine.profile(app.DB_PATH)
+
+        assert app.engine.schema_cache.builds == builds + 1
+
+    @pytest.mark.asyncio
+    async def test_explanation_requested_before_render(self, stub, monkeypatch):
+        """Test that the explanation request overlaps rendering, while the reply keeps its order"""
+        events = []
+        to_markdown = pd.DataFrame.to_markdown
+
+        def slow_markdown(df, **kwargs):
+            time.sleep(0.05)
+            events.append("rendered")
+            return to_markdown(df, **kwargs)
+
+        stream = stub.stream
+        monkeypatch.setattr(pd.DataFrame, 'to_markdown', slow_markdown)
+        monkeypatch.setattr(stub, 'stream', lambda **kwargs: events.append("explain") or stream(**kwargs))
+
+        await app.main(SimpleNamespace(content=QUERIES[0][1], elements=[]))
+        reply = StubMessage.sent[-1].content
+
+        assert events == ["explain", "rendered"]
+        assert reply.index("| product_name") < reply.index("**Insights**") < reply.index("word word")
+
+    @pytest.mark.asyncio
+    async def test_preanswered_question_skips_sql_and_query(self, stub):
+        """Test that a pre-answered question only waits for its explanation"""
+        question = QUERIES[2][1]
+        app.schedule_preanswers([question])
+        await app.preanswers.join()
+        calls, cached = stub.calls, len(app.result_cache._entries)
+        assert calls == 1 and cached == 1
+
+        await app.main(SimpleNamespace(content=question, elements=[]))
+
+        assert stub.calls == calls + 1  # Only the explanation stream
+        assert "| state" in StubMessage.sent[-1].content
+
+    @pytest.mark.asyncio
+    async def test_question_waits_for_pending_preanswer(self, stub):
+        """Test that asking a question being pre-answered doesn't generate its SQL twice"""
+        question = QUERIES[0][1]
+        app.schedule_preanswers([question])
+
+        await app.main(SimpleNamespace(content=question, elements=[]))
+
+        assert stub.calls == 2  # One SQL generation, one explanation
+        assert app.example_questions()[:3] == app.UPLOAD_EXAMPLES
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
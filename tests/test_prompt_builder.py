@@ -0,0 +1,182 @@
+"""
+Test suite for token-budgeted prompts and prompt caching
+"""
+
+import pytest
+import os
+import pandas as pd
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import prompt_builder
+from ingest import ingest_csv
+from prompt_builder import (TokenUsageLog, build_explain_prompt, build_sql_prompt, compact_schema,
+                            estimate_tokens, format_results, rank_columns)
+from schema_profile import build_profile
+from stubs import StubMessages, StubStreamingMessages
+
+
+def load_profile(tmp_path, data, name="orders"):
+    csv_file = tmp_path / f"{name}.csv"
+    pd.DataFrame(data).to_csv(csv_file, index=False)
+    path = str(tmp_path / f"{name}.db")
+    ingest_csv(str(csv_file), path)
+    return path, build_profile(path)
+
+
+@pytest.fixture
+def orders(tmp_path):
+    """A narrow orders table whose full schema fits the budget"""
+    n = 500
+    return load_profile(tmp_path, {
+        'order_id': range(n),
+        'product': [f"Product {i % 17}" for i in range(n)],
+        'state': [['CA', 'TX', 'NY', 'WA'][i % 4] for i in range(n)],
+        'order_date': [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(n)],
+        'price': [round(i * 0.37 % 100, 2) for i in range(n)],
+    })
+
+
+@pytest.fixture
+def wide(tmp_path):
+    """A table with hundreds of columns, far over the schema budget"""
+    n = 50
+    data = {f"metric_{i:03d}": [j * i for j in range(n)] for i in range(300)}
+    data['region'] = [['North', 'South'][j % 2] for j in range(n)]
+    data['sale_date'] = [f"2024-01-{j % 28 + 1:02d}" for j in range(n)]
+    return load_profile(tmp_path, data, "wide")
+
+
+class TestPromptBuilder:
+    """Test cases for schema compaction, relevance ranking and result trimming"""
+
+    def test_narrow_schema_fully_in_stable_prefix(self, orders):
+        """Test that a schema within budget is sent whole, with stats and sample rows"""
+        _, profile = orders
+        stable, relevant = compact_schema(profile, "Top products?")
+
+        assert relevant == ""
+        assert "Table: orders (500 rows)" in stable
+        assert "state: TEXT; 4 distinct; top 'CA', 'NY', 'TX', 'WA'" in stable
+        assert "order_date: TEXT; date" in stable
+        assert "Sample rows:" in stable
+        assert len(stable) < len(profile.to_prompt())
+
+    def test_wide_schema_ranked_within_budget(self, wide):
+        """Test that a wide schema keeps all names and details the columns the question needs"""
+        _, profile = wide
+        stable, relevant = compact_schema(profile, "Monthly sales by region", budget=1500)
+        lines = relevant.splitlines()[1:]
+
+        assert "metric_298, metric_299\n  TEXT: region, sale_date" in stable
+        assert {line.split(":")[0].strip() for line in lines[:2]} == {'region', 'sale_date'}
+        assert estimate_tokens(stable) + estimate_tokens(relevant) <= 1500
+
+    def test_rank_columns_uses_values(self, orders):
+        """Test that a column whose values are mentioned outranks unrelated ones"""
+        _, profile = orders
+        ranked = rank_columns(profile, "How did we do in TX?")
+
+        assert ranked[0].name == 'state'
+
+    def test_stable_prefix_shared_across_questions(self, orders):
+        """Test that the cached system prompt doesn't depend on the question"""
+        _, profile = orders
+        first = build_sql_prompt("Top products?", profile, "SQLite", ["Dates are ISO text"])
+        second = build_sql_prompt("Revenue by state", profile, "SQLite", ["Dates are ISO text"],
+                                  feedback="Too expensive")
+
+        assert first.system == second.system
+        assert first.system[0]['cache_control'] == {'type': 'ephemeral'}
+        assert "- Dates are ISO text\n- The table name is 'orders'" in first.system[0]['text']
+        assert "Revenue by state" in second.messages[0]['content']
+        assert "Too expensive" in second.messages[0]['content']
+
+    def test_caching_can_be_disabled(self, orders, monkeypatch):
+        """Test that PROMPT_CACHING=false sends no cache_control"""
+        monkeypatch.setattr(prompt_builder, 'PROMPT_CACHING', False)
+        prompt = build_sql_prompt("Top products?", orders[1], "SQLite")
+
+        assert 'cache_control' not in prompt.system[0]
+
+    def test_results_trimmed_to_budget(self):
+        """Test that result rows stop at the token budget and note what was left out"""
+        df = pd.DataFrame({'customer': [f"Customer with a long name {i}" for i in range(20)],
+                           'revenue': [i * 1.5 for i in range(20)]})
+        text = format_results(df, budget=50)
+
+        assert text.startswith("customer,revenue\n")
+        assert text.endswith("more rows")
+        assert estimate_tokens(text) <= 60
+        assert format_results(df.head(0)) == "No results found"
+
+    def test_large_results_digested(self):
+        """Test that large results are sent as a fixed-size digest plus a few rows"""
+        sizes = []
+        for n in (1000, 100000):
+            df = pd.DataFrame({'customer': [f"Customer {i}" for i in range(n)],
+                               'revenue': [i * 1.5 for i in range(n)]})
+            prompt = build_explain_prompt("Top customers?", "SELECT 1", df)
+            sizes.append(prompt.estimated_tokens)
+
+        content = prompt.messages[0]['content']
+        assert "Summary of all rows:\n100,000 rows" in content
+        assert content.count("Customer ") < 20
+        assert abs(sizes[1] - sizes[0]) < 20
+
+    def test_usage_summary(self):
+        """Test that usage is totalled per kind with the cache hit ratio"""
+        log = TokenUsageLog()
+        prompt = SimpleNamespace(estimated_tokens=100)
+        log.record("sql", prompt, SimpleNamespace(input_tokens=20, output_tokens=10,
+                                                  cache_creation_input_tokens=80, cache_read_input_tokens=0))
+        log.record("sql", prompt, SimpleNamespace(input_tokens=20, output_tokens=10,
+                                                  cache_creation_input_tokens=0, cache_read_input_tokens=80))
+
+        summary = log.summary()['sql']
+        assert summary['calls'] == 2 and summary['output'] == 20
+        assert summary['cache_hit_ratio'] == pytest.approx(80 / 200)
+
+
+class TestAppPrompts:
+    """Test the prompts the app sends through a stubbed client"""
+
+    @pytest.mark.asyncio
+    async def test_schema_prefix_cached_across_questions(self, orders, monkeypatch):
+        """Test that the second question reads the schema prefix from the cache"""
+        _, profile = orders
+        stub = StubMessages("SELECT COUNT(*) FROM orders")
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+        monkeypatch.setattr(app, 'token_usage', TokenUsageLog())
+
+        await app.generate_sql_query("How many orders?", profile)
+        await app.generate_sql_query("Revenue by state?", profile)
+        first, second = app.token_usage.entries()
+
+        assert "Database Schema:\nTable: orders" in stub.calls[0]['system'][0]['text']
+        assert stub.calls[1]['messages'][0]['content'].startswith("User Question: Revenue by state?")
+        assert first['cache_write'] > 0 and first['cache_read'] == 0
+        assert second['cache_read'] == first['cache_write']
+        assert second['input'] < second['cache_read']
+
+    @pytest.mark.asyncio
+    async def test_explain_records_usage(self, monkeypatch):
+        """Test that streamed explanations report their token counts"""
+        stub = StubStreamingMessages(["Product ", "A ", "leads."])
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+        monkeypatch.setattr(app, 'token_usage', TokenUsageLog())
+        df = pd.DataFrame({'product': ['A', 'B'], 'revenue': [100.0, 50.0]})
+
+        _ = [t async for t in app.explain_results("Top products?", "SELECT 1", df)]
+        entry, = app.token_usage.entries()
+
+        assert "product,revenue\nA,100\nB,50" in stub.calls[0]['messages'][0]['content']
+        assert entry['kind'] == "explain" and entry['output'] == 3 and entry['input'] > 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
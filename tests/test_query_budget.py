@@ -0,0 +1,156 @@
+"""
+Test suite for bounded query execution
+"""
+
+import pytest
+import os
+import sqlite3
+import threading
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from benchmark import StubLLM, stub_chainlit
+from pipeline import BackgroundJobs
+from query_budget import QueryBudget, QueryCancelled, QueryTimeout, run_bounded, count_rows
+from result_cache import ResultCache
+from translation_cache import TranslationCache
+
+
+class TestQueryBudget:
+    """Test cases for time, row and byte budgets"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        """Create an orders table large enough for a slow self-join"""
+        path = tmp_path / "test.db"
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE orders (order_id INTEGER, product TEXT, price REAL)")
+        conn.executemany(
+            "INSERT INTO orders VALUES (?, ?, ?)",
+            [(i, f"Product {i % 10}", float(i)) for i in range(5000)]
+        )
+        conn.commit()
+        conn.close()
+        return str(path)
+
+    def test_row_budget_truncates(self, db_path):
+        """Test that only the budgeted rows are fetched"""
+        conn = sqlite3.connect(db_path)
+        df = run_bounded(conn, "SELECT * FROM orders", QueryBudget(max_rows=100))
+
+        assert len(df) == 100
+        assert df.attrs['truncated'] is True
+        assert count_rows(conn, "SELECT * FROM orders") == 5000
+        conn.close()
+
+    def test_byte_budget_truncates(self, db_path):
+        """Test that fetching stops once the byte budget is used"""
+        conn = sqlite3.connect(db_path)
+        df = run_bounded(conn, "SELECT * FROM orders", QueryBudget(max_bytes=10_000))
+        conn.close()
+
+        assert 0 < len(df) < 5000
+        assert df.attrs['truncated'] is True
+
+    def test_small_result_not_truncated(self, db_path):
+        """Test that results within budget come back whole, with pandas-style types"""
+        conn = sqlite3.connect(db_path)
+        df = run_bounded(conn, "SELECT product, SUM(price) AS revenue FROM orders GROUP BY product")
+        conn.close()
+
+        assert len(df) == 10
+        assert df.attrs['truncated'] is False
+        assert df['revenue'].dtype == float
+
+    def test_timeout_interrupts_query(self, db_path):
+        """Test that a runaway self-join is interrupted at the deadline"""
+        conn = sqlite3.connect(db_path)
+        with pytest.raises(QueryTimeout):
+            run_bounded(
+                conn,
+                "SELECT COUNT(*) FROM orders a, orders b WHERE a.price + b.price > 0",
+                QueryBudget(timeout=0.05)
+            )
+        # The progress handler is removed afterwards
+        assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 5000
+        conn.close()
+
+    def test_cancel_from_another_thread(self, db_path):
+        """Test that a session can cancel its running query"""
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        budget = QueryBudget(timeout=60)
+        threading.Timer(0.05, budget.cancel).start()
+
+        with pytest.raises(QueryCancelled, match="cancelled"):
+            run_bounded(conn, "SELECT COUNT(*) FROM orders a, orders b WHERE a.price + b.price > 0", budget)
+        conn.close()
+
+    def test_execute_sql_reports_total_rows(self, db_path, monkeypatch):
+        """Test that execute_sql counts the full result when it truncates"""
+        monkeypatch.setattr(app, 'DB_PATH', db_path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+
+        df, error = app.execute_sql("SELECT * FROM orders", QueryBudget(max_rows=50))
+
+        assert error is None
+        assert len(df) == 50
+        assert df.attrs['total_rows'] == 5000
+
+
+class TestAppBudget:
+    """Test that stopping a query doesn't count against its SQL"""
+
+    QUESTION = "What is the total price?"
+
+    @pytest.fixture
+    def stub(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "orders.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE orders (order_id INTEGER, price REAL)")
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(app, 'DB_PATH', path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(app, 'translation_cache', TranslationCache(path=str(tmp_path / "t.db")))
+        monkeypatch.setattr(app, 'preanswers', BackgroundJobs(2))
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        monkeypatch.setattr(app, 'LOCAL_SQL_REPAIR', False)
+        llm = StubLLM({self.QUESTION: "SELECT SUM(price) FROM orders"}, latency=0)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=llm))
+
+    def cached(self):
+        return app.translation_cache.get(self.QUESTION, app.engine.profile(app.DB_PATH).schema_hash, app.MODEL)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("stop", ["cancel", "timeout"])
+    async def test_stopped_query_stays_cached(self, stub, monkeypatch, stop):
+        """Test that a cancelled or timed-out query keeps its translation"""
+        def stopped(sql, budget=None):
+            if stop == "cancel":
+                budget.cancel()
+                return None, "Query cancelled"
+            budget.timeout = 0
+            budget.start()
+            return None, "Query exceeded the 0s time limit"
+        monkeypatch.setattr(app, 'execute_sql', stopped)
+
+        await app.main(SimpleNamespace(content=self.QUESTION, elements=[]))
+
+        assert self.cached() == "SELECT SUM(price) FROM orders"
+
+    @pytest.mark.asyncio
+    async def test_failing_query_discarded(self, stub, monkeypatch):
+        """Test that SQL failing on its own is dropped from the cache"""
+        monkeypatch.setattr(app, 'execute_sql', lambda sql, budget=None: (None, "no such column: prize"))
+
+        await app.main(SimpleNamespace(content=self.QUESTION, elements=[]))
+
+        assert self.cached() is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
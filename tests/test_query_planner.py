@@ -0,0 +1,135 @@
+"""
+Test suite for the EXPLAIN QUERY PLAN pre-flight
+"""
+
+import pytest
+import os
+import sqlite3
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from query_planner import preflight, table_aliases, has_outer_limit
+
+
+class TestQueryPlanner:
+    """Test cases for plan-based cost estimates and decisions"""
+
+    ROWS = 1_000_000  # Pretend the table is large; plans don't depend on contents
+
+    @pytest.fixture
+    def conn(self):
+        """An empty orders table with one index"""
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE orders (order_id INTEGER, product TEXT, state TEXT, price REAL)")
+        conn.execute("CREATE INDEX orders_state ON orders (state)")
+        yield conn
+        conn.close()
+
+    def check(self, conn, query, limit=20_000_000):
+        return preflight(conn, query, lambda name: self.ROWS, cost_limit=limit)
+
+    def test_single_scan_aggregate_allowed(self, conn):
+        """Test that one pass over the table is allowed"""
+        decision = self.check(conn, "SELECT product, SUM(price) FROM orders GROUP BY product")
+
+        assert decision.action == "allow"
+        assert decision.cost >= self.ROWS
+
+    def test_index_search_is_cheaper_than_scan(self, conn):
+        """Test that an index SEARCH is estimated below a full SCAN"""
+        search = self.check(conn, "SELECT * FROM orders WHERE state = 'CA'")
+        scan = self.check(conn, "SELECT * FROM orders WHERE product = 'A'")
+
+        assert search.cost < scan.cost
+
+    def test_self_join_regenerates(self, conn):
+        """Test that a nested full scan is sent back with plan feedback"""
+        decision = self.check(
+            conn, "SELECT a.order_id FROM orders a, orders b WHERE a.price < b.price",
+            limit=1e9
+        )
+
+        assert decision.action in ("regenerate", "reject")
+        assert any("nested full scan" in reason for reason in decision.reasons)
+        assert "Query plan" in decision.feedback()
+
+    def test_correlated_subquery_regenerates(self, conn):
+        """Test that a correlated subquery is recognized as expensive"""
+        decision = self.check(
+            conn,
+            "SELECT order_id, (SELECT COUNT(*) FROM orders o2 WHERE o2.price > o.price) FROM orders o"
+        )
+
+        assert decision.action in ("regenerate", "reject")
+        assert any("correlated" in reason for reason in decision.reasons)
+
+    def test_huge_cost_rejected(self, conn):
+        """Test that pathological plans are rejected outright"""
+        decision = preflight(
+            conn, "SELECT * FROM orders a, orders b, orders c WHERE a.price < b.price AND b.price < c.price",
+            lambda name: self.ROWS
+        )
+
+        assert decision.action == "reject"
+
+    def test_expensive_sort_gets_limit(self, conn):
+        """Test that a large unbounded ORDER BY is rewritten with a LIMIT"""
+        decision = self.check(conn, "SELECT * FROM orders ORDER BY price DESC", limit=1_000_000)
+
+        assert decision.action == "rewrite"
+        assert has_outer_limit(decision.sql)
+        conn.execute(decision.sql)
+
+    def test_existing_limit_not_rewritten(self, conn):
+        """Test that queries that already have a LIMIT are left alone"""
+        decision = self.check(conn, "SELECT * FROM orders ORDER BY price DESC LIMIT 10", limit=1_000_000)
+
+        assert decision.action == "allow"
+
+    def test_sort_after_group_by_charged_per_group(self, conn):
+        """Test that ordering aggregated rows isn't costed or capped like sorting the whole table"""
+        grouped = "SELECT product, SUM(price) AS total FROM orders GROUP BY product"
+        query = f"{grouped} ORDER BY total DESC"
+        unsorted = preflight(conn, grouped, lambda name: 5_000_000)
+        decision = preflight(conn, query, lambda name: 5_000_000)
+        assert decision.action == "allow" and decision.sql == query
+        assert decision.cost < unsorted.cost * 1.01
+
+        # Grouped by an index: the plan shows only the ORDER BY sort
+        conn.execute("CREATE INDEX orders_product ON orders (product)")
+        indexed = preflight(conn, query, lambda name: 5_000_000)
+        assert not any("GROUP BY" in line for line in indexed.plan)
+        assert indexed.action == "allow" and indexed.cost < 20_000_000
+
+    def test_constant_row_not_a_scan(self, conn):
+        """Test that SCAN CONSTANT ROW around scalar subqueries isn't charged as a table scan"""
+        decision = self.check(conn, "SELECT (SELECT COUNT(*) FROM orders WHERE state = 'CA') AS n")
+
+        assert any("CONSTANT ROW" in line for line in decision.plan)
+        assert decision.cost < self.ROWS
+
+    def test_table_aliases(self):
+        """Test alias resolution in FROM and JOIN clauses"""
+        aliases = table_aliases("SELECT * FROM orders o JOIN orders AS b ON o.x = b.x WHERE 1")
+
+        assert aliases == {'orders': 'orders', 'o': 'orders', 'b': 'orders'}
+
+    def test_check_query_plan_uses_profile(self, tmp_path, monkeypatch):
+        """Test the app-level pre-flight against a real database"""
+        db_path = tmp_path / "test.db"
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE orders (order_id INTEGER, price REAL)")
+        conn.executemany("INSERT INTO orders VALUES (?, ?)", [(i, float(i)) for i in range(100)])
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(app, 'DB_PATH', str(db_path))
+
+        assert app.check_query_plan("SELECT SUM(price) FROM orders").action == "allow"
+        assert app.check_query_plan("SELECT nope FROM orders") is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
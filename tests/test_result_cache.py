@@ -0,0 +1,100 @@
+"""
+Test suite for the query result cache
+"""
+
+import pytest
+import os
+import pandas as pd
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from result_cache import ResultCache, canonicalize_sql, compact_frame, frame_bytes
+
+
+class TestResultCache:
+    """Test cases for caching query results"""
+
+    @pytest.fixture
+    def result_df(self):
+        """A result with repeated text and numeric columns"""
+        return pd.DataFrame({
+            'state': ['CA', 'TX', 'CA', 'TX'] * 50,
+            'revenue': [float(i) for i in range(200)],
+        })
+
+    def test_canonicalize_sql(self):
+        """Test that spelling differences outside quotes share a key"""
+        a = canonicalize_sql("SELECT state, SUM(price)\n  FROM orders WHERE state = 'CA';")
+        b = canonicalize_sql("select state,sum( price ) from ORDERS where  state = 'CA'")
+        c = canonicalize_sql("select state,sum(price) from orders where state = 'ca'")
+
+        assert a == b
+        assert a != c
+
+    def test_canonicalize_keeps_operator_spacing(self):
+        """Test that spaces separating operators aren't removed, so different queries don't collide"""
+        assert canonicalize_sql("SELECT a - -1 FROM t") != canonicalize_sql("SELECT a --1 FROM t")
+        assert canonicalize_sql("SELECT a  -  1 FROM t") == canonicalize_sql("select a - 1 from t")
+
+    def test_round_trip(self, result_df):
+        """Test that a cached result comes back equal and independent"""
+        cache = ResultCache()
+        cache.put("SELECT 1", "db", "v1", result_df)
+        cached = cache.get("select 1", "db", "v1")
+
+        pd.testing.assert_frame_equal(cached, result_df)
+        cached.loc[0, 'revenue'] = -1
+        assert cache.get("SELECT 1", "db", "v1").loc[0, 'revenue'] == 0.0
+
+    def test_fingerprint_change_misses(self, result_df):
+        """Test that results for an older database version are not served"""
+        cache = ResultCache()
+        cache.put("SELECT 1", "db", "v1", result_df)
+
+        assert cache.get("SELECT 1", "db", "v2") is None
+
+    def test_byte_budget_eviction(self, result_df):
+        """Test that the least recently used results are evicted to fit the budget"""
+        size = frame_bytes(compact_frame(result_df))
+        cache = ResultCache(max_bytes=size * 4)
+        for i in range(6):
+            cache.put(f"SELECT {i}", "db", "v1", result_df)
+
+        assert cache.bytes <= cache.max_bytes
+        assert cache.get("SELECT 0", "db", "v1") is None
+        assert cache.get("SELECT 5", "db", "v1") is not None
+        assert cache.stats['evictions'] > 0
+
+    def test_oversized_result_not_cached(self, result_df):
+        """Test that a single huge result cannot flush the cache"""
+        cache = ResultCache(max_bytes=100)
+
+        assert cache.put("SELECT 1", "db", "v1", result_df) is False
+        assert cache.stats['too_large'] == 1
+
+    def test_ingest_invalidates(self, tmp_path, monkeypatch):
+        """Test that replacing the table drops cached results"""
+        csv_file = tmp_path / "orders.csv"
+        pd.DataFrame({'order_id': [1, 2, 3]}).to_csv(csv_file, index=False)
+        db_path = str(tmp_path / "test.db")
+        monkeypatch.setattr(app, 'DB_PATH', db_path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+
+        app.convert_csv_to_db(str(csv_file), db_path)
+        first, _ = app.execute_sql("SELECT COUNT(*) AS n FROM orders")
+        assert app.result_cache.bytes > 0
+
+        pd.DataFrame({'order_id': [1, 2, 3, 4, 5]}).to_csv(csv_file, index=False)
+        app.convert_csv_to_db(str(csv_file), db_path)
+        assert app.result_cache.bytes == 0
+
+        second, _ = app.execute_sql("SELECT COUNT(*) AS n FROM orders")
+        assert first['n'][0] == 3
+        assert second['n'][0] == 5
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
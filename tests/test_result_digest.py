@@ -0,0 +1,94 @@
+"""
+Test suite for the result digest
+"""
+
+import pytest
+import os
+import time
+import numpy as np
+import pandas as pd
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_digest import digest_results
+
+
+class TestResultDigest:
+    """Test cases for the statistical summary of query results"""
+
+    def test_totals_shares_and_ranking(self):
+        """Test totals, top/bottom rankings and shares of the total"""
+        df = pd.DataFrame({'product': [f"P{i:02d}" for i in range(25)],
+                           'revenue': np.arange(25) * 10.0})
+        digest = digest_results(df)
+
+        assert digest.splitlines()[0] == "25 rows"
+        assert "revenue: total 3,000, mean 120, median 120, min 0, max 240" in digest
+        assert "top by product: P24 240 (8.0%), P23 230 (7.7%)" in digest
+        assert "bottom: P00 0 (0.0%), P01 10 (0.3%)" in digest
+        assert "product: 25 distinct (one row each)" in digest
+
+    def test_repeated_labels_summed(self):
+        """Test that a month x state result is ranked by state totals and trended by month"""
+        df = pd.DataFrame({
+            'month': [f"2024-{m:02d}" for m in range(1, 13) for _ in range(3)],
+            'state': ['CA', 'NY', 'TX'] * 12,
+            'revenue': [100.0 * m + s for m in range(1, 13) for s in (30, 20, 10)],
+        })
+        digest = digest_results(df)
+
+        assert "Time column month: 2024-01 to 2024-12" in digest
+        assert "top by state (summed, 3 distinct): CA 8,160 (33.8%)" in digest
+        assert "revenue by month (12 periods, 2024-01 to 2024-12): 360 → 3,660 (+916.7% overall" in digest
+        assert "peak 2024-12 3,660, low 2024-01 360; biggest rise 2024-02 +83.3%, smallest rise 2024-12 +8.9%" in digest
+
+    def test_integer_year_and_growth(self):
+        """Test that an integer year column is a time axis, not a measure"""
+        df = pd.DataFrame({'year': [2024, 2022, 2023], 'orders': [120, 100, 150]})
+        digest = digest_results(df)
+
+        assert "year: total" not in digest
+        assert "orders by year (3 periods, 2022 to 2024): 100 → 120 (+20.0% overall" in digest
+        assert "biggest rise 2023 +50.0%, biggest drop 2024 -20.0%" in digest
+
+    def test_outliers_and_nulls(self):
+        """Test that robust outliers and NULL counts are reported"""
+        values = [10.0 + i % 3 for i in range(100)] + [500.0, None]
+        df = pd.DataFrame({'customer': [f"C{i}" for i in range(102)], 'spend': values})
+        digest = digest_results(df)
+
+        assert "1 NULL" in digest
+        assert "1 outlier(s) vs median 11: C100 500" in digest
+
+    def test_truncated_results_noted(self):
+        """Test that a row-budget cut is stated so the model doesn't read it as the whole answer"""
+        df = pd.DataFrame({'x': range(100)})
+        df.attrs.update(truncated=True, total_rows=5000)
+
+        assert digest_results(df).startswith("100 rows (first 100 of 5,000")
+
+    def test_million_rows_fixed_size(self):
+        """Test that a million-row result is digested in well under a second, at a fixed size"""
+        rng = np.random.default_rng(0)
+        sizes = []
+        for n in (10_000, 1_000_000):
+            df = pd.DataFrame({
+                'month': [f"2024-{m:02d}" for m in rng.integers(1, 13, n)],
+                'customer': [f"Customer {i}" for i in rng.integers(0, 5000, n)],
+                'revenue': rng.gamma(2, 50, n),
+                'quantity': rng.integers(1, 10, n),
+            })
+            started = time.perf_counter()
+            digest = digest_results(df)
+            elapsed = time.perf_counter() - started
+            sizes.append(len(digest))
+
+        assert elapsed < 1.0
+        assert len(digest.splitlines()) <= 16
+        assert abs(sizes[1] - sizes[0]) < 100
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
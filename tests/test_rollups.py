@@ -0,0 +1,169 @@
+"""
+Test suite for rollup tables and query rewriting
+"""
+
+import pytest
+import os
+import pandas as pd
+import sqlite3
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from ingest import ingest_csv
+from result_cache import ResultCache
+from rollups import build_rollups, drop_rollups, load_rollups, plan_rollups, rewrite_query
+from schema_profile import build_profile
+
+# Aggregate questions a rollup should answer, as the model tends to write them
+ROLLUP_QUERIES = [
+    "SELECT product, SUM(price * quantity) AS revenue FROM orders GROUP BY product ORDER BY revenue DESC, product LIMIT 5",
+    "SELECT strftime('%Y-%m', order_date) AS month, SUM(price) AS revenue, COUNT(*) AS orders "
+    "FROM orders GROUP BY month ORDER BY month",
+    "SELECT state, COUNT(*), AVG(price) FROM orders WHERE state != 'TX' GROUP BY state ORDER BY state",
+    "SELECT strftime('%Y', o.order_date) AS year, MAX(o.quantity) FROM orders o GROUP BY 1",
+    "SELECT AVG(price) AS avg_order_value, MIN(price), COUNT(discount) FROM orders",
+    "SELECT payment_method, SUM(quantity) units FROM orders GROUP BY payment_method "
+    "HAVING SUM(quantity) > 100 ORDER BY 2 DESC",
+    "SELECT state, ROUND(SUM(discount), 2) AS discounts FROM orders AS o "
+    "WHERE o.state IN ('CA', 'NY') GROUP BY state ORDER BY discounts DESC",
+]
+
+# Queries that need row-level data and must run on orders
+TABLE_QUERIES = [
+    "SELECT * FROM orders LIMIT 5",
+    "SELECT product FROM orders WHERE state = 'CA'",
+    "SELECT state, SUM(price) FROM orders WHERE price > 50 GROUP BY state",
+    "SELECT COUNT(DISTINCT customer) FROM orders",
+    "SELECT customer, SUM(price) FROM orders GROUP BY customer",
+    "SELECT product, SUM(price) FROM orders WHERE order_date >= '2024-06-01' GROUP BY product",
+    "SELECT state, SUM(price) FROM orders WHERE product IN (SELECT product FROM orders LIMIT 1) GROUP BY state",
+    "SELECT state, SUM(price) FROM orders WHERE payment_method = 'Card' GROUP BY state",
+]
+
+
+def write_orders(path, n):
+    data = {
+        'order_id': range(n),
+        'product': [f"Product {i % 17}" for i in range(n)],
+        'state': [['CA', 'TX', 'NY', 'WA'][i % 4] for i in range(n)],
+        'payment_method': [['Card', 'Cash', 'Wire'][i % 3] for i in range(n)],
+        'order_date': [f"{2023 + i % 2}-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(n)],
+        'customer': [f"Customer {i}" for i in range(n)],
+        'quantity': [i % 5 + 1 for i in range(n)],
+        'price': [round(i * 0.37 % 100, 2) for i in range(n)],
+        'discount': [None if i % 3 else i % 10 * 0.5 for i in range(n)],
+    }
+    pd.DataFrame(data).to_csv(path, index=False)
+
+
+class TestRollups:
+    """Test cases for rollup planning, building and transparent rewriting"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        """Create an orders database with rollups built"""
+        csv_file = tmp_path / "orders.csv"
+        write_orders(csv_file, 6000)
+        path = str(tmp_path / "test.db")
+        ingest_csv(str(csv_file), path)
+        build_rollups(path, build_profile(path))
+        return path
+
+    def test_plan_rollups(self, db_path):
+        """Test that month x low-cardinality text rollups with revenue are planned"""
+        rollups = plan_rollups(build_profile(db_path))
+        dimensions = [[column for _, column in rollup.dimensions] for rollup in rollups]
+
+        assert ['order_date'] in dimensions
+        assert ['order_date', 'product'] in dimensions
+        assert not any('customer' in dims for dims in dimensions)
+        assert ('quantity', 'price') in rollups[0].measures
+
+    def test_rewritten_answers_match(self, db_path):
+        """Test that every rollup-routed query returns exactly what the table query does"""
+        profile = build_profile(db_path)
+        conn = sqlite3.connect(db_path)
+        rollups = load_rollups(conn)
+
+        for query in ROLLUP_QUERIES:
+            rewritten = rewrite_query(query, rollups, profile.column_names)
+            assert rewritten is not None, query
+
+            expected = pd.read_sql_query(query, conn)
+            actual = pd.read_sql_query(rewritten[0], conn)
+            pd.testing.assert_frame_equal(actual, expected, check_dtype=False, rtol=1e-9)
+        conn.close()
+
+    def test_row_level_queries_not_rewritten(self, db_path):
+        """Test that queries needing non-dimension columns or rows are left alone"""
+        profile = build_profile(db_path)
+        conn = sqlite3.connect(db_path)
+        rollups = load_rollups(conn)
+        conn.close()
+
+        for query in TABLE_QUERIES:
+            assert rewrite_query(query, rollups, profile.column_names) is None, query
+
+    def test_smallest_rollup_chosen(self, db_path):
+        """Test that a monthly trend reads the month-only rollup"""
+        conn = sqlite3.connect(db_path)
+        rollups = load_rollups(conn)
+        conn.close()
+
+        _, rollup = rewrite_query(
+            "SELECT strftime('%Y-%m', order_date), COUNT(*) FROM orders GROUP BY 1",
+            rollups, build_profile(db_path).column_names
+        )
+
+        assert rollup.dimensions == [('month', 'order_date')]
+
+    def test_rollup_size_independent_of_rows(self, tmp_path):
+        """Test that rollups stay the same size when the table grows"""
+        sizes = []
+        for n in (6000, 24000):
+            csv_file = tmp_path / f"orders_{n}.csv"
+            write_orders(csv_file, n)
+            path = str(tmp_path / f"test_{n}.db")
+            ingest_csv(str(csv_file), path)
+            sizes.append(sorted(r.rows for r in build_rollups(path, build_profile(path))))
+
+        assert sizes[0] == sizes[1]
+
+    def test_drop_rollups(self, db_path):
+        """Test that rollups and their catalog entries are removed"""
+        drop_rollups(db_path)
+
+        conn = sqlite3.connect(db_path)
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        assert load_rollups(conn) == []
+        conn.close()
+        assert not any(name.startswith("rollup_orders") for name in tables)
+
+    def test_app_routes_and_rebuilds_on_upload(self, tmp_path, monkeypatch):
+        """Test that uploads build rollups and the app routes matching queries to them"""
+        path = str(tmp_path / "app.db")
+        monkeypatch.setattr(app, 'DB_PATH', path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        csv_file = tmp_path / "orders.csv"
+        write_orders(csv_file, 6000)
+
+        success, _ = app.convert_csv_to_db(str(csv_file), path)
+        query = "SELECT state, SUM(price) AS revenue FROM orders GROUP BY state ORDER BY state"
+        rewritten = app.route_to_rollup(query)
+        df, error = app.execute_sql(rewritten)
+
+        assert success and "rollup_orders" in rewritten
+        assert error is None and len(df) == 4
+
+        # A new upload replaces the rollups along with the data
+        write_orders(csv_file, 600)
+        app.convert_csv_to_db(str(csv_file), path)
+        df, _ = app.execute_sql(app.route_to_rollup("SELECT COUNT(*) AS n FROM orders"))
+        assert df['n'][0] == 600
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,169 @@
+"""
+Test suite for approximate answers from stratified samples
+"""
+
+import pytest
+import os
+import pandas as pd
+import random
+import sqlite3
+import sys
+import time
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import sampling
+from benchmark import StubLLM, StubMessage, stub_chainlit
+from incremental import append_files
+from pipeline import BackgroundJobs
+from result_cache import ResultCache
+from sampling import approximate_query, load_sample
+from translation_cache import TranslationCache
+
+REGIONS = ["North"] * 50 + ["South"] * 30 + ["East"] * 19 + ["Rare"]
+
+
+def write_orders(path, ids):
+    rng = random.Random(7)
+    pd.DataFrame({
+        'order_id': ids,
+        'region': [REGIONS[i % len(REGIONS)] for i in ids],
+        'quantity': [i % 9 + 1 for i in ids],
+        'revenue': [round(rng.expovariate(0.01), 2) for _ in ids],
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def sampled(tmp_path, monkeypatch):
+    """A 40,000-row table with a sample of about 2,000 rows (and about 200 of its 400 Rare rows)"""
+    monkeypatch.setattr(app, 'DB_PATH', str(tmp_path / "orders.db"))
+    monkeypatch.setattr(app, 'result_cache', ResultCache())
+    monkeypatch.setattr(sampling, 'SAMPLE_MIN_ROWS', 10_000)
+    monkeypatch.setattr(sampling, 'SAMPLE_ROWS', 2_000)
+    success, _ = app.convert_csv_to_db(write_orders(tmp_path / "orders.csv", range(40_000)), app.DB_PATH)
+    assert success
+    return app.DB_PATH
+
+
+class TestBuild:
+    """Test cases for drawing the sample at ingest"""
+
+    def test_weights_add_up(self, sampled):
+        """Test that each stratum's weights sum to its rows, and small strata are kept whole"""
+        conn = sqlite3.connect(sampled)
+        sample = load_sample(conn, "orders")
+        assert sample.stratum == "region" and sample.rows == 40_000
+        assert 1_500 < sample.sampled < 3_000
+        weights = dict(conn.execute('SELECT region, SUM(__w) FROM "orders__sample" GROUP BY region'))
+        rows = dict(conn.execute("SELECT region, COUNT(*) FROM orders GROUP BY region"))
+        assert weights.keys() == rows.keys()
+        for region, count in rows.items():
+            assert weights[region] == pytest.approx(count)
+        # Rare alone would get about 20 rows at the table-wide rate
+        assert conn.execute('SELECT COUNT(*) FROM "orders__sample" WHERE region = \'Rare\'').fetchone()[0] > 150
+        conn.close()
+
+    def test_small_table_unsampled(self, tmp_path, monkeypatch):
+        """Test that tables under SAMPLE_MIN_ROWS get no sample"""
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        db_path = str(tmp_path / "small.db")
+        app.convert_csv_to_db(write_orders(tmp_path / "small.csv", range(500)), db_path)
+        conn = sqlite3.connect(db_path)
+        assert load_sample(conn, "orders") is None
+        conn.close()
+
+    def test_append_extends_sample(self, sampled, tmp_path):
+        """Test that appended rows are drawn into the sample and weights still add up"""
+        append_files([write_orders(tmp_path / "delta.csv", range(40_000, 50_000))], sampled, key=["order_id"])
+        conn = sqlite3.connect(sampled)
+        sample = load_sample(conn, "orders")
+        assert sample.rows == 50_000
+        assert conn.execute('SELECT SUM(__w) FROM "orders__sample"').fetchone()[0] == pytest.approx(50_000)
+        assert conn.execute('SELECT COUNT(*) FROM "orders__sample" WHERE order_id >= 40000').fetchone()[0] > 0
+        conn.close()
+
+
+class TestApproximateQuery:
+    """Test cases for rewriting aggregates to run on the sample"""
+
+    def test_estimates_within_margin(self, sampled):
+        """Test that scaled counts, sums and averages land near the exact values"""
+        query = ("SELECT o.region, COUNT(*) AS orders, SUM(o.revenue) AS revenue, AVG(revenue), MIN(quantity) "
+                 "FROM orders AS o WHERE quantity > 2 GROUP BY o.region ORDER BY 1")
+        approximation = app.route_to_sample(query)
+        assert approximation is not None
+        estimate, error = app.execute_sql(approximation.sql)
+        assert error is None
+        estimate = approximation.frame(estimate)
+        exact, _ = app.execute_sql(query)
+
+        assert list(estimate.columns) == ["region", "orders", "orders ±", "revenue", "revenue ±",
+                                          "AVG(revenue)", "AVG(revenue) ±", "MIN(quantity)"]
+        assert list(estimate["region"]) == list(exact["region"])
+        for column in ("orders", "revenue", "AVG(revenue)"):
+            # 95% margins: allow a little slack so the test isn't flaky
+            assert ((estimate[column] - exact[column]).abs() <= 2 * estimate[f"{column} ±"] + 1e-6).all(), column
+        assert (estimate["orders ±"] > 0).any()
+
+    def test_unsupported_shapes(self, sampled):
+        """Test that row-level, DISTINCT, join and string-aggregate queries aren't estimated"""
+        for query in ("SELECT * FROM orders LIMIT 10",
+                      "SELECT region FROM orders GROUP BY region",
+                      "SELECT COUNT(DISTINCT region) FROM orders",
+                      "SELECT group_concat(region) FROM orders",
+                      "SELECT COUNT(*) FROM orders a JOIN orders b ON a.order_id = b.order_id"):
+            assert app.route_to_sample(query) is None, query
+
+    def test_order_by_position_kept(self, sampled):
+        """Test that margin columns don't shift ORDER BY positions"""
+        conn = sqlite3.connect(sampled)
+        approximation = approximate_query("SELECT region, SUM(revenue) FROM orders GROUP BY 1 ORDER BY 2 DESC",
+                                          load_sample(conn, "orders"))
+        conn.close()
+        df, error = app.execute_sql(approximation.sql)
+        assert error is None
+        assert list(df["SUM(revenue)"]) == sorted(df["SUM(revenue)"], reverse=True)
+
+
+class TestAppEstimate:
+    """Test that the estimate shows while the exact query runs, then gives way"""
+
+    @pytest.mark.asyncio
+    async def test_estimate_replaced(self, sampled, tmp_path, monkeypatch):
+        """Test that a slow exact query shows the estimate first and the exact rows last"""
+        question = "How many orders per region?"
+        # Revenue isn't a rollup dimension, so this one goes to the table
+        query = "SELECT region, COUNT(*) AS orders FROM orders WHERE revenue > 50 GROUP BY region ORDER BY region"
+        monkeypatch.setattr(app, 'preanswers', BackgroundJobs(2))
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=StubLLM({question: query}, latency=0)))
+        monkeypatch.setattr(app, 'translation_cache', TranslationCache(path=str(tmp_path / "t.db")))
+
+        execute_sql = app.execute_sql
+        def slow_exact(sql, budget=None):
+            if "__sample" not in sql:
+                time.sleep(0.5)
+            return execute_sql(sql, budget)
+        monkeypatch.setattr(app, 'execute_sql', slow_exact)
+
+        snapshots = []
+        async def stream_token(self, token):
+            self.content += token
+            snapshots.append(self.content)
+        monkeypatch.setattr(StubMessage, 'stream_token', stream_token)
+
+        StubMessage.sent.clear()
+        await app.main(SimpleNamespace(content=question, elements=[]))
+
+        reply = StubMessage.sent[-1].content
+        assert any("**Approximate Results**" in snapshot and "orders ±" in snapshot for snapshot in snapshots)
+        assert "**Approximate Results**" not in reply
+        assert "**Results** • 4 row(s)" in reply and "| Rare" in reply
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,86 @@
+"""
+Test suite for the cached schema profile
+"""
+
+import pytest
+import os
+import pandas as pd
+import sys
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import ingest_csv
+from schema_profile import SchemaCache, build_profile, looks_like_date
+
+
+class TestSchemaProfile:
+    """Test cases for schema profiling and caching"""
+
+    @pytest.fixture
+    def orders_db_path(self, tmp_path):
+        """Create an orders database with dates and low-cardinality text"""
+        csv_file = tmp_path / "orders.csv"
+        data = {
+            'order_id': range(200),
+            'state': [['CA', 'TX', 'NY'][i % 3] for i in range(200)],
+            'order_date': [f"2024-01-{i % 28 + 1:02d}" for i in range(200)],
+            'price': [float(i) for i in range(200)],
+        }
+        pd.DataFrame(data).to_csv(csv_file, index=False)
+        db_path = tmp_path / "test.db"
+        ingest_csv(str(csv_file), str(db_path))
+        return str(db_path)
+
+    def test_column_statistics(self, orders_db_path):
+        """Test distinct counts, ranges, top values and date detection"""
+        profile = build_profile(orders_db_path)
+
+        assert profile.row_count == 200
+        assert profile.column('order_id').distinct == 200
+        assert profile.column('price').min == 0.0
+        assert profile.column('price').max == 199.0
+        assert [v for v, _ in profile.column('state').top_values] == ['CA', 'TX', 'NY']
+        assert profile.column('order_date').is_date
+        assert not profile.column('state').is_date
+
+    def test_prompt_rendering(self, orders_db_path):
+        """Test that the rendered schema keeps the expected sections"""
+        prompt = build_profile(orders_db_path).to_prompt()
+
+        assert 'Table: orders (200 rows)' in prompt
+        assert "top values: 'CA', 'TX', 'NY'" in prompt
+        assert 'Sample Data' in prompt
+
+    def test_cache_reuses_profile(self, orders_db_path):
+        """Test that repeated lookups do not re-introspect the database"""
+        cache = SchemaCache()
+        first = cache.get(orders_db_path)
+        second = cache.get(orders_db_path)
+
+        assert first is second
+        assert cache.builds == 1
+
+    def test_cache_rebuilds_after_ingest(self, orders_db_path, tmp_path):
+        """Test that a new ingest produces a new profile"""
+        cache = SchemaCache()
+        before = cache.get(orders_db_path)
+
+        csv_file = tmp_path / "new.csv"
+        pd.DataFrame({'order_id': [1, 2], 'state': ['CA', 'WA']}).to_csv(csv_file, index=False)
+        ingest_csv(str(csv_file), orders_db_path)
+        after = cache.get(orders_db_path)
+
+        assert after is not before
+        assert after.row_count == 2
+        assert after.schema_hash != before.schema_hash
+
+    def test_looks_like_date(self):
+        """Test date detection on sampled text values"""
+        assert looks_like_date(['2024-01-15', '2024-02-01'])
+        assert not looks_like_date(['2024', '2025'])
+        assert not looks_like_date(['Product A', 'Product B'])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,149 @@
+"""
+Test suite for local SQL repair
+"""
+
+import pytest
+import os
+import sqlite3
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from benchmark import BROKEN_QUERIES, StubLLM, StubMessage, stub_chainlit
+from pipeline import BackgroundJobs
+from result_cache import ResultCache
+from sql_repair import clean_sql, repair_sql
+from synthetic_orders import generate_orders
+from translation_cache import TranslationCache
+
+COLUMNS = ["order_id", "order_date", "customer_id", "product_name", "unit_price", "revenue", "Sales Amount"]
+
+
+class TestRepairSQL:
+    """Test cases for the deterministic fixes"""
+
+    def test_clean_sql(self):
+        """Test that fences, prose, smart quotes and semicolons are stripped"""
+        text = "Here is the query:\n```sql\nSELECT * FROM orders WHERE state = ‘CA’;\n```\nThis lists orders."
+        assert clean_sql(text) == "SELECT * FROM orders WHERE state = 'CA'"
+        assert clean_sql("select 1;") == "select 1"
+
+    def test_clean_sql_keeps_literals(self):
+        """Test that curly apostrophes and backticks inside string literals are left alone"""
+        sql = "SELECT `product_name` FROM orders WHERE product_name = 'Men’s Shirt' OR note = 'a`b'"
+        assert clean_sql(sql) == "SELECT \"product_name\" FROM orders WHERE product_name = 'Men’s Shirt' OR note = 'a`b'"
+
+    def test_dialect_functions(self):
+        """Test that other dialects' functions are rewritten to SQLite"""
+        sql, fixes = repair_sql(
+            "SELECT DATE_TRUNC('month', order_date) AS m, EXTRACT(YEAR FROM order_date) AS y, "
+            "CONCAT(product_name, '-', order_id) FROM orders", 'near "FROM": syntax error', COLUMNS, ["orders"]
+        )
+        assert "strftime('%Y-%m-01', order_date)" in sql
+        assert "CAST(strftime('%Y', order_date) AS INTEGER)" in sql
+        assert "(product_name || '-' || order_id)" in sql
+        assert len(fixes) == 3
+
+    def test_top_ilike_and_casts(self):
+        """Test TOP n, ILIKE and :: casts"""
+        sql, _ = repair_sql("SELECT TOP 5 product_name FROM orders WHERE product_name ILIKE '%a%' "
+                            "AND order_date::date > '2024-01-01'", 'near "5": syntax error', COLUMNS, ["orders"])
+        assert sql == ("SELECT product_name FROM orders WHERE product_name LIKE '%a%' "
+                       "AND date(order_date) > '2024-01-01' LIMIT 5")
+
+    def test_identifiers(self):
+        """Test that misspelled, partial and spaced column names are matched, and tables after FROM only"""
+        sql, fixes = repair_sql("SELECT prodct_name FROM orders", "no such column: prodct_name", COLUMNS, ["orders"])
+        assert sql == "SELECT product_name FROM orders" and fixes == ["column prodct_name → product_name"]
+
+        sql, _ = repair_sql("SELECT SUM(price) FROM orders", "no such column: price", COLUMNS, ["orders"])
+        assert sql == "SELECT SUM(unit_price) FROM orders"
+
+        sql, _ = repair_sql("SELECT SUM(sales_amount) FROM orders", "no such column: sales_amount", COLUMNS, ["orders"])
+        assert sql == 'SELECT SUM("Sales Amount") FROM orders'
+
+        sql, _ = repair_sql("SELECT * FROM order ORDER BY revenue", "no such table: order", COLUMNS, ["orders"])
+        assert sql == "SELECT * FROM orders ORDER BY revenue"
+
+    def test_leaves_literals_and_unknowns(self):
+        """Test that string literals are untouched and unclear names are not guessed"""
+        sql, _ = repair_sql("SELECT revnue FROM orders WHERE note = 'revnue'", "no such column: revnue",
+                            COLUMNS, ["orders"])
+        assert sql == "SELECT revenue FROM orders WHERE note = 'revnue'"
+
+        sql, fixes = repair_sql("SELECT shoe_size FROM orders", "no such column: shoe_size", COLUMNS, ["orders"])
+        assert sql == "SELECT shoe_size FROM orders" and fixes == []
+
+    def test_repaired_sql_runs(self):
+        """Test that each benchmark's broken query runs after repair"""
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE orders (order_date TEXT, customer_id INTEGER, product_name TEXT, "
+                     "category TEXT, state TEXT, quantity INTEGER, discount REAL, revenue REAL, profit REAL)")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(orders)")]
+        for name, _, broken, _ in BROKEN_QUERIES:
+            with pytest.raises(sqlite3.Error) as failure:
+                conn.execute(broken)
+            sql, fixes = repair_sql(broken, str(failure.value), columns, ["orders"])
+            assert fixes, name
+            conn.execute(sql)
+
+
+class TestAppRepair:
+    """Test that failed queries are repaired before the model is asked again"""
+
+    @pytest.fixture
+    def stub(self, tmp_path, monkeypatch):
+        """Synthetic orders database with a stub client that answers broken SQL first"""
+        path = str(tmp_path / "orders.db")
+        monkeypatch.setattr(app, 'DB_PATH', path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(app, 'translation_cache', TranslationCache(path=str(tmp_path / "t.db")))
+        monkeypatch.setattr(app, 'preanswers', BackgroundJobs(2))
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        success, _ = app.convert_csv_to_db(generate_orders(str(tmp_path / "orders.csv"), 2000), path)
+        assert success
+        llm = StubLLM({question: [broken, fixed] for _, question, broken, fixed in BROKEN_QUERIES}, latency=0)
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=llm))
+        return llm
+
+    @pytest.mark.asyncio
+    async def test_repaired_locally(self, stub):
+        """Test that a fixable query is answered without a second SQL generation"""
+        question = BROKEN_QUERIES[0][1]
+        await app.main(SimpleNamespace(content=question, elements=[]))
+        reply = StubMessage.sent[-1].content
+
+        assert "**Repaired Query** (DATE_TRUNC() → SQLite equivalent" in reply
+        assert "**Error**" not in reply
+        assert stub.calls == 2  # SQL generation and explanation
+
+        # The working query is what the translation cache serves next time
+        cached = app.translation_cache.get(question, app.engine.profile(app.DB_PATH).schema_hash, app.MODEL)
+        assert cached.startswith("SELECT strftime('%Y-%m-01', order_date)")
+
+    @pytest.mark.asyncio
+    async def test_model_feedback_without_local_repair(self, stub, monkeypatch):
+        """Test the single error-feedback call when local repair is off"""
+        monkeypatch.setattr(app, 'LOCAL_SQL_REPAIR', False)
+        await app.main(SimpleNamespace(content=BROKEN_QUERIES[1][1], elements=[]))
+        reply = StubMessage.sent[-1].content
+
+        assert "regenerated from the error" in reply and "**Error**" not in reply
+        assert stub.calls == 3
+
+    @pytest.mark.asyncio
+    async def test_unrepairable_query_errors(self, stub):
+        """Test that a query still failing after the feedback call reports the error"""
+        stub.sql_by_question = {BROKEN_QUERIES[0][1]: "SELECT shoe_size FROM orders"}
+        await app.main(SimpleNamespace(content=BROKEN_QUERIES[0][1], elements=[]))
+        reply = StubMessage.sent[-1].content
+
+        assert "no such column: shoe_size" in reply and "Please try rephrasing" in reply
+        assert stub.calls == 2  # One generation, one feedback call; no explanation
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,148 @@
+"""
+Test suite for per-stage tracing and the metrics endpoint
+"""
+
+import pytest
+import json
+import os
+import socket
+import sys
+import time
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import tracing
+from benchmark import QUERIES, StubLLM, StubMessage, stub_chainlit
+from result_cache import ResultCache
+from synthetic_orders import generate_orders
+from tracing import Metrics
+from translation_cache import TranslationCache
+
+
+class TestTracing:
+    """Test cases for spans, metrics and the JSON log"""
+
+    def test_spans_join_the_current_trace(self):
+        """Test that spans record time and summed attributes, and only join an open trace"""
+        with tracing.span("outside"):
+            pass
+        trace = tracing.start("question")
+        with tracing.span("generate_sql") as stage:
+            time.sleep(0.01)
+            tracing.annotate(input_tokens=100, output_tokens=20)
+            tracing.annotate(input_tokens=50, output_tokens=5)
+        tracing.annotate(ignored=1)
+
+        assert [s.name for s in trace.spans] == ["generate_sql"]
+        assert stage.seconds >= 0.01
+        assert stage.attrs['input_tokens'] == 150 and stage.attrs['output_tokens'] == 25
+        assert "generate_sql" in trace.footer() and "150→25 tokens" in trace.footer()
+
+    @pytest.mark.skipif(tracing.rss_mb() is None, reason="needs /proc")
+    def test_memory_per_span(self):
+        """Test that a span records the memory it kept, not the process's lifetime peak"""
+        with tracing.span("small") as small:
+            pass
+        with tracing.span("large") as large:
+            kept = bytearray(64 * 1024 * 1024)
+            kept[::4096] = b"x" * len(kept[::4096])  # Touch every page
+
+        assert abs(small.attrs['rss_growth_mb']) < 16
+        assert large.attrs['rss_growth_mb'] >= 48
+        assert Metrics().snapshot()['peak_rss_mb'] >= large.attrs['rss_growth_mb']
+        del kept
+
+    def test_percentiles_histogram_and_log(self, tmp_path):
+        """Test the snapshot statistics and that finished traces are logged as JSON lines"""
+        metrics = Metrics(history=50, log_path=str(tmp_path / "traces.jsonl"))
+        for ms in range(1, 101):
+            trace = tracing.Trace("question")
+            stage = tracing.Span("execute_sql", {'rows_returned': ms})
+            stage.seconds = ms / 1000
+            trace.spans.append(stage)
+            trace.seconds = ms / 1000
+            metrics.record(trace)
+
+        stats = metrics.snapshot()['stages']['question.execute_sql']
+        assert stats['count'] == 50 and stats['max_ms'] == 100
+        assert stats['p50_ms'] == pytest.approx(75.5)
+        assert stats['histogram_ms']['le_50'] == 0 and stats['histogram_ms']['le_100'] == 50
+        assert stats['mean_rows_returned'] == pytest.approx(75.5)
+        lines = open(tmp_path / "traces.jsonl").read().splitlines()
+        assert len(lines) == 100 and json.loads(lines[-1])['spans'][0]['rows_returned'] == 100
+
+    def test_metrics_endpoint(self, monkeypatch):
+        """Test that /metrics serves the snapshot as JSON on localhost"""
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        metrics = Metrics()
+        monkeypatch.setattr(tracing, 'metrics', metrics)
+        tracing.finish(tracing.start("upload"))
+
+        server = tracing.serve_metrics(port)
+        try:
+            body = json.load(urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics"))
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/other")
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert body['traces'] == {'upload': 1} and 'upload.total' in body['stages']
+        assert tracing.serve_metrics(0) is None
+
+
+class TestAppTracing:
+    """Test the stages traced through the app's upload and question paths"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path, monkeypatch):
+        """Synthetic orders loaded through convert_csv_to_db inside an upload trace"""
+        path = str(tmp_path / "orders.db")
+        monkeypatch.setattr(app, 'DB_PATH', path)
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(tracing, 'metrics', Metrics())
+        trace = tracing.start("upload")
+        success, _ = app.convert_csv_to_db(generate_orders(str(tmp_path / "orders.csv"), 2000), path)
+        tracing.finish(trace)
+        assert success
+        return path
+
+    def test_upload_stages(self, db_path):
+        """Test that ingest and its follow-up work are separate stages"""
+        stages = tracing.metrics.snapshot()['stages']
+
+        assert {'upload.ingest', 'upload.schema_profile', 'upload.indexes', 'upload.rollups'} <= set(stages)
+        assert stages['upload.ingest']['mean_rows_written'] == 2000
+
+    @pytest.mark.asyncio
+    async def test_question_stages_and_footer(self, db_path, tmp_path, monkeypatch):
+        """Test that a question records each stage with tokens and rows, and shows the footer"""
+        _, question, sql = QUERIES[0]
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=StubLLM({question: sql}, latency=0)))
+        monkeypatch.setattr(app, 'translation_cache', TranslationCache(path=str(tmp_path / "t.db")))
+        monkeypatch.setattr(app, 'TIMING_FOOTER', True)
+
+        await app.main(SimpleNamespace(content=question, elements=[]))
+        reply = StubMessage.sent[-1].content
+        stages = tracing.metrics.snapshot()['stages']
+
+        assert {'question.schema', 'question.generate_sql', 'question.execute_sql',
+                'question.render', 'question.explain', 'question.total'} <= set(stages)
+        assert stages['question.generate_sql']['mean_input_tokens'] > 0
+        assert stages['question.generate_sql']['mean_cache_hit'] == 0
+        assert stages['question.execute_sql']['mean_rows_returned'] == 10
+        assert stages['question.execute_sql']['mean_result_bytes'] > 0
+        assert stages['question.explain']['mean_output_tokens'] > 0
+        footer = reply.splitlines()[-1]
+        assert footer.startswith("⏱️ schema") and "execute_sql" in footer and "(10 rows)" in footer
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
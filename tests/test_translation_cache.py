@@ -0,0 +1,105 @@
+"""
+Test suite for the NL -> SQL translation cache
+"""
+
+import pytest
+import os
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from translation_cache import TranslationCache, normalize_question
+from stubs import StubMessages
+
+
+class TestTranslationCache:
+    """Test cases for the two-tier translation cache"""
+
+    @pytest.fixture
+    def cache_path(self, tmp_path):
+        """Location of the persistent tier"""
+        return str(tmp_path / "translations.db")
+
+    def test_normalize_question(self):
+        """Test that trivial variants normalize to the same text"""
+        assert normalize_question("  What are the TOP 5 products?  ") == "what are the top 5 products"
+        assert normalize_question("what are the top\t5 products") == "what are the top 5 products"
+
+    def test_hit_and_miss_counters(self, cache_path):
+        """Test lookups by normalized question, schema and model"""
+        cache = TranslationCache(cache_path)
+        assert cache.get("Top products?", "schema1", "model") is None
+
+        cache.put("Top products?", "schema1", "model", "SELECT 1")
+
+        assert cache.get("top products", "schema1", "model") == "SELECT 1"
+        assert cache.get("Top products?", "schema2", "model") is None
+        assert cache.get("Top products?", "schema1", "other-model") is None
+        assert cache.stats['hits'] == 1
+        assert cache.stats['misses'] == 3
+
+    def test_persistent_tier_survives_restart(self, cache_path):
+        """Test that a new cache instance reads entries from disk"""
+        TranslationCache(cache_path).put("Top products?", "schema1", "model", "SELECT 1")
+
+        cache = TranslationCache(cache_path)
+        assert cache.get("Top products?", "schema1", "model") == "SELECT 1"
+        assert cache.stats['persistent_hits'] == 1
+
+    def test_lru_eviction(self, cache_path):
+        """Test that the memory tier keeps only the most recently used entries"""
+        cache = TranslationCache(None, max_entries=2)
+        cache.put("q1", "s", "m", "SELECT 1")
+        cache.put("q2", "s", "m", "SELECT 2")
+        cache.get("q1", "s", "m")
+        cache.put("q3", "s", "m", "SELECT 3")
+
+        assert cache.get("q2", "s", "m") is None
+        assert cache.get("q1", "s", "m") == "SELECT 1"
+        assert cache.stats['evictions'] == 1
+
+    def test_persistent_size_limit(self, cache_path):
+        """Test that the persistent tier is trimmed to max_rows"""
+        cache = TranslationCache(cache_path, max_entries=1, max_rows=2)
+        for i in range(4):
+            cache.put(f"q{i}", "s", "m", f"SELECT {i}")
+
+        fresh = TranslationCache(cache_path)
+        assert fresh.get("q0", "s", "m") is None
+        assert fresh.get("q3", "s", "m") == "SELECT 3"
+
+    def test_ttl_expiry(self, cache_path):
+        """Test that expired entries are not served"""
+        cache = TranslationCache(cache_path, ttl=-1)
+        cache.put("q", "s", "m", "SELECT 1")
+
+        assert cache.get("q", "s", "m") is None
+
+    def test_discard(self, cache_path):
+        """Test removing an entry from both tiers"""
+        cache = TranslationCache(cache_path)
+        cache.put("q", "s", "m", "SELECT 1")
+        cache.discard("q", "s", "m")
+
+        assert cache.get("q", "s", "m") is None
+        assert TranslationCache(cache_path).get("q", "s", "m") is None
+
+    @pytest.mark.asyncio
+    async def test_generate_sql_query_skips_llm_on_hit(self, cache_path, monkeypatch):
+        """Test that a repeated question is answered without calling the model"""
+        stub = StubMessages("SELECT COUNT(*) FROM orders")
+        monkeypatch.setattr(app, 'client', SimpleNamespace(messages=stub))
+        monkeypatch.setattr(app, 'translation_cache', TranslationCache(cache_path))
+
+        first = await app.generate_sql_query("How many orders?", "schema", "fp")
+        second = await app.generate_sql_query("how many orders", "schema", "fp")
+
+        assert first == second == "SELECT COUNT(*) FROM orders"
+        assert len(stub.calls) == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,204 @@
+"""
+Test suite for compressed and columnar uploads
+"""
+
+import pytest
+import datetime
+import decimal
+import gzip
+import os
+import pandas as pd
+import sqlite3
+import sys
+from types import SimpleNamespace
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import upload_formats
+from benchmark import StubMessage, stub_chainlit
+from ingest import ingest_csv
+from parallel_ingest import ingest_files
+from pipeline import BackgroundJobs
+from result_cache import ResultCache
+from upload_formats import accepted_upload, detect_format, read_chunks, source_columns
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+def read_table(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT * FROM orders ORDER BY order_id").fetchall()
+    types = [row[2] for row in conn.execute("PRAGMA table_info(orders)")]
+    conn.close()
+    return rows, types
+
+
+@pytest.fixture
+def orders_df():
+    return pd.DataFrame({
+        'order_id': range(1, 201),
+        'product': [f"Product {i % 7}" for i in range(200)],
+        'quantity': [i % 9 + 1 for i in range(200)],
+        'price': [round(i * 1.25, 2) for i in range(200)],
+    })
+
+
+@pytest.fixture
+def uploads(orders_df, tmp_path):
+    """The same orders as CSV, gzip CSV, zstd CSV, Parquet, Arrow IPC file and stream"""
+    csv_path = tmp_path / "orders.csv"
+    orders_df.to_csv(csv_path, index=False)
+    paths = {'csv': str(csv_path)}
+    # Stored the way Chainlit stores uploads: under an id, without the original extension
+    with gzip.open(tmp_path / "upload-1", "wb") as f:
+        f.write(csv_path.read_bytes())
+    paths['gzip'] = str(tmp_path / "upload-1")
+    with pa.CompressedOutputStream(str(tmp_path / "upload-2"), "zstd") as f:
+        f.write(csv_path.read_bytes())
+    paths['zstd'] = str(tmp_path / "upload-2")
+    table = pa.Table.from_pandas(orders_df, preserve_index=False)
+    pq.write_table(table, tmp_path / "upload-3", row_group_size=64)
+    paths['parquet'] = str(tmp_path / "upload-3")
+    with pa.ipc.new_file(str(tmp_path / "upload-4"), table.schema) as writer:
+        writer.write_table(table, max_chunksize=150)
+    paths['arrow'] = str(tmp_path / "upload-4")
+    with pa.ipc.new_stream(str(tmp_path / "upload-5"), table.schema) as writer:
+        writer.write_table(table)
+    paths['arrow_stream'] = str(tmp_path / "upload-5")
+    return paths
+
+
+class TestFormats:
+    """Test cases for recognizing and streaming each format"""
+
+    def test_detect_by_content(self, uploads):
+        """Test that formats are told apart by their first bytes, not names"""
+        assert {fmt: detect_format(path) for fmt, path in uploads.items()} == {fmt: fmt for fmt in uploads}
+        for path in uploads.values():
+            assert source_columns(path) == ['order_id', 'product', 'quantity', 'price']
+
+    def test_accepted_uploads(self):
+        """Test that names count when the browser sends a generic type"""
+        assert accepted_upload("orders.csv", "text/csv")
+        assert accepted_upload("orders.parquet", "application/octet-stream")
+        assert accepted_upload("orders.csv.zst", "")
+        assert not accepted_upload("notes.pdf", "application/pdf")
+
+    def test_only_compressed_csv_accepted(self):
+        """Test that gzip/zstd uploads need .csv inside the name, whatever their type"""
+        assert accepted_upload("orders.CSV.GZ", "application/gzip")
+        assert accepted_upload("orders.csv.zst", "application/octet-stream")
+        for name in ("orders.json.gz", "backup.tar.gz", "orders.gz", "dump.sql.zst"):
+            assert not accepted_upload(name, "application/gzip"), name
+        assert not accepted_upload("", "application/x-gzip")
+
+    def test_chunks_bounded(self, uploads):
+        """Test that every format is read in chunks of at most chunk_size rows"""
+        for fmt, path in uploads.items():
+            sizes = [len(chunk) for chunk in read_chunks(path, 50)]
+            assert sum(sizes) == 200 and max(sizes) <= 50, fmt
+
+    def test_same_table_from_every_format(self, uploads, tmp_path):
+        """Test that every format loads the rows and column types the CSV does"""
+        ingest_csv(uploads['csv'], str(tmp_path / "csv.db"))
+        expected = read_table(tmp_path / "csv.db")
+        for fmt, path in uploads.items():
+            db_path = tmp_path / f"{fmt}.db"
+            ingest_csv(path, str(db_path))
+            assert read_table(db_path) == expected, fmt
+
+    def test_arrow_types(self, tmp_path):
+        """Test dates, timestamps, decimals, dictionaries, nullable integers and lists"""
+        table = pa.table({
+            'order_id': pa.array([1, None, 3]),
+            'order_date': pa.array([datetime.date(2024, 1, 2)] * 3),
+            'shipped_at': pa.array([datetime.datetime(2024, 1, 2, 3, 4, 5), None,
+                                    datetime.datetime(2024, 1, 2, 3, 4, 5, 500000)]),
+            'amount': pa.array([decimal.Decimal("1.50")] * 3),
+            'state': pa.array(["CA", "NY", "CA"]).dictionary_encode(),
+            'tags': pa.array([["a", "b"], None, []]),
+        })
+        path = str(tmp_path / "typed.parquet")
+        pq.write_table(table, path)
+        ingest_csv(path, str(tmp_path / "typed.db"))
+
+        conn = sqlite3.connect(tmp_path / "typed.db")
+        rows = conn.execute("SELECT * FROM orders ORDER BY rowid").fetchall()
+        types = [row[2] for row in conn.execute("PRAGMA table_info(orders)")]
+        conn.close()
+        assert types == ["INTEGER", "TEXT", "TEXT", "REAL", "TEXT", "TEXT"]
+        assert rows[0] == (1, "2024-01-02", "2024-01-02 03:04:05", 1.5, "CA", '["a", "b"]')
+        assert rows[1][0] is None and rows[1][2] is None
+        assert rows[2][2] == "2024-01-02 03:04:05.500000"
+
+    def test_mixed_files(self, uploads, tmp_path):
+        """Test that a CSV and a Parquet file uploaded together load into one table"""
+        result = ingest_files([uploads['csv'], uploads['parquet']], str(tmp_path / "mixed.db"))
+        assert result['records'] == 400 and result['files'] == 2
+
+
+class TestDecodedLimit:
+    """Test that the size limit applies to decoded data, not the upload"""
+
+    def test_limit_applies_decoded(self, uploads, tmp_path, monkeypatch):
+        """Test that a small compressed or columnar file is refused if its data is too large"""
+        ingest_csv(uploads['csv'], str(tmp_path / "orders.db"))
+        monkeypatch.setattr(upload_formats, 'MAX_FILE_SIZE_MB', 0)
+        for fmt in ('gzip', 'parquet', 'arrow'):
+            with pytest.raises(ValueError, match="limit once decoded"):
+                ingest_csv(uploads[fmt], str(tmp_path / "orders.db"))
+        # The table loaded before is kept
+        assert len(read_table(tmp_path / "orders.db")[0]) == 200
+
+    @pytest.mark.asyncio
+    async def test_upload_compressed(self, tmp_path, monkeypatch):
+        """Test that a gzip upload under the limit is loaded, and one over it once decoded is refused"""
+        monkeypatch.setattr(app, 'DB_PATH', str(tmp_path / "app.db"))
+        monkeypatch.setattr(app, 'result_cache', ResultCache())
+        monkeypatch.setattr(app, 'preanswers', BackgroundJobs(2))
+        monkeypatch.setattr(app, 'PREANSWER_EXAMPLES', False)
+        monkeypatch.setattr(app, 'cl', stub_chainlit())
+        monkeypatch.setattr(app, 'MAX_FILE_SIZE_MB', 1)
+        monkeypatch.setattr(upload_formats, 'MAX_FILE_SIZE_MB', 1)
+        small, large = tmp_path / "small", tmp_path / "large"
+        rows = [f"{i},Product {i % 7},{i % 9}\n" for i in range(100_000)]  # About 2 MB of text
+        for path, count in ((small, 10_000), (large, 100_000)):
+            with gzip.open(path, "wt") as f:
+                f.write("order_id,product,quantity\n" + "".join(rows[:count]))
+        assert os.path.getsize(large) < 1024 * 1024
+
+        StubMessage.sent.clear()
+        for name, path in (("orders.csv.gz", small), ("all_orders.csv.gz", large)):
+            element = SimpleNamespace(name=name, path=str(path), mime="application/gzip")
+            await app.main(SimpleNamespace(content="", elements=[element]))
+
+        loaded, refused = (message.content for message in StubMessage.sent)
+        assert "Processing gzip CSV file" in loaded and "Successfully converted" in loaded
+        assert "limit once decoded" in refused
+        assert len(read_table(tmp_path / "app.db")[0]) > 0
+
+
+@pytest.mark.skipif(duckdb is None, reason="duckdb is not installed")
+class TestDuckDBFormats:
+    """Test that the DuckDB engines read every format themselves"""
+
+    def test_ingest(self, uploads, tmp_path):
+        from engines import DuckDBEngine
+        engine = DuckDBEngine("duckdb")
+        for fmt, path in uploads.items():
+            result = engine.ingest(path, str(tmp_path / "orders.duckdb"))
+            assert result['records'] == 200 and result['column_names'][0] == 'order_id', fmt
+        result = engine.ingest([uploads['gzip'], uploads['parquet'], uploads['arrow']], str(tmp_path / "orders.duckdb"))
+        assert result['records'] == 600
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,257 @@
+"""
+Pipeline Tracing
+Per-stage wall time, tokens, rows, result bytes and memory for each question
+and upload, aggregated into percentile histograms served as JSON on a local
+metrics endpoint and optionally appended to a JSON-lines log
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: memory is not recorded
+    resource = None
+
+# Tracing configuration
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")  # JSON-lines file of finished traces ("" = off)
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", 1000))  # Recent samples per stage kept for percentiles
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Serve /metrics on 127.0.0.1:<port> (0 = off)
+TIMING_FOOTER = os.getenv("TIMING_FOOTER", "false").lower() in ("1", "true", "yes")  # Stage timings under each answer
+HISTOGRAM_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+PERCENTILES = [50, 90, 95, 99]
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+def rss_mb():
+    """The process's current resident memory in MB (None where unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):  # Not Linux
+        return None
+    return pages * PAGE_SIZE / (1024 * 1024)
+
+
+def peak_rss_mb():
+    """The process's peak resident memory since it started, in MB (None where unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Span:
+    """One timed stage with its attributes (tokens, rows, bytes, ...)"""
+
+    def __init__(self, name: str, attrs: dict = None):
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.seconds = None
+
+    def add(self, **attrs):
+        """Set attributes; numbers add to what the stage already recorded (e.g. tokens of two calls)"""
+        for key, value in attrs.items():
+            if value is None:
+                continue
+            previous = self.attrs.get(key)
+            if isinstance(value, (int, float)) and isinstance(previous, (int, float)):
+                value = previous + value
+            self.attrs[key] = value
+
+    def to_dict(self):
+        return {'stage': self.name, 'ms': round(self.seconds * 1000, 2), **self.attrs}
+
+
+class Trace:
+    """The spans of one question or upload"""
+
+    def __init__(self, kind: str, **attrs):
+        self.kind = kind
+        self.attrs = attrs
+        self.spans = []
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self.seconds = None
+
+    def to_dict(self):
+        return {
+            'kind': self.kind, 'started': round(self.started, 3),
+            'ms': round((self.seconds or 0) * 1000, 2), **self.attrs,
+            'spans': [span.to_dict() for span in self.spans],
+        }
+
+    def footer(self) -> str:
+        """One line of stage timings for the chat"""
+        parts = []
+        for span in self.spans:
+            text = f"{span.name} {format_ms(span.seconds)}"
+            details = []
+            if 'input_tokens' in span.attrs:
+                details.append(f"{span.attrs['input_tokens']:,}→{span.attrs.get('output_tokens', 0):,} tokens")
+            if 'rows_returned' in span.attrs:
+                details.append(f"{span.attrs['rows_returned']:,} rows")
+            if details:
+                text += f" ({', '.join(details)})"
+            parts.append(text)
+        elapsed = self.seconds if self.seconds is not None else time.perf_counter() - self._clock
+        parts.append(f"total {format_ms(elapsed)}")
+        return "⏱️ " + " · ".join(parts)
+
+
+def format_ms(seconds: float) -> str:
+    return f"{seconds:.1f} s" if seconds >= 1 else f"{seconds * 1000:.0f} ms"
+
+
+def start(kind: str, **attrs) -> Trace:
+    """Start tracing a question/upload; spans opened in this context (and work it spawns) join it"""
+    trace = Trace(kind, **attrs)
+    _current_trace.set(trace)
+    return trace
+
+
+def current():
+    """The trace of the running question/upload, if any"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time a stage of the current trace. Outside a trace the span is timed but
+    not recorded, so instrumented code also runs from scripts and tests.
+    """
+    stage = Span(name, attrs)
+    token = _current_span.set(stage)
+    rss = rss_mb()
+    started = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        stage.seconds = time.perf_counter() - started
+        if rss is not None:
+            # Memory the stage kept (stages of concurrent sessions overlap)
+            stage.attrs['rss_growth_mb'] = round(rss_mb() - rss, 1)
+        _current_span.reset(token)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append(stage)
+
+
+def annotate(**attrs):
+    """Add attributes to the innermost open span (no-op outside one)"""
+    stage = _current_span.get()
+    if stage is not None:
+        stage.add(**attrs)
+
+
+def record_usage(usage):
+    """Add an API response's token counts to the current span"""
+    annotate(
+        input_tokens=usage.input_tokens + (getattr(usage, 'cache_read_input_tokens', 0) or 0)
+        + (getattr(usage, 'cache_creation_input_tokens', 0) or 0),
+        output_tokens=usage.output_tokens
+    )
+
+
+class Metrics:
+    """Recent stage samples per (kind, stage), summarized as percentiles and histograms"""
+
+    def __init__(self, history: int = TRACE_HISTORY, log_path: str = TRACE_LOG_PATH):
+        self.history = history
+        self.log_path = log_path
+        self._samples = defaultdict(lambda: deque(maxlen=self.history))
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, trace: Trace):
+        """Add a finished trace's spans (and the trace total) to the samples and the log"""
+        with self._lock:
+            self._counts[trace.kind] += 1
+            self._samples[(trace.kind, "total")].append((trace.seconds, {}))
+            for stage in trace.spans:
+                self._samples[(trace.kind, stage.name)].append((stage.seconds, stage.attrs))
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+
+    def snapshot(self) -> dict:
+        """Counts, latency percentiles, cumulative histograms and mean attributes per stage, and the process's peak memory"""
+        with self._lock:
+            samples = {key: list(values) for key, values in self._samples.items()}
+            counts = dict(self._counts)
+        stages = {}
+        for (kind, name), values in sorted(samples.items()):
+            ms = np.array([seconds for seconds, _ in values]) * 1000
+            stats = {'count': len(ms), 'mean_ms': round(float(ms.mean()), 2), 'max_ms': round(float(ms.max()), 2)}
+            for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+                stats[f'p{p}_ms'] = round(float(value), 2)
+            stats['histogram_ms'] = {
+                **{f"le_{bound}": int((ms <= bound).sum()) for bound in HISTOGRAM_BUCKETS_MS},
+                'le_inf': len(ms),
+            }
+            numeric = defaultdict(list)
+            for _, attrs in values:
+                for key, value in attrs.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        numeric[key].append(value)
+            for key, observed in numeric.items():
+                stats[f'mean_{key}'] = round(float(np.mean(observed)), 2)
+            stages[f"{kind}.{name}"] = stats
+        return {'traces': counts, 'window': self.history, 'peak_rss_mb': peak_rss_mb(), 'stages': stages}
+
+
+# Shared by every session in this worker
+metrics = Metrics()
+
+
+def finish(trace: Trace):
+    """Close a trace and add it to the metrics"""
+    trace.seconds = time.perf_counter() - trace._clock
+    metrics.record(trace)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics → the metrics snapshot as JSON"""
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = json.dumps(metrics.snapshot(), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the app's console
+
+
+def serve_metrics(port: int = METRICS_PORT):
+    """
+    Serve /metrics on localhost from a daemon thread. Returns the server,
+    or None when port is 0 or already taken (e.g. by a previous reload).
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    except OSError:
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
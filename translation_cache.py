@@ -0,0 +1,170 @@
+"""
+NL -> SQL Translation Cache
+Remembers the SQL generated for a question so repeated questions skip the LLM
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache configuration
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", "translation_cache.db")
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", 1000))  # In-memory entries
+TRANSLATION_CACHE_MAX_ROWS = int(os.getenv("TRANSLATION_CACHE_MAX_ROWS", 50_000))  # Persistent entries
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", 7 * 24 * 3600))  # Seconds
+
+
+def normalize_question(question: str) -> str:
+    """Normalize case, whitespace and trailing punctuation so trivial variants share an entry"""
+    question = question.lower().strip()
+    question = re.sub(r"\s+", " ", question)
+    question = question.replace("’", "'")
+    return question.rstrip(" ?!.")
+
+
+def cache_key(question: str, schema_fingerprint: str, model: str) -> str:
+    """Build the cache key for a question against a schema and model"""
+    raw = "\x1f".join([normalize_question(question), schema_fingerprint, model])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class TranslationCache:
+    """
+    Two-tier cache of generated SQL: an in-process LRU in front of a
+    SQLite table that survives restarts and is shared by worker processes.
+    Entries expire after ttl seconds; each tier is trimmed to its size limit.
+    """
+
+    def __init__(self, path: str = TRANSLATION_CACHE_PATH, max_entries: int = TRANSLATION_CACHE_SIZE,
+                 max_rows: int = TRANSLATION_CACHE_MAX_ROWS, ttl: float = TRANSLATION_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'persistent_hits': 0, 'misses': 0, 'evictions': 0}
+        self._store_ready = False
+
+    def _connect(self):
+        """Open the persistent tier, creating it on first use"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._store_ready:
+            self._init_store(conn)
+            self._store_ready = True
+        return conn
+
+    def _init_store(self, conn):
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                question TEXT,
+                sql TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        conn.commit()
+
+    def get(self, question: str, schema_fingerprint: str, model: str):
+        """Return cached SQL for the question, or None"""
+        key = cache_key(question, schema_fingerprint, model)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                sql, created = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return sql
+                del self._memory[key]
+
+        if self.path:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT sql, created FROM translations WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    conn.execute("UPDATE translations SET last_used = ? WHERE key = ?", (now, key))
+                    conn.commit()
+                    with self._lock:
+                        self._remember(key, row[0], row[1])
+                        self.stats['hits'] += 1
+                        self.stats['persistent_hits'] += 1
+                    return row[0]
+                if row is not None:
+                    conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                    conn.commit()
+            finally:
+                conn.close()
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, question: str, schema_fingerprint: str, model: str, sql: str):
+        """Store generated SQL in both tiers"""
+        key = cache_key(question, schema_fingerprint, model)
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, sql, now)
+
+        if self.path:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                    (key, normalize_question(question), sql, now, now)
+                )
+                conn.execute("DELETE FROM translations WHERE created < ?", (now - self.ttl,))
+                conn.execute("""
+                    DELETE FROM translations WHERE key IN (
+                        SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_rows,))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def discard(self, question: str, schema_fingerprint: str, model: str):
+        """Forget the SQL for a question, e.g. after it failed to execute"""
+        key = cache_key(question, schema_fingerprint, model)
+        with self._lock:
+            self._memory.pop(key, None)
+        if self.path:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _remember(self, key, sql, created):
+        """Insert into the LRU tier, evicting the least recently used entries (lock held)"""
+        self._memory[key] = (sql, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM translations")
+                conn.commit()
+            finally:
+                conn.close()
@@ -0,0 +1,207 @@
+"""
+Upload Formats
+Recognizes CSV (plain, gzip or zstd compressed), Parquet and Arrow IPC
+uploads by their first bytes and streams them as DataFrame chunks:
+compressed CSV is decoded on the fly, columnar files are read a record
+batch at a time with no CSV text in between
+"""
+
+import gzip
+import io
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: only needed for zstd, Parquet and Arrow uploads
+    pa = None
+
+# Upload limits
+MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", 4096))  # Largest upload, measured decoded (rows as text/arrays)
+
+ACCEPTED_MIME_TYPES = [
+    "text/csv", "application/vnd.ms-excel", "application/csv",
+    "application/vnd.apache.parquet", "application/x-parquet",
+    "application/vnd.apache.arrow.file", "application/vnd.apache.arrow.stream",
+]
+# Browsers often send columnar and zstd files as application/octet-stream, so names count too
+ACCEPTED_EXTENSIONS = (".csv", ".csv.gz", ".csv.zst", ".parquet", ".pq", ".arrow", ".arrows", ".feather", ".ipc")
+# A compressed file's type says nothing about its contents: only compressed CSV is read
+COMPRESSED_EXTENSIONS = (".gz", ".zst")
+
+# Leading bytes of each format; anything else is read as CSV text
+MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"PAR1", "parquet"),
+    (b"ARROW1", "arrow"),
+    (b"\xff\xff\xff\xff", "arrow_stream"),
+]
+CSV_FORMATS = ("csv", "gzip", "zstd")
+FORMAT_NAMES = {"csv": "CSV", "gzip": "gzip CSV", "zstd": "zstd CSV", "parquet": "Parquet",
+                "arrow": "Arrow IPC", "arrow_stream": "Arrow IPC stream"}
+
+
+def accepted_upload(name: str, mime: str) -> bool:
+    """Whether an uploaded file looks like a format the ingest path reads"""
+    name = (name or "").lower()
+    if name.endswith(COMPRESSED_EXTENSIONS):
+        return name.endswith(ACCEPTED_EXTENSIONS)  # .csv.gz or .csv.zst, not .json.gz or .tar.gz
+    return mime in ACCEPTED_MIME_TYPES or name.endswith(ACCEPTED_EXTENSIONS)
+
+
+def detect_format(path: str) -> str:
+    """'csv', 'gzip', 'zstd', 'parquet', 'arrow' or 'arrow_stream', from the file's first bytes"""
+    with open(path, "rb") as f:
+        head = f.read(8)
+    for magic, fmt in MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return "csv"
+
+
+def require_pyarrow(fmt: str):
+    if pa is None:
+        raise ValueError(f"Reading {FORMAT_NAMES[fmt]} files requires pyarrow (pip install pyarrow)")
+
+
+def size_error(path: str) -> ValueError:
+    return ValueError(f"{os.path.basename(path)} is larger than the {MAX_FILE_SIZE_MB:,} MB limit once decoded")
+
+
+class LimitedReader(io.RawIOBase):
+    """A byte stream that fails once more than limit bytes have been read from it"""
+
+    def __init__(self, stream, limit: int, path: str):
+        self.stream = stream
+        self.limit = limit
+        self.path = path
+        self.read_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        self.read_bytes += len(data)
+        if self.read_bytes > self.limit:
+            raise size_error(self.path)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+def open_decoded(path: str, fmt: str = None):
+    """The decoded bytes of a CSV, gzip or zstd file as a stream, limited to MAX_FILE_SIZE_MB"""
+    fmt = fmt or detect_format(path)
+    if fmt == "gzip":
+        stream = gzip.open(path, "rb")
+    elif fmt == "zstd":
+        require_pyarrow(fmt)
+        stream = pa.CompressedInputStream(pa.OSFile(path), "zstd")
+    else:
+        stream = open(path, "rb")
+    return io.BufferedReader(LimitedReader(stream, MAX_FILE_SIZE_MB * 1024 * 1024, path))
+
+
+def plain_batch(batch):
+    """
+    Cast Arrow columns SQLite can't store as they are: dates and times to ISO
+    text, decimals to floats, dictionaries to their values, nested values to JSON
+    """
+    columns = []
+    for column in batch.columns:
+        kind = column.type
+        if pa.types.is_dictionary(kind):
+            column = column.cast(kind.value_type)
+            kind = kind.value_type
+        if pa.types.is_timestamp(kind) or pa.types.is_date(kind) or pa.types.is_time(kind) \
+                or pa.types.is_duration(kind):
+            # Whole seconds print without a fraction: 2024-01-02 03:04:05
+            column = pc.replace_substring_regex(column.cast(pa.string()), pattern=r"\.0+(Z?)$", replacement=r"\1")
+        elif pa.types.is_decimal(kind):
+            column = column.cast(pa.float64())
+        elif pa.types.is_nested(kind):
+            column = pa.array([None if value is None else json.dumps(value, default=str)
+                               for value in column.to_pylist()], pa.string())
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def arrow_dtype(kind):
+    """Nullable pandas dtypes, so integer and boolean columns with nulls don't become floats or objects"""
+    if pa.types.is_integer(kind) and kind != pa.uint64():
+        return pd.Int64Dtype()
+    if pa.types.is_boolean(kind):
+        return pd.BooleanDtype()
+    return None
+
+
+def record_batches(path: str, fmt: str, chunk_size: int):
+    """Record batches of a Parquet (at most chunk_size rows each) or Arrow IPC file (as written)"""
+    require_pyarrow(fmt)
+    if fmt == "parquet":
+        return pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+    if fmt == "arrow":
+        # Memory-mapped: a batch's pages are only read when its rows are converted
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        return (reader.get_batch(i) for i in range(reader.num_record_batches))
+    return pa.ipc.open_stream(pa.OSFile(path))
+
+
+def open_arrow(path: str, fmt: str):
+    """An Arrow IPC file as a memory-mapped table, or a stream as a batch reader (e.g. for DuckDB to scan)"""
+    require_pyarrow(fmt)
+    if fmt == "arrow":
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return pa.ipc.open_stream(pa.OSFile(path))
+
+
+def read_chunks(path: str, chunk_size: int):
+    """
+    DataFrame chunks of at most chunk_size rows from an upload in any
+    accepted format. Raises ValueError once the decoded data passes
+    MAX_FILE_SIZE_MB: CSV text after decompression, columnar data as arrays.
+    """
+    fmt = detect_format(path)
+    limit = MAX_FILE_SIZE_MB * 1024 * 1024
+    if fmt == "csv":
+        # Plain text is its own decoded size; pandas reads the path directly
+        if os.path.getsize(path) > limit:
+            raise size_error(path)
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+    if fmt in CSV_FORMATS:
+        with open_decoded(path, fmt) as stream:
+            yield from pd.read_csv(stream, chunksize=chunk_size)
+        return
+
+    decoded = 0
+    for batch in record_batches(path, fmt, chunk_size):
+        # Counted before slicing: slices share their batch's buffers
+        decoded += batch.get_total_buffer_size()
+        if decoded > limit:
+            raise size_error(path)
+        for offset in range(0, batch.num_rows, chunk_size):
+            yield plain_batch(batch.slice(offset, chunk_size)).to_pandas(types_mapper=arrow_dtype)
+
+
+def source_columns(path: str) -> list:
+    """Column names of an upload in any accepted format, without reading its rows"""
+    fmt = detect_format(path)
+    if fmt in CSV_FORMATS:
+        with open_decoded(path, fmt) as stream:
+            header = stream.readline()
+        return [str(col) for col in pd.read_csv(io.BytesIO(header), nrows=0).columns] if header.strip() else []
+    require_pyarrow(fmt)
+    if fmt == "parquet":
+        return pq.read_schema(path).names
+    if fmt == "arrow":
+        return pa.ipc.open_file(pa.memory_map(path)).schema.names
+    return pa.ipc.open_stream(pa.OSFile(path)).schema.names